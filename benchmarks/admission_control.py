@@ -0,0 +1,202 @@
+"""
+Overload benchmark of admission control: checkout latency while scrapers flood the catalog.
+
+Starts the product, order and cart services under uvicorn on temporary SQLite databases, seeds the
+catalog and runs --shoppers concurrent shoppers, each filling a fresh cart, checking it out through
+POST /cart/checkout, which reserves stock on the product service and places the order, and waiting
+--think seconds on average before the next one. Checkouts are timed for --seconds after a --warmup,
+so the first, cold checkout of every shopper does not set the p99. This is run three ways, on fresh
+services each time:
+- quiet: shoppers only;
+- flood: --scrapers clients in a child process page through GET /api/v1/products and search the
+  catalog as fast as they are answered, with admission control off;
+- flood, admission: the same with ADMISSION_ENABLED=true on every service and --rps as RATE_LIMIT_RPS
+  of the product service, shoppers and scrapers told apart by an X-Client-Id header. Scrapers wait
+  for the Retry-After of a 429 or 503.
+
+Reports checkout throughput, p50/p99 latency and failed shopper requests, and the scraper requests
+served, rate limited (429) and shed (503). Fails when a shopper request fails with admission on, or when
+its checkout p99 is more than --p99-slack times the quiet one. The scrapers speak just enough HTTP/1.1
+to read the responses, since they share the machine's cores with the services.
+
+Usage:
+    python benchmarks/admission_control.py [--shoppers 8] [--scrapers 64] [--seconds 60] [--rps 0.5]
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from urllib.parse import urlencode, urlsplit
+
+import httpx
+from sqlalchemy import create_engine
+
+from harness import percentile, run_service
+from platform_load import insert_rows
+
+PRODUCTS = 10_000
+
+
+async def shop(base_urls, args):
+    """Checks out fresh carts from concurrent shoppers until --seconds are up."""
+    latencies, failures = [], Counter()
+    users = iter(range(1, 10_000_000))
+    warm = time.monotonic() + args.warmup
+    deadline = warm + args.seconds
+    async with httpx.AsyncClient(base_url=base_urls["cart"], timeout=60) as client:
+        async def shopper(number):
+            rng, headers = random.Random(number), {"X-Client-Id": f"shopper-{number}"}
+            while time.monotonic() < deadline:
+                user_id = next(users)
+                try:
+                    for product_id in rng.sample(range(1, PRODUCTS + 1), rng.randint(1, 3)):
+                        added = await client.post("/cart", headers=headers,
+                                                  json={"user_id": user_id, "product_id": product_id, "quantity": 1})
+                        if added.status_code != 200:
+                            failures[f"add {added.status_code}"] += 1
+                    start = time.perf_counter()
+                    response = await client.post("/cart/checkout", headers=headers, json={"user_id": user_id})
+                except httpx.HTTPError as e:
+                    failures[type(e).__name__] += 1
+                    continue
+                if response.status_code == 200:
+                    if time.monotonic() >= warm:
+                        latencies.append((time.perf_counter() - start) * 1000)
+                else:
+                    failures[f"checkout {response.status_code}"] += 1
+                await asyncio.sleep(rng.expovariate(1 / args.think) if args.think else 0)
+
+        await asyncio.gather(*(shopper(number) for number in range(args.shoppers)))
+    return latencies, failures
+
+
+async def fetch(connection, path, params, client_id):
+    """
+    One GET over a kept-alive connection, with just enough HTTP/1.1 to read the response: the scrapers
+    share the machine with the services, and a full client's CPU use would slow checkout down by itself.
+    """
+    reader, writer = connection
+    writer.write(f"GET {path}?{urlencode(params)} HTTP/1.1\r\nHost: scraper\r\n"
+                 f"X-Client-Id: {client_id}\r\n\r\n".encode())
+    head = await reader.readuntil(b"\r\n\r\n")
+    length = re.search(rb"(?i)\r\ncontent-length: *(\d+)", head)
+    body = await reader.readexactly(int(length.group(1))) if length else b""
+    return int(head.split(b" ", 2)[1]), head, body
+
+
+async def scrape(base_url, args):
+    """Pages through the catalog and searches it from --scrapers clients until --seconds are up."""
+    statuses = Counter()
+    deadline = time.monotonic() + args.warmup + args.seconds
+    address = urlsplit(base_url)
+
+    async def scraper(number):
+        rng, cursor, connection = random.Random(number), None, None
+        while time.monotonic() < deadline:
+            try:
+                connection = connection or await asyncio.open_connection(address.hostname, address.port)
+                if rng.random() < 0.5:
+                    status, head, body = await fetch(connection, "/api/v1/products",
+                                               dict(limit=100, **({"cursor": cursor} if cursor else {})),
+                                               f"scraper-{number}")
+                    if status == 200:
+                        cursor = json.loads(body)["next_cursor"]
+                else:
+                    status, head, body = await fetch(connection, "/api/v1/products/search",
+                                               {"q": f"product {rng.randint(1, PRODUCTS)}", "limit": 100},
+                                               f"scraper-{number}")
+            except (OSError, asyncio.IncompleteReadError):
+                statuses["error"] += 1
+                connection = None
+                continue
+            statuses[status] += 1
+            if status in (429, 503):
+                # Waits for Retry-After as crawlers and client libraries do: one retrying at once costs a
+                # response per request, which on a few cores only a proxy in front of the service can stop
+                await asyncio.sleep(int(re.search(rb"(?i)\r\nretry-after: *(\d+)", head).group(1)))
+
+    await asyncio.gather(*(scraper(number) for number in range(args.scrapers)))
+    return statuses
+
+
+def run(args, tmpdir, label, scrapers, env, catalog_env):
+    databases = {service: f"sqlite:///{os.path.join(tmpdir, f'{label}_{service}.db')}"
+                 for service in ("product", "order", "cart")}
+    env = dict(env, METRICS_ENABLED="false")
+    with contextlib.ExitStack() as stack:
+        base_urls = {"product": stack.enter_context(run_service("product", databases["product"],
+                                                                env=dict(env, **catalog_env)))}
+        env["PRODUCT_SERVICE_URL"] = base_urls["product"]
+        base_urls["order"] = stack.enter_context(run_service("order", databases["order"], env=env))
+        base_urls["cart"] = stack.enter_context(run_service(
+            "cart", databases["cart"], env=dict(env, ORDER_SERVICE_URL=base_urls["order"])))
+
+        engine = create_engine(databases["product"])
+        rng = random.Random(7)
+        insert_rows(engine, "products", [
+            {"name": f"product {i}", "description": f"a product of merchant {i % 100}",
+             "price": round(rng.uniform(1, 500), 2), "stock": 1_000_000, "image_url": None,
+             "merchant_id": 1 + i % 100} for i in range(1, PRODUCTS + 1)])
+        engine.dispose()
+
+        flood = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--scrape", base_urls["product"]]
+                                 + sys.argv[1:], stdout=subprocess.PIPE, text=True) if scrapers else None
+        latencies, failures = asyncio.run(shop(base_urls, args))
+        statuses = Counter(json.loads(flood.communicate()[0])) if flood is not None else Counter()
+    return latencies, failures, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shoppers", type=int, default=8, help="concurrent shoppers checking out")
+    parser.add_argument("--scrapers", type=int, default=64, help="concurrent scraper clients")
+    parser.add_argument("--think", type=float, default=1, help="mean seconds a shopper waits between carts")
+    parser.add_argument("--warmup", type=float, default=2,
+                        help="seconds of checkouts not counted, so every shopper's first one does not set the p99")
+    parser.add_argument("--seconds", type=float, default=60, help="length of each run")
+    parser.add_argument("--rps", type=float, default=0.5,
+                        help="RATE_LIMIT_RPS per client of the product service with admission on")
+    parser.add_argument("--p99-slack", type=float, default=2, help="checkout p99 allowed over the quiet run, times")
+    parser.add_argument("--scrape", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scrape:
+        print(json.dumps(asyncio.run(scrape(args.scrape, args))))
+        return
+
+    tmpdir = tempfile.mkdtemp()
+    admission = {"ADMISSION_ENABLED": "true", "RATE_LIMIT_CLIENT_HEADER": "X-Client-Id"}
+    runs = [("quiet", False, {}, {}), ("flood", True, {}, {}),
+            ("flood, admission", True, admission, {"RATE_LIMIT_RPS": str(args.rps)})]
+    results = {}
+    print(f"{'run':<17} {'checkouts/s':>11} {'p50 ms':>8} {'p99 ms':>8} {'failed':>7} "
+          f"{'scrapes/s':>10} {'429':>7} {'503':>7}")
+    for number, (label, scrapers, env, catalog_env) in enumerate(runs):
+        latencies, failures, statuses = run(args, tmpdir, f"run{number}", scrapers, env, catalog_env)
+        results[label] = (percentile(latencies, 99) if latencies else float("inf"), failures)
+        p50 = percentile(latencies, 50) if latencies else float("inf")
+        print(f"{label:<17} {len(latencies) / args.seconds:>11.1f} {p50:>8.1f} {results[label][0]:>8.1f} "
+              f"{sum(failures.values()):>7} {statuses['200'] / args.seconds:>10.1f} {statuses['429']:>7} "
+              f"{statuses['503']:>7}")
+
+    problems = []
+    p99, failures = results["flood, admission"]
+    if failures:
+        problems.append(f"shoppers failed with admission on: {dict(failures)}")
+    if p99 > args.p99_slack * results["quiet"][0]:
+        problems.append(f"checkout p99 {p99:.1f} ms with admission on, over {args.p99_slack}x the quiet "
+                        f"{results['quiet'][0]:.1f} ms")
+    print("; ".join(problems) or "checkout held steady while the scrapers were shed")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Load test comparing the sync and async database modes of a service.
+
+Starts the service under uvicorn twice, once with a sync sqlite:// URL and once
+with sqlite+aiosqlite://, seeds it, then drives GET requests from many
+concurrent clients and reports requests/sec and p50/p99 latency per mode.
+
+Usage:
+    python benchmarks/async_load.py [--service product] [--concurrency 1000] [--requests 20000]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import httpx
+
+from harness import percentile, run_service
+
+ENDPOINTS = {
+    "product": ("/api/v1/products", "/api/v1/products", {"name": "item", "price": 9.99, "merchant_id": 1}),
+    "user": ("/api/v1/users", None, None),
+    "order": ("/api/v1/order", "/api/v1/order", {"user_id": 1, "items": [{"product_id": 1, "quantity": 1, "price": 9.99}]}),
+    "payment": ("/api/v1/payment", "/api/v1/payment", {"order_id": 1, "total_amount": 9.99}),
+    "cart": ("/cart?user_id=1", "/cart", {"product_id": 1, "user_id": 1}),
+}
+
+
+async def drive(base_url, path, concurrency, total):
+    latencies = []
+    errors = 0
+    remaining = iter(range(total))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        async def worker():
+            nonlocal errors
+            for _ in remaining:
+                start = time.perf_counter()
+                try:
+                    response = await client.get(path)
+                    response.raise_for_status()
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+
+    return total / elapsed, latencies, errors
+
+
+async def run_mode(mode, args):
+    read_path, write_path, payload = ENDPOINTS[args.service]
+    driver = "sqlite+aiosqlite" if mode == "async" else "sqlite"
+    database_url = f"{driver}:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+
+    with run_service(args.service, database_url) as base_url:
+        if write_path:
+            async with httpx.AsyncClient(base_url=base_url) as client:
+                for _ in range(args.seed):
+                    (await client.post(write_path, json=payload)).raise_for_status()
+        rps, latencies, errors = await drive(base_url, read_path, args.concurrency, args.requests)
+
+    print(f"{mode:>6} {rps:>10.1f} {percentile(latencies, 50):>9.1f} "
+          f"{percentile(latencies, 99):>9.1f} {errors:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--service", choices=sorted(ENDPOINTS), default="product")
+    parser.add_argument("--concurrency", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--seed", type=int, default=50, help="rows created before the run")
+    args = parser.parse_args()
+
+    print(f"{'mode':>6} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for mode in ("sync", "async"):
+        asyncio.run(run_mode(mode, args))
+
+
+if __name__ == "__main__":
+    main()
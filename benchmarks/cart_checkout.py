@@ -0,0 +1,147 @@
+"""
+Benchmark of the frontend's cart flows, before and after the cart summary and checkout endpoints.
+
+Starts the product, order and cart services under uvicorn on temporary SQLite databases and seeds
+the catalog. For carts of each size in --lines, fills fresh carts and times each flow both ways:
+- render, before: GET /cart, then one GET /api/v1/products/{id} per line, sent concurrently;
+- render, after: GET /cart/summary;
+- checkout, before: reserve the stock, place the order, commit the reservation, then one DELETE /cart per line;
+- checkout, after: POST /cart/checkout.
+
+Reports the requests the frontend sends per flow and their p50/p95 latency. Also checks that the
+summary total matches the order total and that checked out carts are empty.
+
+Usage:
+    python benchmarks/cart_checkout.py [--lines 1,5,20] [--carts 50] [--products 10000]
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+from sqlalchemy import create_engine
+
+from harness import percentile, run_service
+from platform_load import insert_rows
+
+
+class Frontend:
+    """HTTP clients for the three services that count the requests of the current flow."""
+
+    def __init__(self, clients):
+        self.clients = clients
+        self.requests = 0
+
+    async def call(self, service, method, url, **kwargs):
+        self.requests += 1
+        response = await self.clients[service].request(method, url, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    async def fill_cart(self, user_id, product_ids):
+        return [await self.call("cart", "POST", "/cart", json={"user_id": user_id, "product_id": product_id,
+                                                               "quantity": 1 + product_id % 3})
+                for product_id in product_ids]
+
+    async def render_before(self, user_id):
+        lines = (await self.call("cart", "GET", "/cart", params={"user_id": user_id, "limit": 100}))["items"]
+        products = await asyncio.gather(*(self.call("product", "GET", f"/api/v1/products/{line['product_id']}")
+                                          for line in lines))
+        return sum(product["price"] * line["quantity"] for product, line in zip(products, lines))
+
+    async def render_after(self, user_id):
+        return (await self.call("cart", "GET", "/cart/summary", params={"user_id": user_id}))["total_amount"]
+
+    async def checkout_before(self, user_id, lines):
+        items = [{"product_id": line["product_id"], "quantity": line["quantity"]} for line in lines]
+        reservation = await self.call("product", "POST", "/api/v1/products/reservations", json={"items": items})
+        order = await self.call("order", "POST", "/api/v1/order", json={"user_id": user_id, "items": items})
+        await self.call("product", "POST", f"/api/v1/products/reservations/{reservation['reservation_id']}/commit")
+        for line in lines:
+            await self.call("cart", "DELETE", "/cart", params={"cart_id": line["id"]})
+        return order["total_amount"]
+
+    async def checkout_after(self, user_id, lines):
+        return (await self.call("cart", "POST", "/cart/checkout", json={"user_id": user_id}))["total_amount"]
+
+
+async def measure(base_urls, args):
+    rng = random.Random(42)
+    results, failures = [], []
+    async with contextlib.AsyncExitStack() as stack:
+        clients = {service: await stack.enter_async_context(httpx.AsyncClient(base_url=url, timeout=30))
+                   for service, url in base_urls.items()}
+        frontend = Frontend(clients)
+        user_id = 0
+        for size in args.lines:
+            samples = {flow: [] for flow in ("render before", "render after", "checkout before", "checkout after")}
+            requests = {}
+            for _ in range(args.carts):
+                for variant in ("before", "after"):
+                    user_id += 1
+                    lines = await frontend.fill_cart(user_id, rng.sample(range(1, args.products + 1), size))
+                    totals = []
+                    for flow in (f"render {variant}", f"checkout {variant}"):
+                        frontend.requests = 0
+                        start = time.perf_counter()
+                        if flow.startswith("render"):
+                            total = await getattr(frontend, flow.replace(" ", "_"))(user_id)
+                        else:
+                            total = await getattr(frontend, flow.replace(" ", "_"))(user_id, lines)
+                        samples[flow].append((time.perf_counter() - start) * 1000)
+                        requests[flow] = frontend.requests
+                        totals.append(total)
+                    if abs(totals[0] - totals[1]) > 1e-6:
+                        failures.append(f"{size} lines, {variant}: cart total {totals[0]} but order total {totals[1]}")
+                    left = (await frontend.call("cart", "GET", "/cart", params={"user_id": user_id}))["items"]
+                    if left:
+                        failures.append(f"{size} lines, {variant}: {len(left)} lines left after checkout")
+            for flow, latencies in samples.items():
+                results.append((size, flow, requests[flow], statistics.median(latencies), percentile(latencies, 95)))
+    return results, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", default="1,5,20", help="comma separated cart sizes")
+    parser.add_argument("--carts", type=int, default=50, help="carts per size and variant")
+    parser.add_argument("--products", type=int, default=10_000, help="products seeded into the catalog")
+    args = parser.parse_args()
+    args.lines = [int(size) for size in args.lines.split(",")]
+
+    tmpdir = tempfile.mkdtemp()
+    databases = {service: f"sqlite:///{os.path.join(tmpdir, f'{service}.db')}"
+                 for service in ("product", "order", "cart")}
+    env = {"METRICS_ENABLED": "false"}
+    with contextlib.ExitStack() as stack:
+        base_urls = {"product": stack.enter_context(run_service("product", databases["product"], env=env))}
+        env["PRODUCT_SERVICE_URL"] = base_urls["product"]
+        base_urls["order"] = stack.enter_context(run_service("order", databases["order"], env=env))
+        base_urls["cart"] = stack.enter_context(run_service(
+            "cart", databases["cart"], env=dict(env, ORDER_SERVICE_URL=base_urls["order"])))
+
+        engine = create_engine(databases["product"])
+        rng = random.Random(7)
+        insert_rows(engine, "products", [
+            {"name": f"product {i}", "description": None, "price": round(rng.uniform(1, 500), 2),
+             "stock": 1_000_000, "image_url": None, "merchant_id": 1} for i in range(args.products)])
+        engine.dispose()
+
+        results, failures = asyncio.run(measure(base_urls, args))
+
+    print(f"{'lines':>5} {'flow':<16} {'requests':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for size, flow, requests, p50, p95 in results:
+        print(f"{size:>5} {flow:<16} {requests:>9} {p50:>8.2f} {p95:>8.2f}")
+    for failure in failures:
+        print(f"FAILED {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Benchmark of cart mutations, one call per line against the bulk, merge and clear endpoints.
+
+Loads the cart service in process on a temporary SQLite database (aiosqlite with --async) and runs
+each flow both ways for carts of each size in --lines:
+- fill, before: one POST /cart per product;
+- fill, after: one POST /cart/bulk with an add operation per product;
+- merge, before: read both carts, then per guest line a PUT or POST on the user's cart and a DELETE of the guest line;
+- merge, after: one POST /cart/merge;
+- clear, before: read the cart, then one DELETE /cart per line;
+- clear, after: one DELETE /cart/clear.
+Half of the guest cart's products are also in the user's cart, so merging has conflicts to resolve.
+
+Reports the HTTP calls, database commits and SQL statements per flow and its median time. Also
+checks that both ways leave the same carts.
+
+Usage:
+    python benchmarks/cart_mutations.py [--lines 10,50] [--rounds 20] [--async]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from harness import service_dir
+
+
+class Counters:
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.calls = self.commits = self.statements = 0
+        event.listen(engine, "commit", lambda conn: self.count("commits"))
+        event.listen(engine, "before_cursor_execute", lambda *args: self.count("statements"))
+
+    def count(self, name):
+        setattr(self, name, getattr(self, name) + 1)
+
+    def reset(self):
+        self.calls = self.commits = self.statements = 0
+
+
+class Flows:
+    """The before and after way of every flow; each returns nothing and leaves its result in the database."""
+
+    def __init__(self, client, counters):
+        self.client = client
+        self.counters = counters
+
+    def call(self, method, url, **kwargs):
+        self.counters.calls += 1
+        response = self.client.request(method, url, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    def lines(self, user_id):
+        return self.call("GET", "/cart", params={"user_id": user_id, "limit": 500})["items"]
+
+    def fill_before(self, user_id, products):
+        for product_id in products:
+            self.call("POST", "/cart", json={"user_id": user_id, "product_id": product_id, "quantity": 2})
+
+    def fill_after(self, user_id, products):
+        self.call("POST", "/cart/bulk", json={"user_id": user_id, "operations": [
+            {"op": "add", "product_id": product_id, "quantity": 2} for product_id in products]})
+
+    def merge_before(self, guest_id, user_id):
+        existing = {line["product_id"]: line for line in self.lines(user_id)}
+        for line in self.lines(guest_id):
+            target = existing.get(line["product_id"])
+            if target is None:
+                self.call("POST", "/cart", json={"user_id": user_id, "product_id": line["product_id"],
+                                                 "quantity": line["quantity"]})
+            else:
+                self.call("PUT", "/cart", params={"cart_id": target["id"]},
+                          json={"quantity": target["quantity"] + line["quantity"]})
+            self.call("DELETE", "/cart", params={"cart_id": line["id"]})
+
+    def merge_after(self, guest_id, user_id):
+        self.call("POST", "/cart/merge", json={"source_user_id": guest_id, "target_user_id": user_id})
+
+    def clear_before(self, user_id):
+        for line in self.lines(user_id):
+            self.call("DELETE", "/cart", params={"cart_id": line["id"]})
+
+    def clear_after(self, user_id):
+        self.call("DELETE", "/cart/clear", params={"user_id": user_id})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", default="10,50", help="comma separated cart sizes")
+    parser.add_argument("--rounds", type=int, default=20, help="runs of every flow per size and way")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="use the aiosqlite driver")
+    args = parser.parse_args()
+
+    driver = "sqlite+aiosqlite" if args.use_async else "sqlite"
+    os.environ["DATABASE_URL"] = f"{driver}:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ["METRICS_ENABLED"] = "false"
+    sys.path.insert(0, service_dir("cart"))
+
+    from fastapi.testclient import TestClient
+    from database import sync_engine
+    import main as cart_main
+
+    counters = Counters(sync_engine)
+    failures = []
+    print(f"{'lines':>5} {'flow':<8} {'calls':>13} {'commits':>13} {'statements':>13} {'ms':>17}")
+    with TestClient(cart_main.app) as client:
+        flows = Flows(client, counters)
+        user_id = 0
+
+        def timed(fn, *fn_args):
+            counters.reset()
+            start = time.perf_counter()
+            fn(*fn_args)
+            return (time.perf_counter() - start) * 1000, (counters.calls, counters.commits, counters.statements)
+
+        for size in (int(size) for size in args.lines.split(",")):
+            samples = {(flow, way): [] for flow in ("fill", "merge", "clear") for way in ("before", "after")}
+            counts = {}
+            for _ in range(args.rounds):
+                carts = {}
+                for way in ("before", "after"):
+                    user_id += 2
+                    guest_id, owner_id = user_id - 1, user_id
+                    for flow, fn_args in (("fill", (owner_id, range(1, size + 1))),
+                                          ("merge", (guest_id, owner_id)),
+                                          ("clear", (owner_id,))):
+                        if flow == "merge":
+                            # The guest shares the upper half of the user's products
+                            flows.fill_after(guest_id, range(size // 2 + 1, size + size // 2 + 1))
+                        if flow == "clear":
+                            carts[way] = sorted((line["product_id"], line["quantity"])
+                                                for line in flows.lines(owner_id))
+                        ms, counts[(flow, way)] = timed(getattr(flows, f"{flow}_{way}"), *fn_args)
+                        samples[(flow, way)].append(ms)
+                    if flows.lines(owner_id) or flows.lines(guest_id):
+                        failures.append(f"{size} lines, {way}: carts not empty after clearing")
+                if carts["before"] != carts["after"]:
+                    failures.append(f"{size} lines: merged carts differ")
+
+            for flow in ("fill", "merge", "clear"):
+                before, after = counts[(flow, "before")], counts[(flow, "after")]
+                ms_before, ms_after = (statistics.median(samples[(flow, way)]) for way in ("before", "after"))
+                print(f"{size:>5} {flow:<8} {before[0]:>6} -> {after[0]:<3} {before[1]:>6} -> {after[1]:<3} "
+                      f"{before[2]:>6} -> {after[2]:<3} {ms_before:>7.1f} -> {ms_after:<6.1f}")
+
+    for failure in failures:
+        print(f"FAILED {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Benchmark of cart mutation throughput, straight to the database against the write-behind cart store.
+
+Seeds a temporary SQLite database (aiosqlite with --async) with --users carts of --lines lines. Then
+loads the cart service in process with CART_STORE_ENABLED off and on, each in a child process of its
+own. --concurrency clients, each owning a slice of the users, send a mix through ASGI for --requests
+requests each:
+- 70% quantity changes (PUT /cart);
+- 20% adds of a product already in the cart (POST /cart);
+- 10% cart reads (GET /cart).
+
+Reports requests/s, p50/p95 latency, database commits per mutation and the flushes of the store. After
+shutdown, which writes the store's pending changes, checks that the database holds exactly the
+quantities the clients last set.
+
+Usage:
+    python benchmarks/cart_store.py [--users 1000] [--lines 5] [--concurrency 20] [--requests 500] [--async]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from harness import percentile, service_dir
+
+
+async def client(http, users, lines, args, rng, latencies, expected):
+    """
+    Sends one client's requests and returns how many were mutations.
+    expected ends up as {line id: quantity} for the client's users' lines.
+    """
+    mutations = 0
+    for _ in range(args.requests):
+        user_id = rng.choice(users)
+        line_id, product_id = rng.choice(lines[user_id])
+        kind = rng.random()
+        start = time.perf_counter()
+        if kind < 0.7:
+            quantity = rng.randint(1, 9)
+            response = await http.put("/cart", params={"cart_id": line_id}, json={"quantity": quantity})
+            expected[line_id] = quantity
+        elif kind < 0.9:
+            response = await http.post("/cart", json={"user_id": user_id, "product_id": product_id, "quantity": 1})
+            expected[line_id] += 1
+        else:
+            response = await http.get("/cart", params={"user_id": user_id})
+        latencies.append((time.perf_counter() - start) * 1000)
+        response.raise_for_status()
+        mutations += kind < 0.9
+    return mutations
+
+
+async def drive(main, args, seeded):
+    import httpx
+    from sqlalchemy import event
+    from database import sync_engine
+
+    commits = []
+    event.listen(sync_engine, "commit", lambda conn: commits.append(1))
+    lines = {}
+    for line_id, user_id, product_id, _ in seeded:
+        lines.setdefault(user_id, []).append((line_id, product_id))
+    expected = {line_id: quantity for line_id, _, _, quantity in seeded}
+    users = sorted(lines)
+    latencies = []
+
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench") as http:
+            commits.clear()
+            start = time.perf_counter()
+            mutations = await asyncio.gather(*(
+                client(http, users[i::args.concurrency], lines, args, random.Random(i), latencies, expected)
+                for i in range(args.concurrency)))
+            elapsed = time.perf_counter() - start
+            stats = (await http.get("/metrics/cart-store")).json()
+    return elapsed, latencies, len(commits) / sum(mutations), stats, expected
+
+
+def run_variant(args, path):
+    os.environ["DATABASE_URL"] = f"{'sqlite+aiosqlite' if args.use_async else 'sqlite'}:///{path}"
+    os.environ["METRICS_ENABLED"] = "false"
+    os.environ["CART_STORE_ENABLED"] = "true" if args.variant == "store" else "false"
+    sys.path.insert(0, service_dir("cart"))
+
+    import sqlite3
+    import main
+
+    with sqlite3.connect(path) as conn:
+        seeded = conn.execute("SELECT id, user_id, product_id, quantity FROM cart").fetchall()
+    elapsed, latencies, commits_per_mutation, stats, expected = asyncio.run(drive(main, args, seeded))
+    with sqlite3.connect(path) as conn:
+        stored = dict(conn.execute("SELECT id, quantity FROM cart").fetchall())
+
+    print(json.dumps({"variant": args.variant, "throughput": len(latencies) / elapsed,
+                      "p50": statistics.median(latencies), "p95": percentile(latencies, 95),
+                      "commits_per_mutation": commits_per_mutation, "flushes": stats.get("flushes"),
+                      "consistent": stored == expected}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="carts seeded")
+    parser.add_argument("--lines", type=int, default=5, help="lines per cart")
+    parser.add_argument("--concurrency", type=int, default=20, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=500, help="requests per client")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="use the aiosqlite driver")
+    parser.add_argument("--variant", help=argparse.SUPPRESS)
+    parser.add_argument("--database", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        run_variant(args, args.database)
+        return
+
+    tmpdir = tempfile.mkdtemp()
+    seed_path = os.path.join(tmpdir, "seed.db")
+    # Creates the schema through the service's migrations, then seeds it
+    subprocess.run([sys.executable, "-c", "import asyncio, main; asyncio.run(main.create_db_and_tables())"],
+                   cwd=service_dir("cart"), env=dict(os.environ, DATABASE_URL=f"sqlite:///{seed_path}"), check=True)
+    import sqlite3
+    conn = sqlite3.connect(seed_path)
+    conn.executemany("INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, 1)",
+                     [(user_id, product_id) for user_id in range(1, args.users + 1)
+                      for product_id in range(1, args.lines + 1)])
+    conn.commit()
+    # Closing the last connection checkpoints the WAL, so the copies hold every row
+    conn.close()
+
+    print(f"{'path':<10} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'commits/mutation':>17} {'flushes':>8}  state")
+    failed = False
+    for variant in ("database", "store"):
+        path = os.path.join(tmpdir, f"{variant}.db")
+        shutil.copy(seed_path, path)
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--variant", variant, "--database", path]
+                                + sys.argv[1:], check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        failed |= not result["consistent"]
+        print(f"{variant:<10} {result['throughput']:>8.0f} {result['p50']:>8.2f} {result['p95']:>8.2f} "
+              f"{result['commits_per_mutation']:>17.3f} {str(result['flushes'] or '-'):>8}  "
+              f"{'consistent' if result['consistent'] else 'DATABASE DIFFERS FROM THE CLIENTS'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
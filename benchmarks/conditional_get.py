@@ -0,0 +1,140 @@
+"""
+Benchmark of conditional GETs on the endpoints mobile clients poll: the product list, a cart and a user's orders.
+
+For each endpoint, in a child process of its own, loads the service in process on a temporary SQLite
+database (aiosqlite with --async), seeds it through its API and polls one page of --page-size rows
+--polls times, first without and then with If-None-Match set to the ETag of the previous response.
+It reports the response bytes, the process CPU time (client and service), the SQL statements and the
+median latency per poll. The product list is run with its cache on and off, the cart with the database
+and with the in-memory cart store.
+
+After the polls it changes one row of the page through the API and checks that the next conditional
+poll gets a 200 with a new ETag and the changed data, never a stale 304.
+
+Usage:
+    python benchmarks/conditional_get.py [--polls 2000] [--page-size 100] [--async]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from harness import service_dir
+
+VARIANTS = {
+    "products": ("product", {}),
+    "products, no cache": ("product", {"PRODUCT_CACHE_SIZE": "0"}),
+    "cart": ("cart", {}),
+    "cart, cart store": ("cart", {"CART_STORE_ENABLED": "true"}),
+    "orders": ("order", {"PRODUCT_SERVICE_URL": ""}),
+}
+
+
+def seed(client, service, rows):
+    """Seeds the service and returns the polled URL, its params and a write that changes the polled page."""
+    if service == "product":
+        for i in range(rows):
+            client.post("/api/v1/products", json={"name": f"product {i}", "description": "a product to poll",
+                                                  "price": 9.99, "stock": 10, "merchant_id": 1}).raise_for_status()
+        return "/api/v1/products", {"limit": rows}, lambda: client.put(
+            "/api/v1/products", params={"product_id": 1}, json={"price": 19.99})
+    if service == "cart":
+        client.post("/cart/bulk", json={"user_id": 1, "operations": [
+            {"op": "add", "product_id": product_id, "quantity": 1} for product_id in range(1, rows + 1)]}
+                    ).raise_for_status()
+        return "/cart", {"user_id": 1, "limit": rows}, lambda: client.post(
+            "/cart", json={"user_id": 1, "product_id": 1, "quantity": 1})
+    client.post("/api/v1/order/batch", json=[
+        {"user_id": 1, "items": [{"product_id": i, "quantity": 1, "price": 9.99}]} for i in range(rows)]
+                ).raise_for_status()
+    order_id = client.get("/api/v1/order", params={"user_id": 1, "limit": 1}).json()["items"][0]["id"]
+    return "/api/v1/order", {"user_id": 1, "limit": rows}, lambda: client.put(
+        "/api/v1/order", json={"order_id": order_id, "order_status": "completed"})
+
+
+def run_variant(args, path):
+    service, env = VARIANTS[args.variant]
+    os.environ.update(env, DATABASE_URL=f"{'sqlite+aiosqlite' if args.use_async else 'sqlite'}:///{path}",
+                      METRICS_ENABLED="false")
+    sys.path.insert(0, service_dir(service))
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+    from database import sync_engine
+    import main as service_main
+
+    statements = []
+    event.listen(sync_engine, "before_cursor_execute", lambda *args: statements.append(1))
+    failures = []
+    results = {}
+
+    with TestClient(service_main.app) as client:
+        url, params, write = seed(client, service, args.page_size)
+        first = client.get(url, params=params)
+        first.raise_for_status()
+        etag = first.headers.get("etag")
+        if etag is None:
+            failures.append("no ETag on the response")
+
+        for label, headers in (("plain", {}), ("conditional", {"If-None-Match": etag or ""})):
+            sizes, latencies = [], []
+            statements.clear()
+            cpu = time.process_time()
+            for _ in range(args.polls):
+                start = time.perf_counter()
+                response = client.get(url, params=params, headers=headers)
+                latencies.append((time.perf_counter() - start) * 1000)
+                sizes.append(len(response.content))
+            results[label] = {"bytes": statistics.mean(sizes), "status": response.status_code,
+                              "cpu_ms": (time.process_time() - cpu) * 1000 / args.polls,
+                              "statements": len(statements) / args.polls, "p50_ms": statistics.median(latencies)}
+        if results["conditional"]["status"] != 304:
+            failures.append(f"unchanged poll got {results['conditional']['status']}, not 304")
+
+        write().raise_for_status()
+        response = client.get(url, params=params, headers={"If-None-Match": etag or ""})
+        if response.status_code != 200:
+            failures.append(f"poll after a write got {response.status_code}, not 200")
+        elif response.headers.get("etag") in (None, etag) or response.content == first.content:
+            failures.append("poll after a write kept the old ETag or data")
+        elif client.get(url, params=params, headers={"If-None-Match": response.headers["etag"]}).status_code != 304:
+            failures.append("new ETag is not honoured")
+
+    print(json.dumps(dict(results, failures=failures)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--polls", type=int, default=2000, help="polls per way and endpoint")
+    parser.add_argument("--page-size", type=int, default=100, help="rows on the polled page")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="use the aiosqlite driver")
+    parser.add_argument("--variant", help=argparse.SUPPRESS)
+    parser.add_argument("--database", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        run_variant(args, args.database)
+        return
+
+    tmpdir = tempfile.mkdtemp()
+    failed = False
+    print(f"{'endpoint':<20} {'poll':<12} {'bytes':>7} {'CPU ms':>7} {'SQL':>5} {'p50 ms':>7}  check")
+    for number, variant in enumerate(VARIANTS):
+        path = os.path.join(tmpdir, f"poll_{number}.db")
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--variant", variant,
+                                 "--database", path] + sys.argv[1:], check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        failed |= bool(result["failures"])
+        for label in ("plain", "conditional"):
+            poll = result[label]
+            print(f"{variant:<20} {label:<12} {poll['bytes']:>7.0f} {poll['cpu_ms']:>7.2f} {poll['statements']:>5.1f} "
+                  f"{poll['p50_ms']:>7.2f}  {'; '.join(result['failures']) or 'no stale 304'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Memory check for the streaming order and payment exports.
+
+Fills a temporary SQLite table of the order or payment service with synthetic rows (5M by default,
+generated inside SQLite so the script itself holds none of them). Loads the service in process and
+reads GET /export directly through ASGI, first for the last 100k rows (resuming with after_id), then
+for the whole table. Samples the process RSS as the chunks arrive.
+
+For each service and format, reports rows/s, output size and how far RSS rose above its level before
+the export. The check fails, with exit status 1, if the full export grows memory by more than
+--slack-mb beyond the small one, i.e. if memory depends on the row count. Also checks:
+- that the exports return every row exactly once;
+- that a one-day created_at range returns the expected count.
+
+Every service is measured in a child process of its own, since their modules share names.
+
+Usage:
+    python benchmarks/export_memory.py [--services order,payment] [--rows 5000000] [--formats ndjson,csv]
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from harness import service_dir
+
+PATHS = {"order": "/api/v1/order/export", "payment": "/api/v1/payment/export"}
+# One row every 5 seconds from 2024-01-01, so a day holds 17280 rows
+SEED_SQL = {
+    "order": "INSERT INTO orders (user_id, order_status, total_amount, payment_status, created_at) "
+             "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :rows) "
+             "SELECT i % 10000, 'completed', (i % 50000) / 100.0, 'paid', "
+             # Stored the way SQLAlchemy binds datetimes, so range bounds compare as strings correctly
+             "datetime('2024-01-01', '+' || ((i - 1) * 5) || ' seconds') || '.000000' FROM n",
+    "payment": "INSERT INTO payment (order_id, total_amount, payment_status, created_at) "
+               "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :rows) "
+               "SELECT i, (i % 50000) / 100.0, 'paid', "
+               "strftime('%Y-%m-%dT%H:%M:%S', '2024-01-01', '+' || ((i - 1) * 5) || ' seconds') FROM n",
+}
+ROWS_PER_DAY = 17280
+
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    raise RuntimeError("VmRSS not found")
+
+
+async def export(app, path, query):
+    """Streams one export through ASGI; returns rows, bytes, seconds, RSS growth in MB and the first data line."""
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+             "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+             "query_string": query.encode(), "headers": [(b"host", b"bench")],
+             "client": ("127.0.0.1", 1), "server": ("bench", 80)}
+    state = {"lines": 0, "bytes": 0, "peak": 0.0, "first": None, "requested": False}
+    baseline = rss_mb()
+
+    async def receive():
+        if state["requested"]:
+            await asyncio.Event().wait()
+        state["requested"] = True
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            assert message["status"] == 200, message
+        elif message["type"] == "http.response.body":
+            body = message.get("body", b"")
+            if state["first"] is None and body:
+                state["first"] = body
+            state["lines"] += body.count(b"\n")
+            state["bytes"] += len(body)
+            state["peak"] = max(state["peak"], rss_mb() - baseline)
+
+    start = time.perf_counter()
+    await app(scope, receive, send)
+    return state["lines"], state["bytes"], time.perf_counter() - start, state["peak"], state["first"]
+
+
+async def measure(service, main, args):
+    path = PATHS[service]
+    failures = []
+    small = min(100_000, args.rows)
+
+    lines, *_ = await export(main.app, path, "created_from=2024-01-02T00:00:00&created_to=2024-01-03T00:00:00")
+    expected_day = max(0, min(ROWS_PER_DAY, args.rows - ROWS_PER_DAY))
+    if lines != expected_day:
+        failures.append(f"{service}: one day range returned {lines} rows instead of {expected_day}")
+
+    for export_format in args.formats:
+        header = 1 if export_format == "csv" else 0
+        growth = {}
+        for label, query, expected in (
+            ("resume", f"format={export_format}&after_id={args.rows - small}", small),
+            ("full", f"format={export_format}", args.rows),
+        ):
+            lines, size, seconds, growth[label], first = await export(main.app, path, query)
+            if lines - header != expected:
+                failures.append(f"{service} {export_format} {label}: {lines - header} rows instead of {expected}")
+            if label == "resume" and export_format == "ndjson" and not first.startswith(
+                    f'{{"id":{args.rows - small + 1},'.encode()):
+                failures.append(f"{service}: resuming after id {args.rows - small} started at {first[:40]!r}")
+            print(f"{service:<8} {export_format:<7} {label:<7} {lines - header:>9} {lines / seconds:>10.0f} "
+                  f"{size / 1024 ** 2:>9.1f} {growth[label]:>10.1f}")
+
+        if growth["full"] > growth["resume"] + args.slack_mb:
+            failures.append(f"{service} {export_format}: memory grew {growth['full']:.1f} MB for {args.rows} rows "
+                            f"against {growth['resume']:.1f} MB for {small}")
+    return failures
+
+
+def run_service_benchmark(service, args):
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ["METRICS_ENABLED"] = "false"
+    sys.path.insert(0, service_dir(service))
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import text
+    from database import sync_engine
+    import main
+
+    with TestClient(main.app) as client:
+        with sync_engine.begin() as conn:
+            conn.execute(text(SEED_SQL[service]), {"rows": args.rows})
+        failures = client.portal.call(measure, service, main, args)
+
+    for failure in failures:
+        print(f"FAILED {failure}")
+    sys.exit(1 if failures else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--services", default="order,payment")
+    parser.add_argument("--rows", type=int, default=5_000_000, help="synthetic rows in the exported table")
+    parser.add_argument("--formats", default="ndjson,csv")
+    parser.add_argument("--slack-mb", type=float, default=16,
+                        help="allowed extra RSS growth of the full export over the 100k row one")
+    parser.add_argument("--service", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.formats = args.formats.split(",")
+
+    if args.service:
+        run_service_benchmark(args.service, args)
+        return
+
+    print(f"{'service':<8} {'format':<7} {'export':<7} {'rows':>9} {'rows/s':>10} {'MB out':>9} {'RSS +MB':>10}")
+    failed = False
+    for service in args.services.split(","):
+        failed |= subprocess.run([sys.executable, os.path.abspath(__file__), "--service", service]
+                                 + sys.argv[1:]).returncode != 0
+    if failed:
+        sys.exit(1)
+    print("memory stayed flat for every export")
+
+
+if __name__ == "__main__":
+    main()
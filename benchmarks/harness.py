@@ -0,0 +1,59 @@
+"""
+Helpers shared by the benchmark scripts: starting services under uvicorn and summarizing latencies.
+"""
+import contextlib
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def service_dir(service):
+    return os.path.join(ROOT, f"{service}_service")
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    with httpx.Client(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            try:
+                client.get("/docs")
+                return
+            except httpx.TransportError:
+                time.sleep(0.1)
+    raise RuntimeError(f"service at {base_url} did not start")
+
+
+@contextlib.contextmanager
+def run_service(service, database_url, env=None, workers=1):
+    """Runs a service under uvicorn against database_url and yields its base URL."""
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", service_dir(service),
+         "--port", str(port), "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        env=dict(os.environ, DATABASE_URL=database_url, **(env or {})),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_ready(base_url)
+        yield base_url
+    finally:
+        server.terminate()
+        server.wait()
@@ -0,0 +1,256 @@
+"""
+Benchmark for the index redesign of the order, payment and address tables.
+
+For every service, builds two temporary SQLite databases from the current models:
+- "before" swaps the composite indexes for the single-column indexes every field used to have;
+- "after" is the schema as declared.
+
+Seeds both with the same data through bulk inserts and reports rows/s. Then writes through the
+service's own CRUD functions, one transaction per request as the API does (orders/s, payments/s).
+Then times the listing and lookup queries the services actually run (p50/p95 ms).
+
+Finally migrates a copy of the seeded "before" database with reconcile_indexes, as the services
+do at startup, checks that it ends up with exactly the "after" indexes and reports how long it took.
+
+Every service is measured in a child process of its own, since their modules share names.
+
+Usage:
+    python benchmarks/index_design.py [--services order,payment,user] [--rows 200000] [--writes 2000]
+        [--queries 300]
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from harness import percentile, service_dir
+
+# The single-column indexes each table had before the redesign
+OLD_INDEXES = {
+    "order": {
+        "orders": ["user_id", "order_status", "total_amount", "payment_status", "shipping_id", "created_at",
+                   "updated_at"],
+        "orderitem": ["order_id", "product_id", "quantity", "price", "subtotal"],
+        "shipping": ["order_id", "shipping_method", "tracking_number", "shipped_at", "delivered_at"],
+    },
+    "payment": {
+        "payment": ["order_id", "total_amount", "payment_status", "payment_method_id", "created_at", "updated_at"],
+        "paymentmethod": ["user_id", "method_type", "created_at", "updated_at"],
+    },
+    "user": {
+        "address": ["user_id", "street", "city", "state", "zip_code", "country", "default"],
+    },
+}
+
+
+def use_old_indexes(engine, old_indexes):
+    from sqlalchemy import inspect, text
+
+    with engine.begin() as conn:
+        for name in old_indexes:
+            for index in inspect(conn).get_indexes(name):
+                if index["name"].startswith("ix_"):
+                    conn.execute(text(f'DROP INDEX "{index["name"]}"'))
+            for column in old_indexes[name]:
+                conn.execute(text(f'CREATE INDEX "ix_{name}_{column}" ON "{name}" ("{column}")'))
+
+
+def index_names(engine, tables):
+    from sqlalchemy import inspect
+
+    inspector = inspect(engine)
+    return {table.name: sorted(index["name"] for index in inspector.get_indexes(table.name)) for table in tables}
+
+
+class Workload:
+    """The seed data, service writes and read queries of one service."""
+
+    def __init__(self, service, rows, rng):
+        self.service = service
+        self.rows = rows
+        self.rng = rng
+
+    def tables(self, models):
+        if self.service == "order":
+            return [models.Orders.__table__, models.OrderItem.__table__, models.Shipping.__table__]
+        if self.service == "payment":
+            return [models.Payment.__table__, models.PaymentMethod.__table__]
+        return [models.Address.__table__]
+
+    def seed(self, models):
+        """Returns (table, rows) pairs in insert order; the same rows for both variants."""
+        rng, rows = random.Random(42), self.rows
+        start = datetime(2024, 1, 1)
+        if self.service == "order":
+            users = max(1, rows // 10)
+            orders = [{"user_id": rng.randint(1, users),
+                       "order_status": rng.choices(["completed", "pending", "processing"], [90, 5, 5])[0],
+                       "total_amount": round(rng.uniform(5, 500), 2),
+                       "payment_status": rng.choices(["paid", "unpaid"], [95, 5])[0],
+                       "created_at": start + timedelta(seconds=i * 60)} for i in range(rows)]
+            items = [{"order_id": order_id, "product_id": rng.randint(1, 100_000), "quantity": rng.randint(1, 3),
+                      "price": 9.99, "subtotal": 9.99} for order_id in range(1, rows + 1) for _ in range(4)]
+            shipping = [{"order_id": order_id, "shipping_method": "standard", "tracking_number": f"TRK{order_id:010d}"}
+                        for order_id in range(1, rows + 1) if orders[order_id - 1]["order_status"] == "completed"]
+            return [(models.Orders.__table__, orders), (models.OrderItem.__table__, items),
+                    (models.Shipping.__table__, shipping)]
+        if self.service == "payment":
+            methods = [{"user_id": user_id, "method_type": "credit_card"} for user_id in range(1, rows // 10 + 1)]
+            payments = [{"order_id": i, "total_amount": round(rng.uniform(5, 500), 2),
+                         "payment_status": rng.choices(["paid", "failed", "pending"], [90, 5, 5])[0],
+                         "payment_method_id": rng.randint(1, len(methods)),
+                         "created_at": (start + timedelta(seconds=i * 60)).isoformat()} for i in range(1, rows + 1)]
+            return [(models.PaymentMethod.__table__, methods), (models.Payment.__table__, payments)]
+        users = max(1, rows // 2)
+        addresses = [{"user_id": rng.randint(1, users), "street": f"{i} Main Street", "city": f"City {i % 500}",
+                      "state": f"State {i % 50}", "zip_code": f"{i % 100000:05d}", "country": "ID",
+                      "default": i % 2 == 0} for i in range(rows)]
+        return [(models.Users.__table__, [{"email": f"user{i}@example.com", "fullname": f"User {i}"}
+                                          for i in range(1, users + 1)]),
+                (models.Address.__table__, addresses)]
+
+    def write(self, session, models, crud, i):
+        """One write as the API makes it; returns nothing."""
+        rng = self.rng
+        if self.service == "order":
+            crud.place_orders(session, [models.OrderRequest(user_id=rng.randint(1, max(1, self.rows // 10)), items=[
+                models.OrderItem(product_id=rng.randint(1, 100_000), quantity=1, price=9.99) for _ in range(4)])])
+        elif self.service == "payment":
+            crud.create_payment(session, models.Payment(order_id=self.rows + i + 1, total_amount=9.99))
+        else:
+            session.add(models.Address(user_id=rng.randint(1, max(1, self.rows // 2)), street="1 Main Street",
+                                       city="City", state="State", zip_code="00000", country="ID"))
+            session.commit()
+
+    def queries(self, models, crud):
+        """Named callables taking a session, one per access path the service serves."""
+        from sqlmodel import select
+
+        rng, rows = self.rng, self.rows
+        if self.service == "order":
+            OrderItem, Shipping = models.OrderItem, models.Shipping
+            return {
+                "orders of a user": lambda s: crud.list_orders(s, rng.randint(1, rows // 10), None, None, None, 20),
+                "newest orders": lambda s: crud.list_orders(s, None, None, None, None, 50),
+                "pending orders": lambda s: crud.list_orders(s, None, models.OrderStatus.pending, None, None, 50),
+                "unpaid orders": lambda s: crud.list_orders(s, None, None, models.PaymentStatus.unpaid, None, 50),
+                "items of an order": lambda s: s.exec(
+                    select(OrderItem).where(OrderItem.order_id == rng.randint(1, rows))).all(),
+                "shipment by tracking": lambda s: s.exec(
+                    select(Shipping).where(Shipping.tracking_number == f"TRK{rng.randint(1, rows):010d}")).first(),
+            }
+        if self.service == "payment":
+            return {
+                "payments of an order": lambda s: crud.list_payments(s, rng.randint(1, rows), None, None, 20),
+                "newest payments": lambda s: crud.list_payments(s, None, None, None, 50),
+                "failed payments": lambda s: crud.list_payments(s, None, models.PaymentStatus.failed, None, 50),
+                "methods of a user": lambda s: s.exec(select(models.PaymentMethod).where(
+                    models.PaymentMethod.user_id == rng.randint(1, rows // 10))).all(),
+            }
+        Address = models.Address
+        return {
+            "addresses of a user": lambda s: s.exec(
+                select(Address).where(Address.user_id == rng.randint(1, rows // 2))).all(),
+            "default address": lambda s: s.exec(select(Address).where(
+                Address.user_id == rng.randint(1, rows // 2), Address.default == True)).first(),  # noqa: E712
+        }
+
+
+def run_service_benchmark(service, args):
+    tmpdir = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmpdir, 'unused.db')}"
+    os.environ["METRICS_ENABLED"] = "false"
+    sys.path.insert(0, service_dir(service))
+
+    from sqlmodel import Session, SQLModel, create_engine
+    import models
+    import crud
+    from database import configure_sqlite, reconcile_indexes
+
+    results = {}
+    for variant in ("before", "after"):
+        path = os.path.join(tmpdir, f"{variant}.db")
+        engine = create_engine(f"sqlite:///{path}")
+        configure_sqlite(engine)
+        workload = Workload(service, args.rows, random.Random(7))
+        tables = workload.tables(models)
+        SQLModel.metadata.create_all(engine)
+        if variant == "before":
+            use_old_indexes(engine, OLD_INDEXES[service])
+
+        seeded, start = 0, time.perf_counter()
+        with engine.begin() as conn:
+            for table, rows in workload.seed(models):
+                for offset in range(0, len(rows), 10_000):
+                    conn.execute(table.insert(), rows[offset:offset + 10_000])
+                seeded += len(rows)
+        bulk = seeded / (time.perf_counter() - start)
+        if variant == "before":
+            # Closing every connection checkpoints the WAL, so the copy holds all the rows
+            engine.dispose()
+            shutil.copy(path, os.path.join(tmpdir, "migrated.db"))
+
+        start = time.perf_counter()
+        with Session(engine, expire_on_commit=False) as session:
+            for i in range(args.writes):
+                workload.write(session, models, crud, i)
+        writes = args.writes / (time.perf_counter() - start)
+
+        latencies = {}
+        with Session(engine) as session:
+            for name, query in workload.queries(models, crud).items():
+                samples = []
+                for _ in range(args.queries):
+                    start = time.perf_counter()
+                    query(session)
+                    samples.append((time.perf_counter() - start) * 1000)
+                latencies[name] = (statistics.median(samples), percentile(samples, 95))
+        results[variant] = (bulk, writes, os.path.getsize(path) / 1024 ** 2, latencies, index_names(engine, tables))
+        engine.dispose()
+
+    engine = create_engine(f"sqlite:///{os.path.join(tmpdir, 'migrated.db')}")
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        reconcile_indexes(conn, tables)
+    migration = time.perf_counter() - start
+    migrated = index_names(engine, tables) == results["after"][4]
+
+    (bulk_b, writes_b, size_b, reads_b, _), (bulk_a, writes_a, size_a, reads_a, _) = results["before"], results["after"]
+    print(f"{service}: bulk insert {bulk_b:,.0f} -> {bulk_a:,.0f} rows/s, service writes {writes_b:,.0f} -> "
+          f"{writes_a:,.0f}/s, database {size_b:.0f} -> {size_a:.0f} MB")
+    for name in reads_b:
+        print(f"  {name:<24} p50 {reads_b[name][0]:>7.3f} -> {reads_a[name][0]:>7.3f} ms   "
+              f"p95 {reads_b[name][1]:>7.3f} -> {reads_a[name][1]:>7.3f} ms")
+    print(f"  migration of the before database: {migration:.1f}s, "
+          f"{'indexes match the models' if migrated else 'INDEXES DIFFER FROM THE MODELS'}")
+    sys.exit(0 if migrated else 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--services", default="order,payment,user")
+    parser.add_argument("--rows", type=int, default=200_000, help="orders, payments or addresses seeded")
+    parser.add_argument("--writes", type=int, default=2000, help="writes through the service's CRUD functions")
+    parser.add_argument("--queries", type=int, default=300, help="runs of each read query")
+    parser.add_argument("--service", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.service:
+        run_service_benchmark(args.service, args)
+        return
+
+    failed = False
+    for service in args.services.split(","):
+        failed |= subprocess.run([sys.executable, os.path.abspath(__file__), "--service", service]
+                                 + sys.argv[1:]).returncode != 0
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Micro-benchmark for the overhead of the request and database instrumentation.
+
+Loads the product service with METRICS_ENABLED=false and calls it directly through ASGI
+(no sockets, so only the app's own cost is measured), for a single-product read that hits the
+database and for a page of products.
+
+The instrumentation's own cost per request is measured in isolation, where it is steady enough
+to compare with a 2% budget: the middleware around a stub app replaying the route's real response,
+plus the engine hooks per statement times the statements a request runs,
+timed with the hooks attached and detached in turn. The overhead is that cost over the time of a
+request through the bare app, and the benchmark fails when it reaches --max-overhead percent.
+
+As a cross-check, blocks of requests through the bare app and through the same app wrapped in the
+middleware with the hooks attached are interleaved, taking turns going first, and timed in process
+CPU time. The median over the pairs of adjacent blocks is printed as the end-to-end overhead along
+with the spread of two bare blocks against each other, which on a busy machine is as large as
+the overhead itself.
+
+Usage:
+    python benchmarks/instrumentation_overhead.py [--blocks 40] [--block-size 250] [--max-overhead 2]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from harness import service_dir
+
+PATHS = ("/api/v1/products/1", "/api/v1/products?limit=20")
+ROUNDS = 40
+
+
+def make_scope(path):
+    raw_path, _, query = path.partition("?")
+    return {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": raw_path, "raw_path": raw_path.encode(), "root_path": "",
+            "query_string": query.encode(), "headers": [(b"host", b"bench")],
+            "client": ("127.0.0.1", 1), "server": ("bench", 80)}
+
+
+async def receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def call(app, path, sent=None):
+    """Sends one GET through the ASGI interface and returns the status code, keeping the messages in sent."""
+    scope, status = make_scope(path), {}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status["code"] = message["status"]
+        if sent is not None:
+            sent.append(message)
+
+    await app(scope, receive, send)
+    return status["code"], scope
+
+
+async def run_block(app, path, requests):
+    # CPU time of the whole process (threadpool included), so time stolen by other tenants doesn't count
+    start = time.process_time()
+    for _ in range(requests):
+        assert (await call(app, path))[0] == 200
+    return time.process_time() - start
+
+
+async def run_instrumented(instrumented, timer, metrics, path, requests):
+    from database import sync_engine, pool_metrics
+
+    timer.attach(sync_engine)
+    pool_metrics.listeners.append(metrics.record_pool_wait)
+    try:
+        return await run_block(instrumented, path, requests)
+    finally:
+        pool_metrics.listeners.remove(metrics.record_pool_wait)
+        timer.detach(sync_engine)
+
+
+async def paired_difference(timed, bare, instrumented):
+    """Median over ROUNDS pairs of timed(instrumented) - timed(bare), the two taking turns going first."""
+    differences = []
+    for number in range(ROUNDS):
+        if number % 2:
+            on = await timed(instrumented)
+            differences.append(on - await timed(bare))
+        else:
+            off = await timed(bare)
+            differences.append(await timed(instrumented) - off)
+    return statistics.median(differences)
+
+
+async def middleware_cost(app, path, requests):
+    """Seconds per request the middleware adds around a stub app replaying path's response."""
+    from instrumentation import InstrumentationMiddleware, Metrics
+
+    messages = []
+    route = (await call(app, path, messages))[1].get("route")
+    metrics = Metrics()
+
+    async def replay(scope, receive, send):
+        scope["route"] = route
+        for message in messages:
+            await send(message)
+
+    async def discard(message):
+        pass
+
+    async def timed(app):
+        start = time.perf_counter()
+        for _ in range(requests):
+            await app(make_scope(path), receive, discard)
+        return (time.perf_counter() - start) / requests
+
+    return await paired_difference(timed, replay, InstrumentationMiddleware(replay, metrics))
+
+
+def hook_cost(statements):
+    """Seconds the engine hooks add to one statement charged to a request, timed attached and detached in turn."""
+    from sqlalchemy import text
+    from database import sync_engine
+    from instrumentation import Metrics, QueryTimer, RequestStats, current_request
+
+    timer = QueryTimer(Metrics())
+    token = current_request.set(RequestStats())
+    statement = text("SELECT 1")
+
+    async def timed(attached):
+        if attached:
+            timer.attach(sync_engine)
+        start = time.perf_counter()
+        for _ in range(statements):
+            connection.execute(statement)
+        elapsed = (time.perf_counter() - start) / statements
+        if attached:
+            timer.detach(sync_engine)
+        return elapsed
+
+    try:
+        with sync_engine.connect() as connection:
+            return asyncio.run(paired_difference(timed, False, True))
+    finally:
+        current_request.reset(token)
+
+
+async def compare(app, args):
+    from instrumentation import InstrumentationMiddleware, Metrics, QueryTimer
+
+    per_statement = await asyncio.to_thread(hook_cost, args.block_size * 4)
+    results = {}
+    for path in PATHS:
+        metrics = Metrics()
+        instrumented = InstrumentationMiddleware(app, metrics)
+        timer = QueryTimer(metrics)
+
+        await run_block(app, path, args.block_size)
+        pairs, spread = [], []
+        for block in range(args.blocks):
+            # Whichever block of a pair runs second is a little slower, so the variants take turns going first
+            if block % 2:
+                on = await run_instrumented(instrumented, timer, metrics, path, args.block_size)
+                off = await run_block(app, path, args.block_size)
+            else:
+                off = await run_block(app, path, args.block_size)
+                on = await run_instrumented(instrumented, timer, metrics, path, args.block_size)
+            pairs.append((off, on))
+            if block % 8 == 0:
+                spread.append(await run_block(app, path, args.block_size) / off - 1)
+
+        route = next(iter(metrics.routes.values()))
+        queries = route.queries.sum / route.queries.count
+        cost = await middleware_cost(app, path, args.block_size) + queries * per_statement
+
+        off_total, on_total = (sum(times) / (args.blocks * args.block_size) for times in zip(*pairs))
+        results[path] = {
+            "off": off_total, "on": on_total, "queries": queries, "cost": cost,
+            "overhead": cost / off_total * 100,
+            "end_to_end": statistics.median(on / off - 1 for off, on in pairs) * 100,
+            "spread": statistics.median(abs(value) for value in spread) * 100,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--blocks", type=int, default=40, help="alternating blocks per variant and path")
+    parser.add_argument("--block-size", type=int, default=250, help="requests per block")
+    parser.add_argument("--max-overhead", type=float, default=2, help="overhead allowed per request, in percent")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ["METRICS_ENABLED"] = "false"
+    # The product cache is disabled so every read runs its query
+    os.environ["PRODUCT_CACHE_SIZE"] = "0"
+    sys.path.insert(0, service_dir("product"))
+
+    from fastapi.testclient import TestClient
+    import main as product_main
+
+    with TestClient(product_main.app) as client:
+        for i in range(50):
+            client.post("/api/v1/products", json={"name": f"product {i}", "price": 9.99, "merchant_id": 1})
+        results = client.portal.call(compare, product_main.app, args)
+
+    print(f"{'path':<28} {'off us/req':>11} {'on us/req':>10} {'queries':>8} {'cost us':>8} {'overhead':>9} "
+          f"{'end-to-end':>11} {'A/A spread':>11}")
+    for path, result in results.items():
+        print(f"{path:<28} {result['off'] * 1e6:>11.1f} {result['on'] * 1e6:>10.1f} {result['queries']:>8.1f} "
+              f"{result['cost'] * 1e6:>8.1f} {result['overhead']:>8.2f}% {result['end_to_end']:>10.2f}% "
+              f"{result['spread']:>10.2f}%")
+    over = [path for path, result in results.items() if result["overhead"] >= args.max_overhead]
+    if over:
+        print(f"overhead of {args.max_overhead}% or more on {', '.join(over)}")
+    sys.exit(1 if over else 0)
+
+
+if __name__ == "__main__":
+    main()
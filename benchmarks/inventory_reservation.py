@@ -0,0 +1,84 @@
+"""
+Concurrency stress test for product stock reservations.
+
+Starts the product service under uvicorn, creates one hot SKU, then fires many
+parallel reservers at it. Checks that exactly min(stock, reservers) reservations
+succeed and that stock never goes negative (zero oversell), and reports
+reservations/sec.
+
+Usage:
+    python benchmarks/inventory_reservation.py [--stock 100] [--reservers 500] [--workers 1]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+
+from harness import percentile, run_service
+
+
+async def reserve_all(base_url, product_id, reservers, concurrency):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    outcomes = {"reserved": 0, "rejected": 0, "errors": 0}
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        async def reserver():
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/api/v1/products/reservations",
+                                             json={"items": [{"product_id": product_id, "quantity": 1}]})
+                latencies.append((time.perf_counter() - start) * 1000)
+                if response.status_code != 200:
+                    outcomes["errors"] += 1
+                elif response.json()["reservation_id"] is not None:
+                    outcomes["reserved"] += 1
+                else:
+                    outcomes["rejected"] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[reserver() for _ in range(reservers)])
+        elapsed = time.perf_counter() - start
+
+        stock = (await client.get(f"/api/v1/products/{product_id}")).json()["stock"]
+    return outcomes, latencies, elapsed, stock
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stock", type=int, default=100)
+    parser.add_argument("--reservers", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=200, help="requests in flight at once")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    args = parser.parse_args()
+
+    database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    # The product cache is per process, so it is disabled to read the final stock from the database
+    with run_service("product", database_url, env={"PRODUCT_CACHE_SIZE": "0"}, workers=args.workers) as base_url:
+        with httpx.Client(base_url=base_url) as client:
+            product = client.post("/api/v1/products", json={"name": "hot sku", "price": 9.99,
+                                                            "stock": args.stock, "merchant_id": 1}).json()
+
+        outcomes, latencies, elapsed, stock = asyncio.run(
+            reserve_all(base_url, product["id"], args.reservers, args.concurrency))
+
+    expected = min(args.stock, args.reservers)
+    print(f"reserved {outcomes['reserved']} / expected {expected}, rejected {outcomes['rejected']}, "
+          f"errors {outcomes['errors']}, final stock {stock}")
+    print(f"{args.reservers / elapsed:.1f} reservation requests/sec, "
+          f"p50 {percentile(latencies, 50):.1f} ms, p99 {percentile(latencies, 99):.1f} ms")
+
+    oversold = outcomes["reserved"] > args.stock or stock < 0 or stock != args.stock - outcomes["reserved"]
+    if oversold:
+        print("OVERSELL DETECTED")
+        sys.exit(1)
+    print("no oversell")
+
+
+if __name__ == "__main__":
+    main()
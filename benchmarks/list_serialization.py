@@ -0,0 +1,161 @@
+"""
+Benchmark for the fast JSON path of the list endpoints (FAST_JSON_ENABLED).
+
+Seeds a temporary SQLite database of the order, payment or product service, loads the service in
+process and calls its list endpoint directly through ASGI, switching between the default path
+(ORM objects validated and serialized through the response_model) and the fast path (column rows
+encoded with orjson). Blocks of requests through the two paths are interleaved, so both are exposed
+to the same machine noise. Reports CPU time per row and the traced memory peak of one request, for
+each path and page size. Also checks that both paths return the same JSON.
+
+Every service is measured in a child process of its own, since their modules share names.
+
+Usage:
+    python benchmarks/list_serialization.py [--services order,payment,product] [--rows 20000]
+        [--limits 50,500] [--blocks 10] [--block-size 20]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from harness import service_dir
+
+PATHS = {"order": "/api/v1/order", "payment": "/api/v1/payment", "product": "/api/v1/products"}
+
+
+def seed_rows(service, count, rng):
+    now = datetime.utcnow()
+    if service == "order":
+        return [{"user_id": rng.randint(1, 1000), "order_status": rng.choice(["pending", "shipping", "completed"]),
+                 "total_amount": round(rng.uniform(1, 500), 2), "payment_status": rng.choice(["unpaid", "paid"]),
+                 "created_at": now - timedelta(seconds=i), "updated_at": now} for i in range(count)]
+    if service == "payment":
+        return [{"order_id": i, "total_amount": round(rng.uniform(1, 500), 2), "payment_status": "paid",
+                 "created_at": now.isoformat(), "updated_at": None} for i in range(count)]
+    return [{"name": f"product {i}", "description": "a product used to benchmark list serialization",
+             "price": round(rng.uniform(1, 500), 2), "stock": rng.randint(0, 100), "image_url": None,
+             "merchant_id": rng.randint(1, 100)} for i in range(count)]
+
+
+async def get(app, path, query):
+    """Sends one GET through the ASGI interface and returns the response body."""
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+             "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+             "query_string": query.encode(), "headers": [(b"host", b"bench")],
+             "client": ("127.0.0.1", 1), "server": ("bench", 80)}
+    body = []
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if requested:
+            # Like a server, block until the client disconnects; streaming responses listen for that
+            await asyncio.Event().wait()
+        requested = True
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            assert message["status"] == 200, message
+        elif message["type"] == "http.response.body":
+            body.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return b"".join(body)
+
+
+async def measure(service, main, args):
+    path = PATHS[service]
+    results = []
+    for limit in args.limits:
+        query = f"limit={limit}"
+
+        def use(fast):
+            main.FAST_JSON_ENABLED = fast
+
+        bodies = {}
+        for fast in (False, True):
+            use(fast)
+            bodies[fast] = await get(main.app, path, query)
+        if json.loads(bodies[False]) != json.loads(bodies[True]):
+            raise AssertionError(f"{service}: the fast path returned different JSON for limit={limit}")
+        rows = len(json.loads(bodies[True])["items"])
+
+        cpu = {False: [], True: []}
+        for _ in range(args.blocks):
+            for fast in (False, True):
+                use(fast)
+                start = time.process_time()
+                for _ in range(args.block_size):
+                    await get(main.app, path, query)
+                cpu[fast].append((time.process_time() - start) / (args.block_size * rows) * 1e6)
+
+        peaks = {}
+        for fast in (False, True):
+            use(fast)
+            tracemalloc.start()
+            await get(main.app, path, query)
+            tracemalloc.reset_peak()
+            await get(main.app, path, query)
+            peaks[fast] = tracemalloc.get_traced_memory()[1] / 1024
+            tracemalloc.stop()
+
+        results.append((limit, rows, statistics.median(cpu[False]), statistics.median(cpu[True]),
+                        peaks[False], peaks[True]))
+    return results
+
+
+def run_service_benchmark(service, args):
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ["PRODUCT_CACHE_SIZE"] = "0"
+    os.environ["METRICS_ENABLED"] = "false"
+    sys.path.insert(0, service_dir(service))
+
+    from fastapi.testclient import TestClient
+    from sqlmodel import SQLModel
+    from database import sync_engine
+    import main
+
+    with TestClient(main.app) as client:
+        table = {"order": "orders", "payment": "payment", "product": "products"}[service]
+        with sync_engine.begin() as conn:
+            conn.execute(SQLModel.metadata.tables[table].insert(), seed_rows(service, args.rows, random.Random(42)))
+        results = client.portal.call(measure, service, main, args)
+
+    for limit, rows, cpu_off, cpu_on, peak_off, peak_on in results:
+        print(f"{service:<8} {limit:>6} {cpu_off:>12.2f} {cpu_on:>12.2f} {cpu_off / cpu_on:>8.1f}x "
+              f"{peak_off:>11.0f} {peak_on:>11.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--services", default="order,payment,product")
+    parser.add_argument("--rows", type=int, default=20_000, help="rows seeded into the listed table")
+    parser.add_argument("--limits", default="50,500", help="comma separated page sizes")
+    parser.add_argument("--blocks", type=int, default=10, help="alternating blocks per path and page size")
+    parser.add_argument("--block-size", type=int, default=20, help="requests per block")
+    parser.add_argument("--service", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.limits = [int(limit) for limit in args.limits.split(",")]
+
+    if args.service:
+        run_service_benchmark(args.service, args)
+        return
+
+    print(f"{'service':<8} {'limit':>6} {'default us/row':>12} {'fast us/row':>12} {'speedup':>9} "
+          f"{'default KiB':>11} {'fast KiB':>11}")
+    for service in args.services.split(","):
+        subprocess.run([sys.executable, os.path.abspath(__file__), "--service", service] + sys.argv[1:], check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark for the order -> outbox -> broker -> notification pipeline.
+
+Starts the order and notification services under uvicorn sharing a file broker, with a simulated
+email/SMS gateway latency in the notification service. Places orders from concurrent clients and
+reports order latency (which should not include the gateway latency), how long until every
+notification was sent, and notification throughput.
+
+Usage:
+    python benchmarks/notification_pipeline.py [--orders 1000] [--concurrency 50] [--latency 0.2]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import httpx
+
+from harness import percentile, run_service
+
+
+async def place_orders(base_url, orders, concurrency):
+    latencies = []
+    remaining = iter(range(orders))
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        async def worker():
+            for i in remaining:
+                start = time.perf_counter()
+                response = await client.post("/api/v1/order", json={
+                    "user_id": i, "items": [{"product_id": 1, "quantity": 1, "price": 9.99}]})
+                response.raise_for_status()
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return latencies
+
+
+def wait_delivered(base_url, expected, timeout=300):
+    deadline = time.monotonic() + timeout
+    with httpx.Client(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            stats = client.get("/metrics/consumer").json()
+            if stats["sent"] + stats["failed"] >= expected:
+                return stats
+            time.sleep(0.05)
+    raise RuntimeError(f"notifications not delivered within {timeout}s: {stats}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent order clients")
+    parser.add_argument("--latency", type=float, default=0.2, help="simulated gateway latency per notification, seconds")
+    parser.add_argument("--consumers", type=int, default=50, help="notifications in flight in the consumer")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    env = {"EVENT_BROKER_URL": f"file://{os.path.join(tmpdir, 'events.jsonl')}", "PRODUCT_SERVICE_URL": ""}
+    notification_env = dict(env, NOTIFICATION_LATENCY=str(args.latency), NOTIFICATION_CONCURRENCY=str(args.consumers))
+
+    with run_service("notification", f"sqlite:///{os.path.join(tmpdir, 'notification.db')}", env=notification_env) as notification_url, \
+            run_service("order", f"sqlite:///{os.path.join(tmpdir, 'order.db')}", env=env) as order_url:
+        start = time.perf_counter()
+        latencies = asyncio.run(place_orders(order_url, args.orders, args.concurrency))
+        placed = time.perf_counter() - start
+        stats = wait_delivered(notification_url, args.orders)
+        delivered = time.perf_counter() - start
+
+    print(f"orders:        {args.orders / placed:.1f}/s, p50 {percentile(latencies, 50):.1f} ms, "
+          f"p99 {percentile(latencies, 99):.1f} ms (gateway latency {args.latency * 1000:.0f} ms per notification)")
+    print(f"notifications: all {args.orders} events handled {delivered - placed:.2f}s after the last order, "
+          f"{args.orders / delivered:.1f} events/s end to end")
+    print(f"consumer:      {stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark for order placement in the order service.
+
+Starts the product service under uvicorn with a seeded catalog, then places
+orders of growing basket sizes against a temporary SQLite database and reports
+commits, product lookup calls and p50/p99 latency per order for each basket
+size. The price cache is disabled so every order pays for its lookup.
+
+Usage:
+    python benchmarks/order_placement.py [--orders 200] [--sizes 1,10,50,200]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+
+from harness import percentile, run_service, service_dir
+
+
+def seed_products(base_url, products):
+    with httpx.Client(base_url=base_url) as client:
+        for i in range(products):
+            client.post("/api/v1/products", json={"name": f"product {i}", "price": 9.99,
+                                                   "stock": 1_000_000, "merchant_id": 1}).raise_for_status()
+
+
+def run(args, sizes, tmpdir, product_url):
+    os.environ["PRODUCT_SERVICE_URL"] = product_url
+    os.environ["PRICE_CACHE_TTL"] = "0"
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    sys.path.insert(0, service_dir("order"))
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+    import main as order_main
+    import catalog
+    from database import sync_engine
+
+    counts = {"commits": 0, "lookups": 0}
+    event.listen(sync_engine, "commit", lambda conn: counts.__setitem__("commits", counts["commits"] + 1))
+    call_service = catalog.call_service
+
+    async def counted_call_service(*args, **kwargs):
+        counts["lookups"] += 1
+        return await call_service(*args, **kwargs)
+
+    catalog.call_service = counted_call_service
+
+    with TestClient(order_main.app) as client:
+        print(f"{'basket':>8} {'commits/order':>14} {'lookups/order':>14} {'p50 ms':>9} {'p99 ms':>9}")
+        for size in sizes:
+            payload = {
+                "user_id": 1,
+                "items": [{"product_id": i + 1, "quantity": 2} for i in range(size)],
+            }
+            counts.update(commits=0, lookups=0)
+            latencies = []
+            for _ in range(args.orders):
+                start = time.perf_counter()
+                response = client.post("/api/v1/order", json=payload)
+                latencies.append((time.perf_counter() - start) * 1000)
+                response.raise_for_status()
+
+            print(f"{size:>8} {counts['commits'] / args.orders:>14.2f} {counts['lookups'] / args.orders:>14.2f} "
+                  f"{statistics.median(latencies):>9.2f} {percentile(latencies, 99):>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=200, help="orders placed per basket size")
+    parser.add_argument("--sizes", default="1,10,50,200", help="comma separated basket sizes")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    tmpdir = tempfile.mkdtemp()
+    with run_service("product", f"sqlite:///{os.path.join(tmpdir, 'products.db')}") as product_url:
+        seed_products(product_url, max(sizes))
+        run(args, sizes, tmpdir, product_url)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Benchmark of order sharding by user, with SQLite files standing in for the shards (aiosqlite with --async).
+
+Runs the order service under uvicorn, with the product lookup off, first on one database and then on
+--shards databases (DATABASE_URL plus ORDER_SHARD_URLS). Each is seeded through POST /api/v1/order/batch
+with --users users and --orders orders, then the median latency of these is measured over --rounds requests:
+- a user's order history, GET /api/v1/order?user_id=, served by the user's shard alone;
+- the admin list, GET /api/v1/order, and the same filtered by status, read from every shard at once
+  and merged; the pages are walked to the end to check every order is listed exactly once;
+- placing an order, and GET /api/v1/order/stats, summed over the shards; the top products must be the
+  same as on one database. Products are drawn with Zipf popularity.
+
+Then it adds one more shard: restarts the service with an extra empty SQLite file and runs
+`python order_service/reshard.py rebalance` while --clients clients keep placing orders and reading
+their history. It reports how long the rebalance took, the write latency during it and the requests
+that failed, and checks that no order was lost or duplicated, that every order is on the shard owning
+its user's bucket and that every shard's status rollup counts its orders.
+
+Usage:
+    python benchmarks/order_sharding.py [--shards 4] [--users 2000] [--orders 50000] [--rounds 200]
+                                        [--clients 8] [--async]
+"""
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from hashlib import blake2b
+
+import httpx
+
+from harness import percentile, run_service, service_dir
+
+SHARD_BUCKETS = 1024
+BATCH = 1000
+# Product popularity follows Zipf's law, as it does in most catalogs
+PRODUCTS = range(1, 2001)
+POPULARITY = list(itertools.accumulate(1 / product_id for product_id in PRODUCTS))
+
+
+def user_bucket(user_id):
+    """Same hash as order_service/sharding.py."""
+    return int.from_bytes(blake2b(str(user_id).encode(), digest_size=8).digest(), "big") % SHARD_BUCKETS
+
+
+def shard_env(paths, use_async):
+    driver = "sqlite+aiosqlite" if use_async else "sqlite"
+    urls = [f"{driver}:///{path}" for path in paths]
+    env = {"PRODUCT_SERVICE_URL": "", "METRICS_ENABLED": "false", "SHARD_MOVE_WAIT": "30"}
+    if len(urls) > 1:
+        env["ORDER_SHARD_URLS"] = ",".join(urls[1:])
+    return urls[0], env
+
+
+def new_order(rng, user_id):
+    return {"user_id": user_id, "items": [{"product_id": rng.choices(PRODUCTS, cum_weights=POPULARITY)[0],
+                                           "quantity": rng.randint(1, 3),
+                                           "price": round(rng.uniform(1, 500), 2)}
+                                          for _ in range(rng.randint(1, 4))]}
+
+
+def seed(client, args):
+    rng = random.Random(1)
+    for start in range(0, args.orders, BATCH):
+        client.post("/api/v1/order/batch", json=[new_order(rng, rng.randint(1, args.users))
+                                                 for _ in range(min(BATCH, args.orders - start))]).raise_for_status()
+
+
+def timed(fn, rounds):
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn().raise_for_status()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def walk(client, params):
+    """Every order id of a listing, page by page."""
+    ids, cursor = [], None
+    while True:
+        page = client.get("/api/v1/order", params=dict(params, limit=500, **({"cursor": cursor} if cursor else {})))
+        page.raise_for_status()
+        ids.extend(order["id"] for order in page.json()["items"])
+        cursor = page.json()["next_cursor"]
+        if not cursor:
+            return ids
+
+
+def measure(args, paths):
+    database_url, env = shard_env(paths, args.use_async)
+    rng = random.Random(2)
+    with run_service("order", database_url, env) as base_url, httpx.Client(base_url=base_url, timeout=60) as client:
+        seed(client, args)
+        result = {
+            "user": timed(lambda: client.get("/api/v1/order", params={"user_id": rng.randint(1, args.users),
+                                                                      "limit": 20}), args.rounds),
+            "admin": timed(lambda: client.get("/api/v1/order", params={"limit": 50}), args.rounds),
+            "status": timed(lambda: client.get("/api/v1/order", params={"limit": 50, "order_status": "pending"}),
+                            args.rounds),
+            "place": timed(lambda: client.post("/api/v1/order", json=new_order(rng, rng.randint(1, args.users))),
+                           args.rounds),
+            "stats": timed(lambda: client.get("/api/v1/order/stats", params={"top": 10}), args.rounds),
+        }
+        ids = walk(client, {})
+        expected = args.orders + args.rounds
+        result["check"] = "consistent" if len(ids) == len(set(ids)) == expected else \
+            f"listed {len(ids)} orders ({len(set(ids))} distinct), expected {expected}"
+        result["top"] = [product["product_id"] for product in
+                         client.get("/api/v1/order/stats", params={"top": 10}).json()["top_products"]]
+    return result
+
+
+def client_load(base_url, args, user_ids, stop, outcome):
+    """Places orders for and reads the history of random users until stop is set."""
+    rng = random.Random(threading.get_ident())
+    with httpx.Client(base_url=base_url, timeout=60) as client:
+        while not stop.is_set():
+            user_id = rng.choice(user_ids)
+            start = time.perf_counter()
+            response = client.post("/api/v1/order", json=new_order(rng, user_id))
+            elapsed = (time.perf_counter() - start) * 1000
+            if response.status_code == 200:
+                outcome["placed"].append(response.json()["id"])
+                outcome["write_ms"].append(elapsed)
+            else:
+                outcome["failed"].append(response.status_code)
+            read = client.get("/api/v1/order", params={"user_id": user_id, "limit": 20})
+            if read.status_code != 200:
+                outcome["failed"].append(read.status_code)
+
+
+def check_placement(paths):
+    """Problems with where the orders are: duplicates, orders off their user's shard, rollups off their shard."""
+    problems, seen = [], set()
+    for index, path in enumerate(paths):
+        conn = sqlite3.connect(path)
+        owned = {bucket for bucket, in conn.execute("SELECT bucket FROM shardbucket")}
+        orders = conn.execute("SELECT id, user_id FROM orders").fetchall()
+        misplaced = sum(1 for _, user_id in orders if user_bucket(user_id) not in owned)
+        if misplaced:
+            problems.append(f"shard {index} holds {misplaced} orders of buckets it does not own")
+        if seen & {order_id for order_id, _ in orders}:
+            problems.append(f"shard {index} holds orders also found on another shard")
+        seen |= {order_id for order_id, _ in orders}
+        counted = conn.execute("SELECT COALESCE(SUM(orders), 0) FROM statusrollup").fetchone()[0]
+        if counted != len(orders):
+            problems.append(f"shard {index} rollups count {counted} orders, it holds {len(orders)}")
+        conn.close()
+    return problems, seen
+
+
+def rebalance(args, paths):
+    """Adds a shard and rebalances onto it while clients keep writing and reading."""
+    database_url, env = shard_env(paths, args.use_async)
+    outcome = {"placed": [], "write_ms": [], "failed": []}
+    stop = threading.Event()
+    with run_service("order", database_url, env) as base_url:
+        with httpx.Client(base_url=base_url, timeout=60) as client:
+            before = len(walk(client, {}))
+        clients = [threading.Thread(target=client_load, args=(base_url, args, list(range(1, args.users + 1)),
+                                                              stop, outcome)) for _ in range(args.clients)]
+        for thread in clients:
+            thread.start()
+        time.sleep(1)
+        start = time.perf_counter()
+        moves = subprocess.run([sys.executable, "reshard.py", "rebalance"], cwd=service_dir("order"),
+                               env=dict(os.environ, DATABASE_URL=database_url, **env), check=True,
+                               capture_output=True, text=True).stdout.splitlines()
+        seconds = time.perf_counter() - start
+        time.sleep(1)
+        stop.set()
+        for thread in clients:
+            thread.join()
+        with httpx.Client(base_url=base_url, timeout=60) as client:
+            listed = walk(client, {})
+
+    problems, stored = check_placement(paths)
+    expected = before + len(outcome["placed"])
+    if len(stored) != expected or len(listed) != expected or set(outcome["placed"]) - stored:
+        problems.append(f"{len(stored)} orders stored and {len(listed)} listed, expected {expected}")
+    return {"moves": len(moves), "seconds": seconds, "writes": len(outcome["write_ms"]),
+            "write_p50": percentile(outcome["write_ms"], 50), "write_max": max(outcome["write_ms"]),
+            "failed": len(outcome["failed"]), "problems": problems}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--orders", type=int, default=50000)
+    parser.add_argument("--rounds", type=int, default=200, help="requests per measured endpoint")
+    parser.add_argument("--clients", type=int, default=8, help="clients writing during the rebalance")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="use the aiosqlite driver")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    failed, top = False, None
+    print(f"{'databases':>9} {'user ms':>8} {'admin ms':>9} {'status ms':>10} {'place ms':>9} {'stats ms':>9}  check")
+    for count in (1, args.shards):
+        paths = [os.path.join(tmpdir, f"orders_{count}_{index}.db") for index in range(count)]
+        result = measure(args, paths)
+        top = top or result["top"]
+        if result["check"] == "consistent" and result["top"] != top:
+            result["check"] = f"top products {result['top']}, on one database {top}"
+        failed |= result["check"] != "consistent"
+        print(f"{count:>9} {result['user']:>8.2f} {result['admin']:>9.2f} {result['status']:>10.2f} "
+              f"{result['place']:>9.2f} {result['stats']:>9.2f}  {result['check']}")
+
+    paths.append(os.path.join(tmpdir, f"orders_{args.shards}_{args.shards}.db"))
+    result = rebalance(args, paths)
+    failed |= bool(result["problems"])
+    print(f"\nrebalance onto shard {args.shards}: {result['moves']} buckets moved in {result['seconds']:.1f}s "
+          f"under load; {result['writes']} orders placed meanwhile, write p50 {result['write_p50']:.1f} ms, "
+          f"max {result['write_max']:.0f} ms, {result['failed']} failed requests")
+    print("; ".join(result["problems"]) or "no order lost, duplicated or off its user's shard")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
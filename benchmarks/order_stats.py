@@ -0,0 +1,186 @@
+"""
+Benchmark of the order dashboard, ad-hoc aggregates over the order history against the rollup tables.
+
+For each history size in --orders, seeds a temporary SQLite database (aiosqlite with --async) with
+orders spread over the last 90 days, 1 to 4 items each, and backfills the rollups with the rebuild
+command (python order_service/rollups.py). Then, in a child process of its own per size, loads the
+order service in process with the product lookup off and:
+- times the dashboard computed ad hoc in SQL: sales per day over 30 days, order counts per status and
+  the top 10 products by revenue, each a GROUP BY over orders or items;
+- times GET /api/v1/order/stats, which reads the same figures from the rollups, and checks they agree;
+- places --writes orders one at a time, reporting the SQL statements and median latency per order,
+  then updates the status of half of them and deletes a quarter;
+- checks that the incrementally maintained rollups equal a rebuild from the history.
+
+Usage:
+    python benchmarks/order_stats.py [--orders 10000,100000] [--rounds 20] [--writes 200] [--async]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from harness import service_dir
+
+AD_HOC = [
+    "SELECT strftime('%Y-%m-%d 00:00:00', created_at) AS day, COUNT(*), SUM(total_amount) FROM orders "
+    "WHERE created_at >= ? GROUP BY day ORDER BY day",
+    "SELECT order_status, payment_status, COUNT(*), SUM(total_amount) FROM orders "
+    "GROUP BY order_status, payment_status",
+    "SELECT product_id, COUNT(*), SUM(quantity), SUM(subtotal) AS revenue FROM orderitem "
+    "JOIN orders ON orders.id = orderitem.order_id GROUP BY product_id ORDER BY revenue DESC LIMIT 10",
+]
+
+
+def seed(path, orders, rng):
+    """Creates the schema through the order service's migrations, inserts the history and backfills the rollups."""
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}", PRODUCT_SERVICE_URL="")
+    subprocess.run([sys.executable, "-c", "import asyncio, main; asyncio.run(main.create_db_and_tables())"],
+                   cwd=service_dir("order"), env=env, check=True)
+    now = datetime.utcnow()
+    conn = sqlite3.connect(path)
+    statuses = [("pending", "unpaid"), ("processing", "paid"), ("shipping", "paid"), ("completed", "paid")]
+    for start in range(0, orders, 10_000):
+        rows, items = [], []
+        for order_id in range(start + 1, min(orders, start + 10_000) + 1):
+            basket = [(rng.randint(1, 2000), rng.randint(1, 3), round(rng.uniform(1, 500), 2))
+                      for _ in range(rng.randint(1, 4))]
+            order_status, payment_status = rng.choice(statuses)
+            created_at = now - timedelta(minutes=rng.randint(0, 90 * 24 * 60))
+            rows.append((order_id, 1, order_status, sum(q * p for _, q, p in basket), payment_status,
+                         created_at.isoformat(" ")))
+            items.extend((order_id, product_id, quantity, price, quantity * price)
+                         for product_id, quantity, price in basket)
+        conn.executemany("INSERT INTO orders (id, user_id, order_status, total_amount, payment_status, created_at) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", rows)
+        conn.executemany("INSERT INTO orderitem (order_id, product_id, quantity, price, subtotal) "
+                         "VALUES (?, ?, ?, ?, ?)", items)
+    conn.commit()
+    conn.close()
+
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "rollups.py"], cwd=service_dir("order"), env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def snapshot(conn):
+    """The rollup tables' rows, with amounts rounded so float summation order does not matter."""
+    return {table: sorted(tuple(round(value, 2) if isinstance(value, float) else value for value in row)
+                          for row in conn.execute(f"SELECT * FROM {table}") if row[-2] or row[-1])
+            for table in ("salesrollup", "statusrollup", "productrollup")}
+
+
+def run_variant(args, path):
+    os.environ["DATABASE_URL"] = f"{'sqlite+aiosqlite' if args.use_async else 'sqlite'}:///{path}"
+    os.environ["METRICS_ENABLED"] = "false"
+    os.environ["PRODUCT_SERVICE_URL"] = ""
+    sys.path.insert(0, service_dir("order"))
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+    from database import sync_engine, run_in_session
+    from rollups import rebuild_rollups
+    import main as order_main
+
+    statements = []
+    event.listen(sync_engine, "before_cursor_execute", lambda *args: statements.append(1))
+    failures = []
+    rng = random.Random(1)
+    conn = sqlite3.connect(path)
+    since = (datetime.utcnow() - timedelta(days=29)).strftime("%Y-%m-%d 00:00:00")
+
+    with TestClient(order_main.app) as client:
+        ad_hoc, rollup = [], []
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            sales, statuses, top = (conn.execute(query, (since,) if "?" in query else ()).fetchall()
+                                    for query in AD_HOC)
+            ad_hoc.append((time.perf_counter() - start) * 1000)
+            statements.clear()
+            start = time.perf_counter()
+            stats = client.get("/api/v1/order/stats", params={"granularity": "day", "top": 10})
+            rollup.append((time.perf_counter() - start) * 1000)
+            stats.raise_for_status()
+        stats = stats.json()
+        read_statements = len(statements)
+
+        by_day = {bucket["bucket"].replace("T", " "): bucket["orders"] for bucket in stats["sales"]}
+        if any(by_day.get(day, 0) != orders for day, orders, _ in sales):
+            failures.append("sales per day differ from the history")
+        if sorted((s["order_status"], s["payment_status"], s["orders"]) for s in stats["statuses"]) != \
+                sorted((row[0], row[1], row[2]) for row in statuses):
+            failures.append("status counts differ from the history")
+        if [p["product_id"] for p in stats["top_products"]] != [row[0] for row in top]:
+            failures.append("top products differ from the history")
+
+        statements.clear()
+        latencies, placed = [], []
+        for _ in range(args.writes):
+            payload = {"user_id": 1, "items": [{"product_id": rng.randint(1, 2000), "quantity": rng.randint(1, 3),
+                                                "price": round(rng.uniform(1, 500), 2)}
+                                               for _ in range(rng.randint(1, 4))]}
+            start = time.perf_counter()
+            response = client.post("/api/v1/order", json=payload)
+            latencies.append((time.perf_counter() - start) * 1000)
+            response.raise_for_status()
+            placed.append(response.json()["id"])
+        write_statements = len(statements) / args.writes
+        for order_id in placed[::2]:
+            client.put("/api/v1/order", json={"order_id": order_id, "order_status": "completed",
+                                              "payment_status": "paid"}).raise_for_status()
+        for order_id in placed[1::4]:
+            client.delete(f"/api/v1/order/{order_id}").raise_for_status()
+
+        incremental = snapshot(conn)
+        asyncio.run(run_in_session(rebuild_rollups))
+        if snapshot(conn) != incremental:
+            failures.append("incremental rollups differ from a rebuild")
+    conn.close()
+
+    print(json.dumps({"ad_hoc_ms": statistics.median(ad_hoc), "stats_ms": statistics.median(rollup),
+                      "read_statements": read_statements, "write_statements": write_statements,
+                      "write_ms": statistics.median(latencies), "failures": failures}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", default="10000,100000", help="comma separated history sizes")
+    parser.add_argument("--rounds", type=int, default=20, help="dashboard reads per way")
+    parser.add_argument("--writes", type=int, default=200, help="orders placed through the service")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="use the aiosqlite driver")
+    parser.add_argument("--variant", help=argparse.SUPPRESS)
+    parser.add_argument("--database", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        run_variant(args, args.database)
+        return
+
+    tmpdir = tempfile.mkdtemp()
+    failed = False
+    print(f"{'orders':>8} {'rebuild s':>10} {'ad hoc ms':>10} {'stats ms':>9} {'stats SQL':>10} "
+          f"{'SQL/order':>10} {'place ms':>9}  check")
+    for orders in (int(orders) for orders in args.orders.split(",")):
+        path = os.path.join(tmpdir, f"orders_{orders}.db")
+        rebuild = seed(path, orders, random.Random(orders))
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--variant", str(orders),
+                                 "--database", path] + sys.argv[1:], check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        failed |= bool(result["failures"])
+        print(f"{orders:>8} {rebuild:>10.2f} {result['ad_hoc_ms']:>10.2f} {result['stats_ms']:>9.2f} "
+              f"{result['read_statements']:>10} {result['write_statements']:>10.1f} {result['write_ms']:>9.2f}  "
+              f"{'; '.join(result['failures']) or 'consistent'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Benchmark for keyset pagination on the order service's orders table.
+
+Seeds a temporary SQLite database with orders, then compares the latency of
+fetching a page at increasing depths with keyset cursors against OFFSET.
+
+Usage:
+    python benchmarks/pagination.py [--rows 200000] [--limit 50]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "order_service")
+
+
+def timed(fn, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000, help="orders to seed")
+    parser.add_argument("--limit", type=int, default=50, help="page size")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    sys.path.insert(0, SERVICE_DIR)
+
+    from sqlmodel import Session, SQLModel
+    from database import engine
+    from models import Orders
+    from pagination import paginate, encode_cursor
+
+    engine.echo = False
+    SQLModel.metadata.create_all(engine)
+
+    epoch = datetime(2024, 1, 1)
+    with Session(engine) as session:
+        session.execute(Orders.__table__.insert(), [
+            {"user_id": i % 5000, "total_amount": 10.0, "order_status": "pending",
+             "payment_status": "unpaid", "created_at": epoch + timedelta(seconds=i)}
+            for i in range(args.rows)
+        ])
+        session.commit()
+
+    keys = [Orders.created_at, Orders.id]
+    print(f"{'depth':>10} {'offset ms':>10} {'keyset ms':>10}")
+    with Session(engine) as session:
+        for depth in [0, args.rows // 10, args.rows // 2, args.rows - args.limit - 1]:
+            offset_ms = timed(lambda: session.query(Orders)
+                              .order_by(Orders.created_at.desc(), Orders.id.desc())
+                              .offset(depth).limit(args.limit).all())
+            # The cursor a client would hold after paging down to this depth
+            row = session.query(Orders).order_by(Orders.created_at.desc(), Orders.id.desc()).offset(depth).first()
+            cursor = encode_cursor([row.created_at, row.id])
+            keyset_ms = timed(lambda: paginate(session.query(Orders), keys, args.limit, cursor))
+            print(f"{depth:>10} {offset_ms:>10.2f} {keyset_ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
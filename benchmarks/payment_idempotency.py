@@ -0,0 +1,102 @@
+"""
+Benchmark for idempotent payment creation in the payment service.
+
+Starts the payment service under uvicorn and creates payments with unique Idempotency-Key headers,
+then replays every request with its key, then fires concurrent duplicates of fresh keys at once.
+Reports requests/sec and p50/p99 latency for first writes and replays, and checks through the
+outbox counter that replays wrote nothing and that each key produced exactly one payment.
+
+Usage:
+    python benchmarks/payment_idempotency.py [--payments 2000] [--concurrency 50] [--duplicates 10]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+
+from harness import percentile, run_service
+
+
+async def send_all(base_url, requests, concurrency):
+    """Sends (key, body) pairs from concurrent clients; returns latencies, payment ids and replay count."""
+    latencies, payment_ids, replays = [], [], 0
+    remaining = iter(requests)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        async def worker():
+            nonlocal replays
+            for key, body in remaining:
+                start = time.perf_counter()
+                response = await client.post("/api/v1/payment", json=body, headers={"Idempotency-Key": key})
+                latencies.append((time.perf_counter() - start) * 1000)
+                response.raise_for_status()
+                payment_ids.append((key, response.json()["id"]))
+                replays += response.headers.get("Idempotent-Replayed") == "true"
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    return latencies, payment_ids, replays, elapsed
+
+
+def writes(base_url):
+    with httpx.Client(base_url=base_url) as client:
+        return client.get("/metrics/outbox").json()["published"]
+
+
+def report(label, count, latencies, elapsed, replays):
+    print(f"{label:>11} {count / elapsed:>10.1f} {percentile(latencies, 50):>9.2f} "
+          f"{percentile(latencies, 99):>9.2f} {replays:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--payments", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duplicates", type=int, default=10, help="concurrent copies of each request in the race phase")
+    args = parser.parse_args()
+
+    database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    # The outbox relay publishes one event per payment written, which makes it a write counter
+    env = {"EVENT_BROKER_URL": "memory://", "OUTBOX_LINGER": "0"}
+    requests = [(f"key-{i}", {"order_id": i, "total_amount": 9.99}) for i in range(args.payments)]
+    races = [(f"race-{i}", {"order_id": i, "total_amount": 9.99})
+             for i in range(args.payments // 10) for _ in range(args.duplicates)]
+
+    with run_service("payment", database_url, env=env) as base_url:
+        print(f"{'phase':>11} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'replayed':>8}")
+        latencies, first_ids, replays, elapsed = asyncio.run(send_all(base_url, requests, args.concurrency))
+        report("first", len(requests), latencies, elapsed, replays)
+        time.sleep(1.5)
+        written = writes(base_url)
+
+        latencies, replay_ids, replays, elapsed = asyncio.run(send_all(base_url, requests, args.concurrency))
+        report("replay", len(requests), latencies, elapsed, replays)
+        time.sleep(1.5)
+        replay_writes = writes(base_url) - written
+
+        latencies, race_ids, replays, elapsed = asyncio.run(send_all(base_url, races, args.concurrency))
+        report("duplicates", len(races), latencies, elapsed, replays)
+        time.sleep(1.5)
+        race_writes = writes(base_url) - written - replay_writes
+
+    race_keys = len({key for key, _ in races})
+    ids_per_key = {}
+    for key, payment_id in race_ids:
+        ids_per_key.setdefault(key, set()).add(payment_id)
+    ok = (sorted(first_ids) == sorted(replay_ids) and replay_writes == 0 and race_writes == race_keys
+          and all(len(ids) == 1 for ids in ids_per_key.values()))
+    print(f"payments written: {written} first, {replay_writes} during replay, "
+          f"{race_writes} for {race_keys} raced keys ({len(races)} requests)")
+    if not ok:
+        print("IDEMPOTENCY VIOLATED")
+        sys.exit(1)
+    print("every key wrote exactly one payment")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+"""
+End-to-end load test of the platform.
+
+Starts the user, product, cart, order and payment services under uvicorn, each on its own temporary
+SQLite database, or on temporary Postgres databases created through --postgres and dropped afterwards.
+Seeds them with realistic volumes straight through the database: users, a 100k product catalog,
+open carts and an order and payment history. Then runs a mixed shopper workload from concurrent
+virtual users for a fixed time:
+- browsing and searching the catalog;
+- adding to the cart and viewing the priced cart;
+- checking the cart out into an order through the cart service;
+- paying.
+
+Reports throughput and p50/p95/p99 latency per endpoint and writes them as JSON, so runs can be
+compared. With --baseline, endpoints whose p95 latency or throughput got worse than --tolerance
+are reported as regressions and the script exits with status 1.
+
+Data and the shoppers' choices come from --seed, so two runs of the same commit send the same mix.
+
+Usage:
+    python benchmarks/platform_load.py [--products 100000] [--users 10000] [--orders 50000]
+        [--concurrency 50] [--duration 60] [--output results.json] [--baseline previous.json]
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import httpx
+from sqlalchemy import MetaData, Table, create_engine, select, text
+from sqlalchemy.engine import make_url
+
+from harness import ROOT, percentile, run_service, service_dir
+
+SERVICES = ("user", "product", "order", "cart", "payment")
+WORDS = ("red blue green black white leather cotton wool running trail hiking summer winter "
+         "classic slim wide vintage shoe boot sandal jacket shirt dress scarf hat glove bag "
+         "wallet watch lamp chair table mug bottle phone case charger cable speaker").split()
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+@contextlib.contextmanager
+def temporary_databases(postgres_url):
+    """Yields a sync database URL per service: temp SQLite files, or temp Postgres databases."""
+    if postgres_url is None:
+        tmpdir = tempfile.mkdtemp()
+        yield {service: f"sqlite:///{os.path.join(tmpdir, f'{service}.db')}" for service in SERVICES}
+        return
+
+    admin_url = make_url(postgres_url)
+    admin = create_engine(admin_url, isolation_level="AUTOCOMMIT")
+    names = {service: f"bench_{service}_{os.getpid()}" for service in SERVICES}
+    try:
+        with admin.connect() as conn:
+            for name in names.values():
+                conn.execute(text(f'CREATE DATABASE "{name}"'))
+        yield {service: admin_url.set(database=name).render_as_string(hide_password=False)
+               for service, name in names.items()}
+    finally:
+        with admin.connect() as conn:
+            for name in names.values():
+                conn.execute(text(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)'))
+        admin.dispose()
+
+
+def service_url(database_url, use_async):
+    """The URL the service runs on: the seeding URL, or its async driver variant with --async."""
+    if not use_async:
+        return database_url
+    url = make_url(database_url)
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()]).render_as_string(hide_password=False)
+
+
+def insert_rows(engine, table_name, rows, batch_size=10_000):
+    """Bulk inserts rows into a table the service created, reflected so no service module is imported."""
+    table = Table(table_name, MetaData(), autoload_with=engine)
+    with engine.begin() as conn:
+        for start in range(0, len(rows), batch_size):
+            conn.execute(table.insert(), rows[start:start + batch_size])
+    return table
+
+
+def seed(databases, args, rng):
+    """Seeds every service's database; returns how long it took."""
+    start = time.perf_counter()
+    engines = {service: create_engine(url) for service, url in databases.items()}
+    brands = sorted({"".join(rng.choices("kalomirazetuvonisapedofiguhaje", k=6)) for _ in range(2000)})
+    merchants = max(1, args.users // 100)
+    now = datetime.utcnow()
+
+    insert_rows(engines["user"], "users", [
+        {"email": f"user{i}@example.com", "fullname": f"User {i}", "is_merchant": i <= merchants}
+        for i in range(1, args.users + 1)
+    ])
+
+    insert_rows(engines["product"], "products", [
+        {"name": f"{rng.choice(brands)} {' '.join(rng.sample(WORDS, 2))}",
+         "description": " ".join(rng.sample(WORDS, 6)),
+         "price": round(rng.uniform(1, 500), 2), "stock": 1_000_000,
+         "image_url": None, "merchant_id": rng.randint(1, merchants)}
+        for _ in range(args.products)
+    ])
+
+    insert_rows(engines["cart"], "cart", [
+        {"user_id": user_id, "product_id": rng.randint(1, args.products), "quantity": rng.randint(1, 3)}
+        for user_id in rng.sample(range(1, args.users + 1), min(args.carts, args.users))
+        for _ in range(rng.randint(1, 5))
+    ])
+
+    orders = [{"user_id": rng.randint(1, args.users), "order_status": rng.choice(["pending", "completed"]),
+               "total_amount": 0.0, "payment_status": "unpaid",
+               "created_at": now - timedelta(minutes=rng.randint(0, 525_600))}
+              for _ in range(args.orders)]
+    orders.sort(key=lambda order: order["created_at"])
+    items = []
+    for order_id, order in enumerate(orders, start=1):
+        for _ in range(rng.randint(1, 4)):
+            quantity, price = rng.randint(1, 3), round(rng.uniform(1, 500), 2)
+            items.append({"order_id": order_id, "product_id": rng.randint(1, args.products),
+                          "quantity": quantity, "price": price, "subtotal": quantity * price})
+            order["total_amount"] += quantity * price
+        if order["order_status"] == "completed":
+            order["payment_status"] = "paid"
+    orders_table = insert_rows(engines["order"], "orders", orders)
+    # Ids are read back rather than assumed, in case the database does not start its sequence at 1
+    with engines["order"].connect() as conn:
+        order_ids = conn.execute(select(orders_table.c.id).order_by(orders_table.c.id)).scalars().all()
+    for item in items:
+        item["order_id"] = order_ids[item["order_id"] - 1]
+    insert_rows(engines["order"], "orderitem", items)
+    # The history bypassed the service, so its rollups are rebuilt with the order service's command
+    subprocess.run([sys.executable, "rollups.py"], cwd=service_dir("order"), check=True, stdout=subprocess.DEVNULL,
+                   env=dict(os.environ, DATABASE_URL=databases["order"]))
+
+    insert_rows(engines["payment"], "payment", [
+        {"order_id": order_id, "total_amount": order["total_amount"], "payment_status": "paid",
+         "payment_method_id": None, "created_at": order["created_at"].isoformat(), "updated_at": None}
+        for order_id, order in zip(order_ids, orders) if order["payment_status"] == "paid"
+    ])
+
+    for engine in engines.values():
+        engine.dispose()
+    return time.perf_counter() - start
+
+
+class Recorder:
+    """Latencies and errors per endpoint, counted only inside the measured window."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.measuring = False
+
+    def record(self, endpoint, milliseconds, ok):
+        if not self.measuring:
+            return
+        self.latencies.setdefault(endpoint, []).append(milliseconds)
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+
+class Shopper:
+    """One virtual user: browses, fills a cart and sometimes checks out and pays."""
+
+    def __init__(self, clients, recorder, rng, args):
+        self.clients = clients
+        self.recorder = recorder
+        self.rng = rng
+        self.args = args
+
+    async def call(self, service, endpoint, method, url, **kwargs):
+        """Sends one request and records it under its endpoint template; returns the response or None."""
+        start = time.perf_counter()
+        try:
+            response = await self.clients[service].request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.recorder.record(endpoint, (time.perf_counter() - start) * 1000, False)
+            return None
+        self.recorder.record(endpoint, (time.perf_counter() - start) * 1000, response.is_success)
+        return response if response.is_success else None
+
+    def product_id(self):
+        # Skewed towards low ids, so a few popular products get most of the traffic
+        return 1 + int(self.args.products * self.rng.random() ** 3)
+
+    async def visit(self):
+        user_id = self.rng.randint(1, self.args.users)
+        await self.browse()
+        if self.rng.random() < self.args.history_rate:
+            await self.call("order", "GET /api/v1/order", "GET", "/api/v1/order", params={"user_id": user_id})
+        if self.rng.random() < self.args.cart_rate:
+            lines = await self.fill_cart(user_id)
+            if lines and self.rng.random() < self.args.checkout_rate:
+                await self.checkout(user_id)
+
+    async def browse(self):
+        response = await self.call("product", "GET /api/v1/products", "GET", "/api/v1/products",
+                                   params={"limit": 20})
+        for _ in range(self.rng.randint(0, 2)):
+            if response is None or response.json().get("next_cursor") is None:
+                break
+            response = await self.call("product", "GET /api/v1/products", "GET", "/api/v1/products",
+                                       params={"limit": 20, "cursor": response.json()["next_cursor"]})
+        for _ in range(self.rng.randint(1, 3)):
+            await self.call("product", "GET /api/v1/products/{product_id}", "GET",
+                            f"/api/v1/products/{self.product_id()}")
+        if self.rng.random() < self.args.search_rate:
+            await self.call("product", "GET /api/v1/products/search", "GET", "/api/v1/products/search",
+                            params={"q": self.rng.choice(WORDS)[:self.rng.randint(3, 5)]})
+
+    async def fill_cart(self, user_id):
+        lines = []
+        for _ in range(self.rng.randint(1, 3)):
+            response = await self.call("cart", "POST /cart", "POST", "/cart", json={
+                "user_id": user_id, "product_id": self.product_id(), "quantity": self.rng.randint(1, 2)})
+            if response is not None:
+                lines.append(response.json())
+        await self.call("cart", "GET /cart/summary", "GET", "/cart/summary", params={"user_id": user_id})
+        return lines
+
+    async def checkout(self, user_id):
+        order = await self.call("cart", "POST /cart/checkout", "POST", "/cart/checkout", json={"user_id": user_id})
+        if order is None:
+            return
+        order = order.json()
+
+        payment = await self.call("payment", "POST /api/v1/payment", "POST", "/api/v1/payment",
+                                  json={"order_id": order["order_id"], "total_amount": order["total_amount"]},
+                                  headers={"Idempotency-Key": uuid.UUID(int=self.rng.getrandbits(128)).hex})
+        if payment is not None:
+            await self.call("payment", "PUT /api/v1/payment", "PUT", "/api/v1/payment",
+                            params={"payment_id": payment.json()["id"]}, json={"payment_status": "paid"})
+            await self.call("order", "PUT /api/v1/order", "PUT", "/api/v1/order",
+                            json={"order_id": order["order_id"], "payment_status": "paid"})
+
+
+async def drive(base_urls, args):
+    """Runs the shoppers through the warm-up and the measured window; returns the recorder and its length."""
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with contextlib.AsyncExitStack() as stack:
+        clients = {service: await stack.enter_async_context(httpx.AsyncClient(base_url=url, limits=limits,
+                                                                              timeout=60))
+                   for service, url in base_urls.items()}
+        stop = asyncio.Event()
+
+        async def run(shopper):
+            while not stop.is_set():
+                await shopper.visit()
+
+        shoppers = [asyncio.create_task(run(Shopper(clients, recorder, random.Random(f"{args.seed}-{i}"), args)))
+                    for i in range(args.concurrency)]
+        await asyncio.sleep(args.warmup)
+        recorder.measuring = True
+        start = time.perf_counter()
+        await asyncio.sleep(args.duration)
+        recorder.measuring = False
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await asyncio.gather(*shoppers)
+    return recorder, elapsed
+
+
+def summarize(recorder, elapsed):
+    def stats(latencies, errors):
+        return {"requests": len(latencies), "errors": errors, "throughput": round(len(latencies) / elapsed, 2),
+                "p50_ms": round(percentile(latencies, 50), 2), "p95_ms": round(percentile(latencies, 95), 2),
+                "p99_ms": round(percentile(latencies, 99), 2)}
+
+    endpoints = {endpoint: stats(latencies, recorder.errors.get(endpoint, 0))
+                 for endpoint, latencies in sorted(recorder.latencies.items())}
+    everything = [latency for latencies in recorder.latencies.values() for latency in latencies]
+    return endpoints, stats(everything, sum(recorder.errors.values())) if everything else {}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                               check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def regressions(results, baseline, tolerance):
+    """Endpoints whose p95 rose or whose throughput fell by more than tolerance against the baseline."""
+    found = []
+    for endpoint, current in results["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(endpoint)
+        if previous is None:
+            continue
+        if current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            found.append(f"{endpoint}: p95 {previous['p95_ms']} -> {current['p95_ms']} ms")
+        if current["throughput"] < previous["throughput"] * (1 - tolerance):
+            found.append(f"{endpoint}: throughput {previous['throughput']} -> {current['throughput']} req/s")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--carts", type=int, default=5_000, help="users with an open cart")
+    parser.add_argument("--orders", type=int, default=50_000, help="orders in the seeded history")
+    parser.add_argument("--concurrency", type=int, default=50, help="virtual users")
+    parser.add_argument("--duration", type=float, default=60, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds of traffic before measuring")
+    parser.add_argument("--cart-rate", type=float, default=0.5, help="share of visits that add to the cart")
+    parser.add_argument("--checkout-rate", type=float, default=0.4, help="share of carts checked out and paid")
+    parser.add_argument("--search-rate", type=float, default=0.3, help="share of visits that search")
+    parser.add_argument("--history-rate", type=float, default=0.2, help="share of visits that list past orders")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers per service")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="run the services on the async database drivers")
+    parser.add_argument("--postgres", metavar="URL",
+                        help="Postgres server URL to create the temporary databases on, instead of SQLite")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="relative p95 or throughput change reported as a regression")
+    args = parser.parse_args()
+
+    with temporary_databases(args.postgres) as databases, contextlib.ExitStack() as stack:
+        base_urls = {}
+        for service in SERVICES:
+            # The order service validates baskets against the product service, and the cart service checks
+            # out through both, so they start after the services they call
+            env = {}
+            if service in ("order", "cart"):
+                env["PRODUCT_SERVICE_URL"] = base_urls["product"]
+            if service == "cart":
+                env["ORDER_SERVICE_URL"] = base_urls["order"]
+            base_urls[service] = stack.enter_context(run_service(
+                service, service_url(databases[service], args.use_async), env=env, workers=args.workers))
+
+        print(f"seeding {args.users} users, {args.products} products, {args.carts} carts, {args.orders} orders")
+        seed_seconds = seed(databases, args, random.Random(args.seed))
+        print(f"seeded in {seed_seconds:.1f}s; {args.concurrency} shoppers for {args.duration:.0f}s")
+        recorder, elapsed = asyncio.run(drive(base_urls, args))
+
+    endpoints, total = summarize(recorder, elapsed)
+    results = {
+        "config": vars(args),
+        "environment": {"commit": git_commit(), "python": platform.python_version(),
+                        "platform": platform.platform(), "cpus": os.cpu_count(),
+                        "database": "postgres" if args.postgres else "sqlite"},
+        "seed_seconds": round(seed_seconds, 2),
+        "elapsed_seconds": round(elapsed, 2),
+        "total": total,
+        "endpoints": endpoints,
+    }
+
+    print(f"{'endpoint':<58} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for endpoint, stats in list(endpoints.items()) + [("total", total)]:
+        if stats:
+            print(f"{endpoint:<58} {stats['throughput']:>8.1f} {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} "
+                  f"{stats['p99_ms']:>8.2f} {stats['errors']:>7}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for regression in found:
+            print(f"REGRESSION {regression}")
+        if found:
+            sys.exit(1)
+        print(f"no regressions beyond {args.tolerance:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
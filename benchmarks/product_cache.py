@@ -0,0 +1,67 @@
+"""
+Benchmark for the product catalog cache.
+
+Seeds a temporary SQLite catalog and measures GET /api/v1/products throughput
+with the cache disabled and enabled, then prints the cache counters.
+
+Usage:
+    python benchmarks/product_cache.py [--products 5000] [--requests 5000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "product_service")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--pages", type=int, default=20, help="distinct pages the clients browse")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    sys.path.insert(0, SERVICE_DIR)
+
+    from fastapi.testclient import TestClient
+    from sqlmodel import Session
+    import main as product_main
+    from cache import product_cache
+    from database import engine
+    from models import Products
+
+    with TestClient(product_main.app) as client:
+        with Session(engine) as session:
+            session.execute(Products.__table__.insert(), [
+                {"name": f"product {i}", "price": 9.99, "stock": 10, "merchant_id": i % 50}
+                for i in range(args.products)
+            ])
+            session.commit()
+
+        cursors = [None]
+        while len(cursors) < args.pages:
+            page = client.get("/api/v1/products", params={"cursor": cursors[-1]} if cursors[-1] else {}).json()
+            if not page["next_cursor"]:
+                break
+            cursors.append(page["next_cursor"])
+
+        max_size = product_cache.max_size
+        print(f"{'cache':>9} {'req/s':>10}")
+        for label, size in (("disabled", 0), ("enabled", max_size)):
+            product_cache.max_size = size
+            product_cache.clear()
+            start = time.perf_counter()
+            for i in range(args.requests):
+                cursor = cursors[i % len(cursors)]
+                client.get("/api/v1/products", params={"cursor": cursor} if cursor else {}).raise_for_status()
+            print(f"{label:>9} {args.requests / (time.perf_counter() - start):>10.1f}")
+
+        print(product_cache.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark for product full-text search.
+
+Seeds a temporary SQLite catalog (1M products by default), builds the FTS5 index
+through the service's startup hook, then runs random prefix queries with and
+without price/merchant filters and reports p50/p95 latency. The target is
+p95 under 20 ms at 1M products.
+
+Usage:
+    python benchmarks/product_search.py [--products 1000000] [--queries 2000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "product_service")
+
+WORDS = ("red blue green black white leather cotton wool running trail hiking summer winter "
+         "classic slim wide vintage shoe boot sandal jacket shirt dress scarf hat glove bag "
+         "wallet watch lamp chair table mug bottle phone case charger cable speaker").split()
+SYLLABLES = "ka lo mi ra ze tu vo ni sa pe do fi gu ha je".split()
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    sys.path.insert(0, SERVICE_DIR)
+
+    from sqlmodel import Session
+    import main as product_main
+    import crud
+    from database import engine
+    from models import Products
+
+    rng = random.Random(42)
+    # Brand and model words: a long tail of rare terms next to the few common ones above
+    brands = sorted({"".join(rng.choices(SYLLABLES, k=3)) for _ in range(5000)})
+    asyncio.run(product_main.create_db_and_tables())
+
+    start = time.perf_counter()
+    batch = 50_000
+    with Session(engine) as session:
+        for offset in range(0, args.products, batch):
+            session.execute(Products.__table__.insert(), [
+                {"name": f"{rng.choice(brands)} {' '.join(rng.sample(WORDS, 2))}",
+                 "description": f"{rng.choice(brands)} {' '.join(rng.sample(WORDS, 5))}",
+                 "price": round(rng.uniform(1, 500), 2), "stock": 10, "merchant_id": rng.randrange(1000)}
+                for _ in range(min(batch, args.products - offset))
+            ])
+        session.commit()
+    print(f"seeded {args.products} products with incremental indexing in {time.perf_counter() - start:.1f}s")
+
+    scenarios = {
+        "prefix": lambda: dict(q=rng.choice(WORDS)[:3]),
+        "brand": lambda: dict(q=rng.choice(brands)[:5]),
+        "two terms": lambda: dict(q=f"{rng.choice(brands)} {rng.choice(WORDS)[:4]}"),
+        "price range": lambda: dict(q=rng.choice(WORDS), min_price=50.0, max_price=150.0),
+        "merchant": lambda: dict(q=rng.choice(WORDS)[:4], merchant_id=rng.randrange(1000)),
+    }
+
+    print(f"{'scenario':>12} {'p50 ms':>9} {'p95 ms':>9}")
+    with Session(engine) as session:
+        for name, make_query in scenarios.items():
+            latencies = []
+            for _ in range(args.queries):
+                params = dict(min_price=None, max_price=None, merchant_id=None, limit=20)
+                params.update(make_query())
+                started = time.perf_counter()
+                crud.search_products(session, **params)
+                latencies.append((time.perf_counter() - started) * 1000)
+            print(f"{name:>12} {statistics.median(latencies):>9.2f} {percentile(latencies, 95):>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
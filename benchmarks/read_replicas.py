@@ -0,0 +1,189 @@
+"""
+Benchmark of read replica routing in the order service, with two SQLite files standing in for a
+primary and its replica (aiosqlite with --async).
+
+Seeds the primary with --orders orders and copies it to the replica. The copy never replicates
+afterwards, so a read that reaches the replica cannot see later writes. Loads the order service in
+process with DATABASE_REPLICA_URLS set and runs:
+- load: --clients clients, each with its own cookies, send --requests order history reads
+  (GET /api/v1/order) each; a quarter of them are buyers, who place an order instead 10% of the
+  time. Reports requests/s and the share of reads and SQL statements the primary served;
+- read your writes: right after each placement the client reads its orders and must find the new
+  one, which only the primary has. A fresh client without the cookie reads from the replica, which
+  shows the staleness the pin hides;
+- pin expiry: after DB_REPLICA_PIN_SECONDS (1 here) the writer's reads go back to the replica;
+- failover: the replica file is replaced by garbage, then reads must keep succeeding from the
+  primary once the replica is probed. When the file is restored, reads return to the replica.
+
+Usage:
+    python benchmarks/read_replicas.py [--orders 20000] [--clients 20] [--requests 100] [--async]
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from harness import service_dir
+
+
+def seed(tmpdir, orders):
+    """Creates the primary through the service's migrations, inserts the history and copies it to the replica."""
+    primary, replica = os.path.join(tmpdir, "primary.db"), os.path.join(tmpdir, "replica.db")
+    subprocess.run([sys.executable, "-c", "import asyncio, main; asyncio.run(main.create_db_and_tables())"],
+                   cwd=service_dir("order"), env=dict(os.environ, DATABASE_URL=f"sqlite:///{primary}"), check=True)
+    rng = random.Random(7)
+    now = datetime.utcnow()
+    conn = sqlite3.connect(primary)
+    conn.executemany("INSERT INTO orders (user_id, order_status, total_amount, payment_status, created_at) "
+                     "VALUES (?, 'pending', ?, 'unpaid', ?)",
+                     [(rng.randint(1, 1000), round(rng.uniform(1, 500), 2),
+                       (now - timedelta(minutes=rng.randint(0, 525_600))).isoformat(" ")) for _ in range(orders)])
+    conn.commit()
+    # Closing the last connection checkpoints the WAL, so the copy holds every row
+    conn.close()
+    shutil.copy(primary, replica)
+    return primary, replica
+
+
+class Counters:
+    def __init__(self, engines):
+        from sqlalchemy import event
+
+        self.statements = {name: 0 for name in engines}
+        for name, engine in engines.items():
+            event.listen(engine, "before_cursor_execute", lambda *args, name=name: self.count(name))
+
+    def count(self, name):
+        self.statements[name] += 1
+
+
+async def client(http, user_id, args, rng, stale, buyer):
+    """Sends one client's mix; stale counts reads after the client's own write that missed it."""
+    for _ in range(args.requests):
+        if buyer and rng.random() < 0.1:
+            response = await http.post("/api/v1/order", json={"user_id": user_id, "items": [
+                {"product_id": rng.randint(1, 100), "quantity": 1, "price": 9.99}]})
+            response.raise_for_status()
+            order_id = response.json()["id"]
+            page = (await http.get("/api/v1/order", params={"user_id": user_id})).json()
+            stale["own"] += order_id not in {order["id"] for order in page["items"]}
+        else:
+            (await http.get("/api/v1/order", params={"user_id": user_id, "limit": 20})).raise_for_status()
+
+
+async def drive(main, args, replica_path):
+    import httpx
+    from database import replica_router, sync_engine
+
+    replica = replica_router.replicas[0]
+    counters = Counters({"primary": sync_engine, "replica": replica.sync_engine})
+    failures = []
+
+    def http_client():
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench")
+
+    async with main.app.router.lifespan_context(main.app):
+        # Load, with read-your-writes checked after every placement
+        clients = [http_client() for _ in range(args.clients)]
+        stale = {"own": 0}
+        for name in counters.statements:
+            counters.statements[name] = 0
+        before = (replica.sessions, replica_router.pinned, replica_router.fallbacks)
+        start = time.perf_counter()
+        await asyncio.gather(*(client(http, 1000 + i, args, random.Random(i), stale, i % 4 == 0)
+                               for i, http in enumerate(clients)))
+        elapsed = time.perf_counter() - start
+        replica_reads, pinned, fallbacks = (now - then for now, then in zip(
+            (replica.sessions, replica_router.pinned, replica_router.fallbacks), before))
+        reads = replica_reads + pinned + fallbacks
+        total = sum(counters.statements.values())
+        print(f"load: {args.clients * args.requests / elapsed:.0f} req/s; reads from the replica "
+              f"{replica_reads}/{reads}, pinned to the primary {pinned}, fallbacks {fallbacks}; "
+              f"SQL statements on the primary {counters.statements['primary']}/{total}")
+        if stale["own"]:
+            failures.append(f"{stale['own']} reads after a write missed the client's own order")
+
+        # A client without the pin reads the replica, which never received the new orders
+        writer = clients[0]
+        order_id = (await writer.post("/api/v1/order", json={"user_id": 1000, "items": [
+            {"product_id": 1, "quantity": 1, "price": 9.99}]})).json()["id"]
+        async with http_client() as other:
+            page = (await other.get("/api/v1/order", params={"user_id": 1000})).json()
+        seen = {order["id"] for order in page["items"]}
+        print(f"read your writes: {stale['own']} stale reads by writers; a client without the pin "
+              f"{'sees' if order_id in seen else 'does not see'} the new order")
+
+        # The pin expires after DB_REPLICA_PIN_SECONDS
+        await asyncio.sleep(float(os.environ["DB_REPLICA_PIN_SECONDS"]) + 0.2)
+        sessions = replica.sessions
+        await writer.get("/api/v1/order", params={"user_id": 1000})
+        expired = replica.sessions == sessions + 1
+        print(f"pin expiry: the writer's next read {'went to the replica' if expired else 'stayed on the primary'}")
+        if not expired:
+            failures.append("the pin did not expire")
+        for http in clients:
+            await http.aclose()
+
+        # Failover: the replica becomes unreadable, then comes back
+        async with http_client() as http:
+            backup = replica_path + ".bak"
+            shutil.copy(replica_path, backup)
+            await dispose(replica)
+            with open(replica_path, "wb") as garbage:
+                garbage.write(os.urandom(8192))
+            await asyncio.sleep(float(os.environ["DB_REPLICA_CHECK_INTERVAL"]) + 0.1)
+            errors = 0
+            for _ in range(50):
+                errors += (await http.get("/api/v1/order", params={"limit": 5})).status_code != 200
+            down = not replica.healthy
+            os.replace(backup, replica_path)
+            await asyncio.sleep(float(os.environ["DB_REPLICA_CHECK_INTERVAL"]) + 0.1)
+            sessions = replica.sessions
+            for _ in range(10):
+                (await http.get("/api/v1/order", params={"limit": 5})).raise_for_status()
+            recovered = replica.healthy and replica.sessions > sessions
+        print(f"failover: replica marked down {down}, failed reads while down {errors}/50, "
+              f"back to the replica after restoring it {recovered}")
+        if not down or errors or not recovered:
+            failures.append("reads did not fail over to the primary and back")
+    return failures
+
+
+async def dispose(replica):
+    """Drops the replica's pooled connections, which would keep the old file open."""
+    result = replica.engine.dispose()
+    if asyncio.iscoroutine(result):
+        await result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=20_000, help="orders seeded")
+    parser.add_argument("--clients", type=int, default=20, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=100, help="requests per client")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="use the aiosqlite driver")
+    args = parser.parse_args()
+
+    primary, replica = seed(tempfile.mkdtemp(), args.orders)
+    driver = "sqlite+aiosqlite" if args.use_async else "sqlite"
+    os.environ.update(DATABASE_URL=f"{driver}:///{primary}", DATABASE_REPLICA_URLS=f"{driver}:///{replica}",
+                      DB_REPLICA_PIN_SECONDS="1", DB_REPLICA_CHECK_INTERVAL="0.2", METRICS_ENABLED="false",
+                      PRODUCT_SERVICE_URL="")
+    sys.path.insert(0, service_dir("order"))
+    import main as order_main
+
+    failures = asyncio.run(drive(order_main, args, replica))
+    for failure in failures:
+        print(f"FAILED {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Benchmark for the order service's inter-service client, against local stub servers.
+
+Reports connection reuse and latency of pooled calls compared with a new
+connection per call, the upper bound a timeout puts on a hung downstream, and
+how fast calls fail once the circuit breaker opens on a service that is down.
+
+Usage:
+    python benchmarks/service_client.py [--calls 500]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "order_service")
+
+client_ports = set()
+
+
+async def ok(request):
+    client_ports.add(request.client.port)
+    return JSONResponse({"ok": True})
+
+
+async def slow(request):
+    await asyncio.sleep(10)
+    return JSONResponse({"ok": True})
+
+
+async def down(request):
+    return JSONResponse({"detail": "unavailable"}, status_code=503)
+
+
+def start_stub():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    app = Starlette(routes=[Route("/ok", ok), Route("/slow", slow), Route("/down", down)])
+    server = uvicorn.Server(uvicorn.Config(app, port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}"
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def timed_calls(call, calls):
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        await call()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+async def run(args):
+    sys.path.insert(0, SERVICE_DIR)
+    from utils import call_service, close_clients, get_client
+
+    base_url = start_stub()
+
+    async def unpooled():
+        async with httpx.AsyncClient() as client:
+            (await client.get(f"{base_url}/ok")).json()
+
+    print(f"{'client':>10} {'connections':>12} {'p50 ms':>9} {'p99 ms':>9}")
+    for label, call in (("unpooled", unpooled), ("pooled", lambda: call_service(f"{base_url}/ok"))):
+        client_ports.clear()
+        latencies = await timed_calls(call, args.calls)
+        print(f"{label:>10} {len(client_ports):>12} {statistics.median(latencies):>9.2f} "
+              f"{percentile(latencies, 99):>9.2f}")
+
+    start = time.perf_counter()
+    try:
+        await call_service(f"{base_url}/slow", timeout=0.2)
+    except RuntimeError:
+        pass
+    print(f"hung downstream with 0.2s timeout and retries returned after {time.perf_counter() - start:.2f}s")
+
+    breaker = get_client(base_url).breaker
+    breaker.record_success()
+    latencies = []
+    for _ in range(20):
+        start = time.perf_counter()
+        try:
+            await call_service(f"{base_url}/down")
+        except RuntimeError:
+            pass
+        latencies.append((time.perf_counter() - start) * 1000)
+    print(f"service down: first call {latencies[0]:.2f} ms, calls with breaker {breaker.state} "
+          f"p50 {statistics.median(latencies[5:]):.3f} ms")
+
+    await close_clients()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=500)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Startup cost of the schema step of every service, before and after versioned migrations.
+
+For every service, on a temporary SQLite database (aiosqlite with --async):
+- migrates a fresh database once, as the first replica does;
+- then times repeated boots of an up-to-date database, each on a new connection, comparing:
+  - "before": what every boot used to run, i.e. create_all and the other schema steps;
+  - "after": run_migrations, which finds the database at the last version.
+  Reports the median time and the number of SQL statements of each.
+
+Then starts the service under uvicorn with --workers processes at once on another fresh database.
+This checks that every migration was recorded exactly once and that the workers all served requests.
+
+Every service is measured in a child process of its own, since their modules share names.
+
+Usage:
+    python benchmarks/startup_time.py [--services cart,notification,order,payment,product,user]
+        [--boots 20] [--workers 4] [--async]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from harness import run_service, service_dir
+
+
+async def boot_costs(database, main, migrations, boots):
+    from sqlalchemy import event
+
+    statements = []
+    event.listen(database.sync_engine, "before_cursor_execute", lambda *args: statements.append(1))
+
+    async def previous_schema_step():
+        def apply_all(connection):
+            for migration in migrations:
+                migration.apply(connection)
+
+        if database.IS_ASYNC:
+            async with database.engine.begin() as conn:
+                await conn.run_sync(apply_all)
+        else:
+            with database.engine.begin() as conn:
+                apply_all(conn)
+
+    async def measure(step):
+        # A new replica has no pooled connection yet, so each boot opens its own
+        if database.IS_ASYNC:
+            await database.engine.dispose()
+        else:
+            database.engine.dispose()
+        statements.clear()
+        start = time.perf_counter()
+        await step()
+        return (time.perf_counter() - start) * 1000, len(statements)
+
+    fresh = await measure(main.create_db_and_tables)
+    samples = {"before": [], "after": []}
+    for _ in range(boots):
+        samples["before"].append(await measure(previous_schema_step))
+        samples["after"].append(await measure(main.create_db_and_tables))
+    return fresh, {variant: (statistics.median(ms for ms, _ in runs), max(count for _, count in runs))
+                   for variant, runs in samples.items()}
+
+
+def concurrent_start(service, url, migrations, workers):
+    """Starts workers processes on a fresh database; returns a failure message, or None."""
+    from sqlalchemy import create_engine, text
+
+    with run_service(service, url, env={"METRICS_ENABLED": "false"}, workers=workers):
+        pass
+    engine = create_engine(url.replace("+aiosqlite", ""))
+    with engine.connect() as conn:
+        applied = [row.version for row in conn.execute(text("SELECT version FROM schema_migrations ORDER BY version"))]
+    engine.dispose()
+    expected = [migration.version for migration in migrations]
+    if applied != expected:
+        return f"{service}: {workers} workers recorded versions {applied} instead of {expected}"
+    return None
+
+
+def run_service_benchmark(service, args):
+    tmpdir = tempfile.mkdtemp()
+    driver = "sqlite+aiosqlite" if args.use_async else "sqlite"
+    os.environ["DATABASE_URL"] = f"{driver}:///{os.path.join(tmpdir, 'boot.db')}"
+    os.environ["METRICS_ENABLED"] = "false"
+    sys.path.insert(0, service_dir(service))
+
+    import database
+    import main
+    from migrations import MIGRATIONS
+
+    (fresh_ms, fresh_count), costs = asyncio.run(boot_costs(database, main, MIGRATIONS, args.boots))
+    (before_ms, before_count), (after_ms, after_count) = costs["before"], costs["after"]
+    failure = concurrent_start(service, f"{driver}:///{os.path.join(tmpdir, 'workers.db')}", MIGRATIONS,
+                               args.workers)
+
+    print(f"{service:<13} {fresh_ms:>9.1f} {fresh_count:>6} {before_ms:>10.2f} {before_count:>6} "
+          f"{after_ms:>9.2f} {after_count:>6} {before_ms / after_ms:>8.1f}x  {'FAILED' if failure else 'ok'}")
+    if failure:
+        print(f"FAILED {failure}")
+    sys.exit(1 if failure else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--services", default="cart,notification,order,payment,product,user")
+    parser.add_argument("--boots", type=int, default=20, help="boots of an up-to-date database per variant")
+    parser.add_argument("--workers", type=int, default=4, help="uvicorn workers started together on a fresh database")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="use the aiosqlite driver")
+    parser.add_argument("--service", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.service:
+        run_service_benchmark(args.service, args)
+        return
+
+    print(f"{'service':<13} {'fresh ms':>9} {'stmts':>6} {'before ms':>10} {'stmts':>6} {'after ms':>9} "
+          f"{'stmts':>6} {'speedup':>9}  {'workers'}")
+    failed = False
+    for service in args.services.split(","):
+        failed |= subprocess.run([sys.executable, os.path.abspath(__file__), "--service", service]
+                                 + sys.argv[1:]).returncode != 0
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+from collections import OrderedDict
+from contextlib import asynccontextmanager, nullcontext
+from typing import Dict, Iterator, List, Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import delete, update
+from sqlmodel import Session
+from models import Cart, CartUpdate
+from pagination import Page, decode_cursor, encode_cursor
+from database import env_bool, run_in_session
+from versions import bump_versions
+import asyncio
+import crud
+import itertools
+import logging
+import os
+import time
+import uuid
+
+# Serve carts from memory and write their changes to the database in batches (default off)
+CART_STORE_ENABLED = env_bool("CART_STORE_ENABLED", False)
+CART_STORE_MAX_CARTS = int(os.getenv("CART_STORE_MAX_CARTS", "10000"))
+# Carts untouched this long are dropped from memory once their changes are written
+CART_STORE_IDLE_TTL = float(os.getenv("CART_STORE_IDLE_TTL", "300"))
+# Changes are at most this old when written; a crash loses at most this window
+CART_STORE_FLUSH_INTERVAL = float(os.getenv("CART_STORE_FLUSH_INTERVAL", "0.5"))
+CART_STORE_FLUSH_ROWS = int(os.getenv("CART_STORE_FLUSH_ROWS", "1000"))
+
+logger = logging.getLogger(__name__)
+
+class CartStore:
+    """
+    Interface for where hot carts are kept, each as {line id: Cart}.
+    A shared implementation (for example one Redis hash per cart) lets every replica serve the same carts;
+    with the local stand-in carts live in this process, so a user's requests must reach the same replica.
+    """
+    def get(self, user_id: int) -> Optional[Dict[int, Cart]]:
+        raise NotImplementedError
+
+    def put(self, user_id: int, lines: Dict[int, Cart]):
+        raise NotImplementedError
+
+    def drop(self, user_id: int):
+        raise NotImplementedError
+
+    def set_line(self, line: Cart):
+        raise NotImplementedError
+
+    def remove_line(self, line: Cart):
+        raise NotImplementedError
+
+    def owner(self, line_id: int) -> Optional[int]:
+        """Returns the user whose stored cart holds the line, or None."""
+        raise NotImplementedError
+
+    def least_recent(self) -> Iterator[Tuple[int, float]]:
+        """Yields (user_id, last used) for the stored carts, least recently used first."""
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+class LocalCartStore(CartStore):
+    """In-process stand-in for a shared cart store, in least recently used order."""
+    def __init__(self):
+        self.carts: "OrderedDict[int, Dict[int, Cart]]" = OrderedDict()
+        self.last_used: Dict[int, float] = {}
+        self.owners: Dict[int, int] = {}
+
+    def get(self, user_id: int) -> Optional[Dict[int, Cart]]:
+        lines = self.carts.get(user_id)
+        if lines is not None:
+            self.carts.move_to_end(user_id)
+            self.last_used[user_id] = time.monotonic()
+        return lines
+
+    def put(self, user_id: int, lines: Dict[int, Cart]):
+        self.drop(user_id)
+        self.carts[user_id] = lines
+        self.last_used[user_id] = time.monotonic()
+        self.owners.update((line_id, user_id) for line_id in lines)
+
+    def drop(self, user_id: int):
+        for line_id in self.carts.pop(user_id, {}):
+            del self.owners[line_id]
+        self.last_used.pop(user_id, None)
+
+    def set_line(self, line: Cart):
+        lines = self.carts.get(line.user_id)
+        if lines is not None:
+            lines[line.id] = line
+            self.owners[line.id] = line.user_id
+
+    def remove_line(self, line: Cart):
+        lines = self.carts.get(line.user_id)
+        if lines is not None and lines.pop(line.id, None) is not None:
+            del self.owners[line.id]
+
+    def owner(self, line_id: int) -> Optional[int]:
+        return self.owners.get(line_id)
+
+    def least_recent(self) -> Iterator[Tuple[int, float]]:
+        for user_id in list(self.carts):
+            yield user_id, self.last_used[user_id]
+
+    def __len__(self) -> int:
+        return len(self.carts)
+
+def write_changes(session: Session, changes: Dict[int, Tuple[int, Optional[int]]]):
+    """
+    Writes coalesced line changes, {line id: (user id, quantity, or None if deleted)}, in one transaction,
+    bumping the version stamps of the carts they belong to.
+    """
+    updates = [{"id": line_id, "quantity": quantity} for line_id, (_, quantity) in changes.items()
+               if quantity is not None]
+    deleted = [line_id for line_id, (_, quantity) in changes.items() if quantity is None]
+    if updates:
+        # ORM bulk UPDATE by primary key, sent as one executemany
+        session.execute(update(Cart), updates)
+    if deleted:
+        session.execute(delete(Cart).where(Cart.id.in_(deleted)))
+    bump_versions(session, [crud.cart_key(user_id) for user_id, _ in changes.values()])
+    session.commit()
+
+class WriteBehindCartStore:
+    """
+    Serves cart reads and quantity changes from a CartStore and writes the changes to the Cart table behind them.
+    Changes to a line are coalesced until the next flush, which writes every pending line in one transaction,
+    every flush_interval seconds or once flush_rows lines are pending. Carts with unwritten changes are never evicted.
+    New lines are written through, since the response carries the id the database assigns them.
+    Each cart in memory carries a stamp, renewed by every change and every load, that its ETags derive from.
+    """
+    def __init__(self, store: CartStore, max_carts: int = CART_STORE_MAX_CARTS, idle_ttl: float = CART_STORE_IDLE_TTL,
+                 flush_interval: float = CART_STORE_FLUSH_INTERVAL, flush_rows: int = CART_STORE_FLUSH_ROWS):
+        self.store = store
+        self.max_carts = max_carts
+        self.idle_ttl = idle_ttl
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        # line id -> (user id, quantity, or None once deleted)
+        self.dirty: Dict[int, Tuple[int, Optional[int]]] = {}
+        # Serializes flushes, so a line's changes reach the database in order
+        self.flush_lock = asyncio.Lock()
+        self.wake = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        # Stamps are unique to this store, so ETags from another replica or an earlier process never match
+        self.instance = uuid.uuid4().hex[:12]
+        self.clock = itertools.count(1)
+        self.stamps: Dict[int, int] = {}
+        self.hits = 0
+        self.loads = 0
+        self.changes = 0
+        self.flushes = 0
+        self.flushed = 0
+        self.evictions = 0
+        self.errors = 0
+
+    async def cart(self, user_id: int) -> Dict[int, Cart]:
+        lines = self.store.get(user_id)
+        if lines is not None:
+            self.hits += 1
+            return lines
+        loaded = await run_in_session(crud.user_lines, user_id)
+        # A concurrent request may have loaded, and changed, the cart meanwhile
+        lines = self.store.get(user_id)
+        if lines is None:
+            lines = {line.id: line for line in loaded}
+            self.store.put(user_id, lines)
+            self.stamps[user_id] = next(self.clock)
+            self.loads += 1
+            self.evict()
+        return lines
+
+    async def line(self, cart_id: int) -> Cart:
+        user_id = self.store.owner(cart_id)
+        if user_id is None:
+            user_id = (await run_in_session(crud.get_cart_line, cart_id)).user_id
+        line = (await self.cart(user_id)).get(cart_id)
+        if line is None:
+            # Deleted here, not yet in the database
+            raise HTTPException(status_code=404, detail="Cart not found")
+        return line
+
+    async def version(self, user_id: int) -> str:
+        """The stamp of a user's cart as an ETag token, loading the cart if it is not in memory."""
+        await self.cart(user_id)
+        return f"{self.instance}.{self.stamps[user_id]}"
+
+    async def lines(self, user_id: int) -> List[Cart]:
+        """Returns every line of a user's cart in id order; carts over MAX_CART_LINES are rejected with 422."""
+        lines = await self.cart(user_id)
+        if len(lines) > crud.MAX_CART_LINES:
+            raise HTTPException(status_code=422, detail=f"Carts are limited to {crud.MAX_CART_LINES} lines")
+        return [lines[line_id] for line_id in sorted(lines)]
+
+    async def list_cart(self, user_id: int, cursor: Optional[str], limit: int) -> Page:
+        """Pages through a cart newest line first, with the same cursors as the database listing."""
+        lines = await self.cart(user_id)
+        line_ids = sorted(lines, reverse=True)
+        if cursor:
+            before = decode_cursor(cursor, [Cart.id])[0]
+            line_ids = [line_id for line_id in line_ids if line_id < before]
+        next_cursor = encode_cursor([line_ids[limit - 1]]) if len(line_ids) > limit else None
+        return Page(items=[lines[line_id] for line_id in line_ids[:limit]], next_cursor=next_cursor)
+
+    def mark(self, line: Cart, quantity: Optional[int]):
+        self.dirty[line.id] = (line.user_id, quantity)
+        self.stamps[line.user_id] = next(self.clock)
+        self.changes += 1
+        if len(self.dirty) >= self.flush_rows:
+            self.wake.set()
+
+    async def add(self, cart_item: Cart) -> Cart:
+        """Adds to the line of the product, or writes a new line through to the database."""
+        for line in (await self.cart(cart_item.user_id)).values():
+            if line.product_id == cart_item.product_id:
+                line.quantity += cart_item.quantity
+                self.store.set_line(line)
+                self.mark(line, line.quantity)
+                return line
+        # A deleted line of the same product must be gone before the upsert
+        await self.flush(cart_item.user_id)
+        line = await run_in_session(crud.add_cart, cart_item)
+        self.store.set_line(line)
+        self.stamps[line.user_id] = next(self.clock)
+        return line
+
+    async def update(self, cart_id: int, data_update: CartUpdate) -> dict:
+        cart_data = crud.cart_changes(data_update)
+        line = await self.line(cart_id)
+        line.sqlmodel_update(cart_data)
+        self.store.set_line(line)
+        self.mark(line, line.quantity)
+        return {"message": "Update cart success"}
+
+    async def delete(self, cart_id: int) -> dict:
+        line = await self.line(cart_id)
+        self.store.remove_line(line)
+        self.mark(line, None)
+        return {"message": "Delete cart success"}
+
+    async def flush(self, user_id: Optional[int] = None) -> int:
+        """Writes the pending changes, of every cart or of one user's, and returns how many lines were written."""
+        async with self.flush_lock:
+            if user_id is None:
+                changes, self.dirty = self.dirty, {}
+            else:
+                changes = {line_id: change for line_id, change in self.dirty.items() if change[0] == user_id}
+                for line_id in changes:
+                    del self.dirty[line_id]
+            if not changes:
+                return 0
+            try:
+                await run_in_session(write_changes, changes)
+            except Exception:
+                # Kept for the next flush, unless the line changed again meanwhile
+                for line_id, change in changes.items():
+                    self.dirty.setdefault(line_id, change)
+                self.errors += 1
+                raise
+            self.flushes += 1
+            self.flushed += len(changes)
+            return len(changes)
+
+    def evict(self):
+        """Drops carts idle for longer than idle_ttl, then the least recently used ones while over max_carts."""
+        pending = {user_id for user_id, _ in self.dirty.values()}
+        now = time.monotonic()
+        for user_id, last_used in self.store.least_recent():
+            if len(self.store) <= self.max_carts and now - last_used < self.idle_ttl:
+                break
+            if user_id in pending:
+                continue
+            self.drop(user_id)
+            self.evictions += 1
+        if len(self.store) > self.max_carts:
+            # Only carts with pending changes are left to evict
+            self.wake.set()
+
+    def drop(self, user_id: int):
+        self.store.drop(user_id)
+        self.stamps.pop(user_id, None)
+
+    @asynccontextmanager
+    async def bypass(self, *user_ids: int):
+        """
+        Wraps a change made straight in the database: the users' pending changes are written first,
+        and their carts are dropped from memory before and after, so the next read loads the result.
+        """
+        for user_id in user_ids:
+            await self.flush(user_id)
+            self.drop(user_id)
+        try:
+            yield
+        finally:
+            for user_id in user_ids:
+                self.drop(user_id)
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to write cart changes")
+            self.evict()
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def close(self):
+        """Stops the flusher and writes every pending change; called on application shutdown."""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Lost %d cart line changes on shutdown", len(self.dirty))
+
+    def stats(self) -> dict:
+        return {
+            "enabled": True,
+            "carts": len(self.store),
+            "max_carts": self.max_carts,
+            "pending_lines": len(self.dirty),
+            "hits": self.hits,
+            "loads": self.loads,
+            "changes": self.changes,
+            "flushes": self.flushes,
+            "flushed_lines": self.flushed,
+            "evictions": self.evictions,
+            "errors": self.errors,
+        }
+
+cart_store = WriteBehindCartStore(LocalCartStore()) if CART_STORE_ENABLED else None
+
+def bypassing_store(*user_ids: int):
+    """WriteBehindCartStore.bypass for the users' carts, or nothing when the store is off."""
+    return cart_store.bypass(*user_ids) if cart_store is not None else nullcontext()
@@ -0,0 +1,180 @@
+from collections import defaultdict
+from typing import Dict, Iterable, List, Set
+from fastapi import HTTPException
+from models import Cart, CartLine, CartSummary, CheckoutItem, CheckoutResult
+from utils import ServiceCallError, call_service
+from database import run_in_session
+from cart_store import bypassing_store
+import asyncio
+import crud
+import logging
+import os
+
+PRODUCT_SERVICE_URL = os.getenv("PRODUCT_SERVICE_URL", "http://product_service:8000")
+ORDER_SERVICE_URL = os.getenv("ORDER_SERVICE_URL", "http://order_service:8000")
+# How long a checkout holds its stock; held reservations are released by the product service after that
+CHECKOUT_RESERVATION_TTL = int(os.getenv("CHECKOUT_RESERVATION_TTL", "900"))
+# First and longest wait, in seconds, between repeats of an order whose outcome is unknown
+ORDER_RECONCILE_DELAY = float(os.getenv("ORDER_RECONCILE_DELAY", "1"))
+ORDER_RECONCILE_MAX_DELAY = float(os.getenv("ORDER_RECONCILE_MAX_DELAY", "60"))
+
+logger = logging.getLogger(__name__)
+
+async def lookup_products(product_ids: Iterable[int]) -> Dict[int, dict]:
+    """Fetches the catalog entries of a cart's products in a single bulk lookup call."""
+    product_ids = sorted(set(product_ids))
+    if not product_ids:
+        return {}
+    try:
+        products = await call_service(f"{PRODUCT_SERVICE_URL}/api/v1/products/lookup", method="POST",
+                                      data={"product_ids": product_ids}, idempotent=True)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=f"Product service unavailable: {str(e)}")
+    return {product["id"]: product for product in products}
+
+async def cart_summary(user_id: int, lines: List[Cart]) -> CartSummary:
+    """Prices every line of a cart from the catalog and totals the available ones."""
+    products = await lookup_products(line.product_id for line in lines)
+    requested = defaultdict(int)
+    for line in lines:
+        requested[line.product_id] += line.quantity
+
+    priced = []
+    for line in lines:
+        product = products.get(line.product_id)
+        if product is None:
+            priced.append(CartLine(id=line.id, product_id=line.product_id, quantity=line.quantity))
+            continue
+        priced.append(CartLine(
+            id=line.id, product_id=line.product_id, quantity=line.quantity,
+            name=product["name"], image_url=product["image_url"], price=product["price"], stock=product["stock"],
+            subtotal=product["price"] * line.quantity,
+            # Several lines of one product share its stock
+            available=requested[line.product_id] <= product["stock"],
+        ))
+
+    return CartSummary(
+        user_id=user_id,
+        lines=priced,
+        item_count=sum(line.quantity for line in lines),
+        total_amount=sum(line.subtotal for line in priced if line.available),
+        checkout_ready=bool(priced) and all(line.available for line in priced),
+    )
+
+async def finish_reservation(reservation_id: int, outcome: str):
+    try:
+        await call_service(f"{PRODUCT_SERVICE_URL}/api/v1/products/reservations/{reservation_id}/{outcome}",
+                           method="POST", idempotent=True)
+    except RuntimeError:
+        # The reservation stays held until its ttl runs out
+        logger.exception("Failed to %s reservation %d", outcome, reservation_id)
+
+def is_rejection(error: ServiceCallError) -> bool:
+    """Whether the service answered with a 4xx, so it certainly did not act on the call."""
+    return error.status_code is not None and error.status_code < 500
+
+async def submit_order(order: dict) -> dict:
+    # Safe to retry: the order service places at most one order per reservation_id and returns it again
+    return await call_service(f"{ORDER_SERVICE_URL}/api/v1/order", method="POST", data=order, idempotent=True)
+
+class OrderPending(HTTPException):
+    """The order service gave no definite answer; the checkout is left to the reconciler, cart lines and all."""
+    def __init__(self, detail: str):
+        super().__init__(status_code=504, detail=detail)
+
+class OrderReconciler:
+    """
+    Settles checkouts whose order request got no definite answer, such as a read timeout after the order
+    service committed. Their reservation stays held while the request is repeated with the same reservation_id,
+    which returns the order if it was placed and places it otherwise. The reservation is then committed,
+    or released and the cart lines put back if the order service rejects the order with a 4xx.
+    Gives up when the reservation expires; the lines stay claimed then, as the order may exist.
+    """
+    def __init__(self, delay: float = ORDER_RECONCILE_DELAY, max_delay: float = ORDER_RECONCILE_MAX_DELAY,
+                 ttl: float = CHECKOUT_RESERVATION_TTL):
+        self.delay = delay
+        self.max_delay = max_delay
+        self.ttl = ttl
+        self.tasks: Set[asyncio.Task] = set()
+        self.placed = 0
+        self.rejected = 0
+        self.abandoned = 0
+
+    def track(self, order: dict, lines: List[Cart]):
+        task = asyncio.create_task(self.reconcile(order, lines))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def reconcile(self, order: dict, lines: List[Cart]):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.ttl
+        delay = self.delay
+        while loop.time() + delay < deadline:
+            await asyncio.sleep(delay)
+            try:
+                await submit_order(order)
+            except ServiceCallError as e:
+                if not is_rejection(e):
+                    delay = min(delay * 2, self.max_delay)
+                    continue
+                await finish_reservation(order["reservation_id"], "release")
+                async with bypassing_store(order["user_id"]):
+                    await run_in_session(crud.restore_cart, lines)
+                self.rejected += 1
+                return
+            await finish_reservation(order["reservation_id"], "commit")
+            self.placed += 1
+            return
+        self.abandoned += 1
+        logger.error("Gave up confirming the order of reservation %d for user %d",
+                     order["reservation_id"], order["user_id"])
+
+    async def close(self):
+        """Stops reconciling on shutdown; the reservations are released by the product service when they expire."""
+        for task in list(self.tasks):
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {"pending": len(self.tasks), "placed": self.placed, "rejected": self.rejected,
+                "abandoned": self.abandoned}
+
+order_reconciler = OrderReconciler()
+
+async def place_order(user_id: int, lines: List[Cart]) -> CheckoutResult:
+    """
+    Turns claimed cart lines into an order: reserves their stock, places the order priced by the
+    order service and commits the reservation, or releases it if the order service rejected the order.
+    Without a definite answer the reservation stays held and the order is settled by order_reconciler.
+    """
+    items = [{"product_id": line.product_id, "quantity": line.quantity} for line in lines]
+    try:
+        reservation = await call_service(f"{PRODUCT_SERVICE_URL}/api/v1/products/reservations", method="POST",
+                                         data={"items": items, "ttl_seconds": CHECKOUT_RESERVATION_TTL})
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=f"Product service unavailable: {str(e)}")
+    reservation_id = reservation["reservation_id"]
+    if reservation_id is None:
+        # The reservation is all or nothing, so it does not tell which products fell short
+        raise HTTPException(status_code=409, detail="Insufficient stock for the cart")
+
+    order_request = {"user_id": user_id, "items": items, "reservation_id": reservation_id}
+    try:
+        order = await submit_order(order_request)
+    except ServiceCallError as e:
+        if not is_rejection(e):
+            order_reconciler.track(order_request, lines)
+            raise OrderPending(f"Order is being confirmed: {str(e)}")
+        await finish_reservation(reservation_id, "release")
+        raise HTTPException(status_code=502, detail=f"Order could not be placed: {str(e)}")
+    await finish_reservation(reservation_id, "commit")
+
+    return CheckoutResult(
+        order_id=order["id"],
+        user_id=order["user_id"],
+        order_status=order["order_status"],
+        payment_status=order["payment_status"],
+        total_amount=order["total_amount"],
+        items=[CheckoutItem(product_id=item["product_id"], quantity=item["quantity"], price=item["price"],
+                            subtotal=item["subtotal"]) for item in order["items"]],
+    )
@@ -0,0 +1,173 @@
+from fastapi import HTTPException
+from sqlalchemy import Integer, delete, literal, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session
+from typing import List, Optional
+from models import Cart, CartUpdate, CartBulkRequest, CartMerge, CartOperationType
+from pagination import Page, paginate
+from versions import bump_versions
+
+# A whole cart is priced in one catalog lookup and reserved in one request, both limited to 1000 items
+MAX_CART_LINES = 1000
+
+def cart_key(user_id: int) -> str:
+    """The version stamp of a user's cart, bumped by every change to its lines."""
+    return f"cart:{user_id}"
+
+def list_cart(session: Session, user_id: int, cursor: Optional[str], limit: int) -> Page:
+    """Retrieves a page of cart lines from the database, filtered by user_id"""
+    # Use the session to query the database
+    query = session.query(Cart)
+    if user_id is not None:
+        query = query.filter(Cart.user_id == user_id)
+    return paginate(query, [Cart.id], limit, cursor)
+
+def upsert_lines(session: Session, rows, increment: bool):
+    """
+    Inserts cart lines in one statement. A line whose product is already in the cart gets
+    the new quantity added to its own (increment) or replacing it.
+    """
+    insert = postgresql_insert if session.get_bind().dialect.name == "postgresql" else sqlite_insert
+    statement = insert(Cart.__table__)
+    statement = statement.values(rows) if isinstance(rows, list) else statement.from_select(
+        ["user_id", "product_id", "quantity"], rows)
+    excluded = statement.excluded.quantity
+    return statement.on_conflict_do_update(index_elements=["user_id", "product_id"],
+                                           set_={"quantity": Cart.quantity + excluded if increment else excluded})
+
+def user_lines(session: Session, user_id: int) -> List[Cart]:
+    return session.query(Cart).filter(Cart.user_id == user_id).order_by(Cart.id).all()
+
+def add_cart(session: Session, cart_item: Cart) -> Cart:
+    """add cart into the database; adding a product already in the cart increments its quantity."""
+    statement = upsert_lines(session, [{"user_id": cart_item.user_id, "product_id": cart_item.product_id,
+                                        "quantity": cart_item.quantity}], increment=True)
+    line = session.execute(statement.returning(*Cart.__table__.columns)).one()
+    bump_versions(session, [cart_key(cart_item.user_id)])
+    session.commit()
+    return Cart(**line._mapping)
+
+def bulk_update_cart(session: Session, request: CartBulkRequest) -> List[Cart]:
+    """
+    Applies many add, set and remove operations to a cart in one transaction and returns the cart.
+    Operations are folded per product first, so the whole request costs at most three statements.
+    """
+    final = {}
+    for operation in request.operations:
+        previous = final.get(operation.product_id)
+        if operation.op == CartOperationType.add and previous is not None and previous[0] != "remove":
+            final[operation.product_id] = (previous[0], previous[1] + operation.quantity)
+        elif operation.op == CartOperationType.add:
+            # Adding after a remove in the same request starts the line over
+            final[operation.product_id] = ("add" if previous is None else "set", operation.quantity)
+        elif operation.op == CartOperationType.set and operation.quantity > 0:
+            final[operation.product_id] = ("set", operation.quantity)
+        else:
+            final[operation.product_id] = ("remove", 0)
+
+    removed = [product_id for product_id, (action, quantity) in final.items()
+               if action == "remove" or (action == "set" and quantity == 0)]
+    if removed:
+        session.execute(delete(Cart).where(Cart.user_id == request.user_id, Cart.product_id.in_(removed)))
+    for action in ("add", "set"):
+        rows = [{"user_id": request.user_id, "product_id": product_id, "quantity": quantity}
+                for product_id, (kind, quantity) in final.items() if kind == action and quantity > 0]
+        if rows:
+            session.execute(upsert_lines(session, rows, increment=action == "add"))
+    bump_versions(session, [cart_key(request.user_id)])
+    session.commit()
+    return user_lines(session, request.user_id)
+
+def merge_carts(session: Session, merge: CartMerge) -> List[Cart]:
+    """Moves every line of the source cart into the target cart in one transaction and returns the target cart."""
+    if merge.source_user_id == merge.target_user_id:
+        raise HTTPException(status_code=422, detail="Cannot merge a cart into itself")
+    source_lines = select(literal(merge.target_user_id, Integer), Cart.product_id, Cart.quantity).where(
+        Cart.user_id == merge.source_user_id)
+    session.execute(upsert_lines(session, source_lines, increment=True))
+    session.execute(delete(Cart).where(Cart.user_id == merge.source_user_id))
+    bump_versions(session, [cart_key(merge.source_user_id), cart_key(merge.target_user_id)])
+    session.commit()
+    return user_lines(session, merge.target_user_id)
+
+def clear_cart(session: Session, user_id: int) -> dict:
+    """delete every line of a user's cart in one statement."""
+    deleted = session.execute(delete(Cart).where(Cart.user_id == user_id)).rowcount
+    bump_versions(session, [cart_key(user_id)])
+    session.commit()
+    return {"message": "Clear cart success", "deleted": deleted}
+
+def get_cart_line(session: Session, cart_id: int) -> Cart:
+    cart_item = session.get(Cart, cart_id)
+    if not cart_item:
+        raise HTTPException(status_code=404, detail="Cart not found")
+    return cart_item
+
+def cart_changes(data_update: CartUpdate) -> dict:
+    """The fields a cart update sets; a null quantity is rejected with 422 rather than written."""
+    cart_data = data_update.model_dump(exclude_unset=True)
+    if "quantity" in cart_data and cart_data["quantity"] is None:
+        raise HTTPException(status_code=422, detail="quantity cannot be null")
+    return cart_data
+
+def update_cart(session: Session, cart_id: int, data_update: CartUpdate) -> dict:
+    """update cart in the database."""
+    # Use the session to query the database
+    cart_item = session.get(Cart, cart_id)
+    if not cart_item:
+        raise HTTPException(status_code=404, detail="Cart not found")
+    cart_data = cart_changes(data_update)
+    cart_item.sqlmodel_update(cart_data)
+    session.add(cart_item)
+    bump_versions(session, [cart_key(cart_item.user_id)])
+    session.commit()
+    session.refresh(cart_item)
+
+    return {"message": "Update cart success"}
+
+def delete_cart(session: Session, cart_id: int) -> dict:
+    """delete cart from the database."""
+    # Use the session to query the database
+    cart_item = session.get(Cart, cart_id)
+    if not cart_item:
+        raise HTTPException(status_code=404, detail="Cart not found")
+
+    session.delete(cart_item)
+    bump_versions(session, [cart_key(cart_item.user_id)])
+    session.commit()
+
+    return {"message": "Delete cart success"}
+
+def user_cart(session: Session, user_id: int) -> List[Cart]:
+    """Retrieves every line of a user's cart in id order; carts over MAX_CART_LINES are rejected with 422."""
+    lines = session.query(Cart).filter(Cart.user_id == user_id).order_by(Cart.id).limit(MAX_CART_LINES + 1).all()
+    if len(lines) > MAX_CART_LINES:
+        raise HTTPException(status_code=422, detail=f"Carts are limited to {MAX_CART_LINES} lines")
+    return lines
+
+def claim_cart(session: Session, user_id: int) -> List[Cart]:
+    """
+    Removes every line of a user's cart in one transaction and returns them for checkout.
+    A concurrent checkout of the same cart deletes fewer lines than it read and is rejected with 409.
+    """
+    lines = user_cart(session, user_id)
+    if not lines:
+        raise HTTPException(status_code=422, detail="Cart is empty")
+    deleted = session.query(Cart).filter(Cart.id.in_([line.id for line in lines])).delete(synchronize_session=False)
+    if deleted != len(lines):
+        session.rollback()
+        raise HTTPException(status_code=409, detail="Cart is already being checked out")
+    bump_versions(session, [cart_key(user_id)])
+    session.commit()
+    return lines
+
+def restore_cart(session: Session, lines: List[Cart]) -> None:
+    """
+    Puts claimed cart lines back after a checkout that failed, adding to any line
+    the user created for the same product in the meantime.
+    """
+    session.execute(upsert_lines(session, [{"user_id": line.user_id, "product_id": line.product_id,
+                                            "quantity": line.quantity} for line in lines], increment=True))
+    bump_versions(session, [cart_key(line.user_id) for line in lines])
+    session.commit()
@@ -0,0 +1,464 @@
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Iterable, List, Optional, Tuple, Union
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, event, func, inspect, select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+import asyncio
+import fcntl
+import logging
+import math
+import os
+import time
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./database.db")
+# Comma separated read replica URLs, with the same driver as DATABASE_URL (default none)
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+# After a write, the client's reads go to the primary this long, so it reads its own writes
+DB_REPLICA_PIN_SECONDS = float(os.getenv("DB_REPLICA_PIN_SECONDS", "5"))
+# Replicas are probed at most this often, and left out while unreachable or lagging more than DB_REPLICA_MAX_LAG seconds
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "5"))
+DB_REPLICA_CHECK_TIMEOUT = float(os.getenv("DB_REPLICA_CHECK_TIMEOUT", "1"))
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "10"))
+
+logger = logging.getLogger(__name__)
+
+# An async driver in DATABASE_URL (sqlite+aiosqlite://, postgresql+asyncpg://) opts the service into async mode
+ASYNC_DRIVERS = {"aiosqlite", "asyncpg"}
+IS_ASYNC = make_url(DATABASE_URL).get_driver_name() in ASYNC_DRIVERS
+
+def env_bool(name: str, default: bool) -> bool:
+    """Reads a boolean flag such as DB_ECHO=true from the environment."""
+    return os.getenv(name, str(default)).strip().lower() in {"1", "true", "yes", "on"}
+
+def engine_options(url: str) -> dict:
+    """
+    Builds create_engine keyword arguments for the given URL from the environment:
+    DB_ECHO, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE and DB_POOL_PRE_PING.
+    Connect args are only applied to the dialect they belong to.
+    """
+    url = make_url(url)
+    options = {"echo": env_bool("DB_ECHO", False)}
+
+    is_sqlite = url.get_backend_name() == "sqlite"
+    if is_sqlite and url.get_driver_name() != "aiosqlite":
+        options["connect_args"] = {"check_same_thread": False}
+
+    # In-memory SQLite only exists on its one connection, so every thread has to share it
+    if is_sqlite and url.database in (None, "", ":memory:"):
+        options["poolclass"] = StaticPool
+    else:
+        options.update(
+            pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+            pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+            pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+            pool_pre_ping=env_bool("DB_POOL_PRE_PING", True),
+        )
+    return options
+
+def configure_sqlite(engine):
+    """
+    Enables WAL mode and the DB_SQLITE_SYNCHRONOUS pragma (NORMAL by default) on every new SQLite connection.
+    WAL lets readers run alongside the single writer, and NORMAL skips the fsync on every commit
+    while staying crash-safe in WAL mode.
+    """
+    synchronous = os.getenv("DB_SQLITE_SYNCHRONOUS", "NORMAL").upper()
+    if synchronous not in {"OFF", "NORMAL", "FULL", "EXTRA"}:
+        raise ValueError(f"Invalid DB_SQLITE_SYNCHRONOUS value: {synchronous}")
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragma(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={synchronous}")
+        cursor.close()
+
+class PoolMetrics:
+    """
+    Counts connection pool checkouts and how long callers waited for a connection,
+    so pool_size and max_overflow can be sized per service.
+    """
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        # Called with each checkout's wait time, e.g. to attribute it to the current request
+        self.listeners: List[Callable[[float], None]] = []
+
+    def track(self, pool):
+        """Wraps pool.connect so every checkout records its wait time."""
+        connect = pool.connect
+
+        def timed_connect():
+            start = time.perf_counter()
+            try:
+                connection = connect()
+            except PoolTimeoutError:
+                self.timeouts += 1
+                raise
+            waited = time.perf_counter() - start
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+            for listener in self.listeners:
+                listener(waited)
+            return connection
+
+        pool.connect = timed_connect
+
+    def snapshot(self, pool) -> dict:
+        """Returns the counters together with the pool's current occupancy."""
+        stats = {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_seconds_total": self.wait_seconds_total,
+            "wait_seconds_avg": self.wait_seconds_total / self.checkouts if self.checkouts else 0.0,
+            "wait_seconds_max": self.wait_seconds_max,
+        }
+        for name in ("size", "checkedout", "overflow", "checkedin"):
+            if hasattr(pool, name):
+                stats[name] = getattr(pool, name)()
+        return stats
+
+def build_engine(url: str, metrics: Optional[PoolMetrics] = None):
+    """Creates the sync or async engine for url with pool settings, SQLite pragmas and pool metrics."""
+    options = engine_options(url)
+    if IS_ASYNC:
+        engine = create_async_engine(url, **options)
+        sync_engine = engine.sync_engine
+    else:
+        engine = create_engine(url, **options)
+        sync_engine = engine
+
+    if sync_engine.dialect.name == "sqlite":
+        configure_sqlite(sync_engine)
+    (metrics or pool_metrics).track(sync_engine.pool)
+    return engine, sync_engine
+
+pool_metrics = PoolMetrics()
+engine, sync_engine = build_engine(DATABASE_URL)
+
+def pool_stats() -> dict:
+    """Returns connection pool checkout and wait metrics for this service."""
+    return pool_metrics.snapshot(sync_engine.pool)
+
+def replication_lag(connection) -> float:
+    """
+    Seconds a Postgres standby is behind its primary: 0 once it has replayed all the WAL it received,
+    and on servers that are not standbys. SQLite stand-ins are only checked to be readable.
+    """
+    if connection.dialect.name != "postgresql":
+        connection.execute(text("SELECT 1"))
+        return 0.0
+    return float(connection.execute(text(
+        "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+        "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END")).scalar())
+
+class Replica:
+    """A read replica's engine and health, which is probed on use at most every DB_REPLICA_CHECK_INTERVAL seconds."""
+    def __init__(self, url: str):
+        self.name = make_url(url).render_as_string(hide_password=True)
+        self.pool_metrics = PoolMetrics()
+        self.engine, self.sync_engine = build_engine(url, self.pool_metrics)
+        self.healthy = True
+        self.lag: Optional[float] = None
+        self.checked_at = -math.inf
+        self.sessions = 0
+        self.failures = 0
+
+    async def probe(self) -> float:
+        if IS_ASYNC:
+            async with self.engine.connect() as connection:
+                return await connection.run_sync(replication_lag)
+
+        def probe():
+            with self.engine.connect() as connection:
+                return replication_lag(connection)
+        return await run_in_threadpool(probe)
+
+    async def available(self) -> bool:
+        if time.monotonic() - self.checked_at >= DB_REPLICA_CHECK_INTERVAL:
+            # Stamped first, so concurrent requests keep the last verdict instead of probing too
+            self.checked_at = time.monotonic()
+            try:
+                self.lag = await asyncio.wait_for(self.probe(), DB_REPLICA_CHECK_TIMEOUT)
+            except Exception as e:
+                self.mark_down(e)
+            else:
+                if self.lag > DB_REPLICA_MAX_LAG and self.healthy:
+                    logger.warning("Read replica %s is %.1fs behind, reading from the primary", self.name, self.lag)
+                self.healthy = self.lag <= DB_REPLICA_MAX_LAG
+        return self.healthy
+
+    def mark_down(self, error: Exception):
+        """Leaves the replica out until its next probe, DB_REPLICA_CHECK_INTERVAL seconds from now."""
+        if self.healthy:
+            logger.warning("Read replica %s is unavailable, reading from the primary: %s", self.name, error)
+        self.healthy = False
+        self.checked_at = time.monotonic()
+        self.failures += 1
+
+    def stats(self) -> dict:
+        return {"replica": self.name, "healthy": self.healthy, "lag_seconds": self.lag, "sessions": self.sessions,
+                "failures": self.failures, "pool": self.pool_metrics.snapshot(self.sync_engine.pool)}
+
+# Requests that never write; any other method pins the client to the primary
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+PIN_COOKIE = "db_primary_until"
+
+class ReplicaRouter:
+    """
+    Picks where a read-only request reads from: the healthy replicas in turn, or the primary
+    when the client wrote in the last DB_REPLICA_PIN_SECONDS or no replica is healthy.
+    """
+    def __init__(self, replicas: List[Replica]):
+        self.replicas = replicas
+        self.turn = 0
+        self.pinned = 0
+        self.fallbacks = 0
+
+    @staticmethod
+    def is_pinned(request: Request) -> bool:
+        try:
+            return float(request.cookies.get(PIN_COOKIE, "0")) > time.time()
+        except ValueError:
+            return False
+
+    async def choose(self, request: Optional[Request] = None) -> Optional[Replica]:
+        """Returns the replica to read from, or None for the primary."""
+        if request is not None and self.is_pinned(request):
+            self.pinned += 1
+            return None
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[self.turn % len(self.replicas)]
+            self.turn += 1
+            if await replica.available():
+                replica.sessions += 1
+                return replica
+        self.fallbacks += 1
+        return None
+
+    def stats(self) -> dict:
+        return {"enabled": True, "pinned_reads": self.pinned, "primary_fallbacks": self.fallbacks,
+                "replicas": [replica.stats() for replica in self.replicas]}
+
+replica_router = ReplicaRouter([Replica(url) for url in DATABASE_REPLICA_URLS]) if DATABASE_REPLICA_URLS else None
+
+# Engines a service opens on further databases of its own, such as order shards, with their pool metrics
+extra_engines: List[Tuple[object, PoolMetrics]] = []
+
+def all_engines() -> List[Tuple[object, PoolMetrics]]:
+    """Every sync engine of the service with its pool metrics, the primary's first, for instrumentation."""
+    replicas = replica_router.replicas if replica_router is not None else []
+    return ([(sync_engine, pool_metrics)] + [(replica.sync_engine, replica.pool_metrics) for replica in replicas]
+            + extra_engines)
+
+def replica_stats() -> dict:
+    """Returns the replicas' health and how reads were routed."""
+    return replica_router.stats() if replica_router is not None else {"enabled": False}
+
+async def read_engine():
+    """The engine of a healthy replica, or the primary's, for reads outside of a request's session such as exports."""
+    replica = await replica_router.choose() if replica_router is not None else None
+    return replica.engine if replica is not None else engine
+
+class PrimaryPinMiddleware:
+    """
+    Plain ASGI middleware setting a cookie on every successful write response, which sends the client's
+    reads to the primary for DB_REPLICA_PIN_SECONDS, so it reads its own writes despite replication lag.
+    """
+    def __init__(self, app, pin_seconds: float = DB_REPLICA_PIN_SECONDS):
+        self.app = app
+        self.pin_seconds = pin_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_pinned(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                cookie = (f"{PIN_COOKIE}={time.time() + self.pin_seconds:.3f}; Max-Age={math.ceil(self.pin_seconds)}; "
+                          "Path=/; HttpOnly; SameSite=Lax")
+                message = dict(message, headers=list(message.get("headers", [])) + [(b"set-cookie", cookie.encode())])
+            await send(message)
+
+        await self.app(scope, receive, send_pinned)
+
+def route_reads(app: FastAPI):
+    """Mounts the primary pin on app when read replicas are configured; read handlers opt in with get_read_session."""
+    if replica_router is not None:
+        app.add_middleware(PrimaryPinMiddleware)
+
+DBSession = Union[Session, AsyncSession]
+
+if IS_ASYNC:
+    async def get_session():
+        """
+        Dependency function to get a database session.
+        It creates an AsyncSession and ensures it's closed after the request.
+        """
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            yield session
+else:
+    def get_session():
+        """
+        Dependency function to get a database session.
+        It creates a session and ensures it's closed after the request.
+        """
+        with Session(engine, expire_on_commit=False) as session:
+            yield session
+
+async def get_read_session(request: Request):
+    """
+    Dependency function to get a database session for a handler that only reads.
+    It reads from a healthy replica unless the client wrote recently, and from the primary otherwise.
+    """
+    replica = await replica_router.choose(request) if replica_router is not None else None
+    bind = replica.engine if replica is not None else engine
+    session = AsyncSession(bind, expire_on_commit=False) if IS_ASYNC else Session(bind, expire_on_commit=False)
+    try:
+        yield session
+    except DBAPIError as e:
+        # The request fails, but later ones skip the replica until its next probe
+        if replica is not None and e.connection_invalidated:
+            replica.mark_down(e)
+        raise
+    finally:
+        if IS_ASYNC:
+            await session.close()
+        else:
+            await run_in_threadpool(session.close)
+
+async def run_db(session: DBSession, fn: Callable, *args, **kwargs):
+    """
+    Runs fn(session, *args, **kwargs) with a synchronous Session without blocking the event loop.
+    In async mode fn runs on the AsyncSession's own connection through run_sync,
+    otherwise it runs in the threadpool exactly as a sync handler would.
+    """
+    if IS_ASYNC:
+        return await session.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, session, *args, **kwargs)
+
+async def run_in_session(fn: Callable, *args, **kwargs):
+    """Runs fn(session, *args, **kwargs) in a new session outside of a request, e.g. from a background task."""
+    if IS_ASYNC:
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            return await session.run_sync(fn, *args, **kwargs)
+
+    def run():
+        with Session(engine, expire_on_commit=False) as session:
+            return fn(session, *args, **kwargs)
+    return await run_in_threadpool(run)
+
+def reconcile_indexes(connection, tables: Iterable[Table]):
+    """
+    Brings the indexes of existing tables in line with their models, which create_all does not do:
+    creates the declared indexes that are missing and drops the ix_ indexes the models no longer declare.
+    Other indexes, such as those behind unique constraints, are left alone.
+    """
+    inspector = inspect(connection)
+    for table in tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        declared = {index.name: index for index in table.indexes}
+        for name in sorted(existing - declared.keys()):
+            if name.startswith("ix_"):
+                connection.execute(text(f"DROP INDEX {connection.dialect.identifier_preparer.quote(name)}"))
+        for name, index in sorted(declared.items()):
+            if name not in existing:
+                index.create(connection)
+
+class Migration:
+    """
+    One versioned schema change, applied by apply(connection).
+    Version 1 creates missing tables from the current models, so later steps must tolerate finding their change already made.
+    """
+    def __init__(self, version: int, name: str, apply: Callable):
+        self.version = version
+        self.name = name
+        self.apply = apply
+
+schema_migrations = Table(
+    "schema_migrations", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String(200), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+# Key of the Postgres advisory lock held while migrating; any constant shared by every replica works
+MIGRATION_LOCK_KEY = 0x6d696772
+
+def schema_version(connection) -> int:
+    """Returns the latest applied migration in a single query, or 0 when nothing was migrated yet."""
+    try:
+        return connection.execute(select(func.max(schema_migrations.c.version))).scalar() or 0
+    except DBAPIError:
+        # No schema_migrations table yet
+        connection.rollback()
+        return 0
+
+@contextmanager
+def migration_lock(connection):
+    """
+    Lets one process at a time migrate the database: a Postgres advisory lock,
+    or for SQLite an exclusive lock on a file next to the database, since SQLite lives on one host.
+    """
+    url = connection.engine.url
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        try:
+            yield
+        finally:
+            # A failed migration leaves its transaction aborted; the unlock needs a usable one
+            connection.rollback()
+            connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            connection.commit()
+    elif connection.dialect.name == "sqlite" and url.database not in (None, "", ":memory:"):
+        with open(f"{url.database}.migrate.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+    else:
+        yield
+
+def apply_migrations(connection, migrations: List[Migration]) -> int:
+    """
+    Applies the migrations newer than the database's version, each in its own transaction, and returns the version.
+    A database already at the last version costs one query; otherwise the work happens under migration_lock,
+    so replicas starting together apply every migration once.
+    """
+    head = migrations[-1].version
+    if schema_version(connection) >= head:
+        return head
+
+    with migration_lock(connection):
+        schema_migrations.create(connection, checkfirst=True)
+        connection.commit()
+        # Another replica may have migrated while this one waited for the lock
+        current = schema_version(connection)
+        for migration in migrations:
+            if migration.version <= current:
+                continue
+            started = time.perf_counter()
+            migration.apply(connection)
+            connection.execute(schema_migrations.insert().values(
+                version=migration.version, name=migration.name, applied_at=datetime.utcnow()))
+            connection.commit()
+            logger.info("Applied migration %d (%s) in %.2fs", migration.version, migration.name,
+                        time.perf_counter() - started)
+    return max(head, current)
+
+async def run_migrations(migrations: List[Migration]) -> int:
+    """Brings the database schema up to the last of migrations on a connection of its own."""
+    if IS_ASYNC:
+        async with engine.connect() as conn:
+            return await conn.run_sync(apply_migrations, migrations)
+    with engine.connect() as conn:
+        return apply_migrations(conn, migrations)
@@ -1,17 +1,22 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException
-from sqlmodel import SQLModel, create_engine, Session
+from fastapi import FastAPI, APIRouter, Depends, Query, Request, Response
 from contextlib import asynccontextmanager
-from typing import List
-from models import Cart, CartUpdate
-import os
-
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./database.db")
-
-engine = create_engine(DATABASE_URL, echo=True, connect_args={"check_same_thread": False})
-
-def create_db_and_tables():
-    """Creates the database tables based on your SQLModel definitions."""
-    SQLModel.metadata.create_all(engine)
+from typing import List, Optional
+from models import Cart, CartUpdate, CartBulkRequest, CartMerge, CartSummary, CheckoutRequest, CheckoutResult
+from pagination import Page, DEFAULT_LIMIT, MAX_LIMIT
+from database import (get_session, get_read_session, route_reads, run_db, run_migrations, pool_stats,
+                      replica_stats, DBSession)
+from migrations import MIGRATIONS
+from instrumentation import instrument
+from admission import admission_control, admission_stats
+from utils import close_clients
+from checkout import OrderPending, cart_summary, order_reconciler, place_order
+from cart_store import cart_store, bypassing_store
+from versions import check_not_modified, is_fresh, make_etag, not_modified, tagged, versioned
+import crud
+
+async def create_db_and_tables():
+    """Brings the database schema up to date by applying any pending migrations."""
+    await run_migrations(MIGRATIONS)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -19,67 +24,135 @@ async def lifespan(app: FastAPI):
     Function that runs on application startup and shutdown.
     It's the perfect place to create the database tables.
     """
-    create_db_and_tables()
+    await create_db_and_tables()
+    if cart_store is not None:
+        cart_store.start()
     yield
+    if cart_store is not None:
+        # Writes every pending cart change before the process exits
+        await cart_store.close()
+    await order_reconciler.close()
+    await close_clients()
 
 app = FastAPI(title="Cart Service", lifespan=lifespan)
-
-def get_session():
-    """
-    Dependency function to get a database session.
-    It creates a session and ensures it's closed after the request.
-    """
-    with Session(engine) as session:
-        yield session
+admission_control(app, critical=["POST /cart/checkout"])
+instrument(app)
+route_reads(app)
+
+@app.get("/metrics/pool")
+async def get_pool_stats():
+    """Returns connection pool checkout and wait metrics, used to size DB_POOL_SIZE per service."""
+    return pool_stats()
+
+@app.get("/metrics/replicas")
+async def get_replica_stats():
+    """Returns the read replicas' health and lag, and how many reads were pinned to or fell back to the primary."""
+    return replica_stats()
+
+@app.get("/metrics/admission")
+async def get_admission_stats():
+    """Returns the requests admitted, queued, shed and rate limited by priority, and the slots in use."""
+    return admission_stats()
+
+@app.get("/metrics/checkout")
+async def get_checkout_stats():
+    """Returns the checkouts whose order is being confirmed, and how those that settled ended."""
+    return order_reconciler.stats()
+
+@app.get("/metrics/cart-store")
+async def get_cart_store_stats():
+    """Returns the in-memory cart store's size, hit, flush and eviction counters."""
+    return cart_store.stats() if cart_store is not None else {"enabled": False}
 
 router = APIRouter()
 
-@router.get("/cart", response_model=List[Cart])
-def get_users(user_id: int, session: Session = Depends(get_session)):
-    """Retrieves list of cart from the database, filtered by user_id"""
-    # Use the session to query the database
-    query = session.query(Cart)
-    if user_id is not None:
-        query = query.filter(Cart.user_id == user_id)
-    cart_list = query.all()
-    return cart_list
+@router.get("/cart", response_model=Page[Cart])
+async def get_users(request: Request,
+                    response: Response,
+                    user_id: int,
+                    cursor: Optional[str] = None,
+                    limit: int = Query(default=DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+                    session: DBSession = Depends(get_read_session)):
+    """
+    Retrieves a page of cart lines from the database, filtered by user_id.
+    Pages carry an ETag; a poll sending it back in If-None-Match gets a 304 while the cart is unchanged.
+    """
+    if cart_store is not None:
+        etag = make_etag(request, await cart_store.version(user_id))
+        if is_fresh(request, etag):
+            return not_modified(etag)
+        return tagged(await cart_store.list_cart(user_id, cursor, limit), response, etag)
+    keys = [crud.cart_key(user_id)]
+    unchanged = await check_not_modified(request, session, keys)
+    if unchanged is not None:
+        return unchanged
+    token, page = await run_db(session, versioned, keys, crud.list_cart, user_id, cursor, limit)
+    return tagged(page, response, make_etag(request, token))
+
+@router.get("/cart/summary", response_model=CartSummary)
+async def get_cart_summary(user_id: int, session: DBSession = Depends(get_read_session)):
+    """Retrieves a user's whole cart priced from the product catalog, with the totals computed server-side."""
+    if cart_store is not None:
+        lines = await cart_store.lines(user_id)
+    else:
+        lines = await run_db(session, crud.user_cart, user_id)
+    return await cart_summary(user_id, lines)
+
+@router.post("/cart/checkout", response_model=CheckoutResult)
+async def checkout_cart(request: CheckoutRequest, session: DBSession = Depends(get_session)):
+    """
+    Places an order for a user's whole cart and clears it; if the order fails the cart is put back.
+    A 504 means the order's outcome is not known yet: it is confirmed in the background and the cart
+    is only put back if the order turns out to be rejected.
+    """
+    async with bypassing_store(request.user_id):
+        lines = await run_db(session, crud.claim_cart, request.user_id)
+        try:
+            return await place_order(request.user_id, lines)
+        except OrderPending:
+            raise
+        except Exception:
+            await run_db(session, crud.restore_cart, lines)
+            raise
 
 @router.post("/cart", response_model=Cart)
-def add_cart(cart_item: Cart, session: Session = Depends(get_session)):
-    """add cart into the database."""
-    # Use the session to query the database
-    session.add(cart_item)
-    session.commit()
-    session.refresh(cart_item)
-    return cart_item
+async def add_cart(cart_item: Cart, session: DBSession = Depends(get_session)):
+    """add cart into the database; adding a product already in the cart increments its quantity."""
+    if cart_store is not None:
+        return await cart_store.add(cart_item)
+    return await run_db(session, crud.add_cart, cart_item)
+
+@router.post("/cart/bulk", response_model=List[Cart])
+async def bulk_update_cart(request: CartBulkRequest, session: DBSession = Depends(get_session)):
+    """Applies many add, set and remove operations to a cart in one transaction and returns the cart."""
+    async with bypassing_store(request.user_id):
+        return await run_db(session, crud.bulk_update_cart, request)
+
+@router.post("/cart/merge", response_model=List[Cart])
+async def merge_carts(merge: CartMerge, session: DBSession = Depends(get_session)):
+    """Moves every line of one cart, e.g. a guest's at login, into another and returns the merged cart."""
+    async with bypassing_store(merge.source_user_id, merge.target_user_id):
+        return await run_db(session, crud.merge_carts, merge)
 
 @router.put("/cart", response_model=Cart)
-def update_cart(cart_id: int, data_update: CartUpdate, session: Session = Depends(get_session)):
+async def update_cart(cart_id: int, data_update: CartUpdate, session: DBSession = Depends(get_session)):
     """update product in the database."""
-    # Use the session to query the database
-    cart_item = session.get(Cart, cart_id)
-    if not cart_item:
-        raise HTTPException(status_code=404, detail="Cart not found")
-    cart_data = data_update.model_dump(exclude_unset=True)
-    cart_item.sqlmodel_update(cart_data)
-    session.add(cart_item)
-    session.commit()
-    session.refresh(cart_item)
+    if cart_store is not None:
+        return await cart_store.update(cart_id, data_update)
+    return await run_db(session, crud.update_cart, cart_id, data_update)
 
-    return {"message": "Update cart success"}
 
+@router.delete("/cart/clear")
+async def clear_cart(user_id: int, session: DBSession = Depends(get_session)):
+    """delete every line of a user's cart."""
+    async with bypassing_store(user_id):
+        return await run_db(session, crud.clear_cart, user_id)
 
 @router.delete("/cart", response_model=Cart)
-def delete_cart(cart_id: int, session: Session = Depends(get_session)):
+async def delete_cart(cart_id: int, session: DBSession = Depends(get_session)):
     """delete cart from the database."""
-    # Use the session to query the database
-    cart_item = session.get(Cart, cart_id)
-    if not cart_item:
-        raise HTTPException(status_code=404, detail="Cart not found")
-
-    session.delete(cart_item)
-    session.commit()
-
-    return {"message": "Delete cart success"}
+    if cart_store is not None:
+        return await cart_store.delete(cart_id)
+    return await run_db(session, crud.delete_cart, cart_id)
 
-app.include_router(router, tags=["cart"])
\ No newline at end of file
+app.include_router(router, tags=["cart"])
@@ -0,0 +1,30 @@
+from sqlalchemy import delete, func, select, update
+from sqlmodel import SQLModel
+from database import Migration, reconcile_indexes
+from models import Cart, CollectionVersion
+
+def create_tables(connection):
+    SQLModel.metadata.create_all(connection)
+
+def unique_cart_lines(connection):
+    """Merges the duplicate lines of a product in a cart into its oldest line, then adds the unique index."""
+    cart = Cart.__table__
+    duplicates = connection.execute(
+        select(cart.c.user_id, cart.c.product_id, func.min(cart.c.id).label("keep"),
+               func.sum(cart.c.quantity).label("quantity"))
+        .group_by(cart.c.user_id, cart.c.product_id).having(func.count() > 1)).all()
+    for line in duplicates:
+        connection.execute(update(cart).where(cart.c.id == line.keep).values(quantity=line.quantity))
+        connection.execute(delete(cart).where(cart.c.user_id == line.user_id, cart.c.product_id == line.product_id,
+                                              cart.c.id != line.keep))
+    reconcile_indexes(connection, [cart])
+
+def version_stamps(connection):
+    SQLModel.metadata.create_all(connection, tables=[CollectionVersion.__table__])
+
+# Append new migrations with the next version number; applied ones must never change
+MIGRATIONS = [
+    Migration(1, "create tables", create_tables),
+    Migration(2, "unique cart lines", unique_cart_lines),
+    Migration(3, "version stamps", version_stamps),
+]
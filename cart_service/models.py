@@ -1,18 +1,109 @@
-from typing import Optional
-from sqlmodel import SQLModel, Field
+from enum import Enum
+from typing import List, Optional
+from sqlmodel import SQLModel, Field, Index
 
 class Cart(SQLModel, table=True):
     """
     Represents a cart in the product service database.
+    A cart holds one line per product; adding the product again increments its quantity.
     """
+    __table_args__ = (Index("ix_cart_user_id_product_id", "user_id", "product_id", unique=True),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    product_id: int = Field(index=True)
-    quantity: int = Field(default=1, index=True)
-    user_id: int = Field(index=True)
+    product_id: int
+    quantity: int = Field(default=1)
+    user_id: int
 
 class CartUpdate(SQLModel):
     """
     Represents the data structure for updating a cart.
     All fields are optional to allow partial updates.
     """
-    quantity: Optional[int] = None
\ No newline at end of file
+    quantity: Optional[int] = None
+
+class CollectionVersion(SQLModel, table=True):
+    """
+    A version stamp bumped in the same transaction as every write to the data it covers, see versions.py.
+    GET handlers derive their ETags from the stamps, so an unchanged poll is answered without reading the data.
+    """
+    key: str = Field(primary_key=True, max_length=100)
+    version: int = Field(default=0)
+
+class CartOperationType(str, Enum):
+    add = "add"
+    set = "set"
+    remove = "remove"
+
+class CartOperation(SQLModel):
+    """
+    Represents one change to a cart line: add increments its quantity, set replaces it
+    (0 removes the line) and remove deletes the line.
+    """
+    op: CartOperationType
+    product_id: int
+    quantity: int = Field(default=1, ge=0)
+
+class CartBulkRequest(SQLModel):
+    """
+    Represents many changes to one user's cart, applied in order in a single transaction.
+    """
+    user_id: int
+    operations: List[CartOperation] = Field(min_length=1, max_length=1000)
+
+class CartMerge(SQLModel):
+    """
+    Represents moving every line of one cart, e.g. a guest's at login, into another.
+    Quantities of products in both carts add up.
+    """
+    source_user_id: int
+    target_user_id: int
+
+class CartLine(SQLModel):
+    """
+    Represents a cart line priced from the product catalog.
+    Lines whose product left the catalog have no name or price; available is False for them
+    and for lines asking for more than the stock on hand.
+    """
+    id: int
+    product_id: int
+    quantity: int
+    name: Optional[str] = None
+    image_url: Optional[str] = None
+    price: Optional[float] = None
+    stock: Optional[int] = None
+    subtotal: float = 0.0
+    available: bool = False
+
+class CartSummary(SQLModel):
+    """
+    Represents a user's whole cart, every line priced in one catalog lookup, with totals computed server-side.
+    The totals cover the available lines only.
+    """
+    user_id: int
+    lines: List[CartLine] = Field(default_factory=list)
+    item_count: int = 0
+    total_amount: float = 0.0
+    checkout_ready: bool = False
+
+class CheckoutRequest(SQLModel):
+    """
+    Represents a request to turn a user's cart into an order.
+    """
+    user_id: int
+
+class CheckoutItem(SQLModel):
+    product_id: int
+    quantity: int
+    price: float
+    subtotal: float
+
+class CheckoutResult(SQLModel):
+    """
+    Represents the order placed from a cart; the cart lines it was made of are gone.
+    """
+    order_id: int
+    user_id: int
+    order_status: str
+    payment_status: str
+    total_amount: float
+    items: List[CheckoutItem] = Field(default_factory=list)
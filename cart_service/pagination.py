@@ -0,0 +1,55 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Generic, List, Optional, TypeVar
+from fastapi import HTTPException
+from pydantic import BaseModel
+from sqlalchemy import DateTime, tuple_
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+T = TypeVar("T")
+
+class Page(BaseModel, Generic[T]):
+    """
+    Represents one page of a list endpoint.
+    next_cursor is None when there are no more rows to fetch.
+    """
+    items: List[T]
+    next_cursor: Optional[str] = None
+
+def encode_cursor(values: list) -> str:
+    """Encodes the key values of the last row of a page into an opaque cursor."""
+    raw = json.dumps([value.isoformat() if isinstance(value, datetime) else value for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str, keys: list) -> list:
+    """Decodes a cursor back into key values, raising a 400 if it does not match the keys."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError("cursor does not match the sort keys")
+        return [datetime.fromisoformat(value) if isinstance(key.type, DateTime) else value
+                for key, value in zip(keys, values)]
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def paginate(query, keys: list, limit: int, cursor: Optional[str] = None) -> Page:
+    """
+    Applies keyset pagination to a query, newest rows first.
+    The keys must be unique together (end with the primary key) and should be backed by an index,
+    so every page is a bounded index range scan no matter how deep the client pages.
+    """
+    if cursor:
+        query = query.filter(tuple_(*keys) < tuple_(*decode_cursor(cursor, keys)))
+
+    rows = query.order_by(*[key.desc() for key in keys]).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([getattr(rows[-1], key.key) for key in keys])
+
+    return Page(items=rows, next_cursor=next_cursor)
@@ -0,0 +1,149 @@
+from collections import defaultdict
+from typing import Dict, List, Optional
+from sqlmodel import SQLModel
+from models import ProcessedEvent, DeliveryStatus
+from events import Event, Broker
+from database import run_in_session
+import asyncio
+import crud
+import logging
+import os
+
+NOTIFICATION_GROUP = os.getenv("NOTIFICATION_GROUP", "notification")
+NOTIFICATION_CONCURRENCY = int(os.getenv("NOTIFICATION_CONCURRENCY", "50"))
+NOTIFICATION_BATCH_SIZE = int(os.getenv("NOTIFICATION_BATCH_SIZE", "200"))
+NOTIFICATION_RETRIES = int(os.getenv("NOTIFICATION_RETRIES", "3"))
+# Simulated gateway latency of the log notifier, in seconds
+NOTIFICATION_LATENCY = float(os.getenv("NOTIFICATION_LATENCY", "0"))
+# How long handled events are remembered; a redelivery older than this would be sent again
+NOTIFICATION_RETENTION = float(os.getenv("NOTIFICATION_RETENTION", "604800"))
+
+logger = logging.getLogger(__name__)
+
+class Notification(SQLModel):
+    channel: str
+    recipient: str
+    subject: str
+    body: str
+
+def render(event: Event) -> List[Notification]:
+    """Builds the notifications to send for an event; topics without notifications return an empty list."""
+    payload = event.payload
+    if event.topic == "order.placed":
+        recipient = f"user:{payload['user_id']}"
+        subject = f"Order #{payload['id']} received"
+        body = f"We received your order #{payload['id']} of {len(payload.get('items', []))} items, total {payload['total_amount']:.2f}."
+        return [Notification(channel="email", recipient=recipient, subject=subject, body=body),
+                Notification(channel="sms", recipient=recipient, subject=subject, body=subject)]
+    if event.topic == "order.updated":
+        subject = f"Order #{payload['id']} is {payload['order_status']}"
+        body = f"Your order #{payload['id']} is {payload['order_status']}, payment {payload['payment_status']}."
+        return [Notification(channel="email", recipient=f"user:{payload['user_id']}", subject=subject, body=body)]
+    if event.topic in ("payment.created", "payment.updated"):
+        subject = f"Payment for order #{payload['order_id']} is {payload['payment_status']}"
+        body = f"Payment #{payload['id']} of {payload['total_amount']:.2f} is {payload['payment_status']}."
+        return [Notification(channel="email", recipient=f"order:{payload['order_id']}", subject=subject, body=body)]
+    return []
+
+class Notifier:
+    """Interface of the email/SMS gateway."""
+    async def send(self, notification: Notification):
+        raise NotImplementedError
+
+class LogNotifier(Notifier):
+    """Logs notifications instead of sending them, optionally waiting latency seconds like a real gateway."""
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    async def send(self, notification: Notification):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        logger.info("%s to %s: %s", notification.channel, notification.recipient, notification.subject)
+
+class NotificationConsumer:
+    """
+    Consumes events from the broker and sends their notifications, up to concurrency at a time.
+    Events with the same key (e.g. one order) are handled in order; different keys run concurrently.
+    The broker position is committed only after a batch is recorded as processed, so a crash redelivers it
+    and the processed-event table keeps the redelivered events from being sent twice.
+    """
+    def __init__(self, broker: Broker, notifier: Notifier, group: str = NOTIFICATION_GROUP,
+                 concurrency: int = NOTIFICATION_CONCURRENCY, batch_size: int = NOTIFICATION_BATCH_SIZE,
+                 retries: int = NOTIFICATION_RETRIES, backoff: float = 0.5,
+                 retention: float = NOTIFICATION_RETENTION):
+        self.broker = broker
+        self.notifier = notifier
+        self.group = group
+        self.batch_size = batch_size
+        self.retries = retries
+        self.backoff = backoff
+        self.retention = retention
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.received = 0
+        self.duplicates = 0
+        self.sent = 0
+        self.failed = 0
+        self.errors = 0
+
+    async def deliver(self, event: Event) -> ProcessedEvent:
+        """Sends an event's notifications, retrying with backoff; gives up after retries attempts."""
+        error: Optional[Exception] = None
+        for attempt in range(1, self.retries + 1):
+            try:
+                async with self.semaphore:
+                    for notification in render(event):
+                        await self.notifier.send(notification)
+                self.sent += 1
+                return ProcessedEvent(event_id=event.id, topic=event.topic, attempts=attempt)
+            except Exception as e:
+                error = e
+                if attempt < self.retries:
+                    await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+
+        self.failed += 1
+        logger.error("Giving up on event %s (%s): %s", event.id, event.topic, error)
+        return ProcessedEvent(event_id=event.id, topic=event.topic, status=DeliveryStatus.failed,
+                              attempts=self.retries, error=str(error))
+
+    async def deliver_in_order(self, events: List[Event]) -> List[ProcessedEvent]:
+        return [await self.deliver(event) for event in events]
+
+    async def handle_batch(self, events: List[Event]):
+        """Sends the notifications of a batch, skipping events that were already handled."""
+        self.received += len(events)
+        unique: Dict[str, Event] = {event.id: event for event in events}
+        done = await run_in_session(crud.processed_ids, list(unique))
+        pending = [event for event_id, event in unique.items() if event_id not in done]
+        self.duplicates += len(events) - len(pending)
+        if not pending:
+            return
+
+        by_key: Dict[str, List[Event]] = defaultdict(list)
+        for event in pending:
+            by_key[f"{event.topic.split('.')[0]}:{event.key}"].append(event)
+        results = await asyncio.gather(*[self.deliver_in_order(key_events) for key_events in by_key.values()])
+        await run_in_session(crud.mark_processed, [processed for key_results in results for processed in key_results])
+
+    async def run(self):
+        last_purge = 0.0
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                events = await self.broker.fetch(self.group, self.batch_size, timeout=1.0)
+                if events:
+                    await self.handle_batch(events)
+                    await self.broker.commit(self.group)
+                if loop.time() - last_purge >= self.retention / 24:
+                    await run_in_session(crud.purge_processed, self.retention)
+                    last_purge = loop.time()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Not committing leaves the batch to be fetched again
+                self.errors += 1
+                logger.exception("Failed to handle notification events")
+                await asyncio.sleep(1.0)
+
+    def stats(self) -> dict:
+        return {"received": self.received, "duplicates": self.duplicates, "sent": self.sent,
+                "failed": self.failed, "errors": self.errors}
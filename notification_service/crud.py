@@ -0,0 +1,33 @@
+from datetime import datetime, timedelta
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session, select
+from typing import Iterable, List, Set
+from models import ProcessedEvent
+
+def processed_ids(session: Session, event_ids: List[str]) -> Set[str]:
+    """Returns which of the given events have already been handled."""
+    return set(session.exec(select(ProcessedEvent.event_id).where(ProcessedEvent.event_id.in_(event_ids))).all())
+
+def mark_processed(session: Session, processed: Iterable[ProcessedEvent]):
+    """
+    Records handled events in one transaction and one statement.
+    Events another consumer recorded first are left as they are, which keeps this idempotent.
+    """
+    rows = [event.model_dump() for event in processed]
+    if not rows:
+        return
+    insert = postgresql_insert if session.get_bind().dialect.name == "postgresql" else sqlite_insert
+    session.execute(insert(ProcessedEvent.__table__).values(rows).on_conflict_do_nothing(index_elements=["event_id"]))
+    session.commit()
+
+def purge_processed(session: Session, retention: float) -> int:
+    """Deletes the records of events handled more than retention seconds ago."""
+    result = session.execute(
+        delete(ProcessedEvent)
+        .where(ProcessedEvent.processed_at < datetime.utcnow() - timedelta(seconds=retention))
+        .execution_options(synchronize_session=False)
+    )
+    session.commit()
+    return result.rowcount
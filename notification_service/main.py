@@ -0,0 +1,42 @@
+from fastapi import FastAPI
+from contextlib import asynccontextmanager, suppress
+from database import run_migrations, pool_stats
+from migrations import MIGRATIONS
+from instrumentation import instrument
+from events import broker
+from consumer import NotificationConsumer, LogNotifier, NOTIFICATION_LATENCY
+import asyncio
+
+consumer = NotificationConsumer(broker, LogNotifier(NOTIFICATION_LATENCY)) if broker is not None else None
+
+async def create_db_and_tables():
+    """Brings the database schema up to date by applying any pending migrations."""
+    await run_migrations(MIGRATIONS)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Function that runs on application startup and shutdown.
+    Creates the database tables and runs the event consumer in the background.
+    """
+    await create_db_and_tables()
+    task = asyncio.create_task(consumer.run()) if consumer is not None else None
+    yield
+    if task is not None:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+        await broker.close()
+
+app = FastAPI(title="Notification Service", lifespan=lifespan)
+instrument(app)
+
+@app.get("/metrics/pool")
+async def get_pool_stats():
+    """Returns connection pool checkout and wait metrics, used to size DB_POOL_SIZE per service."""
+    return pool_stats()
+
+@app.get("/metrics/consumer")
+async def get_consumer_stats():
+    """Returns how many events the consumer received, skipped as duplicates, sent and gave up on."""
+    return consumer.stats() if consumer is not None else {"enabled": False}
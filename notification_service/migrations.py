@@ -0,0 +1,11 @@
+from sqlmodel import SQLModel
+from database import Migration
+import models  # noqa: F401 registers the tables
+
+def create_tables(connection):
+    SQLModel.metadata.create_all(connection)
+
+# Append new migrations with the next version number; applied ones must never change
+MIGRATIONS = [
+    Migration(1, "create tables", create_tables),
+]
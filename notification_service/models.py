@@ -0,0 +1,20 @@
+from datetime import datetime
+from enum import Enum
+from typing import Optional
+from sqlmodel import SQLModel, Field
+
+class DeliveryStatus(str, Enum):
+    sent = "sent"
+    failed = "failed"
+
+class ProcessedEvent(SQLModel, table=True):
+    """
+    Records every event the consumer has handled, keyed by the event id,
+    so a redelivered event is recognised and its notification is not sent twice.
+    """
+    event_id: str = Field(primary_key=True)
+    topic: str = Field(index=True)
+    status: DeliveryStatus = Field(default=DeliveryStatus.sent)
+    attempts: int = Field(default=1)
+    error: Optional[str] = Field(default=None)
+    processed_at: datetime = Field(default_factory=datetime.utcnow, index=True)
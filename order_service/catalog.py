@@ -0,0 +1,89 @@
+from collections import defaultdict
+from typing import Dict, Iterable, List
+from fastapi import HTTPException
+from models import OrderRequest
+from utils import call_service
+import os
+import time
+
+# Empty PRODUCT_SERVICE_URL disables basket validation, e.g. when running the order service on its own
+PRODUCT_SERVICE_URL = os.getenv("PRODUCT_SERVICE_URL", "http://product_service:8000")
+PRICE_CACHE_TTL = float(os.getenv("PRICE_CACHE_TTL", "5"))
+# Matches the product service's limit on ids per lookup request
+LOOKUP_BATCH_SIZE = 1000
+
+class PriceCache:
+    """
+    Short-lived local cache of product price and stock, keyed by product id.
+    Entries live for ttl seconds, so repeated checkouts of popular products skip the lookup call.
+    """
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.entries: Dict[int, tuple] = {}
+
+    def get_many(self, product_ids: Iterable[int]):
+        """Returns the fresh cached products and the ids that still have to be looked up."""
+        now = time.monotonic()
+        found, missing = {}, []
+        for product_id in product_ids:
+            entry = self.entries.get(product_id)
+            if entry is not None and entry[0] > now:
+                found[product_id] = entry[1]
+            else:
+                missing.append(product_id)
+        return found, missing
+
+    def put_many(self, products: Iterable[dict]):
+        expires_at = time.monotonic() + self.ttl
+        for product in products:
+            self.entries[product["id"]] = (expires_at, product)
+        if len(self.entries) > 10000:
+            now = time.monotonic()
+            self.entries = {key: entry for key, entry in self.entries.items() if entry[0] > now}
+
+price_cache = PriceCache(PRICE_CACHE_TTL)
+
+async def lookup_products(product_ids: Iterable[int]) -> Dict[int, dict]:
+    """Resolves products by id from the price cache, fetching the misses with bulk lookup calls."""
+    found, missing = price_cache.get_many(set(product_ids))
+    for start in range(0, len(missing), LOOKUP_BATCH_SIZE):
+        try:
+            products = await call_service(f"{PRODUCT_SERVICE_URL}/api/v1/products/lookup", method="POST",
+                                          data={"product_ids": missing[start:start + LOOKUP_BATCH_SIZE]},
+                                          idempotent=True)
+        except RuntimeError as e:
+            raise HTTPException(status_code=503, detail=f"Product service unavailable: {str(e)}")
+        price_cache.put_many(products)
+        found.update({product["id"]: product for product in products})
+    return found
+
+async def validate_orders(orders_data: List[OrderRequest]):
+    """
+    Checks every item of every order against the product catalog in a single lookup call.
+    Item prices are replaced by the catalog price, unknown products are rejected with 422
+    and baskets asking for more than the stock on hand with 409. Orders carrying a reservation
+    already hold their stock, which the reservation took off the stock on hand, so only their prices are checked.
+    """
+    if not PRODUCT_SERVICE_URL:
+        return
+
+    items = [item for order_data in orders_data for item in order_data.items]
+    if not items:
+        return
+    products = await lookup_products(item.product_id for item in items)
+
+    unknown = sorted({item.product_id for item in items if item.product_id not in products})
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown products: {unknown}")
+
+    requested = defaultdict(int)
+    for order_data in orders_data:
+        for item in order_data.items:
+            item.price = products[item.product_id]["price"]
+            if order_data.reservation_id is None:
+                requested[item.product_id] += item.quantity
+
+    short = sorted(product_id for product_id, quantity in requested.items()
+                   if quantity > products[product_id]["stock"])
+    if short:
+        raise HTTPException(status_code=409, detail=f"Insufficient stock for products: {short}")
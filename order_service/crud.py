@@ -0,0 +1,164 @@
+from collections import defaultdict
+from fastapi import HTTPException
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+from typing import Dict, Iterable, List, Optional
+from models import Orders, OrderItem, OrderUpdate, OrderRequest, OrderRead, OrderStatus, PaymentStatus
+from pagination import Page, paginate
+from outbox import record_event
+from serialization import model_columns
+from rollups import RollupDelta, apply_rollups, order_items
+from versions import bump_versions, collection_keys, stripe_key
+from sharding import ShardMoved, assign_ids, claim_bucket, shard_router, user_bucket
+
+def order_keys(user_id: Optional[int]) -> List[str]:
+    """The version stamps covering the order list, or one user's orders."""
+    return [f"orders:user:{user_id}"] if user_id is not None else collection_keys("orders")
+
+def changed_order_keys(orders) -> List[str]:
+    """The version stamps a change to orders bumps."""
+    return [key for order in orders for key in (stripe_key("orders", order.id), f"orders:user:{order.user_id}")]
+
+def list_orders(session: Session, user_id: Optional[int], order_status: Optional[OrderStatus],
+                payment_status: Optional[PaymentStatus], cursor: Optional[str], limit: int, rows: bool = False) -> Page:
+    """
+    Retrieves a page of orders from the database, newest first, optionally filtered.
+    With rows, the page holds column rows for page_response instead of Orders objects.
+    """
+    # Use the session to query the database
+    query = session.query(*model_columns(Orders)) if rows else session.query(Orders)
+    if user_id is not None:
+        query = query.filter(Orders.user_id == user_id)
+    if order_status is not None:
+        query = query.filter(Orders.order_status == order_status)
+    if payment_status is not None:
+        query = query.filter(Orders.payment_status == payment_status)
+    return paginate(query, [Orders.created_at, Orders.id], limit, cursor)
+
+def build_order(order_data: OrderRequest):
+    """Builds an order and its items from a request, computing each item's subtotal."""
+    items = [OrderItem(product_id=item.product_id,
+                       quantity=item.quantity,
+                       price=item.price,
+                       subtotal=item.price * item.quantity)
+             for item in order_data.items]
+    order = Orders(user_id=order_data.user_id, reservation_id=order_data.reservation_id,
+                   total_amount=sum(item.subtotal for item in items))
+    return order, items
+
+def reserved_orders(session: Session, reservation_ids: Iterable[int]) -> Dict[int, OrderRead]:
+    """The orders already placed for any of the reservations, with their items, by reservation id."""
+    reservation_ids = list(reservation_ids)
+    if not reservation_ids:
+        return {}
+    orders = session.exec(select(Orders).where(Orders.reservation_id.in_(reservation_ids))).all()
+    items = defaultdict(list)
+    if orders:
+        for item in session.exec(select(OrderItem).where(OrderItem.order_id.in_([order.id for order in orders]))):
+            items[item.order_id].append(item.model_dump())
+    return {order.reservation_id: OrderRead(**order.model_dump(), items=items[order.id]) for order in orders}
+
+def save_orders(session: Session, orders_data: List[OrderRequest]) -> List[OrderRead]:
+    """
+    Inserts orders and all of their items in a single transaction.
+    Orders and items are each flushed as one batched insert, then committed once with the rollup increments.
+    An order whose reservation already has an order is not placed again; that order is returned in its place.
+    """
+    existing = reserved_orders(session, [order_data.reservation_id for order_data in orders_data
+                                         if order_data.reservation_id is not None])
+    new_data = [order_data for order_data in orders_data if order_data.reservation_id not in existing]
+    if not new_data:
+        return [existing[order_data.reservation_id] for order_data in orders_data]
+
+    built = [build_order(order_data) for order_data in new_data]
+    if shard_router is not None:
+        assign_ids(session, built)
+
+    session.add_all([order for order, _ in built])
+    session.flush()
+
+    for order, items in built:
+        for item in items:
+            item.order_id = order.id
+    session.add_all([item for _, items in built for item in items])
+    session.flush()
+
+    # Build the responses from the flushed rows, so no extra SELECT is needed
+    placed = [OrderRead(**order.model_dump(), items=[item.model_dump() for item in items])
+              for order, items in built]
+    for order in placed:
+        record_event(session, "order.placed", order.id, order)
+    delta = RollupDelta()
+    for order in placed:
+        delta.add_order(order.id, order.created_at, order.total_amount, order.order_status, order.payment_status,
+                        [(item.product_id, item.quantity, item.subtotal) for item in order.items])
+    apply_rollups(session, delta)
+    bump_versions(session, changed_order_keys(placed))
+    session.commit()
+    new_orders = iter(placed)
+    return [existing[order_data.reservation_id] if order_data.reservation_id in existing else next(new_orders)
+            for order_data in orders_data]
+
+def place_orders(session: Session, orders_data: List[OrderRequest]) -> List[OrderRead]:
+    """place orders into the database, rolling back all of them on failure."""
+    try:
+        try:
+            return save_orders(session, orders_data)
+        except IntegrityError:
+            # A concurrent request placed the order of one of the reservations first; return that one
+            session.rollback()
+            return save_orders(session, orders_data)
+    except ShardMoved:
+        session.rollback()
+        raise
+    except Exception as e:
+        session.rollback()
+        raise HTTPException(status_code=500, detail=f"Failed to place order: {str(e)}")
+
+def update_order(session: Session, data_update: OrderUpdate) -> Orders:
+    """update order in the database."""
+    # Use the session to query the database
+    order_data = session.get(Orders, data_update.order_id)
+    if not order_data:
+        raise HTTPException(status_code=404, detail="Order not found")
+    if shard_router is not None:
+        claim_bucket(session, user_bucket(order_data.user_id))
+
+    try:
+        delta = RollupDelta()
+        delta.add_status(order_data.id, order_data.order_status, order_data.payment_status,
+                         order_data.total_amount, -1)
+        order_update = data_update.model_dump(exclude_unset=True)
+        order_data.sqlmodel_update(order_update)
+        session.add(order_data)
+        session.flush()
+        delta.add_status(order_data.id, order_data.order_status, order_data.payment_status, order_data.total_amount)
+        apply_rollups(session, delta)
+        bump_versions(session, changed_order_keys([order_data]))
+        record_event(session, "order.updated", order_data.id, order_data)
+        session.commit()
+        session.refresh(order_data)
+    except Exception as e:
+        session.rollback()
+        raise HTTPException(status_code=500, detail=f"Failed to update order: {str(e)}")
+
+    return order_data
+
+def delete_order(session: Session, order_id: int) -> dict:
+    """delete order from the database."""
+    # Use the session to query the database
+    order = session.get(Orders, order_id)
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    if shard_router is not None:
+        claim_bucket(session, user_bucket(order.user_id))
+
+    delta = RollupDelta()
+    delta.add_order(order.id, order.created_at, order.total_amount, order.order_status, order.payment_status,
+                    order_items(session, order_id), sign=-1)
+    apply_rollups(session, delta)
+    bump_versions(session, changed_order_keys([order]))
+    session.delete(order)
+    session.commit()
+
+    return {"message": "Delete order success"}
@@ -0,0 +1,135 @@
+from datetime import datetime
+from enum import Enum
+from typing import AsyncIterator, List, Optional, Sequence
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import DateTime, select
+from database import read_engine, IS_ASYNC
+from serialization import model_columns
+import csv
+import heapq
+import io
+import orjson
+import os
+
+# Rows fetched from the server-side cursor, and encoded, per chunk of the response
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "1000"))
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+MEDIA_TYPES = {ExportFormat.ndjson: "application/x-ndjson", ExportFormat.csv: "text/csv"}
+
+def export_query(model, created_from: Optional[datetime], created_to: Optional[datetime], after_id: Optional[int]):
+    """
+    Selects the model's columns in id order, from created_from (inclusive) to created_to (exclusive).
+    after_id resumes an interrupted export after the last id it received.
+    """
+    created_at = model.created_at
+    # Some services keep created_at as an ISO string, which compares in the same order as the datetime
+    bound = (lambda value: value) if isinstance(created_at.type, DateTime) else datetime.isoformat
+
+    query = select(*model_columns(model)).order_by(model.id)
+    if after_id is not None:
+        query = query.where(model.id > after_id)
+    if created_from is not None:
+        query = query.where(created_at >= bound(created_from))
+    if created_to is not None:
+        query = query.where(created_at < bound(created_to))
+    return query
+
+async def stream_partitions(query, bind=None) -> AsyncIterator[Sequence]:
+    """
+    Yields the query's rows in lists of EXPORT_CHUNK_ROWS from a server-side cursor (yield_per), on a
+    connection of its own that lives as long as the stream, to bind or else to a read replica when one is healthy.
+    Only one chunk is held in memory at a time.
+    """
+    query = query.execution_options(yield_per=EXPORT_CHUNK_ROWS)
+    if bind is None:
+        bind = await read_engine()
+    if IS_ASYNC:
+        async with bind.connect() as connection:
+            result = await connection.stream(query)
+            async for rows in result.partitions():
+                yield rows
+        return
+
+    connection = await run_in_threadpool(bind.connect)
+    try:
+        result = await run_in_threadpool(connection.execute, query)
+        while rows := await run_in_threadpool(result.fetchmany, EXPORT_CHUNK_ROWS):
+            yield rows
+    finally:
+        # Closed directly: when the client disconnects the stream is cancelled and could not await the threadpool
+        connection.close()
+
+def csv_value(value):
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def encode_ndjson(fields: Sequence[str], rows: Sequence) -> bytes:
+    return b"".join(orjson.dumps(dict(zip(fields, row)), option=orjson.OPT_APPEND_NEWLINE) for row in rows)
+
+def encode_csv(rows: Sequence) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([csv_value(value) for value in row] for row in rows)
+    return buffer.getvalue().encode()
+
+async def merged_partitions(query, binds: Sequence) -> AsyncIterator[Sequence]:
+    """
+    Yields the rows of query run on every bind, such as the shards of a table, merged in id order
+    in lists of EXPORT_CHUNK_ROWS. One chunk per bind is held in memory at a time.
+    """
+    streams = [stream_partitions(query, bind) for bind in binds]
+    try:
+        chunks: List[Optional[Sequence]] = [await anext(stream, None) for stream in streams]
+        positions = [0] * len(streams)
+        heap = [(chunk[0].id, index) for index, chunk in enumerate(chunks) if chunk]
+        heapq.heapify(heap)
+        rows, last_id = [], None
+        while heap:
+            row_id, index = heapq.heappop(heap)
+            # A row being moved between binds can be read from both
+            if row_id != last_id:
+                rows.append(chunks[index][positions[index]])
+                last_id = row_id
+            positions[index] += 1
+            if positions[index] == len(chunks[index]):
+                chunks[index], positions[index] = await anext(streams[index], None), 0
+            if chunks[index]:
+                heapq.heappush(heap, (chunks[index][positions[index]].id, index))
+            if len(rows) == EXPORT_CHUNK_ROWS:
+                yield rows
+                rows = []
+        if rows:
+            yield rows
+    finally:
+        for stream in streams:
+            await stream.aclose()
+
+async def export_chunks(query, fields: Sequence[str], export_format: ExportFormat,
+                        binds: Optional[Sequence] = None) -> AsyncIterator[bytes]:
+    if export_format == ExportFormat.csv:
+        yield encode_csv([fields])
+    partitions = merged_partitions(query, binds) if binds else stream_partitions(query)
+    async for rows in partitions:
+        yield encode_ndjson(fields, rows) if export_format == ExportFormat.ndjson else encode_csv(rows)
+
+def export_response(model, name: str, export_format: ExportFormat, created_from: Optional[datetime],
+                    created_to: Optional[datetime], after_id: Optional[int],
+                    binds: Optional[Sequence] = None) -> StreamingResponse:
+    """
+    Streams every matching row of model as NDJSON (one object per line) or CSV (with a header row),
+    chunk by chunk, so memory use does not depend on how many rows are exported.
+    With binds the rows are read from each of those engines and merged in id order.
+    """
+    fields = list(model.model_fields)
+    return StreamingResponse(
+        export_chunks(export_query(model, created_from, created_to, after_id), fields, export_format, binds),
+        media_type=MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{export_format.value}"'},
+    )
@@ -1,17 +1,31 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException
-from sqlmodel import SQLModel, create_engine, Session
-from contextlib import asynccontextmanager
-from typing import List
-from models import Orders, OrderItem, OrderUpdate, OrderRequest
-import os
-
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./database.db")
-
-engine = create_engine(DATABASE_URL, echo=True, connect_args={"check_same_thread": False})
-
-def create_db_and_tables():
-    """Creates the database tables based on your SQLModel definitions."""
-    SQLModel.metadata.create_all(engine)
+from fastapi import FastAPI, APIRouter, Depends, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime
+from typing import List, Optional
+from models import Orders, OrderUpdate, OrderRequest, OrderRead, OrderStatus, PaymentStatus, OrderStats, RollupGranularity
+from pagination import Page, DEFAULT_LIMIT, MAX_LIMIT
+from database import (get_session, get_read_session, route_reads, run_db, run_migrations, pool_stats,
+                      replica_stats, DBSession)
+from migrations import MIGRATIONS
+from instrumentation import instrument
+from admission import admission_control, admission_stats
+from utils import close_clients
+from catalog import validate_orders
+from outbox import OutboxRelay, outbox_relay
+from serialization import FAST_JSON_ENABLED, page_response
+from export import ExportFormat, export_response
+from rollups import TopProductsBy, order_stats, sharded_order_stats
+from versions import check_not_modified, is_fresh, make_etag, not_modified, read_versions, tagged, versioned
+from sharding import merge_pages, shard_router, shard_stats, user_bucket
+import crud
+import asyncio
+
+async def create_db_and_tables():
+    """Brings the database schema up to date by applying any pending migrations."""
+    await run_migrations(MIGRATIONS)
+    if shard_router is not None:
+        await shard_router.initialize(MIGRATIONS)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -19,87 +33,162 @@ async def lifespan(app: FastAPI):
     Function that runs on application startup and shutdown.
     It's the perfect place to create the database tables.
     """
-    create_db_and_tables()
+    await create_db_and_tables()
+    relays = [asyncio.create_task(relay.run()) for relay in outbox_relays if relay.broker is not None]
     yield
+    for relay in relays:
+        relay.cancel()
+        with suppress(asyncio.CancelledError):
+            await relay
+    await close_clients()
 
-app = FastAPI(title="Order Service", lifespan=lifespan)
+# Events are written to the outbox of the shard holding the order, so every shard has a relay
+outbox_relays = ([OutboxRelay(outbox_relay.broker, in_session=shard.run) for shard in shard_router.shards]
+                 if shard_router is not None else [outbox_relay])
 
-def get_session():
-    """
-    Dependency function to get a database session.
-    It creates a session and ensures it's closed after the request.
-    """
-    with Session(engine) as session:
-        yield session
+def notify_relays():
+    for relay in outbox_relays:
+        relay.notify()
 
-router = APIRouter()
+app = FastAPI(title="Order Service", lifespan=lifespan)
+admission_control(app, critical=["POST /api/v1/order"],
+                  browse=["GET /api/v1/order/stats", "GET /api/v1/order/export"])
+instrument(app)
+route_reads(app)
+
+@app.get("/metrics/pool")
+async def get_pool_stats():
+    """Returns connection pool checkout and wait metrics, used to size DB_POOL_SIZE per service."""
+    return pool_stats()
+
+@app.get("/metrics/replicas")
+async def get_replica_stats():
+    """Returns the read replicas' health and lag, and how many reads were pinned to or fell back to the primary."""
+    return replica_stats()
+
+@app.get("/metrics/admission")
+async def get_admission_stats():
+    """Returns the requests admitted, queued, shed and rate limited by priority, and the slots in use."""
+    return admission_stats()
+
+@app.get("/metrics/outbox")
+async def get_outbox_stats():
+    """Returns how many outbox events the relay has published to the broker."""
+    stats = [relay.stats() for relay in outbox_relays]
+    return {key: stats[0][key] if key == "enabled" else sum(relay[key] for relay in stats) for key in stats[0]}
+
+@app.get("/metrics/shards")
+async def get_shard_stats():
+    """Returns the buckets and pool of every order shard, and how often requests waited for a bucket being moved."""
+    return shard_stats()
 
-@router.get("/order", response_model=List[Orders])
-def get_all_orders(session: Session = Depends(get_session)):
-    """Retrieves list of order from the database"""
-    # Use the session to query the database
-    query = session.query(Orders)
-    order_list = query.all()
-    return order_list
+router = APIRouter()
 
-@router.post("/order", response_model=Orders)
-def place_order(order_data: OrderRequest, session: Session = Depends(get_session)):
+@router.get("/order", response_model=Page[Orders])
+async def get_all_orders(request: Request,
+                         response: Response,
+                         user_id: Optional[int] = None,
+                         order_status: Optional[OrderStatus] = None,
+                         payment_status: Optional[PaymentStatus] = None,
+                         cursor: Optional[str] = None,
+                         limit: int = Query(default=DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+                         session: DBSession = Depends(get_read_session)):
+    """
+    Retrieves a page of orders from the database, newest first, optionally filtered.
+    Pages carry an ETag; a poll sending it back in If-None-Match gets a 304 while the orders are unchanged.
+    """
+    keys = crud.order_keys(user_id)
+    if shard_router is not None:
+        return await sharded_orders(request, response, keys, user_id, order_status, payment_status, cursor, limit)
+    unchanged = await check_not_modified(request, session, keys)
+    if unchanged is not None:
+        return unchanged
+    token, page = await run_db(session, versioned, keys, crud.list_orders, user_id, order_status, payment_status,
+                               cursor, limit, rows=FAST_JSON_ENABLED)
+    return tagged(page_response(page) if FAST_JSON_ENABLED else page, response, make_etag(request, token))
+
+async def sharded_orders(request: Request, response: Response, keys: List[str], user_id: Optional[int],
+                         order_status: Optional[OrderStatus], payment_status: Optional[PaymentStatus],
+                         cursor: Optional[str], limit: int):
+    """
+    Lists orders from the shards: a user's from the user's shard, any other list from every shard at once,
+    merged newest first. The ETag covers the stamps of every shard read.
+    """
+    if user_id is not None:
+        async def read(fn, *args, **kwargs):
+            return [await shard_router.read(user_bucket(user_id), fn, *args, **kwargs)]
+    else:
+        read = shard_router.gather
+    if "if-none-match" in request.headers:
+        etag = make_etag(request, "/".join(await read(read_versions, keys)))
+        if is_fresh(request, etag):
+            return not_modified(etag)
+    parts = await read(versioned, keys, crud.list_orders, user_id, order_status, payment_status, cursor, limit,
+                       rows=FAST_JSON_ENABLED)
+    tokens = [token for token, _ in parts]
+    page = merge_pages([page for _, page in parts], ["created_at", "id"], limit)
+    etag = make_etag(request, None if None in tokens else "/".join(tokens))
+    return tagged(page_response(page) if FAST_JSON_ENABLED else page, response, etag)
+
+@router.get("/order/export", response_class=StreamingResponse)
+async def export_orders(format: ExportFormat = ExportFormat.ndjson,
+                        created_from: Optional[datetime] = None,
+                        created_to: Optional[datetime] = None,
+                        after_id: Optional[int] = None):
+    """Streams all orders in id order as NDJSON or CSV, optionally by created_at range and resuming after an id."""
+    binds = [shard.engine for shard in shard_router.shards] if shard_router is not None else None
+    return export_response(Orders, "orders", format, created_from, created_to, after_id, binds)
+
+@router.get("/order/stats", response_model=OrderStats)
+async def get_order_stats(granularity: RollupGranularity = RollupGranularity.day,
+                          start: Optional[datetime] = None,
+                          end: Optional[datetime] = None,
+                          top: int = Query(default=10, ge=0, le=100),
+                          top_by: TopProductsBy = TopProductsBy.revenue,
+                          session: DBSession = Depends(get_read_session)):
+    """Retrieves sales per hour or day, order counts per status and the top products from the rollup tables."""
+    if shard_router is not None:
+        return await sharded_order_stats(granularity, start, end, top, top_by)
+    return await run_db(session, order_stats, granularity, start, end, top, top_by)
+
+@router.post("/order", response_model=OrderRead)
+async def place_order(order_data: OrderRequest, session: DBSession = Depends(get_session)):
     """place order into the database."""
-    try:
-        total_amount = sum(item.price * item.quantity for item in order_data.items)
-
-        new_order = Orders(user_id=order_data.user_id, total_amount=total_amount)
-        session.add(new_order)
-        session.commit()
-
-        for item in order_data.items:
-            order_item = OrderItem(order_id=new_order.id,
-                                   product_id=item.product_id,
-                                   quantity=item.quantity,
-                                   price=item.price)
-            session.add(order_item)
-            session.commit()
-
-        order_data = session.get(Orders, new_order.id)
-
-    except Exception as e:
-        session.rollback()
-        raise HTTPException(status_code=500, detail=f"Failed to place order: {str(e)}")
-
-    return order_data
+    await validate_orders([order_data])
+    if shard_router is not None:
+        placed = await shard_router.write(user_bucket(order_data.user_id), crud.place_orders, [order_data])
+    else:
+        placed = await run_db(session, crud.place_orders, [order_data])
+    notify_relays()
+    return placed[0]
+
+@router.post("/order/batch", response_model=List[OrderRead])
+async def place_orders_batch(orders_data: List[OrderRequest], session: DBSession = Depends(get_session)):
+    """place many orders into the database in one transaction, or one per shard when orders are sharded."""
+    await validate_orders(orders_data)
+    if shard_router is not None:
+        placed = await shard_router.write_groups(orders_data, lambda order: user_bucket(order.user_id),
+                                                 crud.place_orders)
+    else:
+        placed = await run_db(session, crud.place_orders, orders_data)
+    notify_relays()
+    return placed
 
 @router.put("/order", response_model=Orders)
-def update_product(data_update: OrderUpdate, session: Session = Depends(get_session)):
+async def update_product(data_update: OrderUpdate, session: DBSession = Depends(get_session)):
     """update order in the database."""
-    # Use the session to query the database
-    order_data = session.get(Orders, data_update.order_id)
-    if not order_data:
-        raise HTTPException(status_code=404, detail="Order not found")
-
-    try:
-        order_update = data_update.model_dump(exclude_unset=True)
-        order_data.sqlmodel_update(order_update)
-        session.add(order_data)
-        session.commit()
-        session.refresh(order_data)
-    except Exception as e:
-        session.rollback()
-        raise HTTPException(status_code=500, detail=f"Failed to update order: {str(e)}")
-
-
-    return order_data
+    if shard_router is not None:
+        order = await shard_router.write_order(data_update.order_id, crud.update_order, data_update)
+    else:
+        order = await run_db(session, crud.update_order, data_update)
+    notify_relays()
+    return order
 
 @router.delete("/order/{order_id}", response_model=Orders)
-def delete_cart(order_id: int, session: Session = Depends(get_session)):
+async def delete_cart(order_id: int, session: DBSession = Depends(get_session)):
     """delete order from the database."""
-    # Use the session to query the database
-    order = session.get(Orders, order_id)
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-
-    session.delete(order)
-    session.commit()
-
-    return {"message": "Delete order success"}
+    if shard_router is not None:
+        return await shard_router.write_order(order_id, crud.delete_order, order_id)
+    return await run_db(session, crud.delete_order, order_id)
 
-app.include_router(router, tags=["order"], prefix="/api/v1")
\ No newline at end of file
+app.include_router(router, tags=["order"], prefix="/api/v1")
@@ -0,0 +1,52 @@
+from sqlalchemy import inspect, text
+from sqlmodel import SQLModel, Session
+from database import Migration, reconcile_indexes
+from models import (Orders, OrderItem, Shipping, SalesRollup, StatusRollup, ProductRollup, CollectionVersion,
+                    ShardBucket)
+from rollups import rebuild_rollups
+
+def create_tables(connection):
+    SQLModel.metadata.create_all(connection)
+
+def composite_indexes(connection):
+    """Replaces the per-column indexes of databases created before the index redesign."""
+    reconcile_indexes(connection, [Orders.__table__, OrderItem.__table__, Shipping.__table__])
+
+def sales_rollups(connection):
+    """Creates the rollup tables of existing databases and fills them from the order history."""
+    SQLModel.metadata.create_all(connection, tables=[SalesRollup.__table__, StatusRollup.__table__,
+                                                     ProductRollup.__table__])
+    rebuild_rollups(Session(bind=connection))
+
+def version_stamps(connection):
+    SQLModel.metadata.create_all(connection, tables=[CollectionVersion.__table__])
+
+def shard_buckets(connection):
+    """Creates the bucket table; buckets are assigned when ORDER_SHARD_URLS turns sharding on."""
+    SQLModel.metadata.create_all(connection, tables=[ShardBucket.__table__])
+
+def order_reservations(connection):
+    """Adds the reservation each order was placed for, with the unique index retried checkouts are matched on."""
+    if "reservation_id" not in {column["name"] for column in inspect(connection).get_columns("orders")}:
+        connection.execute(text("ALTER TABLE orders ADD COLUMN reservation_id INTEGER"))
+    reconcile_indexes(connection, [Orders.__table__])
+
+def striped_rollups(connection):
+    """Recreates the sales and status rollups of databases from before their rows were striped, then refills them."""
+    if "stripe" in {column["name"] for column in inspect(connection).get_columns("salesrollup")}:
+        return
+    for table in (SalesRollup.__table__, StatusRollup.__table__):
+        table.drop(connection)
+        table.create(connection)
+    rebuild_rollups(Session(bind=connection))
+
+# Append new migrations with the next version number; applied ones must never change
+MIGRATIONS = [
+    Migration(1, "create tables", create_tables),
+    Migration(2, "composite indexes", composite_indexes),
+    Migration(3, "sales rollups", sales_rollups),
+    Migration(4, "version stamps", version_stamps),
+    Migration(5, "shard buckets", shard_buckets),
+    Migration(6, "order reservations", order_reservations),
+    Migration(7, "striped rollups", striped_rollups),
+]
@@ -1,7 +1,8 @@
 from enum import Enum
 from typing import Optional, List
-from sqlmodel import SQLModel, Field
+from sqlmodel import SQLModel, Field, JSON, Column, Index
 from datetime import datetime
+from uuid import uuid4
 
 
 class OrderStatus(str, Enum):
@@ -22,15 +23,26 @@ class ShippingMethod(str, Enum):
 class Orders(SQLModel, table=True):
     """
     Represents an order in the product service database.
+    Orders are listed newest first by (created_at, id), so every index on the listing filters ends with those keys.
     """
+    __table_args__ = (
+        Index("ix_orders_user_id_created_at_id", "user_id", "created_at", "id"),
+        Index("ix_orders_created_at_id", "created_at", "id"),
+        Index("ix_orders_order_status_created_at_id", "order_status", "created_at", "id"),
+        Index("ix_orders_payment_status_created_at_id", "payment_status", "created_at", "id"),
+        # At most one order per reservation, so a retried checkout finds the order it placed
+        Index("ix_orders_reservation_id", "reservation_id", unique=True),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: int = Field(index=True)
-    order_status: OrderStatus = Field(default=OrderStatus.pending, index=True)
-    total_amount: float = Field(default=0.0, index=True)
-    payment_status: PaymentStatus = Field(default=PaymentStatus.unpaid, index=True)
-    shipping_id: Optional[int] = Field(default=None, index=True)
-    created_at: datetime = Field(default=datetime.utcnow(), index=True)
-    updated_at: Optional[datetime] = Field(default=None,sa_column_kwargs={"onupdate": datetime.utcnow}, index=True)
+    user_id: int
+    order_status: OrderStatus = Field(default=OrderStatus.pending)
+    total_amount: float = Field(default=0.0)
+    payment_status: PaymentStatus = Field(default=PaymentStatus.unpaid)
+    shipping_id: Optional[int] = Field(default=None)
+    reservation_id: Optional[int] = Field(default=None)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: Optional[datetime] = Field(default=None,sa_column_kwargs={"onupdate": datetime.utcnow})
 
 
 class OrderUpdate(SQLModel):
@@ -45,10 +57,10 @@ class OrderUpdate(SQLModel):
 class OrderItem(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     order_id: int = Field(foreign_key="orders.id", index=True)
-    product_id: int = Field(index=True)
-    quantity: int = Field(default=1, index=True)
-    price: float = Field(default=0.0, index=True)
-    subtotal: float = Field(default=0.0, index=True)
+    product_id: int
+    quantity: int = Field(default=1)
+    price: float = Field(default=0.0)
+    subtotal: float = Field(default=0.0)
 
 class OrderRequest(SQLModel):
     """
@@ -56,15 +68,34 @@ class OrderRequest(SQLModel):
     """
     user_id: int
     items: List[OrderItem] = Field(default_factory=list)
+    # Set by checkout once the product service has reserved the items, so their stock is not counted again.
+    # It is also the order's idempotency key: a repeated request gets back the order already placed for it
+    reservation_id: Optional[int] = None
+
+class OrderRead(SQLModel):
+    """
+    Represents a placed order together with its items.
+    """
+    id: int
+    user_id: int
+    order_status: OrderStatus
+    total_amount: float
+    payment_status: PaymentStatus
+    shipping_id: Optional[int] = None
+    reservation_id: Optional[int] = None
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+    items: List[OrderItem] = Field(default_factory=list)
 
 
 class Shipping(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     order_id: int = Field(foreign_key="orders.id", index=True)
-    shipping_method: ShippingMethod = Field(default=ShippingMethod.standard, index=True)
+    shipping_method: ShippingMethod = Field(default=ShippingMethod.standard)
+    # Carrier updates arrive by tracking number
     tracking_number: Optional[str] = Field(default=None, index=True)
-    shipped_at: Optional[datetime] = Field(default=None, index=True)
-    delivered_at: Optional[datetime] = Field(default=None, index=True)
+    shipped_at: Optional[datetime] = Field(default=None)
+    delivered_at: Optional[datetime] = Field(default=None)
 
 
 class ShippingUpdate(SQLModel):
@@ -75,3 +106,118 @@ class ShippingUpdate(SQLModel):
     tracking_number: Optional[str] = None
     shipped_at: Optional[datetime] = None
     delivered_at: Optional[datetime] = None
+
+
+class RollupGranularity(str, Enum):
+    hour = "hour"
+    day = "day"
+
+class SalesRollup(SQLModel, table=True):
+    """
+    Orders placed, their revenue and units per hour and per day, keyed by the start of the bucket.
+    Kept up to date in the same transaction as every order change, see rollups.py.
+    Each bucket is spread over stripes by order id, so concurrent orders rarely wait on the same row.
+    """
+    granularity: RollupGranularity = Field(primary_key=True)
+    bucket: datetime = Field(primary_key=True)
+    stripe: int = Field(default=0, primary_key=True)
+    orders: int = Field(default=0)
+    revenue: float = Field(default=0.0)
+    units: int = Field(default=0)
+
+class StatusRollup(SQLModel, table=True):
+    """
+    Number and value of the orders in each combination of order and payment status, striped like SalesRollup.
+    """
+    order_status: OrderStatus = Field(primary_key=True)
+    payment_status: PaymentStatus = Field(primary_key=True)
+    stripe: int = Field(default=0, primary_key=True)
+    orders: int = Field(default=0)
+    revenue: float = Field(default=0.0)
+
+class ProductRollup(SQLModel, table=True):
+    """
+    Order lines, units and revenue of each product over all orders.
+    The top products are read from the revenue and units indexes.
+    """
+    __table_args__ = (
+        Index("ix_productrollup_revenue_product_id", "revenue", "product_id"),
+        Index("ix_productrollup_units_product_id", "units", "product_id"),
+    )
+
+    product_id: int = Field(primary_key=True)
+    lines: int = Field(default=0)
+    units: int = Field(default=0)
+    revenue: float = Field(default=0.0)
+
+class SalesBucket(SQLModel):
+    bucket: datetime
+    orders: int
+    revenue: float
+    units: int
+
+class StatusCount(SQLModel):
+    order_status: OrderStatus
+    payment_status: PaymentStatus
+    orders: int
+    revenue: float
+
+class ProductSales(SQLModel):
+    product_id: int
+    lines: int
+    units: int
+    revenue: float
+
+class OrderStats(SQLModel):
+    """
+    Represents the dashboard figures, read from the rollup tables.
+    sales holds every bucket of the range, including empty ones; the totals cover all orders.
+    """
+    granularity: RollupGranularity
+    start: datetime
+    end: datetime
+    sales: List[SalesBucket] = Field(default_factory=list)
+    statuses: List[StatusCount] = Field(default_factory=list)
+    top_products: List[ProductSales] = Field(default_factory=list)
+    total_orders: int = 0
+    total_revenue: float = 0.0
+
+
+class CollectionVersion(SQLModel, table=True):
+    """
+    A version stamp bumped in the same transaction as every write to the data it covers, see versions.py.
+    GET handlers derive their ETags from the stamps, so an unchanged poll is answered without reading the data.
+    """
+    key: str = Field(primary_key=True, max_length=100)
+    version: int = Field(default=0)
+
+
+class BucketState(str, Enum):
+    owned = "owned"
+    moving = "moving"
+
+class ShardBucket(SQLModel, table=True):
+    """
+    A bucket of users whose orders this database holds when orders are sharded, see sharding.py.
+    New order, item and shipping ids of the bucket are numbered from next_id; a bucket being copied
+    to another shard by reshard.py is moving, which holds back its writes.
+    """
+    bucket: int = Field(primary_key=True)
+    next_id: int = Field(default=1)
+    state: BucketState = Field(default=BucketState.owned)
+
+
+class OutboxEvent(SQLModel, table=True):
+    """
+    An event written in the same transaction as the state change it describes.
+    The outbox relay publishes unpublished rows to the broker and then stamps published_at.
+    """
+    __table_args__ = (Index("ix_outboxevent_published_at_id", "published_at", "id"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    event_id: str = Field(default_factory=lambda: uuid4().hex, unique=True)
+    topic: str
+    key: str
+    payload: dict = Field(default_factory=dict, sa_column=Column(JSON, nullable=False))
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    published_at: Optional[datetime] = Field(default=None)
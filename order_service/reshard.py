@@ -0,0 +1,221 @@
+"""
+Moves buckets of users, with their orders, between the order shards while the service keeps running.
+
+    python reshard.py status
+    python reshard.py move --bucket 17 --to 2
+    python reshard.py move --user 42 --to 2      # moves the bucket of user 42, with the other users in it
+    python reshard.py rebalance                  # spreads the buckets evenly, e.g. after adding a shard
+
+Run it with the service's DATABASE_URL and ORDER_SHARD_URLS. A bucket being moved only holds back
+writes to its own orders, for as long as they take to copy; reads keep going to the old shard until
+the new one takes over. An interrupted move is finished by running it again with the same target.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+from sqlalchemy import delete, distinct, func, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session
+from models import BucketState, CollectionVersion, Orders, OrderItem, Shipping, ShardBucket
+from rollups import RollupDelta, apply_rollups
+from sharding import SHARD_BUCKETS, Shard, ShardRouter, shard_router, user_bucket
+from versions import bump_versions, stripe_key
+import argparse
+import asyncio
+import os
+import time
+
+# Users whose orders are copied per transaction
+RESHARD_BATCH_USERS = int(os.getenv("RESHARD_BATCH_USERS", "500"))
+# Orders committed this long after they were created are still found by the rescan of a frozen bucket
+RESCAN_MARGIN = timedelta(minutes=5)
+
+def user_key(user_id: int) -> str:
+    return f"orders:user:{user_id}"
+
+def bucket_state(session: Session, bucket: int) -> Optional[BucketState]:
+    return session.execute(select(ShardBucket.state).where(ShardBucket.bucket == bucket)).scalar()
+
+def set_state(session: Session, bucket: int, state: BucketState):
+    """Sets the bucket's state; marking it moving waits for the writes holding its row, and holds back later ones."""
+    session.execute(update(ShardBucket).where(ShardBucket.bucket == bucket).values(state=state)
+                    .execution_options(synchronize_session=False))
+    session.commit()
+
+def bucket_next_id(session: Session, bucket: int) -> int:
+    return session.execute(select(ShardBucket.next_id).where(ShardBucket.bucket == bucket)).scalar()
+
+def bucket_users(session: Session, since: Optional[datetime]) -> Dict[int, Set[int]]:
+    """The users with orders on the shard by bucket, or only the ones with orders created since since."""
+    query = select(distinct(Orders.user_id))
+    if since is not None:
+        query = query.where(Orders.created_at >= since)
+    users = defaultdict(set)
+    for user_id in session.execute(query).scalars():
+        users[user_bucket(user_id)].add(user_id)
+    return users
+
+def user_orders(user_ids: List[int]):
+    return select(Orders.id).where(Orders.user_id.in_(user_ids))
+
+def read_users(session: Session, user_ids: List[int]) -> dict:
+    """Reads every row of the users' orders: the orders, their items and shipping, and the users' version stamps."""
+    return {
+        "orders": session.execute(select(Orders.__table__).where(Orders.user_id.in_(user_ids))).mappings().all(),
+        "items": session.execute(select(OrderItem.__table__).where(
+            OrderItem.order_id.in_(user_orders(user_ids)))).mappings().all(),
+        "shipping": session.execute(select(Shipping.__table__).where(
+            Shipping.order_id.in_(user_orders(user_ids)))).mappings().all(),
+        "stamps": session.execute(select(CollectionVersion.__table__).where(
+            CollectionVersion.key.in_([user_key(user_id) for user_id in user_ids]))).mappings().all(),
+    }
+
+def remove_users(session: Session, user_ids: List[int]):
+    session.execute(delete(OrderItem).where(OrderItem.order_id.in_(user_orders(user_ids))))
+    session.execute(delete(Shipping).where(Shipping.order_id.in_(user_orders(user_ids))))
+    session.execute(delete(Orders).where(Orders.user_id.in_(user_ids)))
+    session.execute(delete(CollectionVersion).where(CollectionVersion.key.in_([user_key(user) for user in user_ids])))
+
+def write_users(session: Session, user_ids: List[int], rows: dict):
+    """
+    Replaces whatever the shard holds of the users with their rows from another shard, so an interrupted copy
+    can be run again. Version stamps move one ahead, so no ETag handed out before the move matches after it.
+    """
+    remove_users(session, user_ids)
+    for model, name in ((Orders, "orders"), (OrderItem, "items"), (Shipping, "shipping")):
+        if rows[name]:
+            session.execute(insert(model.__table__), [dict(row) for row in rows[name]])
+    if rows["stamps"]:
+        session.execute(insert(CollectionVersion.__table__),
+                        [dict(row, version=row["version"] + 1) for row in rows["stamps"]])
+    session.commit()
+
+def take_bucket(session: Session, bucket: int, next_id: int, delta: RollupDelta, stripes: List[str]):
+    """Makes the shard own the copied bucket, in one transaction with the rollups and stamps of its orders."""
+    apply_rollups(session, delta)
+    bump_versions(session, stripes)
+    insert = postgresql_insert if session.get_bind().dialect.name == "postgresql" else sqlite_insert
+    statement = insert(ShardBucket.__table__).values(bucket=bucket, next_id=next_id, state=BucketState.owned)
+    session.execute(statement.on_conflict_do_update(index_elements=["bucket"],
+                                                    set_={"next_id": next_id, "state": BucketState.owned}))
+    session.commit()
+
+def drop_bucket(session: Session, bucket: int, user_ids: List[int], delta: RollupDelta, stripes: List[str]):
+    """Deletes a moved bucket's rows from the shard it left, in one transaction with the bucket itself."""
+    for start in range(0, len(user_ids), RESHARD_BATCH_USERS):
+        remove_users(session, user_ids[start:start + RESHARD_BATCH_USERS])
+    apply_rollups(session, delta)
+    bump_versions(session, stripes)
+    session.execute(delete(ShardBucket).where(ShardBucket.bucket == bucket))
+    session.commit()
+
+def order_count(session: Session) -> int:
+    return session.execute(select(func.count()).select_from(Orders)).scalar()
+
+class BucketUsers:
+    """
+    The users of each bucket of a shard. A shard is scanned once; after that only the users with recent
+    orders are looked up, which a frozen bucket can no longer gain.
+    """
+    def __init__(self):
+        self.scans: Dict[int, tuple] = {}
+
+    async def users(self, shard: Shard, bucket: int) -> List[int]:
+        started = datetime.utcnow()
+        scanned_at, users = self.scans.get(shard.index, (None, defaultdict(set)))
+        found = await shard.run(bucket_users, scanned_at - RESCAN_MARGIN if scanned_at is not None else None)
+        for found_bucket, found_users in found.items():
+            users[found_bucket] |= found_users
+        self.scans[shard.index] = (started, users)
+        return sorted(users[bucket])
+
+async def move_bucket(router: ShardRouter, bucket: int, target: Shard, known: Optional[BucketUsers] = None) -> dict:
+    """
+    Moves a bucket to target: freezes its writes on the source, copies its users' rows in batches,
+    lets the target take it over with their rollups, then drops it from the source.
+    """
+    holders = {shard: state for shard, state in zip(router.shards, await router.gather(bucket_state, bucket))
+               if state is not None}
+    source = next((shard for shard in holders if shard is not target), None)
+    if source is None:
+        if target not in holders:
+            raise SystemExit(f"No shard holds bucket {bucket}")
+        if holders[target] == BucketState.moving:
+            # A move away from target was interrupted before the copy took over; it stays where it is
+            await target.run(set_state, bucket, BucketState.owned)
+        return {"bucket": bucket, "users": 0, "orders": 0, "seconds": 0.0}
+
+    started = time.perf_counter()
+    # An earlier run that got as far as the takeover only has the source left to drop
+    taken = holders.get(target) == BucketState.owned
+    await source.run(set_state, bucket, BucketState.moving)
+    users = await (known or BucketUsers()).users(source, bucket)
+
+    added, removed, stripes, orders = RollupDelta(), RollupDelta(), set(), 0
+    for start in range(0, len(users), RESHARD_BATCH_USERS):
+        batch = users[start:start + RESHARD_BATCH_USERS]
+        rows = await source.run(read_users, batch)
+        items = defaultdict(list)
+        for item in rows["items"]:
+            items[item["order_id"]].append((item["product_id"], item["quantity"], item["subtotal"]))
+        for order in rows["orders"]:
+            for delta, sign in ((added, 1), (removed, -1)):
+                delta.add_order(order["id"], order["created_at"], order["total_amount"], order["order_status"],
+                                order["payment_status"], items[order["id"]], sign=sign)
+            stripes.add(stripe_key("orders", order["id"]))
+        orders += len(rows["orders"])
+        if not taken:
+            await target.run(write_users, batch, rows)
+
+    if not taken:
+        await target.run(take_bucket, bucket, await source.run(bucket_next_id, bucket), added, sorted(stripes))
+    await source.run(drop_bucket, bucket, users, removed, sorted(stripes))
+    return {"bucket": bucket, "users": len(users), "orders": orders, "seconds": time.perf_counter() - started}
+
+def rebalance_plan(router: ShardRouter) -> List[tuple]:
+    """The fewest (bucket, target) moves that leave every shard with an equal share of the buckets."""
+    owned = defaultdict(list)
+    for bucket, shard in sorted(router.owners.items()):
+        owned[shard.index].append(bucket)
+    share, extra = divmod(SHARD_BUCKETS, len(router.shards))
+    goals = {shard.index: share + (shard.index < extra) for shard in router.shards}
+    surplus = [bucket for shard in router.shards for bucket in owned[shard.index][goals[shard.index]:]]
+    plan = []
+    for shard in router.shards:
+        for _ in range(goals[shard.index] - len(owned[shard.index])):
+            plan.append((surplus.pop(), shard))
+    return plan
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="buckets and orders per shard")
+    move = commands.add_parser("move", help="move one bucket to a shard")
+    which = move.add_mutually_exclusive_group(required=True)
+    which.add_argument("--bucket", type=int)
+    which.add_argument("--user", type=int, help="move the bucket of this user")
+    move.add_argument("--to", type=int, required=True, help="index of the target shard, 0 for DATABASE_URL")
+    commands.add_parser("rebalance", help="spread the buckets evenly over the shards")
+    args = parser.parse_args()
+
+    if shard_router is None:
+        raise SystemExit("ORDER_SHARD_URLS is not set, orders are not sharded")
+    await shard_router.load()
+    if args.command == "status":
+        counts = await shard_router.gather(order_count)
+        for shard, orders in zip(shard_router.shards, counts):
+            buckets = sum(1 for owner in shard_router.owners.values() if owner is shard)
+            print(f"shard {shard.index} {shard.name}: {buckets} buckets, {orders} orders")
+    elif args.command == "move":
+        if not 0 <= args.to < len(shard_router.shards):
+            raise SystemExit(f"There is no shard {args.to}")
+        bucket = args.bucket if args.bucket is not None else user_bucket(args.user)
+        print(await move_bucket(shard_router, bucket, shard_router.shards[args.to]))
+    else:
+        known = BucketUsers()
+        for bucket, target in rebalance_plan(shard_router):
+            print(await move_bucket(shard_router, bucket, target, known))
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,247 @@
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from typing import Dict, Iterable, List, Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import delete, func, select, text
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session
+from models import (Orders, OrderItem, OrderStatus, PaymentStatus, RollupGranularity, SalesRollup, StatusRollup,
+                    ProductRollup, OrderStats, SalesBucket, StatusCount, ProductSales)
+from sharding import shard_router
+import os
+
+# Orders read per query when rebuilding the rollups from the history
+ROLLUP_REBUILD_BATCH = int(os.getenv("ROLLUP_REBUILD_BATCH", "5000"))
+# Rollup rows written per upsert statement, well under SQLite's bound parameter limit
+ROLLUP_WRITE_BATCH = 1000
+# Every sales bucket and status combination is spread over this many rows by order id, so concurrent
+# order writes rarely wait on the same row lock; readers add the stripes up
+ROLLUP_STRIPES = 16
+MAX_STATS_BUCKETS = 1000
+DEFAULT_STATS_BUCKETS = {RollupGranularity.hour: 48, RollupGranularity.day: 30}
+BUCKET_STEP = {RollupGranularity.hour: timedelta(hours=1), RollupGranularity.day: timedelta(days=1)}
+
+class TopProductsBy(str, Enum):
+    revenue = "revenue"
+    units = "units"
+
+def bucket_start(moment: datetime, granularity: RollupGranularity) -> datetime:
+    """The start of the bucket holding moment, as a naive UTC datetime like created_at."""
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    moment = moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0) if granularity == RollupGranularity.day else moment
+
+class RollupDelta:
+    """
+    Changes to the rollups, summed per rollup row, so a transaction writes every row it touches once.
+    Orders and their items are counted in with sign 1 and out with sign -1.
+    """
+    def __init__(self):
+        self.sales: Dict[Tuple[RollupGranularity, datetime, int], List] = defaultdict(lambda: [0, 0.0, 0])
+        self.statuses: Dict[Tuple[OrderStatus, PaymentStatus, int], List] = defaultdict(lambda: [0, 0.0])
+        self.products: Dict[int, List] = defaultdict(lambda: [0, 0, 0.0])
+
+    def add_status(self, order_id: int, order_status, payment_status, total_amount: float, sign: int = 1):
+        row = self.statuses[(OrderStatus(order_status), PaymentStatus(payment_status), order_id % ROLLUP_STRIPES)]
+        row[0] += sign
+        row[1] += sign * total_amount
+
+    def add_order(self, order_id: int, created_at: datetime, total_amount: float, order_status, payment_status,
+                  items: Iterable[Tuple[int, int, float]], sign: int = 1):
+        """Counts an order with its items, given as (product_id, quantity, subtotal)."""
+        units = 0
+        for product_id, quantity, subtotal in items:
+            row = self.products[product_id]
+            row[0] += sign
+            row[1] += sign * quantity
+            row[2] += sign * subtotal
+            units += quantity
+        for granularity in RollupGranularity:
+            row = self.sales[(granularity, bucket_start(created_at, granularity), order_id % ROLLUP_STRIPES)]
+            row[0] += sign
+            row[1] += sign * total_amount
+            row[2] += sign * units
+        self.add_status(order_id, order_status, payment_status, total_amount, sign)
+
+    def rows(self):
+        """Yields (model, key columns, rows) per rollup table, rows in key order and without empty changes."""
+        for model, keys, values, changes in (
+            (SalesRollup, ("granularity", "bucket", "stripe"), ("orders", "revenue", "units"), self.sales),
+            (StatusRollup, ("order_status", "payment_status", "stripe"), ("orders", "revenue"), self.statuses),
+            (ProductRollup, ("product_id",), ("lines", "units", "revenue"), self.products),
+        ):
+            rows = [dict(zip(keys, key if isinstance(key, tuple) else (key,)), **dict(zip(values, change)))
+                    for key, change in sorted(changes.items()) if any(change)]
+            yield model, keys, rows
+
+def apply_rollups(session: Session, delta: RollupDelta):
+    """
+    Adds a delta to the rollup tables in the caller's transaction, inserting missing rows.
+    Rows are written in key order, so concurrent transactions lock shared rows in the same order.
+    """
+    insert = postgresql_insert if session.get_bind().dialect.name == "postgresql" else sqlite_insert
+    for model, keys, rows in delta.rows():
+        table = model.__table__
+        for start in range(0, len(rows), ROLLUP_WRITE_BATCH):
+            batch = rows[start:start + ROLLUP_WRITE_BATCH]
+            statement = insert(table).values(batch)
+            session.execute(statement.on_conflict_do_update(
+                index_elements=list(keys),
+                set_={name: table.c[name] + statement.excluded[name] for name in batch[0] if name not in keys},
+            ))
+
+def order_items(session: Session, order_id: int) -> List[Tuple[int, int, float]]:
+    return session.execute(select(OrderItem.product_id, OrderItem.quantity, OrderItem.subtotal)
+                           .where(OrderItem.order_id == order_id)).all()
+
+def rebuild_rollups(session: Session, batch_size: int = ROLLUP_REBUILD_BATCH) -> dict:
+    """
+    Recomputes the rollups from the order history and replaces them in one transaction.
+    Orders are streamed in id order, batch_size at a time with their items, so memory depends on
+    the number of buckets and products rather than on the number of orders.
+    Order writes wait until it commits, so none can land between the history it reads and the rollups it writes.
+    """
+    if session.get_bind().dialect.name == "postgresql":
+        session.execute(text("LOCK TABLE orders IN SHARE MODE"))
+    # Emptying the rollups before reading takes SQLite's single write lock, which holds back order writes too
+    for model in (SalesRollup, StatusRollup, ProductRollup):
+        session.execute(delete(model))
+
+    delta = RollupDelta()
+    last_id, orders = 0, 0
+    while True:
+        batch = session.execute(
+            select(Orders.id, Orders.created_at, Orders.total_amount, Orders.order_status, Orders.payment_status)
+            .where(Orders.id > last_id).order_by(Orders.id).limit(batch_size)).all()
+        if not batch:
+            break
+        items = defaultdict(list)
+        for item in session.execute(
+                select(OrderItem.order_id, OrderItem.product_id, OrderItem.quantity, OrderItem.subtotal)
+                .where(OrderItem.order_id.between(batch[0].id, batch[-1].id))):
+            items[item.order_id].append((item.product_id, item.quantity, item.subtotal))
+        for order in batch:
+            delta.add_order(order.id, order.created_at, order.total_amount, order.order_status,
+                            order.payment_status, items.get(order.id, ()))
+        orders += len(batch)
+        last_id = batch[-1].id
+
+    apply_rollups(session, delta)
+    session.commit()
+    return {"orders": orders, "sales_rows": len(delta.sales), "status_rows": len(delta.statuses),
+            "product_rows": len(delta.products)}
+
+def stats_range(granularity: RollupGranularity, start: Optional[datetime],
+                end: Optional[datetime]) -> Tuple[datetime, datetime, int]:
+    """Aligns a stats range to buckets, defaulting to the last DEFAULT_STATS_BUCKETS; returns it with its length."""
+    step = BUCKET_STEP[granularity]
+    end = bucket_start(end, granularity) if end is not None else bucket_start(datetime.utcnow(), granularity) + step
+    start = bucket_start(start, granularity) if start is not None else end - DEFAULT_STATS_BUCKETS[granularity] * step
+    buckets = (end - start) // step
+    if not 0 < buckets <= MAX_STATS_BUCKETS:
+        raise HTTPException(status_code=422, detail=f"The range must hold 1 to {MAX_STATS_BUCKETS} buckets")
+    return start, end, buckets
+
+def order_stats(session: Session, granularity: RollupGranularity, start: Optional[datetime],
+                end: Optional[datetime], top: int, top_by: TopProductsBy) -> OrderStats:
+    """
+    Reads the dashboard figures from the rollups: sales per bucket from start (inclusive) to end
+    (exclusive), defaulting to the last DEFAULT_STATS_BUCKETS buckets, the status counts and the top products.
+    The cost depends on the number of buckets and top, never on the number of orders.
+    """
+    step = BUCKET_STEP[granularity]
+    start, end, buckets = stats_range(granularity, start, end)
+
+    rows = {row.bucket: row for row in session.execute(
+        select(SalesRollup.bucket, func.sum(SalesRollup.orders).label("orders"),
+               func.sum(SalesRollup.revenue).label("revenue"), func.sum(SalesRollup.units).label("units"))
+        .where(SalesRollup.granularity == granularity, SalesRollup.bucket >= start, SalesRollup.bucket < end)
+        .group_by(SalesRollup.bucket))}
+    sales = []
+    for index in range(buckets):
+        bucket = start + index * step
+        row = rows.get(bucket)
+        sales.append(SalesBucket(bucket=bucket, orders=row.orders, revenue=row.revenue, units=row.units)
+                     if row is not None else SalesBucket(bucket=bucket, orders=0, revenue=0.0, units=0))
+
+    statuses = [StatusCount.model_validate(row, from_attributes=True) for row in session.execute(
+        select(StatusRollup.order_status, StatusRollup.payment_status, func.sum(StatusRollup.orders).label("orders"),
+               func.sum(StatusRollup.revenue).label("revenue"))
+        .group_by(StatusRollup.order_status, StatusRollup.payment_status)
+        .having(func.sum(StatusRollup.orders) != 0))]
+
+    return OrderStats(granularity=granularity, start=start, end=end, sales=sales, statuses=statuses,
+                      top_products=top_products(session, top, top_by), total_orders=sum(row.orders for row in statuses),
+                      total_revenue=sum(row.revenue for row in statuses))
+
+def top_products(session: Session, top: int, top_by: TopProductsBy) -> List[ProductSales]:
+    ranking = ProductRollup.revenue if top_by == TopProductsBy.revenue else ProductRollup.units
+    return [ProductSales.model_validate(row, from_attributes=True) for row in session.execute(
+        select(ProductRollup).order_by(ranking.desc(), ProductRollup.product_id.desc()).limit(top)).scalars()]
+
+def product_sales(session: Session, product_ids: List[int]) -> List[ProductSales]:
+    return [ProductSales.model_validate(row, from_attributes=True) for row in session.execute(
+        select(ProductRollup).where(ProductRollup.product_id.in_(product_ids))).scalars()]
+
+async def sharded_order_stats(granularity: RollupGranularity, start: Optional[datetime], end: Optional[datetime],
+                              top: int, top_by: TopProductsBy) -> OrderStats:
+    """
+    Adds up the figures of every order shard, read at once. The top products are exact: the shards' own
+    top lists are summed over all shards, and read deeper until no product missing from every list
+    could outrank the last one kept.
+    """
+    start, end, _ = stats_range(granularity, start, end)
+    parts = await shard_router.gather(order_stats, granularity, start, end, top, top_by)
+    lists, depth = [part.top_products for part in parts], top
+    while True:
+        candidates = sorted({product.product_id for listed in lists for product in listed})
+        totals: Dict[int, ProductSales] = {}
+        for rows in (await shard_router.gather(product_sales, candidates) if candidates else []):
+            for row in rows:
+                total = totals.setdefault(row.product_id, ProductSales(product_id=row.product_id, lines=0, units=0,
+                                                                       revenue=0.0))
+                total.lines += row.lines
+                total.units += row.units
+                total.revenue += row.revenue
+        ranked = sorted(totals.values(), key=lambda product: (getattr(product, top_by.value), product.product_id),
+                        reverse=True)[:top]
+        # A product in no shard's list sells at most the last listed figure of every shard that listed depth products
+        unseen = sum(getattr(listed[-1], top_by.value) for listed in lists if depth and len(listed) == depth)
+        if not unseen or (len(ranked) == top and getattr(ranked[-1], top_by.value) > unseen):
+            break
+        depth *= 4
+        lists = await shard_router.gather(top_products, depth, top_by)
+
+    statuses: Dict[Tuple, StatusCount] = {}
+    for part in parts:
+        for row in part.statuses:
+            total = statuses.setdefault((row.order_status, row.payment_status), StatusCount(
+                order_status=row.order_status, payment_status=row.payment_status, orders=0, revenue=0.0))
+            total.orders += row.orders
+            total.revenue += row.revenue
+    statuses = [row for row in statuses.values() if row.orders != 0]
+    sales = [SalesBucket(bucket=buckets[0].bucket, orders=sum(bucket.orders for bucket in buckets),
+                         revenue=sum(bucket.revenue for bucket in buckets),
+                         units=sum(bucket.units for bucket in buckets))
+             for buckets in zip(*(part.sales for part in parts))]
+    return OrderStats(granularity=granularity, start=start, end=end, sales=sales, statuses=statuses,
+                      top_products=ranked, total_orders=sum(row.orders for row in statuses),
+                      total_revenue=sum(row.revenue for row in statuses))
+
+if __name__ == "__main__":
+    # Backfills the rollups from the order history: python rollups.py [--batch-size N]
+    import argparse
+    import asyncio
+    from database import run_in_session
+
+    parser = argparse.ArgumentParser(description="Rebuilds the order rollup tables from the order history.")
+    parser.add_argument("--batch-size", type=int, default=ROLLUP_REBUILD_BATCH, help="orders read per query")
+    args = parser.parse_args()
+    if shard_router is not None:
+        # Every shard keeps the rollups of its own orders
+        print(asyncio.run(shard_router.gather(rebuild_rollups, args.batch_size)))
+    else:
+        print(asyncio.run(run_in_session(rebuild_rollups, args.batch_size)))
@@ -0,0 +1,291 @@
+from collections import defaultdict
+from hashlib import blake2b
+from typing import Callable, Dict, List, Optional, Sequence
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import make_url
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from database import (DATABASE_URL, IS_ASYNC, PoolMetrics, apply_migrations, build_engine, engine, extra_engines,
+                      pool_metrics, sync_engine)
+from models import BucketState, Orders, OrderItem, Shipping, ShardBucket
+from pagination import Page, encode_cursor
+import asyncio
+import heapq
+import math
+import os
+import time
+
+# Comma separated URLs of further order databases, with the same driver as DATABASE_URL, which is shard 0
+ORDER_SHARD_URLS = [url.strip() for url in os.getenv("ORDER_SHARD_URLS", "").split(",") if url.strip()]
+# Users are hashed into this many buckets, the unit shards own and reshard.py moves; it can never change
+SHARD_BUCKETS = 1024
+# How long a write to a bucket being moved waits for the move before failing with 503
+SHARD_MOVE_WAIT = float(os.getenv("SHARD_MOVE_WAIT", "10"))
+SHARD_RETRY_DELAY = 0.05
+
+class ShardMoved(Exception):
+    """Raised in a transaction on a shard that does not hold the bucket, or holds it but is moving it away."""
+    def __init__(self, bucket: int):
+        super().__init__(f"Bucket {bucket} is not served by this shard")
+        self.bucket = bucket
+
+def user_bucket(user_id: int) -> int:
+    """The bucket of a user, from a hash of the id so consecutive users spread over the shards."""
+    return int.from_bytes(blake2b(str(user_id).encode(), digest_size=8).digest(), "big") % SHARD_BUCKETS
+
+def id_bucket(row_id: int) -> int:
+    """The bucket an id was allocated from; ids of orders placed before sharding carry no bucket."""
+    return row_id % SHARD_BUCKETS
+
+def claim_bucket(session: Session, bucket: int, count: int = 0) -> List[int]:
+    """
+    Locks the bucket's row for the caller's write transaction and allocates count ids from it.
+    Raises ShardMoved unless this shard owns the bucket and is not moving it, so a write never lands on
+    a shard the bucket left, and a move waits for the writes already holding the lock.
+    Ids are unique across shards and carry the bucket: next_id * SHARD_BUCKETS + bucket.
+    """
+    next_id = session.execute(
+        update(ShardBucket)
+        .where(ShardBucket.bucket == bucket, ShardBucket.state == BucketState.owned)
+        .values(next_id=ShardBucket.next_id + count)
+        .returning(ShardBucket.next_id)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    if next_id is None:
+        raise ShardMoved(bucket)
+    return [sequence * SHARD_BUCKETS + bucket for sequence in range(next_id - count, next_id)]
+
+def assign_ids(session: Session, built):
+    """Numbers built (order, items) pairs from their users' buckets, locking the buckets in order."""
+    by_bucket = defaultdict(list)
+    for order, items in built:
+        by_bucket[user_bucket(order.user_id)].extend([order, *items])
+    for bucket in sorted(by_bucket):
+        rows = by_bucket[bucket]
+        for row, row_id in zip(rows, claim_bucket(session, bucket, len(rows))):
+            row.id = row_id
+
+def check_bucket(session: Session, bucket: int):
+    """
+    Raises ShardMoved unless this shard holds the bucket. Run after a read in the same transaction, it proves
+    the read saw the bucket's rows: a move drops them together with the bucket.
+    """
+    if session.execute(select(ShardBucket.state).where(ShardBucket.bucket == bucket)).first() is None:
+        raise ShardMoved(bucket)
+
+def read_bucket(session: Session, bucket: int, fn: Callable, *args, **kwargs):
+    result = fn(session, *args, **kwargs)
+    check_bucket(session, bucket)
+    return result
+
+def bucket_states(session: Session) -> list:
+    return session.execute(select(ShardBucket.bucket, ShardBucket.state)).all()
+
+def max_row_id(session: Session) -> int:
+    return max(session.execute(select(func.coalesce(func.max(model.id), 0))).scalar()
+               for model in (Orders, OrderItem, Shipping))
+
+def add_buckets(session: Session, buckets: List[int], next_id: int):
+    if buckets:
+        insert = postgresql_insert if session.get_bind().dialect.name == "postgresql" else sqlite_insert
+        session.execute(insert(ShardBucket.__table__).values(
+            [{"bucket": bucket, "next_id": next_id, "state": BucketState.owned} for bucket in buckets]
+        ).on_conflict_do_nothing(index_elements=["bucket"]))
+    session.commit()
+
+def order_user(session: Session, order_id: int) -> Optional[int]:
+    return session.execute(select(Orders.user_id).where(Orders.id == order_id)).scalar()
+
+class Shard:
+    """One order database, with its own engine and pool; shard 0 is the service's DATABASE_URL."""
+    def __init__(self, index: int, url: str):
+        self.index = index
+        self.name = make_url(url).render_as_string(hide_password=True)
+        if url == DATABASE_URL:
+            self.engine, self.sync_engine, self.pool_metrics = engine, sync_engine, pool_metrics
+        else:
+            self.pool_metrics = PoolMetrics()
+            self.engine, self.sync_engine = build_engine(url, self.pool_metrics)
+            extra_engines.append((self.sync_engine, self.pool_metrics))
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """Runs fn(session, *args, **kwargs) in a new session on this shard, as run_in_session does on the primary."""
+        if IS_ASYNC:
+            async with AsyncSession(self.engine, expire_on_commit=False) as session:
+                return await session.run_sync(fn, *args, **kwargs)
+
+        def run():
+            with Session(self.engine, expire_on_commit=False) as session:
+                return fn(session, *args, **kwargs)
+        return await run_in_threadpool(run)
+
+    async def migrate(self, migrations) -> int:
+        if IS_ASYNC:
+            async with self.engine.connect() as connection:
+                return await connection.run_sync(apply_migrations, migrations)
+        with self.engine.connect() as connection:
+            return apply_migrations(connection, migrations)
+
+class ShardRouter:
+    """
+    Sends the orders of each user to the shard owning the user's bucket.
+    The bucket map is cached and reloaded when a shard answers ShardMoved, so every worker follows
+    the moves made by reshard.py without any other coordination. Orders, their items and shipping,
+    and the outbox, rollups and version stamps their writes touch, all live on the user's shard.
+    """
+    def __init__(self, shards: List[Shard]):
+        self.shards = shards
+        self.owners: Dict[int, Shard] = {}
+        self.loaded_at = -math.inf
+        self.lock = asyncio.Lock()
+        self.reloads = 0
+        self.move_waits = 0
+
+    async def initialize(self, migrations):
+        """
+        Migrates every shard and, the first time, assigns the buckets: all to shard 0 when it already holds
+        orders, which reshard.py then spreads out, or else evenly. Ids start above any existing one.
+        """
+        for shard in self.shards:
+            await shard.migrate(migrations)
+        if not any(await self.gather(bucket_states)):
+            existing = await self.shards[0].run(max_row_id)
+            for shard in self.shards:
+                buckets = [bucket for bucket in range(SHARD_BUCKETS)
+                           if (0 if existing else bucket % len(self.shards)) == shard.index]
+                await shard.run(add_buckets, buckets, existing // SHARD_BUCKETS + 1)
+        await self.load()
+
+    async def gather(self, fn: Callable, *args, **kwargs) -> list:
+        """Runs fn(session, *args, **kwargs) on every shard at once; returns the results in shard order."""
+        return list(await asyncio.gather(*(shard.run(fn, *args, **kwargs) for shard in self.shards)))
+
+    async def load(self):
+        """Reads the bucket map from the shards; a bucket held by two shards mid-move belongs to the one owning it."""
+        started = time.monotonic()
+        owners = {}
+        for shard, states in zip(self.shards, await self.gather(bucket_states)):
+            for bucket, state in states:
+                if state == BucketState.owned or bucket not in owners:
+                    owners[bucket] = shard
+        self.owners = owners
+        self.loaded_at = started
+        self.reloads += 1
+
+    async def refresh(self, since: float):
+        """Reloads the map unless a reload started after since, so concurrent retries share one reload."""
+        async with self.lock:
+            if self.loaded_at <= since:
+                await self.load()
+
+    async def owner(self, bucket: int) -> Shard:
+        shard = self.owners.get(bucket)
+        if shard is None:
+            await self.refresh(time.monotonic())
+            shard = self.owners.get(bucket)
+        if shard is None:
+            raise HTTPException(status_code=503, detail=f"No order shard holds bucket {bucket}")
+        return shard
+
+    async def wait_for_move(self, shard: Shard, bucket: int, failed_at: float, deadline: float):
+        """After a ShardMoved: reloads the map, and if the bucket is still on that shard it is moving, so waits."""
+        self.move_waits += 1
+        await self.refresh(failed_at)
+        if self.owners.get(bucket) is shard:
+            if time.monotonic() >= deadline:
+                raise HTTPException(status_code=503, detail="These orders are being moved to another shard, "
+                                                            "retry shortly")
+            await asyncio.sleep(SHARD_RETRY_DELAY)
+
+    async def write(self, bucket: int, fn: Callable, *args, **kwargs):
+        """Runs the write fn(session, ...) on the bucket's shard; fn claims the bucket with claim_bucket."""
+        deadline = time.monotonic() + SHARD_MOVE_WAIT
+        while True:
+            shard = await self.owner(bucket)
+            try:
+                return await shard.run(fn, *args, **kwargs)
+            except ShardMoved:
+                await self.wait_for_move(shard, bucket, time.monotonic(), deadline)
+
+    async def read(self, bucket: int, fn: Callable, *args, **kwargs):
+        """Runs the read fn(session, ...) on the bucket's shard, retried elsewhere if the bucket had moved."""
+        return await self.write(bucket, read_bucket, bucket, fn, *args, **kwargs)
+
+    async def write_order(self, order_id: int, fn: Callable, *args, **kwargs):
+        """
+        Runs a write on one order, fn(session, ...), on the shard of the bucket in the order's id.
+        Orders placed before sharding, whose ids carry no bucket, are found on whichever shard holds them.
+        """
+        try:
+            return await self.write(id_bucket(order_id), fn, *args, **kwargs)
+        except HTTPException as e:
+            if e.status_code != 404:
+                raise
+        user_id = next((user for user in await self.gather(order_user, order_id) if user is not None), None)
+        if user_id is None:
+            raise HTTPException(status_code=404, detail="Order not found")
+        return await self.write(user_bucket(user_id), fn, *args, **kwargs)
+
+    async def write_groups(self, items: Sequence, bucket_of: Callable, fn: Callable, *args) -> list:
+        """
+        Runs fn(session, group, *args) for the items of each shard, on the shards at once, and returns the
+        per-item results in the order of items. Every shard commits its own group, so a batch spanning
+        shards is atomic per shard only.
+        """
+        results: List = [None] * len(items)
+        pending = list(range(len(items)))
+        deadline = time.monotonic() + SHARD_MOVE_WAIT
+        while pending:
+            groups: Dict[Shard, List[int]] = defaultdict(list)
+            for index in pending:
+                groups[await self.owner(bucket_of(items[index]))].append(index)
+            outcomes = await asyncio.gather(
+                *(shard.run(fn, [items[index] for index in group], *args) for shard, group in groups.items()),
+                return_exceptions=True)
+            failed_at, pending = time.monotonic(), []
+            for (shard, group), outcome in zip(groups.items(), outcomes):
+                if isinstance(outcome, ShardMoved):
+                    pending.extend(group)
+                    await self.wait_for_move(shard, outcome.bucket, failed_at, deadline)
+                elif isinstance(outcome, BaseException):
+                    raise outcome
+                else:
+                    for index, result in zip(group, outcome):
+                        results[index] = result
+        return results
+
+    def stats(self) -> dict:
+        counts = defaultdict(int)
+        for shard in self.owners.values():
+            counts[shard.index] += 1
+        return {"enabled": True, "buckets": SHARD_BUCKETS, "map_reloads": self.reloads,
+                "move_waits": self.move_waits,
+                "shards": [{"shard": shard.name, "buckets": counts[shard.index],
+                            "pool": shard.pool_metrics.snapshot(shard.sync_engine.pool)} for shard in self.shards]}
+
+shard_router = (ShardRouter([Shard(index, url) for index, url in enumerate([DATABASE_URL] + ORDER_SHARD_URLS)])
+                if ORDER_SHARD_URLS else None)
+
+def shard_stats() -> dict:
+    return shard_router.stats() if shard_router is not None else {"enabled": False}
+
+def merge_pages(pages: Sequence[Page], keys: Sequence[str], limit: int) -> Page:
+    """
+    Merges the pages every shard returned for the same cursor into the page one database would have returned,
+    newest first by keys. A row read from two shards while its bucket moves is kept once.
+    """
+    def sort_key(row):
+        return tuple(getattr(row, key) for key in keys)
+
+    items, last = [], None
+    for row in heapq.merge(*(page.items for page in pages), key=sort_key, reverse=True):
+        if sort_key(row) != last:
+            items.append(row)
+            last = sort_key(row)
+    more = len(items) > limit or any(page.next_cursor for page in pages)
+    items = items[:limit]
+    return Page(items=items, next_cursor=encode_cursor(list(sort_key(items[-1]))) if more and items else None)
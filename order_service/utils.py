@@ -1,22 +1,162 @@
-import requests
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+import asyncio
+import os
+import random
+import time
 
-def call_service(url: str, method: str = "GET", data: dict = None, headers: dict = None):
+import httpx
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+RETRY_STATUS_CODES = {502, 503, 504}
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling the service while its circuit breaker is open."""
+
+class ServiceCallError(RuntimeError):
+    """
+    Raised by call_service when a call failed. status_code is the service's answer, or None when there was
+    none (a timeout, a dropped connection, an open circuit), in which case a write may or may not have happened.
+    """
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+class CircuitBreaker:
+    """
+    Fails fast after failure_threshold consecutive failures, for reset_timeout seconds.
+    After that a single trial call is let through; it closes the circuit on success or re-opens it on failure.
+    """
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        state = self.state
+        if state == "open" or (state == "half-open" and self.trial_in_flight):
+            raise CircuitOpenError("Circuit open, service unavailable")
+        if state == "half-open":
+            self.trial_in_flight = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def release_trial(self):
+        """Lets the next call be the trial after one that ended without an outcome, e.g. by being cancelled."""
+        self.trial_in_flight = False
+
+class ServiceClient:
+    """
+    Async client for one downstream service.
+    Keeps a keep-alive connection pool, applies a timeout to every call, retries idempotent calls
+    with jittered exponential backoff and fails fast through a circuit breaker while the service is down.
+    """
+    def __init__(self, base_url: str, timeout: float = 5.0, retries: int = 2, backoff: float = 0.1,
+                 max_connections: int = 100, breaker: Optional[CircuitBreaker] = None):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def request(self, method: str, path: str, data: dict = None, headers: dict = None,
+                      timeout: Optional[float] = None, idempotent: Optional[bool] = None):
+        """
+        Sends a request and returns the decoded JSON body.
+        Only idempotent calls are retried; pass idempotent=True for a POST that is safe to repeat.
+        """
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        attempts = 1 + (self.retries if idempotent else 0)
+
+        for attempt in range(attempts):
+            self.breaker.before_call()
+            try:
+                response = await self.client.request(method, path, json=data, headers=headers,
+                                                     timeout=timeout if timeout is not None else self.timeout)
+            except httpx.TransportError as e:
+                self.breaker.record_failure()
+                error = e
+            except BaseException:
+                # Cancelled, or failed before the service answered: neither a success nor a failure of it
+                self.breaker.release_trial()
+                raise
+            else:
+                if response.status_code < 500:
+                    self.breaker.record_success()
+                    response.raise_for_status()
+                    return response.json()
+                self.breaker.record_failure()
+                error = httpx.HTTPStatusError(f"Server error {response.status_code}",
+                                              request=response.request, response=response)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    raise error
+
+            if attempt + 1 < attempts:
+                await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+        raise error
+
+    async def aclose(self):
+        await self.client.aclose()
+
+_clients: Dict[str, ServiceClient] = {}
+
+def get_client(base_url: str) -> ServiceClient:
+    """Returns the shared client, and so the connection pool, for a target service."""
+    client = _clients.get(base_url)
+    if client is None:
+        client = _clients[base_url] = ServiceClient(
+            base_url,
+            timeout=float(os.getenv("SERVICE_TIMEOUT", "5")),
+            retries=int(os.getenv("SERVICE_RETRIES", "2")),
+        )
+    return client
+
+async def close_clients():
+    """Closes every pooled client; called on application shutdown."""
+    for client in _clients.values():
+        await client.aclose()
+    _clients.clear()
+
+async def call_service(url: str, method: str = "GET", data: dict = None, headers: dict = None,
+                       timeout: Optional[float] = None, idempotent: Optional[bool] = None):
     """
     Utility function to call an external service.
+    Calls to the same scheme and host share one pooled client.
     """
+    if method.upper() not in IDEMPOTENT_METHODS | {"POST"}:
+        raise ValueError("Unsupported HTTP method")
+
+    parts = urlsplit(url)
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
     try:
-        if method == "GET":
-            response = requests.get(url, headers=headers)
-        elif method == "POST":
-            response = requests.post(url, json=data, headers=headers)
-        elif method == "PUT":
-            response = requests.put(url, json=data, headers=headers)
-        elif method == "DELETE":
-            response = requests.delete(url, headers=headers)
-        else:
-            raise ValueError("Unsupported HTTP method")
-
-        response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
-        raise RuntimeError(f"Service call failed: {str(e)}")
\ No newline at end of file
+        return await get_client(f"{parts.scheme}://{parts.netloc}").request(
+            method, path, data=data, headers=headers, timeout=timeout, idempotent=idempotent)
+    except (httpx.HTTPError, CircuitOpenError) as e:
+        status_code = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+        raise ServiceCallError(f"Service call failed: {str(e)}", status_code)
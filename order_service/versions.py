@@ -0,0 +1,85 @@
+from hashlib import blake2b
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+from fastapi import Request, Response
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session
+from database import DBSession, run_db
+from models import CollectionVersion
+
+# A collection's stamp is spread over this many rows by item id, so writes to different items rarely
+# wait on the same row lock; readers of the whole collection read every stripe
+VERSION_STRIPES = 16
+
+def stripe_key(collection: str, item_id: int) -> str:
+    """The key of the collection stripe bumped when the item changes."""
+    return f"{collection}#{item_id % VERSION_STRIPES}"
+
+def collection_keys(collection: str) -> List[str]:
+    """The keys to read for a version of the whole collection."""
+    return [f"{collection}#{stripe}" for stripe in range(VERSION_STRIPES)]
+
+def bump_versions(session: Session, keys: Iterable[str]):
+    """
+    Bumps the version stamps a write changes, in the write's own transaction, so readers never see
+    the new data under the old stamp. Stamps are bumped in key order, so concurrent writers lock
+    shared stamps in the same order.
+    """
+    keys = sorted(set(keys))
+    if not keys:
+        return
+    insert = postgresql_insert if session.get_bind().dialect.name == "postgresql" else sqlite_insert
+    table = CollectionVersion.__table__
+    statement = insert(table).values([{"key": key, "version": 1} for key in keys])
+    session.execute(statement.on_conflict_do_update(index_elements=["key"],
+                                                    set_={"version": table.c.version + 1}))
+
+def read_versions(session: Session, keys: Sequence[str]) -> str:
+    """Returns the stamps of keys as one token, with 0 for keys never written, in a single primary key query."""
+    stamps = dict(session.execute(
+        select(CollectionVersion.key, CollectionVersion.version).where(CollectionVersion.key.in_(keys))).all())
+    return ".".join(str(stamps.get(key, 0)) for key in keys)
+
+def versioned(session: Session, keys: Sequence[str], fn: Callable, *args, **kwargs) -> Tuple[Optional[str], object]:
+    """
+    Runs fn(session, *args, **kwargs) between two reads of the keys' stamps and returns (token, result).
+    The token is None when a write committed in between, as the result may then be newer than the stamps.
+    """
+    before = read_versions(session, keys)
+    result = fn(session, *args, **kwargs)
+    return (before if read_versions(session, keys) == before else None), result
+
+def make_etag(request: Request, token: Optional[str]) -> Optional[str]:
+    """A strong ETag for the response to request, from a stamps token; each URL gets tags of its own."""
+    if token is None:
+        return None
+    digest = blake2b(f"{request.url.path}?{request.url.query}|{token}".encode(), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+def is_fresh(request: Request, etag: Optional[str]) -> bool:
+    """Whether the request's If-None-Match holds etag, compared weakly as GET requests are."""
+    header = request.headers.get("if-none-match")
+    if not header or etag is None:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return "*" in tags or etag in tags
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
+
+async def check_not_modified(request: Request, session: DBSession, keys: Sequence[str]) -> Optional[Response]:
+    """
+    Answers a conditional GET whose If-None-Match is still current with a 304, after reading only the stamps.
+    Returns None, at no cost for requests without If-None-Match, when the handler has to build the response.
+    """
+    if "if-none-match" not in request.headers:
+        return None
+    etag = make_etag(request, await run_db(session, read_versions, keys))
+    return not_modified(etag) if is_fresh(request, etag) else None
+
+def tagged(result, response: Response, etag: Optional[str]):
+    """Sets the ETag header of a handler's result, whether the handler returns a Response or a model."""
+    if etag is not None:
+        (result if isinstance(result, Response) else response).headers["ETag"] = etag
+    return result
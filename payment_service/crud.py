@@ -0,0 +1,128 @@
+from fastapi import HTTPException
+from sqlmodel import Session, update
+from typing import Optional, Tuple
+from models import Payment, PaymentMethod, PaymentUpdate, PaymentStatus, PAYMENT_TRANSITIONS, IdempotencyKey
+from pagination import Page, paginate
+from outbox import record_event
+from idempotency import store_response
+from serialization import model_columns
+
+def list_payments(session: Session, order_id: Optional[int], payment_status: Optional[PaymentStatus],
+                  cursor: Optional[str], limit: int, rows: bool = False) -> Page:
+    """
+    Retrieves a page of payments from the database, newest first, optionally filtered.
+    With rows, the page holds column rows for page_response instead of Payment objects.
+    """
+    # Use the session to query the database
+    query = session.query(*model_columns(Payment)) if rows else session.query(Payment)
+    if order_id is not None:
+        query = query.filter(Payment.order_id == order_id)
+    if payment_status is not None:
+        query = query.filter(Payment.payment_status == payment_status)
+
+    return paginate(query, [Payment.id], limit, cursor)
+
+def create_payment_method(session: Session, payment_method_data: PaymentMethod) -> PaymentMethod:
+    """create payment method into the database."""
+    # Use the session to add the new payment method
+    session.add(payment_method_data)
+    session.commit()
+    session.refresh(payment_method_data)
+
+    return payment_method_data
+
+def update_payment_method(session: Session, payment_mtd_id: int, payment_method_data: PaymentMethod) -> PaymentMethod:
+    """update payment method into the database."""
+    # Use the session to query the database
+    existing_payment_method = session.get(PaymentMethod, payment_mtd_id)
+    if not existing_payment_method:
+        raise HTTPException(status_code=404, detail="Payment method not found")
+    payment_method_update = payment_method_data.model_dump(exclude_unset=True)
+    existing_payment_method.sqlmodel_update(payment_method_update)
+    session.add(existing_payment_method)
+    session.commit()
+    session.refresh(existing_payment_method)
+
+    return existing_payment_method
+
+def create_payment(session: Session, payment_data: Payment,
+                   idempotency: Optional[IdempotencyKey] = None) -> Payment:
+    """create payment into the database."""
+    # Use the session to add the new payment
+    session.add(payment_data)
+    session.flush()
+    record_event(session, "payment.created", payment_data.id, payment_data)
+    store_response(session, idempotency, payment_data)
+    session.commit()
+    session.refresh(payment_data)
+
+    return payment_data
+
+def change_status(session: Session, payment_id: int, payment_update: dict,
+                  expected_status: Optional[PaymentStatus]) -> Tuple[Payment, bool]:
+    """
+    Applies an update that changes payment_status as one compare-and-set UPDATE,
+    guarded on the current status being one the new status may follow (or expected_status, if given).
+    Concurrent webhooks for the same payment therefore never apply a stale or out-of-order transition.
+    Returns the payment and whether it changed. When it is already in the requested status, only the
+    other fields of the update are applied, and it is unchanged if they already hold those values.
+    """
+    new_status = payment_update["payment_status"]
+    allowed = [status for status, targets in PAYMENT_TRANSITIONS.items()
+               if new_status in targets and (expected_status is None or status == expected_status)]
+    result = session.execute(
+        update(Payment)
+        .where(Payment.id == payment_id, Payment.payment_status.in_(allowed))
+        .values(**payment_update)
+        .execution_options(synchronize_session=False)
+    )
+    existing_payment = session.get(Payment, payment_id, populate_existing=True)
+    if not existing_payment:
+        raise HTTPException(status_code=404, detail="Payment not found")
+    if result.rowcount == 1:
+        return existing_payment, True
+
+    # A redelivered webhook for a transition that already happened is a no-op, not a conflict
+    if existing_payment.payment_status == new_status and expected_status is None:
+        others = {field: value for field, value in payment_update.items()
+                  if field != "payment_status" and getattr(existing_payment, field) != value}
+        if not others:
+            return existing_payment, False
+        existing_payment.sqlmodel_update(others)
+        session.add(existing_payment)
+        session.flush()
+        return existing_payment, True
+    raise HTTPException(status_code=409, detail=f"Cannot change payment from {existing_payment.payment_status.value} "
+                                                f"to {new_status.value}")
+
+def update_payment(session: Session, payment_id: int, payment_data: PaymentUpdate,
+                   idempotency: Optional[IdempotencyKey] = None) -> Payment:
+    """update payment into the database."""
+    payment_update = payment_data.model_dump(exclude_unset=True)
+    expected_status = payment_update.pop("expected_status", None)
+    if "payment_status" in payment_update and payment_update["payment_status"] is None:
+        raise HTTPException(status_code=422, detail="payment_status cannot be null")
+    if expected_status is not None and "payment_status" not in payment_update:
+        raise HTTPException(status_code=422, detail="expected_status needs a payment_status to change to")
+
+    if "payment_status" in payment_update:
+        existing_payment, changed = change_status(session, payment_id, payment_update, expected_status)
+        if not changed:
+            store_response(session, idempotency, existing_payment)
+            session.commit()
+            return existing_payment
+    else:
+        # Use the session to query the database
+        existing_payment = session.get(Payment, payment_id)
+        if not existing_payment:
+            raise HTTPException(status_code=404, detail="Payment not found")
+        existing_payment.sqlmodel_update(payment_update)
+        session.add(existing_payment)
+        session.flush()
+
+    record_event(session, "payment.updated", existing_payment.id, existing_payment)
+    store_response(session, idempotency, existing_payment)
+    session.commit()
+    session.refresh(existing_payment)
+
+    return existing_payment
@@ -0,0 +1,157 @@
+from collections import defaultdict
+from contextlib import suppress
+from datetime import datetime
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+from sqlmodel import SQLModel, Field
+import asyncio
+import fcntl
+import os
+
+POLL_INTERVAL = 0.05
+
+class Event(SQLModel):
+    """
+    An event passed from a service's outbox to the notification consumers.
+    id is unique per event and stays the same when the event is redelivered, so consumers deduplicate on it.
+    """
+    id: str
+    topic: str
+    key: str
+    payload: dict = Field(default_factory=dict)
+    created_at: datetime
+
+class Broker:
+    """
+    Interface of the message broker between outbox relays and consumers.
+    Consumers fetch the events after their group's committed position and commit once they have handled them,
+    so an event is delivered again until it is committed (at-least-once).
+    A Kafka or Redis streams implementation plugs in here.
+    """
+    async def publish(self, events: List[Event]):
+        raise NotImplementedError
+
+    async def fetch(self, group: str, max_events: int, timeout: float) -> List[Event]:
+        """Returns up to max_events uncommitted events, waiting up to timeout seconds for new ones."""
+        raise NotImplementedError
+
+    async def commit(self, group: str):
+        """Acknowledges every event returned by the group's last fetch."""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+class InMemoryBroker(Broker):
+    """Keeps events in a list in this process; for tests and single-process setups."""
+    def __init__(self):
+        self.events: List[Event] = []
+        self.committed: Dict[str, int] = defaultdict(int)
+        self.fetched: Dict[str, int] = {}
+        self.condition = asyncio.Condition()
+
+    async def publish(self, events: List[Event]):
+        async with self.condition:
+            self.events.extend(events)
+            self.condition.notify_all()
+
+    async def fetch(self, group: str, max_events: int, timeout: float) -> List[Event]:
+        async with self.condition:
+            position = self.committed[group]
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.condition.wait_for(lambda: position < len(self.events)), timeout)
+            events = self.events[position:position + max_events]
+            self.fetched[group] = position + len(events)
+            return events
+
+    async def commit(self, group: str):
+        if group in self.fetched:
+            self.committed[group] = self.fetched.pop(group)
+
+class FileBroker(Broker):
+    """
+    Appends events as JSON lines to a local file shared by producers and consumers, e.g. on a shared volume.
+    Each group's committed byte offset is kept next to it in <path>.<group>.offset.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.fetched: Dict[str, int] = {}
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def offset_path(self, group: str) -> str:
+        return f"{self.path}.{group}.offset"
+
+    def read_offset(self, group: str) -> int:
+        try:
+            with open(self.offset_path(group)) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def write_offset(self, group: str, offset: int):
+        # Written to a temporary file and renamed, so a crash never leaves a torn offset behind
+        tmp_path = f"{self.offset_path(group)}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(offset))
+        os.replace(tmp_path, self.offset_path(group))
+
+    def append(self, events: List[Event]):
+        data = "".join(event.model_dump_json() + "\n" for event in events).encode()
+        with open(self.path, "ab") as f:
+            # Several processes append to the same file, so each batch is written under an exclusive lock
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(data)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def read(self, offset: int, max_events: int):
+        """Reads up to max_events complete lines from offset; returns the events and the offset after them."""
+        events = []
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                while len(events) < max_events:
+                    line = f.readline()
+                    # A line without its newline is still being written
+                    if not line.endswith(b"\n"):
+                        break
+                    offset += len(line)
+                    events.append(Event.model_validate_json(line))
+        except FileNotFoundError:
+            pass
+        return events, offset
+
+    async def publish(self, events: List[Event]):
+        await asyncio.to_thread(self.append, events)
+
+    async def fetch(self, group: str, max_events: int, timeout: float) -> List[Event]:
+        offset = await asyncio.to_thread(self.read_offset, group)
+        deadline = asyncio.get_running_loop().time() + timeout
+        while True:
+            events, next_offset = await asyncio.to_thread(self.read, offset, max_events)
+            if events or asyncio.get_running_loop().time() >= deadline:
+                self.fetched[group] = next_offset
+                return events
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async def commit(self, group: str):
+        if group in self.fetched:
+            await asyncio.to_thread(self.write_offset, group, self.fetched.pop(group))
+
+def broker_from_url(url: Optional[str]) -> Optional[Broker]:
+    """
+    Builds the broker for EVENT_BROKER_URL: memory:// or file:///path/to/events.jsonl.
+    Returns None when no broker is configured.
+    """
+    if not url:
+        return None
+    parts = urlsplit(url)
+    if parts.scheme == "memory":
+        return InMemoryBroker()
+    if parts.scheme == "file":
+        return FileBroker(parts.netloc + parts.path)
+    raise ValueError(f"Unsupported EVENT_BROKER_URL: {url}")
+
+broker = broker_from_url(os.getenv("EVENT_BROKER_URL"))
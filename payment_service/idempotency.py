@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+from typing import Callable, Optional, Tuple
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select, delete
+from models import IdempotencyKey
+import hashlib
+import json
+import os
+
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+
+def request_hash(*parts) -> str:
+    """Fingerprints a request, so a key reused for a different request can be told apart from a retry."""
+    canonical = json.dumps(jsonable_encoder(parts), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def find_key(session: Session, key: str) -> Optional[IdempotencyKey]:
+    """Looks up an unexpired key by primary key; this read is all a replay costs."""
+    record = session.get(IdempotencyKey, key)
+    if record is None or record.expires_at <= datetime.utcnow():
+        return None
+    return record
+
+def stored_response(record: IdempotencyKey, scope: str, fingerprint: str) -> dict:
+    if record.scope != scope or record.request_hash != fingerprint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    return record.response
+
+def store_response(session: Session, record: Optional[IdempotencyKey], response):
+    """Saves the response with the key, in the caller's transaction; does nothing without a key."""
+    if record is not None:
+        record.response = jsonable_encoder(response)
+        session.add(record)
+
+def run_idempotent(session: Session, key: str, scope: str, fingerprint: str,
+                   fn: Callable, *args) -> Tuple[dict, bool]:
+    """
+    Runs fn(session, *args, idempotency=record) once per key and returns (response, replayed).
+    fn stores its response on the record with store_response before committing, so the write and the key
+    commit together. A concurrent request with the same key fails on the key's primary key and replays
+    the winner's response instead.
+    """
+    record = session.get(IdempotencyKey, key)
+    if record is not None:
+        if record.expires_at > datetime.utcnow():
+            return stored_response(record, scope, fingerprint), True
+        session.delete(record)
+        session.flush()
+
+    record = IdempotencyKey(key=key, scope=scope, request_hash=fingerprint,
+                            expires_at=datetime.utcnow() + timedelta(seconds=IDEMPOTENCY_TTL))
+    try:
+        fn(session, *args, idempotency=record)
+    except IntegrityError:
+        session.rollback()
+        record = find_key(session, key)
+        if record is None:
+            raise
+        return stored_response(record, scope, fingerprint), True
+    return record.response, False
+
+def delete_expired(session: Session, batch_size: int = 1000) -> int:
+    """Deletes up to batch_size expired keys; returns how many were deleted."""
+    expired = session.exec(
+        select(IdempotencyKey.key)
+        .where(IdempotencyKey.expires_at <= datetime.utcnow())
+        .limit(batch_size)
+    ).all()
+    if expired:
+        session.execute(delete(IdempotencyKey).where(IdempotencyKey.key.in_(expired)))
+        session.commit()
+    return len(expired)
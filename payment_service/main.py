@@ -1,17 +1,41 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException
-from sqlmodel import SQLModel, create_engine, Session
-from contextlib import asynccontextmanager
-from typing import List
-from models import Payment, PaymentMethod, PaymentUpdate
+from fastapi import FastAPI, APIRouter, Depends, Header, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime
+from typing import Callable, Optional
+from models import Payment, PaymentMethod, PaymentUpdate, PaymentStatus
+from pagination import Page, DEFAULT_LIMIT, MAX_LIMIT
+from database import (get_session, get_read_session, route_reads, run_db, run_migrations,
+                      run_in_session, pool_stats, replica_stats, DBSession)
+from migrations import MIGRATIONS
+from instrumentation import instrument
+from admission import admission_control, admission_stats
+from idempotency import run_idempotent, request_hash, delete_expired
+from outbox import outbox_relay
+from serialization import FAST_JSON_ENABLED, page_response
+from export import ExportFormat, export_response
+import crud
+import asyncio
+import logging
 import os
 
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./database.db")
+IDEMPOTENCY_SWEEP_INTERVAL = float(os.getenv("IDEMPOTENCY_SWEEP_INTERVAL", "300"))
 
-engine = create_engine(DATABASE_URL, echo=True, connect_args={"check_same_thread": False})
+logger = logging.getLogger(__name__)
 
-def create_db_and_tables():
-    """Creates the database tables based on your SQLModel definitions."""
-    SQLModel.metadata.create_all(engine)
+async def create_db_and_tables():
+    """Brings the database schema up to date by applying any pending migrations."""
+    await run_migrations(MIGRATIONS)
+
+async def sweep_idempotency_keys():
+    """Background task that periodically deletes expired idempotency keys in batches."""
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_SWEEP_INTERVAL)
+        try:
+            while await run_in_session(delete_expired):
+                pass
+        except Exception:
+            logger.exception("Failed to delete expired idempotency keys")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -19,78 +43,112 @@ async def lifespan(app: FastAPI):
     Function that runs on application startup and shutdown.
     It's the perfect place to create the database tables.
     """
-    create_db_and_tables()
+    await create_db_and_tables()
+    relay = asyncio.create_task(outbox_relay.run()) if outbox_relay.broker is not None else None
+    sweeper = asyncio.create_task(sweep_idempotency_keys())
     yield
+    for task in (relay, sweeper):
+        if task is not None:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
 
 app = FastAPI(title="Payments Service", lifespan=lifespan)
-
-def get_session():
-    """
-    Dependency function to get a database session.
-    It creates a session and ensures it's closed after the request.
-    """
-    with Session(engine) as session:
-        yield session
+admission_control(app, critical=["POST /api/v1/payment", "PUT /api/v1/payment"],
+                  browse=["GET /api/v1/payment/export"])
+instrument(app)
+route_reads(app)
+
+@app.get("/metrics/pool")
+async def get_pool_stats():
+    """Returns connection pool checkout and wait metrics, used to size DB_POOL_SIZE per service."""
+    return pool_stats()
+
+@app.get("/metrics/replicas")
+async def get_replica_stats():
+    """Returns the read replicas' health and lag, and how many reads were pinned to or fell back to the primary."""
+    return replica_stats()
+
+@app.get("/metrics/admission")
+async def get_admission_stats():
+    """Returns the requests admitted, queued, shed and rate limited by priority, and the slots in use."""
+    return admission_stats()
+
+@app.get("/metrics/outbox")
+async def get_outbox_stats():
+    """Returns how many outbox events the relay has published to the broker."""
+    return outbox_relay.stats()
 
 router = APIRouter()
 
-@router.get("/payment", response_model=List[Payment])
-def get_history_payment(session: Session = Depends(get_session)):
-    """Retrieves list of order from the database, filtered by user_id"""
-    # Use the session to query the database
-    query = session.query(Payment)
-
-    return query.all()
+async def run_payment_write(session: DBSession, idempotency_key: Optional[str], scope: str, fingerprint: str,
+                            fn: Callable, *args):
+    """
+    Runs a payment write, at most once per Idempotency-Key when the header is given.
+    A replay returns the stored response verbatim from a single key lookup, without running the write.
+    """
+    if idempotency_key is None:
+        result = await run_db(session, fn, *args)
+        outbox_relay.notify()
+        return result
+
+    # The first response is sent from the stored copy too, so every replay is byte-for-byte the same
+    response, replayed = await run_db(session, run_idempotent, idempotency_key, scope, fingerprint, fn, *args)
+    if replayed:
+        return JSONResponse(response, headers={"Idempotent-Replayed": "true"})
+    outbox_relay.notify()
+    return JSONResponse(response)
+
+@router.get("/payment", response_model=Page[Payment])
+async def get_history_payment(order_id: Optional[int] = None,
+                              payment_status: Optional[PaymentStatus] = None,
+                              cursor: Optional[str] = None,
+                              limit: int = Query(default=DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+                              session: DBSession = Depends(get_read_session)):
+    """Retrieves a page of payments from the database, newest first, optionally filtered"""
+    if FAST_JSON_ENABLED:
+        return page_response(await run_db(session, crud.list_payments, order_id, payment_status, cursor, limit,
+                                          rows=True))
+    return await run_db(session, crud.list_payments, order_id, payment_status, cursor, limit)
+
+@router.get("/payment/export", response_class=StreamingResponse)
+async def export_payments(format: ExportFormat = ExportFormat.ndjson,
+                          created_from: Optional[datetime] = None,
+                          created_to: Optional[datetime] = None,
+                          after_id: Optional[int] = None):
+    """Streams all payments in id order as NDJSON or CSV, optionally by created_at range and resuming after an id."""
+    return export_response(Payment, "payments", format, created_from, created_to, after_id)
 
 @router.post("/payment/method", response_model=PaymentMethod)
-def create_payment_method(payment_method_data: PaymentMethod, session: Session = Depends(get_session)):
+async def create_payment_method(payment_method_data: PaymentMethod, session: DBSession = Depends(get_session)):
     """create payment method into the database."""
-    # Use the session to add the new payment method
-    session.add(payment_method_data)
-    session.commit()
-    session.refresh(payment_method_data)
-
-    return payment_method_data
+    return await run_db(session, crud.create_payment_method, payment_method_data)
 
 @router.put("/payment/method", response_model=PaymentMethod)
-def update_payment_method(payment_mtd_id: int, payment_method_data: PaymentMethod, session: Session = Depends(get_session)):
+async def update_payment_method(payment_mtd_id: int, payment_method_data: PaymentMethod, session: DBSession = Depends(get_session)):
     """update payment method into the database."""
-    # Use the session to query the database
-    existing_payment_method = session.get(PaymentMethod, payment_mtd_id)
-    if not existing_payment_method:
-        raise HTTPException(status_code=404, detail="Payment method not found")
-    payment_method_update = payment_method_data.model_dump(exclude_unset=True)
-    existing_payment_method.sqlmodel_update(payment_method_update)
-    session.add(existing_payment_method)
-    session.commit()
-    session.refresh(existing_payment_method)
-
-    return existing_payment_method
+    return await run_db(session, crud.update_payment_method, payment_mtd_id, payment_method_data)
 
 @router.post("/payment", response_model=Payment)
-def create_payment(payment_data: Payment, session: Session = Depends(get_session)):
-    """create payment into the database."""
-    # Use the session to add the new payment
-    session.add(payment_data)
-    session.commit()
-    session.refresh(payment_data)
-
-    return payment_data
+async def create_payment(payment_data: Payment,
+                         idempotency_key: Optional[str] = Header(default=None, max_length=255),
+                         session: DBSession = Depends(get_session)):
+    """create payment into the database. Retries with the same Idempotency-Key header get the first response back."""
+    fingerprint = request_hash(payment_data)
+    return await run_payment_write(session, idempotency_key, "POST /payment", fingerprint,
+                                   crud.create_payment, payment_data)
 
 @router.put("/payment", response_model=Payment)
-def update_payment(payment_id: int, payment_data: PaymentUpdate, session: Session = Depends(get_session)):
-    """update payment into the database."""
-    # Use the session to query the database
-    existing_payment = session.get(Payment, payment_id)
-    if not existing_payment:
-        raise HTTPException(status_code=404, detail="Payment not found")
-
-    payment_update = payment_data.model_dump(exclude_unset=True)
-    existing_payment.sqlmodel_update(payment_update)
-    session.add(existing_payment)
-    session.commit()
-    session.refresh(existing_payment)
-
-    return existing_payment
-
-app.include_router(router, tags=["payment"], prefix="/api/v1")
\ No newline at end of file
+async def update_payment(payment_id: int, payment_data: PaymentUpdate,
+                         idempotency_key: Optional[str] = Header(default=None, max_length=255),
+                         session: DBSession = Depends(get_session)):
+    """
+    update payment into the database.
+    Status changes only follow allowed transitions (or expected_status) and answer 409 otherwise,
+    so concurrent and redelivered gateway webhooks are safe to apply.
+    """
+    fingerprint = request_hash(payment_id, payment_data.model_dump(exclude_unset=True))
+    return await run_payment_write(session, idempotency_key, "PUT /payment", fingerprint,
+                                   crud.update_payment, payment_id, payment_data)
+
+app.include_router(router, tags=["payment"], prefix="/api/v1")
@@ -0,0 +1,16 @@
+from sqlmodel import SQLModel
+from database import Migration, reconcile_indexes
+from models import Payment, PaymentMethod
+
+def create_tables(connection):
+    SQLModel.metadata.create_all(connection)
+
+def composite_indexes(connection):
+    """Replaces the per-column indexes of databases created before the index redesign."""
+    reconcile_indexes(connection, [Payment.__table__, PaymentMethod.__table__])
+
+# Append new migrations with the next version number; applied ones must never change
+MIGRATIONS = [
+    Migration(1, "create tables", create_tables),
+    Migration(2, "composite indexes", composite_indexes),
+]
@@ -1,17 +1,39 @@
-from typing import Optional
-from sqlmodel import SQLModel, Field
+from enum import Enum
+from typing import Dict, Optional, Set
+from datetime import datetime
+from uuid import uuid4
+from sqlmodel import SQLModel, Field, JSON, Column, Index
+
+class PaymentStatus(str, Enum):
+    unpaid = "unpaid"
+    pending = "pending"
+    paid = "paid"
+    failed = "failed"
+    refunded = "refunded"
+
+# Statuses a payment may move to from each status; anything else is an out-of-order or stale update
+PAYMENT_TRANSITIONS: Dict[PaymentStatus, Set[PaymentStatus]] = {
+    PaymentStatus.unpaid: {PaymentStatus.pending, PaymentStatus.paid, PaymentStatus.failed},
+    PaymentStatus.pending: {PaymentStatus.paid, PaymentStatus.failed},
+    PaymentStatus.failed: {PaymentStatus.pending, PaymentStatus.paid},
+    PaymentStatus.paid: {PaymentStatus.refunded},
+    PaymentStatus.refunded: set(),
+}
 
 class Payment(SQLModel, table=True):
     """
     Represents payments in the payment service database.
+    Payments are listed newest first by id, by order or by status.
     """
+    __table_args__ = (Index("ix_payment_payment_status_id", "payment_status", "id"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     order_id: int = Field(index=True)
-    total_amount: float = Field(default=0.0, index=True)
-    payment_status: str = Field(default="unpaid", index=True)
-    payment_method_id: Optional[int] = Field(default=None, foreign_key="paymentmethod.id", index=True)
-    created_at: Optional[str] = Field(default=None, index=True)
-    updated_at: Optional[str] = Field(default=None, index=True)
+    total_amount: float = Field(default=0.0)
+    payment_status: PaymentStatus = Field(default=PaymentStatus.unpaid)
+    payment_method_id: Optional[int] = Field(default=None, foreign_key="paymentmethod.id")
+    created_at: Optional[str] = Field(default=None)
+    updated_at: Optional[str] = Field(default=None)
 
 class PaymentMethod(SQLModel, table=True):
     """
@@ -19,15 +41,44 @@ class PaymentMethod(SQLModel, table=True):
     """
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(index=True)
-    method_type: str = Field(default="credit_card", index=True)
-    created_at: Optional[str] = Field(default=None, index=True)
-    updated_at: Optional[str] = Field(default=None, index=True)
+    method_type: str = Field(default="credit_card")
+    created_at: Optional[str] = Field(default=None)
+    updated_at: Optional[str] = Field(default=None)
 
 class PaymentUpdate(SQLModel):
     """
     Represents the data required to update a payment.
     """
     total_amount: Optional[float] = Field(default=None)
-    payment_status: Optional[str] = Field(default=None)
+    payment_status: Optional[PaymentStatus] = Field(default=None)
+    # Only apply the status change if the payment is currently in this status
+    expected_status: Optional[PaymentStatus] = Field(default=None)
     payment_method_id: Optional[int] = Field(default=None, foreign_key="paymentmethod.id")
-    updated_at: Optional[str] = Field(default=None)
\ No newline at end of file
+    updated_at: Optional[str] = Field(default=None)
+
+class OutboxEvent(SQLModel, table=True):
+    """
+    An event written in the same transaction as the state change it describes.
+    The outbox relay publishes unpublished rows to the broker and then stamps published_at.
+    """
+    __table_args__ = (Index("ix_outboxevent_published_at_id", "published_at", "id"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    event_id: str = Field(default_factory=lambda: uuid4().hex, unique=True)
+    topic: str
+    key: str
+    payload: dict = Field(default_factory=dict, sa_column=Column(JSON, nullable=False))
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    published_at: Optional[datetime] = Field(default=None)
+
+class IdempotencyKey(SQLModel, table=True):
+    """
+    Stores the response of a write made with an Idempotency-Key header,
+    so a retry with the same key gets the same response back instead of repeating the write.
+    """
+    key: str = Field(primary_key=True, max_length=255)
+    scope: str
+    request_hash: str
+    response: dict = Field(default_factory=dict, sa_column=Column(JSON, nullable=False))
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    expires_at: datetime = Field(index=True)
@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+from fastapi.encoders import jsonable_encoder
+from sqlmodel import Session, select, update, delete
+from models import OutboxEvent
+from events import Event, Broker, broker
+from database import run_in_session
+import asyncio
+import logging
+import os
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1"))
+OUTBOX_RETENTION = float(os.getenv("OUTBOX_RETENTION", "86400"))
+# How long the relay waits after being woken, so events committed close together go out in one batch
+OUTBOX_LINGER = float(os.getenv("OUTBOX_LINGER", "0.05"))
+
+logger = logging.getLogger(__name__)
+
+def record_event(session: Session, topic: str, key, payload):
+    """
+    Adds an event to the outbox; it is only published if the caller's transaction commits.
+    Nothing is recorded without a broker, as no relay would ever publish or purge the event.
+    """
+    if broker is None:
+        return
+    session.add(OutboxEvent(topic=topic, key=str(key), payload=jsonable_encoder(payload)))
+
+def unpublished_events(session: Session, batch_size: int) -> List[Event]:
+    rows = session.exec(
+        select(OutboxEvent)
+        .where(OutboxEvent.published_at.is_(None))
+        .order_by(OutboxEvent.id)
+        .limit(batch_size)
+    ).all()
+    return [Event(id=row.event_id, topic=row.topic, key=row.key, payload=row.payload, created_at=row.created_at)
+            for row in rows]
+
+def mark_published(session: Session, event_ids: List[str]):
+    session.execute(
+        update(OutboxEvent)
+        .where(OutboxEvent.event_id.in_(event_ids))
+        .values(published_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    session.commit()
+
+def purge_published(session: Session, retention: float) -> int:
+    """Deletes events published more than retention seconds ago."""
+    result = session.execute(
+        delete(OutboxEvent)
+        .where(OutboxEvent.published_at < datetime.utcnow() - timedelta(seconds=retention))
+        .execution_options(synchronize_session=False)
+    )
+    session.commit()
+    return result.rowcount
+
+class OutboxRelay:
+    """
+    Background task that drains the outbox to the broker in batches, oldest first.
+    An event is marked published only after the broker accepted it, so a crash in between publishes it again
+    (at-least-once); consumers deduplicate on the event id. Several replicas relaying at once only add duplicates.
+    """
+    def __init__(self, broker: Optional[Broker], batch_size: int = OUTBOX_BATCH_SIZE,
+                 interval: float = OUTBOX_POLL_INTERVAL, retention: float = OUTBOX_RETENTION,
+                 linger: float = OUTBOX_LINGER, in_session: Callable = run_in_session):
+        self.broker = broker
+        # Runs fn(session, ...) on the database holding the outbox, the service's own by default
+        self.in_session = in_session
+        self.batch_size = batch_size
+        self.interval = interval
+        self.retention = retention
+        self.linger = linger
+        self.wake = asyncio.Event()
+        self.published = 0
+        self.batches = 0
+        self.errors = 0
+
+    def notify(self):
+        """Wakes the relay after a commit that wrote events, instead of waiting for the next poll."""
+        self.wake.set()
+
+    async def relay_batch(self) -> int:
+        """Publishes one batch of unpublished events; returns how many were published."""
+        events = await self.in_session(unpublished_events, self.batch_size)
+        if not events:
+            return 0
+        await self.broker.publish(events)
+        await self.in_session(mark_published, [event.id for event in events])
+        self.published += len(events)
+        self.batches += 1
+        return len(events)
+
+    async def drain(self):
+        """Publishes batches until the outbox is empty."""
+        while await self.relay_batch() == self.batch_size:
+            pass
+
+    async def run(self):
+        last_purge = 0.0
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await self.drain()
+                if loop.time() - last_purge >= self.retention / 24:
+                    await self.in_session(purge_published, self.retention)
+                    last_purge = loop.time()
+            except Exception:
+                self.errors += 1
+                logger.exception("Failed to relay outbox events")
+            try:
+                await asyncio.wait_for(self.wake.wait(), self.interval)
+                await asyncio.sleep(self.linger)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+
+    def stats(self) -> dict:
+        return {"enabled": self.broker is not None, "published": self.published,
+                "batches": self.batches, "errors": self.errors}
+
+outbox_relay = OutboxRelay(broker)
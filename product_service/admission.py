@@ -0,0 +1,257 @@
+from collections import OrderedDict
+from enum import IntEnum
+from typing import Dict, Iterable, List, Optional, Tuple
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from starlette.routing import Match
+from database import env_bool
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+
+# Shed load and rate limit clients before requests reach the handlers and their database sessions (default off)
+ADMISSION_ENABLED = env_bool("ADMISSION_ENABLED", False)
+# Requests handled at once by this process, by default as many as the connection pool holds
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", str(
+    int(os.getenv("DB_POOL_SIZE", "5")) + int(os.getenv("DB_MAX_OVERFLOW", "10")))))
+# Shares of those slots normal and browse requests may fill, so critical ones always find room
+ADMISSION_NORMAL_SHARE = float(os.getenv("ADMISSION_NORMAL_SHARE", "0.8"))
+ADMISSION_BROWSE_SHARE = float(os.getenv("ADMISSION_BROWSE_SHARE", "0.25"))
+# Critical and normal requests wait this long for a slot before a 503, browse ones ADMISSION_BROWSE_QUEUE_TIMEOUT
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "1"))
+ADMISSION_BROWSE_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_BROWSE_QUEUE_TIMEOUT", "0.05"))
+# Caps on the requests in flight per route, e.g. "GET /api/v1/products/search=4,GET /api/v1/order/export=2"
+ADMISSION_ROUTE_LIMITS = {route.strip(): int(limit) for route, _, limit in (
+    entry.rpartition("=") for entry in os.getenv("ADMISSION_ROUTE_LIMITS", "").split(",") if entry.strip())}
+# Retry-After of a 503, in seconds
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+# Requests per second, and the burst, each client may send to the routes that are not critical (default 0, no limit)
+RATE_LIMIT_RPS = float(os.getenv("RATE_LIMIT_RPS", "0"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", str(max(1.0, 2 * RATE_LIMIT_RPS))))
+# Header naming the client, such as X-Forwarded-For behind a proxy or an API key header; the peer address otherwise
+RATE_LIMIT_CLIENT_HEADER = os.getenv("RATE_LIMIT_CLIENT_HEADER", "").strip().lower().encode()
+# Clients the local store keeps a bucket for; the least recently seen are dropped, which refills their bucket
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "100000"))
+
+# Monitoring keeps working under overload
+EXEMPT_PREFIXES = ("/metrics",)
+
+class Priority(IntEnum):
+    """Order in which requests get slots: checkout and payment first, reads that can wait such as listings last."""
+    critical = 0
+    normal = 1
+    browse = 2
+
+class RateLimitStore:
+    """
+    Interface for where the clients' token buckets are kept. A shared implementation (for example a Redis
+    script refilling and taking from one hash per client) applies the limits across replicas; with the local
+    stand-in every replica allows each client RATE_LIMIT_RPS of its own.
+    """
+    async def take(self, client: str, rate: float, burst: float) -> float:
+        """Takes a token from the client's bucket; returns 0 when there was one, or the seconds until there is."""
+        raise NotImplementedError
+
+class LocalRateLimitStore(RateLimitStore):
+    """In-process stand-in for a shared rate limit store, in least recently seen order."""
+    def __init__(self, max_clients: int = RATE_LIMIT_MAX_CLIENTS):
+        self.max_clients = max_clients
+        self.buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, client: str, rate: float, burst: float) -> float:
+        now = time.monotonic()
+        tokens, updated = self.buckets.pop(client, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+        self.buckets[client] = (tokens - 1 if tokens >= 1 else tokens, now)
+        if len(self.buckets) > self.max_clients:
+            self.buckets.popitem(last=False)
+        return wait
+
+class ConcurrencyLimiter:
+    """
+    The process's slots for requests in flight. Each priority may fill them up to its own cap, so lower
+    priorities are turned away while higher ones still get in, and a freed slot goes to the waiting request
+    of the highest priority.
+    """
+    def __init__(self, limit: int, shares: Dict[Priority, float]):
+        self.caps = {priority: max(1, math.floor(limit * share)) for priority, share in shares.items()}
+        self.in_flight = 0
+        self.waiters: List[Tuple[Priority, int, asyncio.Future]] = []
+        self.arrivals = itertools.count()
+        self.queued = dict.fromkeys(Priority, 0)
+
+    def first_waiting(self) -> Optional[Priority]:
+        while self.waiters and self.waiters[0][2].done():
+            heapq.heappop(self.waiters)
+        return self.waiters[0][0] if self.waiters else None
+
+    async def acquire(self, priority: Priority, timeout: float) -> bool:
+        """Takes a slot, waiting at most timeout seconds for one; returns False when none came free."""
+        waiting = self.first_waiting()
+        if self.in_flight < self.caps[priority] and (waiting is None or waiting > priority):
+            self.in_flight += 1
+            return True
+        if timeout <= 0:
+            return False
+
+        self.queued[priority] += 1
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.arrivals), waiter))
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+            return True
+        except asyncio.TimeoutError:
+            # A slot handed over just as the wait ran out is kept
+            if waiter.done():
+                return True
+            waiter.cancel()
+            return False
+        except asyncio.CancelledError:
+            if waiter.done():
+                self.release()
+            else:
+                waiter.cancel()
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        while (waiting := self.first_waiting()) is not None and self.in_flight < self.caps[waiting]:
+            self.in_flight += 1
+            heapq.heappop(self.waiters)[2].set_result(None)
+
+class PriorityStats:
+    __slots__ = ("admitted", "shed", "rate_limited")
+
+    def __init__(self):
+        self.admitted = 0
+        self.shed = 0
+        self.rate_limited = 0
+
+class AdmissionController:
+    """
+    Decides whether a request goes ahead: per-client token buckets on every route that is not critical,
+    then a per-route cap and a slot of the ConcurrencyLimiter.
+    """
+    def __init__(self, limit: int = ADMISSION_MAX_CONCURRENCY, route_limits: Dict[str, int] = ADMISSION_ROUTE_LIMITS,
+                 store: Optional[RateLimitStore] = None, rate: float = RATE_LIMIT_RPS, burst: float = RATE_LIMIT_BURST):
+        self.limiter = ConcurrencyLimiter(limit, {Priority.critical: 1.0, Priority.normal: ADMISSION_NORMAL_SHARE,
+                                                  Priority.browse: ADMISSION_BROWSE_SHARE})
+        self.route_limits = route_limits
+        self.route_in_flight: Dict[str, int] = {}
+        self.store = store or LocalRateLimitStore()
+        self.rate = rate
+        self.burst = burst
+        self.stats = {priority: PriorityStats() for priority in Priority}
+        self.queue_timeouts = {Priority.critical: ADMISSION_QUEUE_TIMEOUT, Priority.normal: ADMISSION_QUEUE_TIMEOUT,
+                               Priority.browse: ADMISSION_BROWSE_QUEUE_TIMEOUT}
+
+    async def admit(self, client: str, route: Optional[str], priority: Priority) -> Optional[JSONResponse]:
+        """Takes a slot for the request, or returns the 429 or 503 to answer it with instead."""
+        stats = self.stats[priority]
+        if self.rate > 0 and priority != Priority.critical:
+            wait = await self.store.take(client, self.rate, self.burst)
+            if wait > 0:
+                stats.rate_limited += 1
+                return JSONResponse({"detail": "Too many requests"}, status_code=429,
+                                    headers={"Retry-After": str(math.ceil(wait))})
+
+        in_route = self.route_in_flight.get(route, 0)
+        if in_route >= self.route_limits.get(route, math.inf):
+            stats.shed += 1
+            return self.overloaded()
+        # Counted while waiting too, so waiters cannot take a route past its cap
+        self.route_in_flight[route] = in_route + 1
+        if not await self.limiter.acquire(priority, self.queue_timeouts[priority]):
+            self.route_in_flight[route] -= 1
+            stats.shed += 1
+            return self.overloaded()
+        stats.admitted += 1
+        return None
+
+    def release(self, route: Optional[str]):
+        self.route_in_flight[route] -= 1
+        self.limiter.release()
+
+    @staticmethod
+    def overloaded() -> JSONResponse:
+        return JSONResponse({"detail": "Service overloaded, retry later"}, status_code=503,
+                            headers={"Retry-After": str(ADMISSION_RETRY_AFTER)})
+
+    def snapshot(self) -> dict:
+        return {"enabled": True, "in_flight": self.limiter.in_flight,
+                "waiting": sum(1 for _, _, waiter in self.limiter.waiters if not waiter.done()),
+                "slots": {priority.name: cap for priority, cap in self.limiter.caps.items()},
+                "routes_in_flight": {route: count for route, count in self.route_in_flight.items()
+                                     if route is not None and count},
+                "priorities": {priority.name: dict({name: getattr(stats, name) for name in PriorityStats.__slots__},
+                                                   queued=self.limiter.queued[priority])
+                               for priority, stats in self.stats.items()}}
+
+admission = AdmissionController() if ADMISSION_ENABLED else None
+
+def client_of(scope) -> str:
+    """The client a request is counted against: the RATE_LIMIT_CLIENT_HEADER value, or the peer address."""
+    if RATE_LIMIT_CLIENT_HEADER:
+        for name, value in scope["headers"]:
+            if name == RATE_LIMIT_CLIENT_HEADER:
+                # X-Forwarded-For lists the proxies after the client
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else ""
+
+class AdmissionMiddleware:
+    """
+    Plain ASGI middleware admitting every request before it reaches the routes, their dependencies and so
+    the session pool. Routes are told apart by their path template, like the request metrics.
+    """
+    def __init__(self, app, controller: AdmissionController, routes: list, priorities: Dict[str, Priority]):
+        self.app = app
+        self.controller = controller
+        self.routes = routes
+        self.priorities = priorities
+
+    def match(self, scope):
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(EXEMPT_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        matched = self.match(scope)
+        route = f"{scope['method']} {matched.path}" if matched is not None else None
+        rejection = await self.controller.admit(client_of(scope), route, self.priorities.get(route, Priority.normal))
+        if rejection is not None:
+            # Labels the rejected request with its route in the request metrics, as the router would have
+            if matched is not None:
+                scope["route"] = matched
+            await rejection(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(route)
+
+def admission_control(app: FastAPI, critical: Iterable[str] = (), browse: Iterable[str] = ()):
+    """
+    Mounts admission control on app when ADMISSION_ENABLED is set. critical and browse list routes as
+    "METHOD path template"; every other route is normal. Call it before instrument(app), so the request
+    metrics count the rejected requests too.
+    """
+    if admission is None:
+        return
+    priorities = dict.fromkeys(critical, Priority.critical)
+    priorities.update(dict.fromkeys(browse, Priority.browse))
+    app.add_middleware(AdmissionMiddleware, controller=admission, routes=app.router.routes, priorities=priorities)
+
+def admission_stats() -> dict:
+    """Returns the requests admitted, queued, shed and rate limited by priority, and the slots in use."""
+    return admission.snapshot() if admission is not None else {"enabled": False}
@@ -0,0 +1,147 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Awaitable, Callable, Hashable, Iterable, List, Optional, Set
+import os
+import time
+
+class InvalidationBus:
+    """
+    Interface for sharing cache invalidations between service replicas.
+    A shared implementation (for example Redis pub/sub) publishes the tags to every replica,
+    which then drops the matching entries from its own in-process cache.
+    """
+    def publish(self, tags: Set[str]):
+        raise NotImplementedError
+
+    def subscribe(self, callback: Callable[[Set[str]], None]):
+        raise NotImplementedError
+
+class LocalInvalidationBus(InvalidationBus):
+    """In-process stand-in for a shared bus; delivers invalidations to every cache subscribed in this process."""
+    def __init__(self):
+        self.subscribers: List[Callable[[Set[str]], None]] = []
+
+    def publish(self, tags: Set[str]):
+        for callback in list(self.subscribers):
+            callback(tags)
+
+    def subscribe(self, callback: Callable[[Set[str]], None]):
+        self.subscribers.append(callback)
+
+class _Entry:
+    __slots__ = ("value", "tags", "expires_at")
+
+    def __init__(self, value, tags: Set[str], expires_at: float):
+        self.value = value
+        self.tags = tags
+        self.expires_at = expires_at
+
+MISSING = object()
+
+class TTLCache:
+    """
+    Bounded read-through cache with LRU eviction and a per-entry TTL.
+    Entries carry tags (for example "product:42") so writes can invalidate exactly the entries they affect.
+    """
+    def __init__(self, max_size: int, ttl: float, bus: Optional[InvalidationBus] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.bus = bus
+        self.entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self.lock = Lock()
+        # Bumped by every invalidation, so a load that raced with a write is not cached
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        if bus is not None:
+            bus.subscribe(self._drop_tags)
+
+    def get(self, key: Hashable):
+        """Returns the cached value for key, or MISSING if it is absent or expired."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry.expires_at <= time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return MISSING
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def contains(self, key: Hashable) -> bool:
+        """Whether key holds an unexpired entry, without counting a hit or a miss."""
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and entry.expires_at > time.monotonic()
+
+    def put(self, key: Hashable, value, tags: Iterable[str], generation: int):
+        """Stores value under key unless an invalidation happened since generation was read."""
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.entries[key] = _Entry(value, set(tags), time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    async def get_or_load(self, key: Hashable, load: Callable[[], Awaitable], tags: Callable[[object], Iterable[str]]):
+        """Returns the cached value for key, or awaits load() and caches its result under tags(result)."""
+        value = self.get(key)
+        if value is MISSING:
+            generation = self.generation
+            value = await load()
+            self.put(key, value, tags(value), generation)
+        return value
+
+    def invalidate(self, tags: Set[str]):
+        """Drops every entry carrying one of tags here and, through the bus, on the other replicas."""
+        if self.bus is not None:
+            self.bus.publish(tags)
+        else:
+            self._drop_tags(tags)
+
+    def _drop_tags(self, tags: Set[str]):
+        with self.lock:
+            self.generation += 1
+            self.invalidations += 1
+            for key in [key for key, entry in self.entries.items() if entry.tags & tags]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        """Returns hit, miss and eviction counters for the metrics endpoint."""
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+# Tag carried by first pages of the product list, the only pages a newly created product can appear on
+LIST_HEAD_TAG = "products:head"
+
+def product_tag(product_id: int) -> str:
+    return f"product:{product_id}"
+
+def merchant_tag(merchant_id: int) -> str:
+    """Tag carried by every page of a merchant's product list, which a product moved to the merchant can land on."""
+    return f"merchant:{merchant_id}"
+
+product_cache = TTLCache(
+    max_size=int(os.getenv("PRODUCT_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("PRODUCT_CACHE_TTL", "30")),
+    bus=LocalInvalidationBus(),
+)
@@ -0,0 +1,89 @@
+from fastapi import HTTPException
+from sqlmodel import Session
+from typing import Iterable, List, Optional
+from models import Products, ProductUpdate, ProductLookup
+from pagination import Page, paginate
+from search import search_backend
+from serialization import model_columns
+from versions import bump_versions, collection_keys, stripe_key
+
+def product_key(product_id: int) -> str:
+    """The version stamp of a single product."""
+    return f"product:{product_id}"
+
+def changed_product_keys(product_ids: Iterable[int]) -> List[str]:
+    """The stamps bumped by a change to the products: their own and their stripes of the catalog."""
+    return [key for product_id in product_ids for key in (product_key(product_id), stripe_key("products", product_id))]
+
+def catalog_keys() -> List[str]:
+    return collection_keys("products")
+
+def list_products(session: Session, merchant_id: Optional[int], cursor: Optional[str], limit: int,
+                  rows: bool = False) -> Page:
+    """
+    Retrieves a page of products from the database, optionally filtered by merchant_id.
+    With rows, the page holds column rows for page_response instead of Products objects.
+    """
+    # Use the session to query the database
+    query = session.query(*model_columns(Products)) if rows else session.query(Products)
+    if merchant_id is not None:
+        query = query.filter(Products.merchant_id == merchant_id)
+    return paginate(query, [Products.id], limit, cursor)
+
+def search_products(session: Session, q: str, min_price: Optional[float], max_price: Optional[float],
+                    merchant_id: Optional[int], limit: int) -> List[Products]:
+    """Searches product names and descriptions by prefix, best match first."""
+    if search_backend is None:
+        raise HTTPException(status_code=501, detail="Search is not supported on this database")
+    return search_backend.search(session, q, min_price, max_price, merchant_id, limit)
+
+def get_product(session: Session, product_id: int) -> Products:
+    """Retrieves a single product from the database."""
+    product = session.get(Products, product_id)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return product
+
+def lookup_products(session: Session, lookup: ProductLookup) -> List[Products]:
+    """Retrieves many products by id in one primary key query; unknown ids are left out."""
+    return session.query(Products).filter(Products.id.in_(set(lookup.product_ids))).all()
+
+def create_product(session: Session, product: Products) -> Products:
+    """create new product into the database."""
+    # Use the session to query the database
+    session.add(product)
+    session.flush()
+    bump_versions(session, changed_product_keys([product.id]))
+    session.commit()
+    session.refresh(product)
+    return product
+
+def update_product(session: Session, product_id: int, data_update: ProductUpdate) -> dict:
+    """update product in the database."""
+    # Use the session to query the database
+    product = session.get(Products, product_id)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    product_data = data_update.model_dump(exclude_unset=True)
+    if "merchant_id" in product_data and product_data["merchant_id"] is None:
+        raise HTTPException(status_code=422, detail="merchant_id cannot be null")
+    product.sqlmodel_update(product_data)
+    session.add(product)
+    bump_versions(session, changed_product_keys([product_id]))
+    session.commit()
+    session.refresh(product)
+
+    return {"message": "update user data success"}
+
+def delete_product(session: Session, product_id: int) -> dict:
+    """delete product from the database."""
+    # Use the session to query the database
+    product = session.get(Products, product_id)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    session.delete(product)
+    bump_versions(session, changed_product_keys([product_id]))
+    session.commit()
+
+    return {"message": "delete success"}
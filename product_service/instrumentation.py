@@ -0,0 +1,286 @@
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional, Tuple
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import event
+from database import all_engines, pool_stats, env_bool
+import logging
+import os
+import time
+
+METRICS_ENABLED = env_bool("METRICS_ENABLED", True)
+# A request running more queries than this on one database is reported as a likely N+1 pattern
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "20"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+logger = logging.getLogger(__name__)
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense: bucket counts, a sum and a count."""
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name: str, labels: str) -> Iterable[str]:
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {self.count}'
+        yield f"{name}_sum{{{labels}}} {self.sum}"
+        yield f"{name}_count{{{labels}}} {self.count}"
+
+class RequestStats:
+    """
+    Database work done on behalf of one request, filled in by the engine and pool hooks.
+    Queries are also counted per engine, as a request spread over shards runs each shard's share at once.
+    """
+    __slots__ = ("queries", "query_seconds", "pool_wait_seconds", "engine_queries")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+        self.engine_queries: Dict[object, int] = {}
+
+    def most_queries_on_one_engine(self) -> int:
+        return max(self.engine_queries.values(), default=0)
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+class RouteMetrics:
+    """
+    The metrics of one route. Query time and pool wait are totals rather than histograms, as their
+    distribution follows the latency's and each observation is paid for on every request.
+    """
+    __slots__ = ("latency", "queries", "query_seconds", "pool_wait_seconds", "response_size", "statuses",
+                 "n_plus_one")
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.query_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+        self.response_size = Histogram(SIZE_BUCKETS)
+        self.statuses: Dict[int, int] = {}
+        self.n_plus_one = 0
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Metrics:
+    """
+    Per-route request, database and pool metrics of one service process.
+    Routes are labelled by their path template (e.g. /api/v1/products/{product_id}), which keeps the series bounded.
+    """
+    def __init__(self, n_plus_one_threshold: int = N_PLUS_ONE_THRESHOLD):
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.routes: Dict[Tuple[str, str], RouteMetrics] = {}
+        self.queries_total = 0
+        self.query_seconds_total = 0.0
+        self.n_plus_one_reported: Dict[Tuple[str, str], float] = {}
+
+    def record_request(self, method: str, route: str, status: int, seconds: float, size: int, stats: RequestStats):
+        key = (method, route)
+        metrics = self.routes.get(key)
+        if metrics is None:
+            metrics = self.routes[key] = RouteMetrics()
+        metrics.latency.observe(seconds)
+        metrics.queries.observe(stats.queries)
+        metrics.query_seconds += stats.query_seconds
+        metrics.pool_wait_seconds += stats.pool_wait_seconds
+        metrics.response_size.observe(size)
+        metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+
+        # The total is checked first, as it is free and rarely over the threshold
+        if stats.queries > self.n_plus_one_threshold:
+            queries = stats.most_queries_on_one_engine()
+            if queries > self.n_plus_one_threshold:
+                self.report_n_plus_one(key, metrics, queries)
+
+    def report_n_plus_one(self, key: Tuple[str, str], metrics: RouteMetrics, queries: int):
+        metrics.n_plus_one += 1
+        # Logged at most once a minute per route; the counter keeps the full tally
+        now = time.monotonic()
+        if now - self.n_plus_one_reported.get(key, -60.0) >= 60.0:
+            self.n_plus_one_reported[key] = now
+            logger.warning("Possible N+1 queries: %s %s ran %d queries on one database in one request",
+                           *key, queries)
+
+    def record_query(self, seconds: float, engine=None):
+        self.queries_total += 1
+        self.query_seconds_total += seconds
+        stats = current_request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.query_seconds += seconds
+            stats.engine_queries[engine] = stats.engine_queries.get(engine, 0) + 1
+
+    def record_pool_wait(self, seconds: float):
+        stats = current_request.get()
+        if stats is not None:
+            stats.pool_wait_seconds += seconds
+
+    def render(self, pool: Optional[dict] = None) -> str:
+        """Renders every metric in the Prometheus text exposition format."""
+        lines: List[str] = []
+        histograms = (
+            ("http_request_duration_seconds", "latency", "Request latency."),
+            ("http_response_size_bytes", "response_size", "Response body size."),
+            ("db_queries_per_request", "queries", "Database queries run by one request."),
+        )
+        totals = (
+            ("db_request_query_seconds_total", "query_seconds", "Time requests spent in database queries."),
+            ("db_request_pool_wait_seconds_total", "pool_wait_seconds", "Time requests waited for pool connections."),
+        )
+        routes = sorted(self.routes.items())
+
+        lines += ["# HELP http_requests_total Requests by route and status.", "# TYPE http_requests_total counter"]
+        for (method, route), metrics in routes:
+            for status, count in sorted(metrics.statuses.items()):
+                lines.append(f'http_requests_total{{method="{method}",route="{escape(route)}",status="{status}"}} {count}')
+
+        for name, attribute, help_text in histograms:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for (method, route), metrics in routes:
+                lines.extend(getattr(metrics, attribute).samples(name, f'method="{method}",route="{escape(route)}"'))
+
+        for name, attribute, help_text in totals:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for (method, route), metrics in routes:
+                lines.append(f'{name}{{method="{method}",route="{escape(route)}"}} {getattr(metrics, attribute)}')
+
+        lines += [f"# HELP db_n_plus_one_requests_total Requests running more than {self.n_plus_one_threshold} queries "
+                  "on one database.",
+                  "# TYPE db_n_plus_one_requests_total counter"]
+        for (method, route), metrics in routes:
+            lines.append(f'db_n_plus_one_requests_total{{method="{method}",route="{escape(route)}"}} {metrics.n_plus_one}')
+
+        lines += ["# HELP db_queries_total Database queries, including those outside requests.",
+                  "# TYPE db_queries_total counter", f"db_queries_total {self.queries_total}",
+                  "# HELP db_query_seconds_total Time spent in database queries.",
+                  "# TYPE db_query_seconds_total counter", f"db_query_seconds_total {self.query_seconds_total}"]
+
+        for name, value in sorted((pool or {}).items()):
+            metric = f"db_pool_{name}"
+            kind = "counter" if name in ("checkouts", "timeouts", "wait_seconds_total") else "gauge"
+            if kind == "counter" and not metric.endswith("_total"):
+                metric += "_total"
+            lines += [f"# TYPE {metric} {kind}", f"{metric} {value}"]
+        return "\n".join(lines) + "\n"
+
+class ResponseMeter:
+    """
+    The send callable handed to the app, noting the status and body size of the response on the way.
+    It returns send's awaitable rather than awaiting it, so a message costs no extra coroutine; the
+    body chunks are only summed when the response has no Content-Length.
+    """
+    __slots__ = ("send", "status", "size", "counting")
+
+    def __init__(self, send):
+        self.send = send
+        self.status = 500
+        self.size = 0
+        self.counting = True
+
+    def __call__(self, message):
+        if self.counting:
+            if message["type"] == "http.response.body":
+                self.size += len(message.get("body", b""))
+            elif message["type"] == "http.response.start":
+                self.status = message["status"]
+                for name, value in message.get("headers", ()):
+                    if name == b"content-length":
+                        self.size, self.counting = int(value), False
+                        break
+        return self.send(message)
+
+class InstrumentationMiddleware:
+    """
+    Plain ASGI middleware timing every HTTP request and measuring its response size.
+    It sets up the RequestStats the database hooks write to for the duration of the request.
+    """
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        response = ResponseMeter(send)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, response)
+        finally:
+            elapsed = time.perf_counter() - start
+            current_request.reset(token)
+            # The router stores the matched route in the scope; unmatched paths share one label
+            route = scope.get("route")
+            self.metrics.record_request(scope["method"], route.path if route is not None else "<unmatched>",
+                                        response.status, elapsed, response.size, stats)
+
+class QueryTimer:
+    """
+    Engine event hooks timing every statement and charging it to the current request.
+    Async engines are instrumented through their sync_engine. The start time is kept on the statement's
+    execution context, which is dropped with it when the statement fails.
+    """
+    EVENTS = ("before_cursor_execute", "after_cursor_execute")
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    def attach(self, engine):
+        for name in self.EVENTS:
+            event.listen(engine, name, getattr(self, name))
+
+    def detach(self, engine):
+        for name in self.EVENTS:
+            event.remove(engine, name, getattr(self, name))
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.query_start = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # Statements run without a context (none of the ORM's) are counted, untimed
+        self.metrics.record_query(time.perf_counter() - context.query_start if context is not None else 0.0,
+                                  conn.engine)
+
+def instrument(app: FastAPI) -> Optional[Metrics]:
+    """
+    Mounts the middleware, the hooks on this service's engines and pools, read replicas included,
+    and a Prometheus GET /metrics endpoint on app.
+    """
+    if not METRICS_ENABLED:
+        return None
+    metrics = Metrics()
+    app.add_middleware(InstrumentationMiddleware, metrics=metrics)
+    timer = QueryTimer(metrics)
+    for sync_engine, pool_metrics in all_engines():
+        timer.attach(sync_engine)
+        pool_metrics.listeners.append(metrics.record_pool_wait)
+
+    @app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+    async def get_metrics():
+        """Returns per-route request, database and pool metrics in the Prometheus text format."""
+        return PlainTextResponse(metrics.render(pool_stats()), media_type="text/plain; version=0.0.4")
+
+    return metrics
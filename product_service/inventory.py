@@ -0,0 +1,122 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import List, Tuple
+from fastapi import HTTPException
+from sqlmodel import Session, select, update
+from models import (Products, Reservation, ReservationItem, ReservationStatus, ReservationRequest,
+                    ReservationItemResult, ReservationResult)
+from crud import changed_product_keys
+from versions import bump_versions
+
+def take_stock(session: Session, product_id: int, quantity: int) -> bool:
+    """
+    Atomically decrements stock if enough is on hand, with a single conditional UPDATE.
+    No row is read or locked beforehand, so concurrent reservers never queue behind each other's reads
+    and stock can never go negative.
+    """
+    result = session.execute(
+        update(Products)
+        .where(Products.id == product_id, Products.stock >= quantity)
+        .values(stock=Products.stock - quantity)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+def return_stock(session: Session, product_id: int, quantity: int):
+    session.execute(
+        update(Products)
+        .where(Products.id == product_id)
+        .values(stock=Products.stock + quantity)
+        .execution_options(synchronize_session=False)
+    )
+
+def transition(session: Session, reservation_id: int, from_status: ReservationStatus,
+               to_status: ReservationStatus) -> bool:
+    """Compare-and-set of a reservation's status; False if another caller moved it first."""
+    result = session.execute(
+        update(Reservation)
+        .where(Reservation.id == reservation_id, Reservation.status == from_status)
+        .values(status=to_status)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+def reserve(session: Session, request: ReservationRequest) -> ReservationResult:
+    """
+    Reserves stock for every item of a basket in one transaction and reports the outcome per item.
+    Products are updated in id order, so two baskets sharing products always take their row locks in the same order.
+    """
+    quantities = defaultdict(int)
+    for item in request.items:
+        quantities[item.product_id] += item.quantity
+
+    results = []
+    for product_id in sorted(quantities):
+        results.append(ReservationItemResult(product_id=product_id, quantity=quantities[product_id],
+                                             reserved=take_stock(session, product_id, quantities[product_id])))
+
+    reserved = [result for result in results if result.reserved]
+    if not reserved or (request.all_or_nothing and len(reserved) < len(results)):
+        session.rollback()
+        for result in results:
+            result.reserved = False
+        return ReservationResult(items=results)
+
+    reservation = Reservation(expires_at=datetime.utcnow() + timedelta(seconds=request.ttl_seconds))
+    session.add(reservation)
+    session.flush()
+    session.add_all([ReservationItem(reservation_id=reservation.id, product_id=result.product_id,
+                                     quantity=result.quantity) for result in reserved])
+    bump_versions(session, changed_product_keys(result.product_id for result in reserved))
+    session.commit()
+
+    return ReservationResult(reservation_id=reservation.id, status=reservation.status,
+                             expires_at=reservation.expires_at, items=results)
+
+def release_items(session: Session, reservation_id: int) -> List[int]:
+    """Puts the stock of a reservation back; returns the product ids whose stock changed."""
+    items = session.exec(select(ReservationItem).where(ReservationItem.reservation_id == reservation_id)).all()
+    for item in items:
+        return_stock(session, item.product_id, item.quantity)
+    return [item.product_id for item in items]
+
+def finish_reservation(session: Session, reservation_id: int, to_status: ReservationStatus) -> List[int]:
+    """
+    Commits or releases a held reservation and returns the product ids whose stock changed.
+    The status change is a compare-and-set, so a reservation is restocked at most once even when
+    a release, a commit and the expiry sweeper race for it.
+    """
+    reservation = session.get(Reservation, reservation_id)
+    if not reservation:
+        raise HTTPException(status_code=404, detail="Reservation not found")
+
+    if not transition(session, reservation_id, ReservationStatus.held, to_status):
+        session.rollback()
+        session.refresh(reservation)
+        raise HTTPException(status_code=409, detail=f"Reservation is already {reservation.status.value}")
+
+    product_ids = release_items(session, reservation_id) if to_status == ReservationStatus.released else []
+    bump_versions(session, changed_product_keys(product_ids))
+    session.commit()
+    return product_ids
+
+def release_expired(session: Session, batch_size: int = 500) -> Tuple[int, List[int]]:
+    """
+    Releases up to batch_size held reservations past their expiry.
+    Returns how many were released and the product ids restocked.
+    """
+    expired_ids = session.exec(
+        select(Reservation.id)
+        .where(Reservation.status == ReservationStatus.held, Reservation.expires_at < datetime.utcnow())
+        .order_by(Reservation.expires_at)
+        .limit(batch_size)
+    ).all()
+
+    released, product_ids = 0, []
+    for reservation_id in expired_ids:
+        if transition(session, reservation_id, ReservationStatus.held, ReservationStatus.released):
+            released += 1
+            product_ids.extend(release_items(session, reservation_id))
+    bump_versions(session, changed_product_keys(product_ids))
+    session.commit()
+    return released, product_ids
@@ -1,17 +1,49 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException
-from sqlmodel import SQLModel, create_engine, Session
-from contextlib import asynccontextmanager
-from typing import List
-from models import Products, ProductUpdate
+from fastapi import FastAPI, APIRouter, Depends, Query, Request, Response
+from contextlib import asynccontextmanager, suppress
+from typing import List, Optional
+from models import Products, ProductUpdate, ProductLookup, ReservationRequest, ReservationResult, ReservationStatus
+from pagination import Page, DEFAULT_LIMIT, MAX_LIMIT
+from database import (get_session, get_read_session, route_reads, run_db, run_migrations,
+                      run_in_session, pool_stats, replica_stats, DBSession)
+from migrations import MIGRATIONS
+from instrumentation import instrument
+from admission import admission_control, admission_stats
+from cache import product_cache, product_tag, merchant_tag, LIST_HEAD_TAG
+from serialization import FAST_JSON_ENABLED, page_response
+from versions import check_not_modified, is_fresh, make_etag, not_modified, tagged, versioned
+import crud
+import inventory
+import asyncio
+import logging
 import os
 
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./database.db")
-
-engine = create_engine(DATABASE_URL, echo=True, connect_args={"check_same_thread": False})
-
-def create_db_and_tables():
-    """Creates the database tables based on your SQLModel definitions."""
-    SQLModel.metadata.create_all(engine)
+RESERVATION_SWEEP_INTERVAL = float(os.getenv("RESERVATION_SWEEP_INTERVAL", "30"))
+
+logger = logging.getLogger(__name__)
+
+async def create_db_and_tables():
+    """Brings the database schema up to date by applying any pending migrations."""
+    await run_migrations(MIGRATIONS)
+
+async def release_expired_reservations() -> int:
+    """Releases expired reservations batch by batch and refreshes the cached stock of their products."""
+    total = 0
+    while True:
+        released, product_ids = await run_in_session(inventory.release_expired)
+        if product_ids:
+            product_cache.invalidate({product_tag(product_id) for product_id in product_ids})
+        total += released
+        if released == 0:
+            return total
+
+async def sweep_expired_reservations():
+    """Background task that periodically returns the stock of expired reservations."""
+    while True:
+        await asyncio.sleep(RESERVATION_SWEEP_INTERVAL)
+        try:
+            await release_expired_reservations()
+        except Exception:
+            logger.exception("Failed to release expired reservations")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -19,64 +51,166 @@ async def lifespan(app: FastAPI):
     Function that runs on application startup and shutdown.
     It's the perfect place to create the database tables.
     """
-    create_db_and_tables()
+    await create_db_and_tables()
+    sweeper = asyncio.create_task(sweep_expired_reservations())
     yield
+    sweeper.cancel()
+    with suppress(asyncio.CancelledError):
+        await sweeper
 
 app = FastAPI(title="Product Service", lifespan=lifespan)
-
-def get_session():
-    """
-    Dependency function to get a database session.
-    It creates a session and ensures it's closed after the request.
-    """
-    with Session(engine) as session:
-        yield session
+admission_control(app, critical=["POST /api/v1/products/lookup", "POST /api/v1/products/reservations",
+                            "POST /api/v1/products/reservations/{reservation_id}/commit",
+                            "POST /api/v1/products/reservations/{reservation_id}/release"],
+                  browse=["GET /api/v1/products", "GET /api/v1/products/search", "GET /api/v1/products/{product_id}"])
+instrument(app)
+route_reads(app)
+
+@app.get("/metrics/pool")
+async def get_pool_stats():
+    """Returns connection pool checkout and wait metrics, used to size DB_POOL_SIZE per service."""
+    return pool_stats()
+
+@app.get("/metrics/replicas")
+async def get_replica_stats():
+    """Returns the read replicas' health and lag, and how many reads were pinned to or fell back to the primary."""
+    return replica_stats()
+
+@app.get("/metrics/admission")
+async def get_admission_stats():
+    """Returns the requests admitted, queued, shed and rate limited by priority, and the slots in use."""
+    return admission_stats()
+
+@app.get("/metrics/cache")
+async def get_cache_stats():
+    """Returns product cache hit, miss and eviction counters."""
+    return product_cache.stats()
 
 router = APIRouter()
 
-@router.get("/products", response_model=List[Products])
-def get_users(session: Session = Depends(get_session)):
-    """Retrieves all product from the database."""
-    # Use the session to query the database
-    users = session.query(Products).all()
-    return users
+async def cached_conditional(request: Request, response: Response, session: DBSession, cache_key, keys,
+                             load, tags, render=lambda value: value):
+    """
+    Serves a cached read as a conditional GET. Cache entries hold the stamps token of their value, so an
+    unchanged poll of a cached entry gets its 304 without a query, and of an uncached one after reading the stamps.
+    """
+    if not product_cache.contains(cache_key) and (
+            unchanged := await check_not_modified(request, session, keys)) is not None:
+        return unchanged
+    token, value = await product_cache.get_or_load(
+        cache_key, lambda: run_db(session, versioned, keys, load), lambda entry: tags(entry[1]))
+    etag = make_etag(request, token)
+    if is_fresh(request, etag):
+        return not_modified(etag)
+    return tagged(render(value), response, etag)
+
+@router.get("/products", response_model=Page[Products])
+async def get_users(request: Request, response: Response,
+                    merchant_id: Optional[int] = None,
+                    cursor: Optional[str] = None,
+                    limit: int = Query(default=DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+                    session: DBSession = Depends(get_read_session)):
+    """Retrieves a page of products from the database, optionally filtered by merchant_id."""
+    def page_tags(page: Page) -> set:
+        tags = {product_tag(product.id) for product in page.items}
+        if cursor is None:
+            tags.add(LIST_HEAD_TAG)
+        if merchant_id is not None:
+            tags.add(merchant_tag(merchant_id))
+        return tags
+
+    return await cached_conditional(
+        request, response, session,
+        ("list", merchant_id, cursor, limit, FAST_JSON_ENABLED), crud.catalog_keys(),
+        lambda session: crud.list_products(session, merchant_id, cursor, limit, rows=FAST_JSON_ENABLED),
+        page_tags,
+        page_response if FAST_JSON_ENABLED else lambda page: page,
+    )
+
+@router.get("/products/search", response_model=List[Products])
+async def search_products(request: Request, response: Response,
+                          q: str = Query(min_length=1, max_length=200),
+                          min_price: Optional[float] = None,
+                          max_price: Optional[float] = None,
+                          merchant_id: Optional[int] = None,
+                          limit: int = Query(default=20, ge=1, le=100),
+                          session: DBSession = Depends(get_read_session)):
+    """
+    Searches products by name and description, ranked by relevance, with optional price and merchant filters.
+    Only the newest SEARCH_CANDIDATES matches are ranked, so with a broad q an older, better match can be missed.
+    """
+    keys = crud.catalog_keys()
+    if (unchanged := await check_not_modified(request, session, keys)) is not None:
+        return unchanged
+    token, products = await run_db(session, versioned, keys, crud.search_products, q, min_price, max_price,
+                                   merchant_id, limit)
+    return tagged(products, response, make_etag(request, token))
+
+@router.get("/products/{product_id}", response_model=Products)
+async def get_product(product_id: int, request: Request, response: Response,
+                      session: DBSession = Depends(get_read_session)):
+    """Retrieves a single product from the database."""
+    return await cached_conditional(
+        request, response, session, ("product", product_id), [crud.product_key(product_id)],
+        lambda session: crud.get_product(session, product_id),
+        lambda product: {product_tag(product_id)},
+    )
+
+@router.post("/products/lookup", response_model=List[Products])
+async def lookup_products(lookup: ProductLookup, session: DBSession = Depends(get_session)):
+    """Retrieves many products by id in one query, for callers validating a whole basket."""
+    return await run_db(session, crud.lookup_products, lookup)
+
+@router.post("/products/reservations", response_model=ReservationResult)
+async def reserve_stock(request: ReservationRequest, session: DBSession = Depends(get_session)):
+    """Atomically reserves stock for a basket and reports which items were reserved."""
+    result = await run_db(session, inventory.reserve, request)
+    if result.reservation_id is not None:
+        product_cache.invalidate({product_tag(item.product_id) for item in result.items if item.reserved})
+    return result
+
+@router.post("/products/reservations/expired/release")
+async def release_expired_stock():
+    """Releases every held reservation past its expiry."""
+    return {"released": await release_expired_reservations()}
+
+@router.post("/products/reservations/{reservation_id}/commit")
+async def commit_reservation(reservation_id: int, session: DBSession = Depends(get_session)):
+    """Marks a held reservation as used by an order; its stock stays taken."""
+    await run_db(session, inventory.finish_reservation, reservation_id, ReservationStatus.committed)
+    return {"message": "Reservation committed"}
+
+@router.post("/products/reservations/{reservation_id}/release")
+async def release_reservation(reservation_id: int, session: DBSession = Depends(get_session)):
+    """Releases a held reservation and returns its stock."""
+    product_ids = await run_db(session, inventory.finish_reservation, reservation_id, ReservationStatus.released)
+    product_cache.invalidate({product_tag(product_id) for product_id in product_ids})
+    return {"message": "Reservation released"}
 
 @router.post("/products", response_model=Products)
-def create_users(product: Products, session: Session = Depends(get_session)):
+async def create_users(product: Products, session: DBSession = Depends(get_session)):
     """create new product into the database."""
-    # Use the session to query the database
-    session.add(product)
-    session.commit()
-    session.refresh(product)
+    product = await run_db(session, crud.create_product, product)
+    product_cache.invalidate({LIST_HEAD_TAG})
     return product
 
 @router.put("/products", response_model=Products)
-def update_product(product_id: int, data_update: ProductUpdate, session: Session = Depends(get_session)):
+async def update_product(product_id: int, data_update: ProductUpdate, session: DBSession = Depends(get_session)):
     """update product in the database."""
-    # Use the session to query the database
-    product = session.get(Products, product_id)
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    product_data = data_update.model_dump(exclude_unset=True)
-    product.sqlmodel_update(product_data)
-    session.add(product)
-    session.commit()
-    session.refresh(product)
-
-    return {"message": "update user data success"}
+    result = await run_db(session, crud.update_product, product_id, data_update)
+    tags = {product_tag(product_id)}
+    # Pages of the old merchant's list hold the product; those of the new one may now have to
+    if data_update.merchant_id is not None:
+        tags.add(merchant_tag(data_update.merchant_id))
+    product_cache.invalidate(tags)
+    return result
 
 
 @router.delete("/products", response_model=Products)
-def delete_users(product_id: int, session: Session = Depends(get_session)):
+async def delete_users(product_id: int, session: DBSession = Depends(get_session)):
     """delete user from the database."""
-    # Use the session to query the database
-    product = session.get(Products, product_id)
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-
-    session.delete(product)
-    session.commit()
-
-    return {"message": "delete success"}
+    result = await run_db(session, crud.delete_product, product_id)
+    product_cache.invalidate({product_tag(product_id)})
+    return result
 
-app.include_router(router, tags=["products"], prefix="/api/v1")
\ No newline at end of file
+app.include_router(router, tags=["products"], prefix="/api/v1")
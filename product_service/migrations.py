@@ -0,0 +1,28 @@
+from sqlmodel import SQLModel
+from database import Migration
+from search import search_backend
+from models import CollectionVersion
+
+def create_tables(connection):
+    SQLModel.metadata.create_all(connection)
+
+def search_index(connection):
+    """Creates the full-text index and its triggers on databases that support it."""
+    if search_backend is not None:
+        search_backend.create_index(connection)
+
+def version_stamps(connection):
+    SQLModel.metadata.create_all(connection, tables=[CollectionVersion.__table__])
+
+def search_prefixes(connection):
+    """Rebuilds the full-text index with its current prefix indexes, which FTS5 only sets on creation."""
+    if search_backend is not None:
+        search_backend.rebuild_index(connection)
+
+# Append new migrations with the next version number; applied ones must never change
+MIGRATIONS = [
+    Migration(1, "create tables", create_tables),
+    Migration(2, "search index", search_index),
+    Migration(3, "version stamps", version_stamps),
+    Migration(4, "search prefix indexes", search_prefixes),
+]
@@ -1,5 +1,7 @@
-from typing import Optional
-from sqlmodel import SQLModel, Field
+from datetime import datetime
+from enum import Enum
+from typing import List, Optional
+from sqlmodel import SQLModel, Field, Index
 
 class Products(SQLModel, table=True):
     """
@@ -23,4 +25,74 @@ class ProductUpdate(SQLModel):
     description: Optional[str] = None
     price: Optional[float] = None
     stock: Optional[int] = None
-    image_url: Optional[str] = None
\ No newline at end of file
+    image_url: Optional[str] = None
+    merchant_id: Optional[int] = None
+
+class ProductLookup(SQLModel):
+    """
+    Represents a bulk request for many products by id.
+    """
+    product_ids: List[int] = Field(min_length=1, max_length=1000)
+
+
+class ReservationStatus(str, Enum):
+    held = "held"
+    committed = "committed"
+    released = "released"
+
+class Reservation(SQLModel, table=True):
+    """
+    Represents stock held for a basket until it is committed by an order or released.
+    Held reservations past expires_at are released by the expiry sweeper.
+    """
+    __table_args__ = (Index("ix_reservation_status_expires_at", "status", "expires_at"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    status: ReservationStatus = Field(default=ReservationStatus.held)
+    expires_at: datetime
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class ReservationItem(SQLModel, table=True):
+    """
+    Represents the quantity of one product held by a reservation.
+    """
+    id: Optional[int] = Field(default=None, primary_key=True)
+    reservation_id: int = Field(foreign_key="reservation.id", index=True)
+    product_id: int
+    quantity: int
+
+class CollectionVersion(SQLModel, table=True):
+    """
+    A version stamp bumped in the same transaction as every write to the data it covers, see versions.py.
+    GET handlers derive their ETags from the stamps, so an unchanged poll is answered without reading the data.
+    """
+    key: str = Field(primary_key=True, max_length=100)
+    version: int = Field(default=0)
+
+class ReservationItemRequest(SQLModel):
+    product_id: int
+    quantity: int = Field(gt=0)
+
+class ReservationRequest(SQLModel):
+    """
+    Represents a request to reserve stock for a basket.
+    With all_or_nothing, nothing is reserved unless every item can be.
+    """
+    items: List[ReservationItemRequest] = Field(min_length=1, max_length=1000)
+    ttl_seconds: int = Field(default=900, gt=0, le=86400)
+    all_or_nothing: bool = True
+
+class ReservationItemResult(SQLModel):
+    product_id: int
+    quantity: int
+    reserved: bool
+
+class ReservationResult(SQLModel):
+    """
+    Represents the outcome of a reservation request, item by item.
+    reservation_id is None when nothing was reserved.
+    """
+    reservation_id: Optional[int] = None
+    status: Optional[ReservationStatus] = None
+    expires_at: Optional[datetime] = None
+    items: List[ReservationItemResult] = Field(default_factory=list)
@@ -0,0 +1,169 @@
+from typing import List, Optional
+from sqlalchemy import select, text
+from sqlmodel import Session
+from models import Products
+from database import sync_engine
+import os
+import re
+
+# How many of the newest matches are ranked; 0 ranks every match, which a broad term on a large catalog makes slow
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", "1000"))
+
+def search_terms(q: str) -> List[str]:
+    """Splits a search query into lowercase word terms, dropping any query syntax characters."""
+    return re.findall(r"\w+", q.lower())
+
+def price_and_merchant_filters(min_price: Optional[float], max_price: Optional[float], merchant_id: Optional[int]):
+    """Builds the SQL conditions and bind parameters shared by every search backend."""
+    conditions, params = [], {}
+    if min_price is not None:
+        conditions.append("products.price >= :min_price")
+        params["min_price"] = min_price
+    if max_price is not None:
+        conditions.append("products.price <= :max_price")
+        params["max_price"] = max_price
+    if merchant_id is not None:
+        conditions.append("products.merchant_id = :merchant_id")
+        params["merchant_id"] = merchant_id
+    return conditions, params
+
+class SearchBackend:
+    """
+    Full-text index over product name and description for one database dialect.
+    Matches are ranked by the database itself, which returns only the best limit of them. With a candidates
+    window only the newest candidates matches are ranked, so a broad term costs a bounded amount of work.
+    """
+    candidates = SEARCH_CANDIDATES
+
+    def create_index(self, connection):
+        """Creates the index if it is missing and fills it from the existing products."""
+        raise NotImplementedError
+
+    def search(self, session: Session, q: str, min_price: Optional[float], max_price: Optional[float],
+               merchant_id: Optional[int], limit: int) -> List[Products]:
+        """Returns up to limit products matching every term of q by prefix, best match first."""
+        raise NotImplementedError
+
+    def rebuild_index(self, connection):
+        """Builds the index again from scratch, for migrations that change how it is built."""
+        self.create_index(connection)
+
+    def ranked(self, matches: str, newest: str, score: str, params: dict, best_first: str = "ASC") -> str:
+        """
+        The statement selecting the best :limit products by score, then newest first. matches is the FROM
+        and WHERE clauses of the matching products, newest the column the window takes the newest matches by.
+        """
+        if not self.candidates:
+            return f"SELECT products.* {matches} ORDER BY {score} {best_first}, products.id DESC LIMIT :limit"
+        params["candidates"] = self.candidates
+        return (f"SELECT products.* FROM (SELECT products.id, {score} AS score {matches} "
+                f"ORDER BY {newest} DESC LIMIT :candidates) AS matches JOIN products ON products.id = matches.id "
+                f"ORDER BY matches.score {best_first}, products.id DESC LIMIT :limit")
+
+class Fts5Search(SearchBackend):
+    """
+    SQLite FTS5 external-content index, kept up to date incrementally by triggers on the products table,
+    so create, update and delete only touch the rows they change.
+    merchant_id is indexed as a token too, so a merchant filter is a doclist intersection inside FTS5
+    instead of a lookup of every matching product. Prefix indexes up to 8 characters let FTS5 read a
+    prefix term as one doclist instead of merging the doclists of every word it expands to.
+
+    Matches are ranked inside FTS5 by its bm25 over name and description.
+    """
+    prefixes = "2 3 4 5 6 7 8"
+
+    def create_index(self, connection):
+        exists = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'"
+        ).first()
+        if exists:
+            return
+
+        connection.exec_driver_sql(
+            "CREATE VIRTUAL TABLE products_fts USING fts5("
+            "name, description, merchant_id, content='products', content_rowid='id', tokenize='unicode61', "
+            f"prefix='{self.prefixes}')"
+        )
+        connection.exec_driver_sql(
+            "CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN "
+            "INSERT INTO products_fts(rowid, name, description, merchant_id) "
+            "VALUES (new.id, new.name, new.description, new.merchant_id); "
+            "END"
+        )
+        connection.exec_driver_sql(
+            "CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN "
+            "INSERT INTO products_fts(products_fts, rowid, name, description, merchant_id) "
+            "VALUES ('delete', old.id, old.name, old.description, old.merchant_id); "
+            "END"
+        )
+        connection.exec_driver_sql(
+            "CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name, description, merchant_id ON products BEGIN "
+            "INSERT INTO products_fts(products_fts, rowid, name, description, merchant_id) "
+            "VALUES ('delete', old.id, old.name, old.description, old.merchant_id); "
+            "INSERT INTO products_fts(rowid, name, description, merchant_id) "
+            "VALUES (new.id, new.name, new.description, new.merchant_id); "
+            "END"
+        )
+        connection.exec_driver_sql("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+
+    def rebuild_index(self, connection):
+        # The triggers name the table, so they keep working on the new one
+        connection.exec_driver_sql("DROP TABLE IF EXISTS products_fts")
+        self.create_index(connection)
+
+    def search(self, session, q, min_price, max_price, merchant_id, limit):
+        terms = search_terms(q)
+        if not terms:
+            return []
+
+        conditions, params = price_and_merchant_filters(min_price, max_price, None)
+        # Every term is quoted so user input can never be parsed as FTS5 syntax
+        match = "{name description} : (" + " ".join(f'"{term}"*' for term in terms) + ")"
+        if merchant_id is not None:
+            match += f' AND merchant_id : "{int(merchant_id)}"'
+        params["match"] = match
+        params["limit"] = limit
+        where = "".join(f" AND {condition}" for condition in conditions)
+        # merchant_id only filters, so it is left out of the relevance with a weight of 0
+        matches = ("FROM products_fts JOIN products ON products.id = products_fts.rowid "
+                   f"WHERE products_fts MATCH :match{where}")
+        statement = text(self.ranked(matches, "products_fts.rowid", "bm25(products_fts, 1, 1, 0)", params))
+        return list(session.execute(select(Products).from_statement(statement), params).scalars())
+
+class PostgresSearch(SearchBackend):
+    """
+    Postgres tsvector search backed by a GIN expression index.
+    The index is maintained by Postgres on every write, so it is always incremental.
+    """
+    DOCUMENT = "to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(description, ''))"
+
+    def create_index(self, connection):
+        connection.exec_driver_sql(
+            f"CREATE INDEX IF NOT EXISTS ix_products_search ON products USING GIN (({self.DOCUMENT}))"
+        )
+
+    def search(self, session, q, min_price, max_price, merchant_id, limit):
+        terms = search_terms(q)
+        if not terms:
+            return []
+
+        conditions, params = price_and_merchant_filters(min_price, max_price, merchant_id)
+        params["query"] = " & ".join(f"{term}:*" for term in terms)
+        params["limit"] = limit
+        where = "".join(f" AND {condition}" for condition in conditions)
+        matches = f"FROM products WHERE {self.DOCUMENT} @@ to_tsquery('simple', :query){where}"
+        score = f"ts_rank({self.DOCUMENT}, to_tsquery('simple', :query))"
+        statement = text(self.ranked(matches, "products.id", score, params, best_first="DESC"))
+        return list(session.execute(select(Products).from_statement(statement), params).scalars())
+
+SEARCH_BACKENDS = {
+    "sqlite": Fts5Search,
+    "postgresql": PostgresSearch,
+}
+
+def search_backend_for(dialect_name: str) -> Optional[SearchBackend]:
+    """Returns the search backend for a dialect, or None when full-text search is unsupported."""
+    backend = SEARCH_BACKENDS.get(dialect_name)
+    return backend() if backend else None
+
+search_backend = search_backend_for(sync_engine.dialect.name)
@@ -0,0 +1,55 @@
+"""
+Fixtures loading one service at a time into the test process.
+
+The services are flat directories of modules with the same names (main, models, database...), so
+a test imports a service with load_service, which puts its directory first on sys.path with the given
+environment, and forgets its modules and tables again afterwards.
+"""
+import importlib
+import os
+import sys
+
+import pytest
+from sqlmodel import SQLModel
+from sqlmodel.main import default_registry
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def service_dir(service):
+    return os.path.join(ROOT, f"{service}_service")
+
+
+def unload(directory):
+    for name, module in list(sys.modules.items()):
+        if (getattr(module, "__file__", None) or "").startswith(directory + os.sep):
+            del sys.modules[name]
+    SQLModel.metadata.clear()
+    default_registry.dispose()
+
+
+@pytest.fixture
+def load_service(monkeypatch, tmp_path):
+    """
+    Returns load(service, module="main", **env), which imports a module of the service with env set.
+    DATABASE_URL defaults to a SQLite file in tmp_path, and metrics and the product lookup are off.
+    """
+    loaded = []
+
+    def load(service, module="main", **env):
+        directory = service_dir(service)
+        if loaded and loaded[-1] != directory:
+            raise RuntimeError("one service per test")
+        env = dict({"DATABASE_URL": f"sqlite:///{tmp_path / f'{service}.db'}", "METRICS_ENABLED": "false",
+                    "PRODUCT_SERVICE_URL": ""}, **env)
+        for name, value in env.items():
+            monkeypatch.setenv(name, value)
+        if not loaded:
+            unload(directory)
+            monkeypatch.syspath_prepend(directory)
+            loaded.append(directory)
+        return importlib.import_module(module)
+
+    yield load
+    for directory in loaded:
+        unload(directory)
@@ -0,0 +1,42 @@
+"""Slots of the admission controller by priority."""
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def admission(load_service):
+    return load_service("product", module="admission")
+
+
+def test_browse_requests_leave_the_slots_to_critical_ones(admission):
+    async def scenario():
+        controller = admission.AdmissionController(limit=8, rate=0)
+        browse_cap = controller.limiter.caps[admission.Priority.browse]
+        for _ in range(browse_cap):
+            assert await controller.admit("scraper", "GET /api/v1/products", admission.Priority.browse) is None
+        shed = await controller.admit("scraper", "GET /api/v1/products", admission.Priority.browse)
+        assert shed.status_code == 503
+        for _ in range(8 - browse_cap):
+            assert await controller.admit("cart", "POST /api/v1/products/reservations",
+                                          admission.Priority.critical) is None
+        return controller.snapshot()
+
+    snapshot = asyncio.run(scenario())
+    assert snapshot["in_flight"] == 8
+    assert snapshot["priorities"]["browse"]["shed"] == 1
+
+
+def test_freed_slot_goes_to_the_waiting_critical_request(admission):
+    async def scenario():
+        limiter = admission.ConcurrencyLimiter(2, {priority: 1.0 for priority in admission.Priority})
+        assert await limiter.acquire(admission.Priority.browse, 0)
+        assert await limiter.acquire(admission.Priority.browse, 0)
+        browse = asyncio.create_task(limiter.acquire(admission.Priority.browse, 1))
+        critical = asyncio.create_task(limiter.acquire(admission.Priority.critical, 1))
+        await asyncio.sleep(0)
+        limiter.release()
+        assert await critical
+        assert not await browse
+
+    asyncio.run(scenario())
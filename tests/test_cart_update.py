@@ -0,0 +1,34 @@
+"""Cart line updates, written through to the database or behind the in-memory cart store."""
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture(params=["false", "true"], ids=["database", "cart_store"])
+def cart(load_service, request):
+    """Returns (client, line): a cart of one line, with or without the write-behind cart store."""
+    main = load_service("cart", CART_STORE_ENABLED=request.param)
+    with TestClient(main.app) as client:
+        line = client.post("/cart", json={"user_id": 1, "product_id": 1, "quantity": 2})
+        line.raise_for_status()
+        yield client, line.json()
+
+
+def lines(client):
+    items = client.get("/cart", params={"user_id": 1}).json()["items"]
+    return [(line["product_id"], line["quantity"]) for line in items]
+
+
+def test_quantity_is_updated(cart):
+    client, line = cart
+    client.put("/cart", params={"cart_id": line["id"]}, json={"quantity": 5}).raise_for_status()
+    assert lines(client) == [(1, 5)]
+
+
+def test_null_quantity_is_rejected_and_keeps_the_line(cart, load_service):
+    client, line = cart
+    assert client.put("/cart", params={"cart_id": line["id"]}, json={"quantity": None}).status_code == 422
+    # Nothing is left pending for the cart store to write, least of all a delete
+    cart_store = load_service("cart", module="cart_store").cart_store
+    if cart_store is not None:
+        assert not cart_store.dirty
+    assert lines(client) == [(1, 2)]
@@ -0,0 +1,93 @@
+"""Checkout's handling of the order request: released only on a rejection, reconciled when its outcome is unknown."""
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+ORDER = {"id": 5, "user_id": 1, "order_status": "pending", "payment_status": "unpaid", "total_amount": 6.0,
+         "items": [{"product_id": 1, "quantity": 2, "price": 3.0, "subtotal": 6.0}]}
+
+
+@pytest.fixture
+def checkout(load_service, monkeypatch):
+    """Returns (client, calls, answers): answers holds what each order request gets in turn, an order or an error."""
+    main = load_service("cart", ORDER_RECONCILE_DELAY="0.01")
+    checkout = load_service("cart", module="checkout")
+    utils = load_service("cart", module="utils")
+    calls, answers = [], []
+
+    async def call_service(url, method="GET", data=None, **kwargs):
+        path = url.split("/api/v1/", 1)[1]
+        calls.append((path, data))
+        if path == "products/reservations":
+            return {"reservation_id": 7}
+        if path == "order":
+            answer = answers.pop(0) if len(answers) > 1 else answers[0]
+            if isinstance(answer, int):
+                raise utils.ServiceCallError(f"Server answered {answer}", answer)
+            if answer is None:
+                raise utils.ServiceCallError("Read timed out")
+            return answer
+        return {}
+
+    monkeypatch.setattr(checkout, "call_service", call_service)
+    with TestClient(main.app) as client:
+        client.post("/cart", json={"user_id": 1, "product_id": 1, "quantity": 2}).raise_for_status()
+        yield client, calls, answers
+
+
+def cart(client):
+    lines = client.get("/cart", params={"user_id": 1}).json()["items"]
+    return [(line["product_id"], line["quantity"]) for line in lines]
+
+
+def outcomes(calls):
+    return [path.rsplit("/", 1)[1] for path, _ in calls if path.startswith("products/reservations/")]
+
+
+def settle(client):
+    deadline = time.monotonic() + 5
+    while client.get("/metrics/checkout").json()["pending"]:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return client.get("/metrics/checkout").json()
+
+
+def test_order_is_placed_under_its_reservation_and_committed(checkout):
+    client, calls, answers = checkout
+    answers.append(ORDER)
+    assert client.post("/cart/checkout", json={"user_id": 1}).json()["order_id"] == 5
+    assert [data["reservation_id"] for path, data in calls if path == "order"] == [7]
+    assert outcomes(calls) == ["commit"]
+    assert cart(client) == []
+
+
+def test_rejected_order_releases_the_stock_and_restores_the_cart(checkout):
+    client, calls, answers = checkout
+    answers.append(422)
+    assert client.post("/cart/checkout", json={"user_id": 1}).status_code == 502
+    assert outcomes(calls) == ["release"]
+    assert cart(client) == [(1, 2)]
+
+
+def test_unanswered_order_keeps_the_reservation_until_it_is_confirmed(checkout):
+    client, calls, answers = checkout
+    # The first request timed out after the order service placed the order; repeating it returns that order
+    answers.extend([None, 503, ORDER])
+    assert client.post("/cart/checkout", json={"user_id": 1}).status_code == 504
+    assert cart(client) == []
+
+    assert settle(client) == {"pending": 0, "placed": 1, "rejected": 0, "abandoned": 0}
+    orders = [data for path, data in calls if path == "order"]
+    assert len(orders) == 3 and all(data == orders[0] for data in orders)
+    assert outcomes(calls) == ["commit"]
+    assert cart(client) == []
+
+
+def test_unanswered_order_later_rejected_is_released_and_restored(checkout):
+    client, calls, answers = checkout
+    answers.extend([None, 409])
+    assert client.post("/cart/checkout", json={"user_id": 1}).status_code == 504
+    assert settle(client)["rejected"] == 1
+    assert outcomes(calls) == ["release"]
+    assert cart(client) == [(1, 2)]
@@ -0,0 +1,56 @@
+"""The order service's stock check on orders placed by checkout, which has already reserved their stock."""
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def order_service(load_service, monkeypatch):
+    main = load_service("order", PRODUCT_SERVICE_URL="http://product")
+    catalog = load_service("order", module="catalog")
+    # Stock was 2 before checkout reserved both units, so the catalog now has none on hand
+    products = {1: {"id": 1, "name": "product 1", "price": 7.5, "stock": 0}}
+
+    async def lookup(url, method="GET", data=None, **kwargs):
+        return [products[product_id] for product_id in data["product_ids"] if product_id in products]
+
+    monkeypatch.setattr(catalog, "call_service", lookup)
+    catalog.price_cache.entries.clear()
+    with TestClient(main.app) as client:
+        yield client, products
+
+
+def place(client, quantity, **extra):
+    return client.post("/api/v1/order", json=dict(
+        {"user_id": 1, "items": [{"product_id": 1, "quantity": quantity, "price": 1}]}, **extra))
+
+
+def test_reserved_order_for_the_whole_remaining_stock_is_placed(order_service):
+    client, _ = order_service
+    response = place(client, 2, reservation_id=41)
+    assert response.status_code == 200, response.text
+    assert response.json()["total_amount"] == 15
+
+
+def test_order_without_a_reservation_is_checked_against_the_stock(order_service):
+    client, products = order_service
+    assert place(client, 2).status_code == 409
+
+    products[1]["stock"] = 2
+    assert place(client, 2).status_code == 200
+    assert place(client, 3).status_code == 409
+
+
+def test_repeated_request_for_a_reservation_returns_the_first_order(order_service):
+    client, _ = order_service
+    first = place(client, 2, reservation_id=41)
+    again = place(client, 2, reservation_id=41)
+    assert first.status_code == again.status_code == 200
+    assert again.json() == first.json()
+    assert len(client.get("/api/v1/order").json()["items"]) == 1
+
+    batch = client.post("/api/v1/order/batch", json=[
+        {"user_id": 1, "items": [{"product_id": 1, "quantity": 1, "price": 1}], "reservation_id": reservation_id}
+        for reservation_id in (42, 41)])
+    assert [order["reservation_id"] for order in batch.json()] == [42, 41]
+    assert batch.json()[1]["id"] == first.json()["id"]
+    assert len(client.get("/api/v1/order").json()["items"]) == 2
@@ -0,0 +1,76 @@
+"""
+A scaled-down benchmarks/export_memory.py: the order and payment exports stream in chunks, so their
+peak memory is the same for the last rows of a table and for the whole of it.
+"""
+import asyncio
+import tracemalloc
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+ROWS = 40_000
+SMALL = 2_000
+CHUNK_ROWS = 500
+PATHS = {"order": "/api/v1/order/export", "payment": "/api/v1/payment/export"}
+SEED_SQL = {
+    "order": "INSERT INTO orders (user_id, order_status, total_amount, payment_status, created_at) "
+             "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :rows) "
+             "SELECT i % 1000, 'completed', (i % 50000) / 100.0, 'paid', "
+             "datetime('2024-01-01', '+' || ((i - 1) * 5) || ' seconds') || '.000000' FROM n",
+    "payment": "INSERT INTO payment (order_id, total_amount, payment_status, created_at) "
+               "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :rows) "
+               "SELECT i, (i % 50000) / 100.0, 'paid', "
+               "strftime('%Y-%m-%dT%H:%M:%S', '2024-01-01', '+' || ((i - 1) * 5) || ' seconds') FROM n",
+}
+
+
+async def export(app, path, query):
+    """Streams one export through ASGI, dropping each chunk; returns its lines and peak traced memory in bytes."""
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+             "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+             "query_string": query.encode(), "headers": [(b"host", b"test")],
+             "client": ("127.0.0.1", 1), "server": ("test", 80)}
+    state = {"lines": 0, "requested": False}
+
+    async def receive():
+        if state["requested"]:
+            await asyncio.Event().wait()
+        state["requested"] = True
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            assert message["status"] == 200
+        elif message["type"] == "http.response.body":
+            state["lines"] += message.get("body", b"").count(b"\n")
+
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        await app(scope, receive, send)
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+    return state["lines"], peak
+
+
+@pytest.mark.parametrize("export_format", ["ndjson", "csv"])
+@pytest.mark.parametrize("service", ["order", "payment"])
+def test_export_memory_does_not_grow_with_rows(load_service, service, export_format):
+    main = load_service(service, EXPORT_CHUNK_ROWS=str(CHUNK_ROWS))
+    database = load_service(service, module="database")
+    header = 1 if export_format == "csv" else 0
+    with TestClient(main.app) as client:
+        with database.sync_engine.begin() as connection:
+            connection.execute(text(SEED_SQL[service]), {"rows": ROWS})
+
+        # The small export runs first, so whatever is set up on first use is counted against it
+        small_lines, small_peak = client.portal.call(export, main.app, PATHS[service],
+                                                     f"format={export_format}&after_id={ROWS - SMALL}")
+        full_lines, full_peak = client.portal.call(export, main.app, PATHS[service], f"format={export_format}")
+
+    assert small_lines - header == SMALL
+    assert full_lines - header == ROWS
+    # 20 times the rows may cost a little more, never in proportion: a whole table in memory is megabytes
+    assert full_peak < small_peak * 1.5 + 256 * 1024, (small_peak, full_peak)
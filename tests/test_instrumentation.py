@@ -0,0 +1,80 @@
+"""The per-route request and database metrics served on GET /metrics."""
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def products(load_service):
+    main = load_service("product", METRICS_ENABLED="true", PRODUCT_CACHE_SIZE="0")
+    with TestClient(main.app) as client:
+        client.post("/api/v1/products", json={"name": "lamp", "price": 12.5, "merchant_id": 1}).raise_for_status()
+        yield client
+
+
+@pytest.fixture
+def payments(load_service):
+    main = load_service("payment", METRICS_ENABLED="true")
+    with TestClient(main.app) as client:
+        for order_id in range(1, 4):
+            client.post("/api/v1/payment", json={"order_id": order_id, "total_amount": 10.0}).raise_for_status()
+        yield client
+
+
+def samples(client):
+    lines = client.get("/metrics").text.splitlines()
+    return dict(line.rsplit(" ", 1) for line in lines if not line.startswith("#"))
+
+
+def test_requests_are_labelled_by_route_template_with_their_queries(products):
+    client = products
+    client.get("/api/v1/products/1")
+    client.get("/api/v1/products/1")
+    client.get("/nowhere")
+    metrics = samples(client)
+
+    route = 'method="GET",route="/api/v1/products/{product_id}"'
+    assert metrics[f'http_requests_total{{{route},status="200"}}'] == "2"
+    assert metrics[f"http_request_duration_seconds_count{{{route}}}"] == "2"
+    assert float(metrics[f"db_queries_per_request_sum{{{route}}}"]) >= 2
+    assert float(metrics[f"db_request_query_seconds_total{{{route}}}"]) > 0
+    assert f"db_request_pool_wait_seconds_total{{{route}}}" in metrics
+    assert metrics['http_requests_total{method="GET",route="<unmatched>",status="404"}'] == "1"
+
+
+def test_response_sizes_of_whole_and_streamed_bodies(payments):
+    client = payments
+    page = client.get("/api/v1/payment")
+    export = client.get("/api/v1/payment/export")
+    assert "content-length" in page.headers and "content-length" not in export.headers
+    metrics = samples(client)
+
+    assert float(metrics['http_response_size_bytes_sum{method="GET",route="/api/v1/payment"}']) == len(page.content)
+    assert float(metrics['http_response_size_bytes_sum{method="GET",route="/api/v1/payment/export"}']) == \
+        len(export.content) > 0
+
+
+def place_batch(load_service, tmp_path, orders, **env):
+    shards = ",".join(f"sqlite:///{tmp_path / f'shard{index}.db'}" for index in (1, 2))
+    main = load_service("order", METRICS_ENABLED="true", ORDER_SHARD_URLS=shards, **env)
+    with TestClient(main.app) as client:
+        client.post("/api/v1/order/batch", json=[
+            {"user_id": user_id, "items": [{"product_id": 1, "quantity": 1, "price": 2.0}]}
+            for user_id in range(1, orders + 1)]).raise_for_status()
+        return samples(client)
+
+
+def test_sharded_batch_counts_queries_per_shard(load_service, tmp_path, caplog):
+    metrics = place_batch(load_service, tmp_path, 10)
+    route = 'method="POST",route="/api/v1/order/batch"'
+    # More than N_PLUS_ONE_THRESHOLD (20) in all, but run on three shards at once
+    assert float(metrics[f"db_queries_per_request_sum{{{route}}}"]) > 20
+    assert metrics[f"db_n_plus_one_requests_total{{{route}}}"] == "0"
+    assert "Possible N+1" not in caplog.text
+
+
+def test_n_plus_one_is_reported_with_the_busiest_shards_queries(load_service, tmp_path, caplog):
+    metrics = place_batch(load_service, tmp_path, 10, N_PLUS_ONE_THRESHOLD="8")
+    route = 'method="POST",route="/api/v1/order/batch"'
+    assert metrics[f"db_n_plus_one_requests_total{{{route}}}"] == "1"
+    reported = int(caplog.text.split("POST /api/v1/order/batch ran ")[1].split()[0])
+    assert 8 < reported < float(metrics[f"db_queries_per_request_sum{{{route}}}"])
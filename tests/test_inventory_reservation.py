@@ -0,0 +1,103 @@
+"""
+Concurrent stock reservations against a small stock, as in benchmarks/inventory_reservation.py: the
+requests go through the app together, their database work running at once on the threadpool.
+"""
+import asyncio
+import random
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+STOCK = {1: 10, 2: 7}
+
+
+@pytest.fixture
+def service(load_service):
+    main = load_service("product", PRODUCT_CACHE_SIZE="0")
+    with TestClient(main.app) as client:
+        for product_id, stock in STOCK.items():
+            client.post("/api/v1/products", json={"name": f"hot sku {product_id}", "price": 5.0, "stock": stock,
+                                                  "merchant_id": 1}).raise_for_status()
+        yield main, client
+
+
+def run_concurrently(client, app, baskets):
+    """Posts every basket at once while polling the stock; returns the responses and the stock levels seen."""
+    async def run():
+        seen = []
+        done = asyncio.Event()
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            async def poll():
+                while not done.is_set():
+                    for product_id in STOCK:
+                        seen.append((await http.get(f"/api/v1/products/{product_id}")).json()["stock"])
+                    await asyncio.sleep(0)
+
+            poller = asyncio.create_task(poll())
+            responses = await asyncio.gather(*(http.post("/api/v1/products/reservations", json={"items": basket})
+                                               for basket in baskets))
+            done.set()
+            await poller
+        return responses, seen
+
+    return client.portal.call(run)
+
+
+def stock(client, product_id):
+    return client.get(f"/api/v1/products/{product_id}").json()["stock"]
+
+
+def test_concurrent_reservers_never_oversell(service):
+    main, client = service
+    responses, seen = run_concurrently(client, main.app,
+                                       [[{"product_id": 1, "quantity": 1}] for _ in range(40)])
+
+    assert [response.status_code for response in responses] == [200] * 40
+    reserved = [response.json() for response in responses if response.json()["reservation_id"] is not None]
+    assert len(reserved) == STOCK[1]
+    assert stock(client, 1) == 0
+    assert min(seen) >= 0
+
+
+def test_mixed_baskets_sell_at_most_the_stock(service):
+    main, client = service
+    rng = random.Random(9)
+    baskets = []
+    for _ in range(30):
+        # Baskets name the products in either order; reserve takes the rows in id order regardless
+        items = [{"product_id": product_id, "quantity": rng.randint(1, 3)} for product_id in rng.sample(list(STOCK), 2)]
+        baskets.append(items[:rng.randint(1, 2)])
+    responses, seen = run_concurrently(client, main.app, baskets)
+
+    assert all(response.status_code == 200 for response in responses)
+    sold = {product_id: 0 for product_id in STOCK}
+    for response in responses:
+        result = response.json()
+        if result["reservation_id"] is not None:
+            for item in result["items"]:
+                assert item["reserved"]
+                sold[item["product_id"]] += item["quantity"]
+    for product_id, initial in STOCK.items():
+        assert 0 < sold[product_id] <= initial
+        assert stock(client, product_id) == initial - sold[product_id] >= 0
+    assert min(seen) >= 0
+
+
+def test_released_stock_is_sold_again_without_oversell(service):
+    main, client = service
+    first, _ = run_concurrently(client, main.app, [[{"product_id": 2, "quantity": 1}] for _ in range(20)])
+    held = [response.json()["reservation_id"] for response in first if response.json()["reservation_id"] is not None]
+    assert len(held) == STOCK[2]
+
+    for reservation_id in held[:3]:
+        client.post(f"/api/v1/products/reservations/{reservation_id}/release").raise_for_status()
+    client.post(f"/api/v1/products/reservations/{held[3]}/commit").raise_for_status()
+    # A released reservation cannot be released again to return its stock twice
+    client.post(f"/api/v1/products/reservations/{held[0]}/release")
+    assert stock(client, 2) == 3
+
+    second, seen = run_concurrently(client, main.app, [[{"product_id": 2, "quantity": 1}] for _ in range(20)])
+    assert sum(response.json()["reservation_id"] is not None for response in second) == 3
+    assert stock(client, 2) == 0
+    assert min(seen) >= 0
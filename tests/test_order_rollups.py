@@ -0,0 +1,42 @@
+"""The order rollups, striped by order id, against a rebuild from the order history."""
+from datetime import datetime
+
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+from sqlmodel import Session
+
+
+def rollup_rows(database, models):
+    with Session(database.sync_engine) as session:
+        return {model.__name__: sorted(tuple(sorted((name, round(value, 6) if isinstance(value, float) else value)
+                                                    for name, value in row.model_dump().items()))
+                                       for row in session.execute(select(model)).scalars())
+                for model in (models.SalesRollup, models.StatusRollup, models.ProductRollup)}
+
+
+def test_striped_rollups_add_up_and_match_a_rebuild(load_service):
+    main = load_service("order")
+    database = load_service("order", module="database")
+    models = load_service("order", module="models")
+    rollups = load_service("order", module="rollups")
+    with TestClient(main.app) as client:
+        placed = client.post("/api/v1/order/batch", json=[
+            {"user_id": user_id, "items": [{"product_id": user_id % 3, "quantity": 2, "price": 5.0}]}
+            for user_id in range(1, 41)]).json()
+        for order in placed[:10]:
+            client.put("/api/v1/order", json={"order_id": order["id"], "payment_status": "paid"}).raise_for_status()
+        client.delete(f"/api/v1/order/{placed[-1]['id']}").raise_for_status()
+
+        stats = client.get("/api/v1/order/stats", params={"granularity": "hour"}).json()
+        hour = rollups.bucket_start(datetime.utcnow(), models.RollupGranularity.hour).isoformat()
+        assert [bucket["orders"] for bucket in stats["sales"] if bucket["bucket"] == hour] == [39]
+        assert sorted((row["payment_status"], row["orders"]) for row in stats["statuses"]) == [("paid", 10),
+                                                                                                ("unpaid", 29)]
+        assert stats["total_revenue"] == 39 * 10.0
+
+        incremental = rollup_rows(database, models)
+        # Orders spread over every stripe of the hour, each of them a row of its own
+        assert len({dict(row)["stripe"] for row in incremental["SalesRollup"]}) == rollups.ROLLUP_STRIPES
+        with Session(database.sync_engine) as session:
+            assert rollups.rebuild_rollups(session)["orders"] == 39
+        assert rollup_rows(database, models) == incremental
@@ -0,0 +1,150 @@
+"""Orders sharded by user over three SQLite databases: routing, merged lists, legacy ids and bucket moves."""
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+from sqlmodel import Session
+
+
+@pytest.fixture
+def sharded(load_service, tmp_path):
+    """Yields (sharding, client): the order service on DATABASE_URL as shard 0 and two more shards."""
+    shards = ",".join(f"sqlite:///{tmp_path / f'shard{index}.db'}" for index in (1, 2))
+    main = load_service("order", ORDER_SHARD_URLS=shards)
+    with TestClient(main.app) as client:
+        yield load_service("order", module="sharding"), client
+
+
+def place(client, user_ids):
+    response = client.post("/api/v1/order/batch", json=[
+        {"user_id": user_id, "items": [{"product_id": 1, "quantity": 1, "price": 4.0}]} for user_id in user_ids])
+    response.raise_for_status()
+    return response.json()
+
+
+def shard_rows(sharding):
+    """Per shard: the (order id, user id) pairs it holds and the orders its status and sales rollups count."""
+    models = sharding.Orders.metadata.tables
+    rows = []
+    for shard in sharding.shard_router.shards:
+        with Session(shard.sync_engine) as session:
+            orders = set(session.execute(select(sharding.Orders.id, sharding.Orders.user_id)).all())
+            counted = tuple(session.execute(select(func.coalesce(func.sum(models[name].c.orders), 0))).scalar()
+                            for name in ("statusrollup", "salesrollup"))
+        rows.append((orders, counted))
+    return rows
+
+
+def users_in_bucket(sharding, bucket, count):
+    return [user_id for user_id in range(1, 100_000) if sharding.user_bucket(user_id) == bucket][:count]
+
+
+def test_orders_go_to_the_shard_owning_their_users_bucket(sharded):
+    sharding, client = sharded
+    router = sharding.shard_router
+    assert sorted(sum(owner is shard for owner in router.owners.values()) for shard in router.shards) == \
+        [341, 341, 342]
+
+    placed = place(client, range(1, 31))
+    held = [orders for orders, _ in shard_rows(sharding)]
+    assert all(held)
+    for order in placed:
+        bucket = sharding.user_bucket(order["user_id"])
+        assert sharding.id_bucket(order["id"]) == bucket
+        assert [(order["id"], order["user_id"]) in orders for orders in held] == \
+            [shard is router.owners[bucket] for shard in router.shards]
+    assert [order["id"] for order in client.get("/api/v1/order", params={"user_id": 7}).json()["items"]] == \
+        [order["id"] for order in placed if order["user_id"] == 7]
+
+
+def test_lists_merge_every_shard_newest_first(sharded):
+    sharding, client = sharded
+    placed = place(client, range(1, 26)) + place(client, range(26, 41))
+    expected = [order["id"] for order in sorted(placed, key=lambda order: (order["created_at"], order["id"]),
+                                                reverse=True)]
+
+    listed, cursor = [], None
+    while True:
+        page = client.get("/api/v1/order", params=dict(limit=7, **({"cursor": cursor} if cursor else {}))).json()
+        listed += [order["id"] for order in page["items"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert listed == expected
+
+
+def test_merge_pages_keeps_a_row_read_from_two_shards_once(sharded):
+    sharding, _ = sharded
+    now = datetime(2024, 5, 1)
+    row = lambda order_id, minutes: SimpleNamespace(id=order_id, created_at=now + timedelta(minutes=minutes))
+    # Order 3 is on both shards while its bucket moves
+    pages = [sharding.Page(items=[row(5, 5), row(3, 3), row(1, 1)]),
+             sharding.Page(items=[row(4, 4), row(3, 3), row(2, 2)], next_cursor="more")]
+    page = sharding.merge_pages(pages, ["created_at", "id"], 4)
+    assert [item.id for item in page.items] == [5, 4, 3, 2]
+    assert page.next_cursor is not None
+    assert [item.id for item in sharding.merge_pages(pages[:1], ["created_at", "id"], 4).items] == [5, 3, 1]
+    assert sharding.merge_pages(pages[:1], ["created_at", "id"], 4).next_cursor is None
+
+
+def test_orders_placed_before_sharding_are_found_on_any_shard(sharded):
+    sharding, client = sharded
+    router = sharding.shard_router
+    # Legacy ids were numbered by the one database, so id 5 says nothing of where the order is
+    user_id = next(user_id for user_id in range(1, 1000)
+                   if router.owners[sharding.user_bucket(user_id)] is not router.owners[sharding.id_bucket(5)])
+    holder = router.owners[sharding.user_bucket(user_id)]
+
+    def add_legacy_order(session):
+        session.add(sharding.Orders(id=5, user_id=user_id, total_amount=4.0))
+        session.commit()
+
+    client.portal.call(holder.run, add_legacy_order)
+    updated = client.put("/api/v1/order", json={"order_id": 5, "payment_status": "paid"})
+    assert updated.status_code == 200, updated.text
+    assert updated.json()["payment_status"] == "paid"
+    assert client.put("/api/v1/order", json={"order_id": 6, "payment_status": "paid"}).status_code == 404
+    assert client.delete("/api/v1/order/5").status_code == 200
+
+
+@pytest.mark.parametrize("interrupted", ["take_bucket", "drop_bucket"])
+def test_interrupted_move_is_finished_by_running_it_again(sharded, load_service, monkeypatch, interrupted):
+    sharding, client = sharded
+    reshard = load_service("order", module="reshard")
+    router = sharding.shard_router
+    movers = users_in_bucket(sharding, sharding.user_bucket(1), 3)
+    bucket = sharding.user_bucket(movers[0])
+    source = router.owners[bucket]
+    target = next(shard for shard in router.shards if shard is not source)
+    placed = place(client, movers + list(range(100_000, 100_020)))
+    moved = {(order["id"], order["user_id"]) for order in placed if order["user_id"] in movers}
+    before = shard_rows(sharding)
+
+    step = getattr(reshard, interrupted)
+
+    def fail_once(*args):
+        monkeypatch.setattr(reshard, interrupted, step)
+        raise RuntimeError("connection lost")
+
+    monkeypatch.setattr(reshard, interrupted, fail_once)
+    with pytest.raises(RuntimeError):
+        client.portal.call(reshard.move_bucket, router, bucket, target)
+    result = client.portal.call(reshard.move_bucket, router, bucket, target)
+    assert result["users"] == 3 and result["orders"] == 3
+
+    client.portal.call(router.load)
+    assert router.owners[bucket] is target
+    after = shard_rows(sharding)
+    for shard, (orders, counted), (orders_before, _) in zip(router.shards, after, before):
+        expected = orders_before - moved if shard is source else orders_before | moved if shard is target \
+            else orders_before
+        assert orders == expected
+        # The status and sales rollups moved with the orders (the sales ones count each order per hour and day)
+        assert counted == (len(orders), 2 * len(orders))
+
+    # Writes follow the bucket to its new shard
+    again = place(client, movers[:1])[0]
+    assert (again["id"], again["user_id"]) in shard_rows(sharding)[target.index][0]
+    assert len(client.get("/api/v1/order", params={"user_id": movers[0]}).json()["items"]) == 2
@@ -0,0 +1,50 @@
+"""The order outbox and the notification service's record of handled events."""
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+from sqlmodel import Session
+
+ORDER = {"user_id": 1, "items": [{"product_id": 1, "quantity": 1, "price": 2.0}]}
+
+
+def outbox_size(load_service):
+    database = load_service("order", module="database")
+    models = load_service("order", module="models")
+    with database.sync_engine.connect() as connection:
+        return connection.execute(select(func.count()).select_from(models.OutboxEvent)).scalar_one()
+
+
+def test_orders_record_events_only_with_a_broker(load_service, tmp_path):
+    main = load_service("order", EVENT_BROKER_URL=f"file://{tmp_path / 'events.jsonl'}")
+    with TestClient(main.app) as client:
+        client.post("/api/v1/order", json=ORDER).raise_for_status()
+        assert outbox_size(load_service) == 1
+
+
+def test_orders_without_a_broker_leave_the_outbox_empty(load_service, monkeypatch):
+    monkeypatch.delenv("EVENT_BROKER_URL", raising=False)
+    main = load_service("order")
+    with TestClient(main.app) as client:
+        client.post("/api/v1/order", json=ORDER).raise_for_status()
+        assert outbox_size(load_service) == 0
+
+
+def test_processed_events_are_recorded_once_and_purged_after_retention(load_service):
+    main = load_service("notification")
+    crud = load_service("notification", module="crud")
+    database = load_service("notification", module="database")
+    models = load_service("notification", module="models")
+    with TestClient(main.app):
+        old = datetime.utcnow() - timedelta(days=8)
+        with Session(database.sync_engine) as session:
+            crud.mark_processed(session, [models.ProcessedEvent(event_id="a", topic="order.placed", processed_at=old),
+                                          models.ProcessedEvent(event_id="b", topic="order.placed")])
+            # Another consumer handled "b" first: its record is kept, failed or not
+            crud.mark_processed(session, [models.ProcessedEvent(event_id="b", topic="order.placed", attempts=3,
+                                                                status=models.DeliveryStatus.failed)])
+            assert crud.processed_ids(session, ["a", "b", "c"]) == {"a", "b"}
+            assert session.get(models.ProcessedEvent, "b").attempts == 1
+
+            assert crud.purge_processed(session, timedelta(days=7).total_seconds()) == 1
+            assert crud.processed_ids(session, ["a", "b"]) == {"b"}
@@ -0,0 +1,55 @@
+"""Payment updates: status changes without a status, and repeats of the current status as redelivered webhooks send."""
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client(load_service):
+    main = load_service("payment")
+    with TestClient(main.app) as client:
+        yield client
+
+
+def paid_payment(client):
+    payment = client.post("/api/v1/payment", json={"order_id": 1, "total_amount": 10}).json()
+    response = client.put("/api/v1/payment", params={"payment_id": payment["id"]}, json={"payment_status": "paid"})
+    assert response.status_code == 200, response.text
+    return payment["id"]
+
+
+def stored_amount(client):
+    return client.get("/api/v1/payment", params={"order_id": 1}).json()["items"][0]["total_amount"]
+
+
+def test_repeated_status_still_applies_the_other_fields(client):
+    payment_id = paid_payment(client)
+    response = client.put("/api/v1/payment", params={"payment_id": payment_id},
+                          json={"payment_status": "paid", "total_amount": 99})
+    assert response.status_code == 200, response.text
+    assert response.json()["total_amount"] == 99
+    assert stored_amount(client) == 99
+
+
+def test_repeated_status_alone_is_a_no_op(client):
+    payment_id = paid_payment(client)
+    response = client.put("/api/v1/payment", params={"payment_id": payment_id}, json={"payment_status": "paid"})
+    assert response.status_code == 200
+    assert response.json()["payment_status"] == "paid"
+    assert response.json()["total_amount"] == 10
+
+
+def test_disallowed_transition_is_a_conflict_and_changes_nothing(client):
+    payment_id = paid_payment(client)
+    response = client.put("/api/v1/payment", params={"payment_id": payment_id},
+                          json={"payment_status": "pending", "total_amount": 99})
+    assert response.status_code == 409
+    assert stored_amount(client) == 10
+
+
+@pytest.mark.parametrize("update", [{"payment_status": None}, {"expected_status": "paid", "total_amount": 99}])
+def test_status_update_without_a_status_is_rejected(client, update):
+    payment_id = paid_payment(client)
+    response = client.put("/api/v1/payment", params={"payment_id": payment_id}, json=update)
+    assert response.status_code == 422
+    assert client.get("/api/v1/payment", params={"order_id": 1}).json()["items"][0]["payment_status"] == "paid"
+    assert stored_amount(client) == 10
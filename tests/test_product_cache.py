@@ -0,0 +1,42 @@
+"""The product cache's invalidation of cached list pages by product updates."""
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def products(load_service):
+    """Products 1 and 3 of merchant 1, 2, 4, 5 and 6 of merchant 2."""
+    main = load_service("product")
+    with TestClient(main.app) as client:
+        for merchant_id in (1, 2, 1, 2, 2, 2):
+            client.post("/api/v1/products", json={"name": "lamp", "price": 12.5, "merchant_id": merchant_id}
+                        ).raise_for_status()
+        yield client
+
+
+def listed(client, merchant_id):
+    """The product ids of every page of a merchant's list, newest first and two to a page."""
+    ids, params = [], {"merchant_id": merchant_id, "limit": 2}
+    while True:
+        page = client.get("/api/v1/products", params=params).json()
+        ids += [product["id"] for product in page["items"]]
+        if page["next_cursor"] is None:
+            return ids
+        params["cursor"] = page["next_cursor"]
+
+
+def test_moving_a_product_refreshes_both_merchants_lists(products):
+    client = products
+    assert listed(client, 1) == [3, 1]
+    assert listed(client, 2) == [6, 5, 4, 2]
+    # Product 3 lands on the second page of merchant 2's list, which none of its products' tags would refresh
+    client.put("/api/v1/products", params={"product_id": 3}, json={"merchant_id": 2}).raise_for_status()
+    assert listed(client, 1) == [1]
+    assert listed(client, 2) == [6, 5, 4, 3, 2]
+    assert client.get("/metrics/cache").json()["hits"] == 0
+
+
+def test_null_merchant_is_rejected(products):
+    client = products
+    assert client.put("/api/v1/products", params={"product_id": 3}, json={"merchant_id": None}).status_code == 422
+    assert listed(client, 1) == [3, 1]
@@ -0,0 +1,68 @@
+"""The product search of the SQLite FTS5 backend: relevance, prefixes and filters."""
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+PRODUCTS = [
+    ("Leather wallet", "A slim wallet in brown leather, leather lined", 40.0, 1),
+    ("Canvas bag", "A bag with leather straps", 80.0, 2),
+    ("Leather boots", "Boots", 120.0, 1),
+    ("Phone charger", "Fast charger for phones", 20.0, 2),
+    ("Café crème mug", "A mug for coffee", 12.0, 3),
+]
+
+
+@pytest.fixture
+def service(load_service):
+    main = load_service("product")
+    with TestClient(main.app) as client:
+        for name, description, price, merchant_id in PRODUCTS:
+            client.post("/api/v1/products", json={"name": name, "description": description, "price": price,
+                                                  "stock": 5, "merchant_id": merchant_id}).raise_for_status()
+        yield load_service("product", module="search"), client
+
+
+def search(client, **params):
+    response = client.get("/api/v1/products/search", params=params)
+    response.raise_for_status()
+    return [product["name"] for product in response.json()]
+
+
+def test_results_follow_fts5_bm25_order(service):
+    search_module, client = service
+    for q in ("leather", "lea", "leather bag"):
+        match = " AND ".join(f'{{name description}} : "{term}"*' for term in search_module.search_terms(q))
+        with search_module.sync_engine.connect() as connection:
+            expected = [name for name, in connection.execute(text(
+                "SELECT products.name FROM products_fts JOIN products ON products.id = products_fts.rowid "
+                "WHERE products_fts MATCH :match ORDER BY bm25(products_fts, 1, 1, 0), products.id DESC"
+            ), {"match": match})]
+        assert search(client, q=q) == expected
+    assert search(client, q="leather")[0] == "Leather wallet"
+
+
+def test_only_the_newest_candidates_are_ranked(service, monkeypatch):
+    search_module, client = service
+    # "leather" is most relevant to the oldest product, the wallet, which falls outside a window of 2
+    monkeypatch.setattr(search_module.search_backend, "candidates", 2)
+    assert search(client, q="leather") == ["Leather boots", "Canvas bag"]
+    monkeypatch.setattr(search_module.search_backend, "candidates", 0)
+    assert search(client, q="leather")[0] == "Leather wallet"
+
+
+def test_prefixes_filters_and_diacritics(service):
+    search_module, client = service
+    assert search(client, q="charg") == ["Phone charger"]
+    assert search(client, q="leather", min_price=50, max_price=100) == ["Canvas bag"]
+    assert sorted(search(client, q="leather", merchant_id=1)) == ["Leather boots", "Leather wallet"]
+    assert search(client, q="cafe") == ["Café crème mug"]
+    assert search(client, q="nothing") == []
+
+
+def test_rebuilt_index_still_follows_writes(service):
+    search_module, client = service
+    with search_module.sync_engine.begin() as connection:
+        search_module.search_backend.rebuild_index(connection)
+    client.post("/api/v1/products", json={"name": "Leather belt", "description": "Leather", "price": 30.0,
+                                          "stock": 5, "merchant_id": 3}).raise_for_status()
+    assert search(client, q="belt") == ["Leather belt"]
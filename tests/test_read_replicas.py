@@ -0,0 +1,106 @@
+"""
+Read routing between a primary and a replica, two SQLite files as in benchmarks/read_replicas.py.
+The replica is a snapshot that never replicates, so a read finding a later write came from the primary.
+"""
+import contextlib
+import sqlite3
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import OperationalError
+
+
+@pytest.fixture
+def replicated(load_service, tmp_path):
+    """Returns start(**env): the payment service on a primary with one payment and a replica snapshot of it."""
+    primary = tmp_path / "primary.db"
+
+    def start(replica=tmp_path / "replica.db", **env):
+        main = load_service("payment", DATABASE_URL=f"sqlite:///{primary}",
+                            DATABASE_REPLICA_URLS=f"sqlite:///{replica}", DB_REPLICA_CHECK_INTERVAL="0", **env)
+        client = stack.enter_context(TestClient(main.app))
+        write(client, order_id=1)
+        if replica.parent.exists():
+            with sqlite3.connect(primary) as source, sqlite3.connect(replica) as target:
+                source.backup(target)
+        client.cookies.clear()
+        return load_service("payment", module="database"), client
+
+    with contextlib.ExitStack() as stack:
+        yield start
+
+
+def write(client, order_id):
+    client.post("/api/v1/payment", json={"order_id": order_id, "total_amount": 10.0}).raise_for_status()
+
+
+def orders(client):
+    response = client.get("/api/v1/payment")
+    response.raise_for_status()
+    return sorted(payment["order_id"] for payment in response.json()["items"])
+
+
+def test_writer_reads_its_writes_from_the_primary(replicated):
+    database, writer = replicated()
+    reader = TestClient(writer.app)
+    assert orders(writer) == [1]
+
+    write(writer, order_id=2)
+    assert database.PIN_COOKIE in writer.cookies
+    # The writer is pinned to the primary; anyone else still reads the replica, which lacks the write
+    assert orders(writer) == [1, 2]
+    assert orders(reader) == [1]
+
+    stats = database.replica_stats()
+    assert stats["pinned_reads"] == 1
+    assert stats["replicas"][0]["sessions"] == 2
+
+
+def test_pin_expires_after_pin_seconds(replicated):
+    database, writer = replicated(DB_REPLICA_PIN_SECONDS="0.2")
+    write(writer, order_id=2)
+    assert orders(writer) == [1, 2]
+    time.sleep(0.3)
+    assert orders(writer) == [1]
+
+
+def test_failed_writes_do_not_pin(replicated):
+    database, writer = replicated()
+    assert writer.put("/api/v1/payment", params={"payment_id": 999}, json={"total_amount": 1.0}).status_code == 404
+    assert database.PIN_COOKIE not in writer.cookies
+    assert orders(writer) == [1]
+
+
+def test_unreachable_replica_falls_back_to_the_primary(replicated, tmp_path):
+    database, client = replicated(replica=tmp_path / "missing" / "replica.db")
+    write(client, order_id=2)
+    client.cookies.clear()
+
+    assert orders(client) == [1, 2]
+    stats = database.replica_stats()
+    assert stats["primary_fallbacks"] == 1
+    assert stats["replicas"][0]["healthy"] is False
+    assert stats["replicas"][0]["failures"] == 1
+
+
+def test_lagging_or_failing_replica_is_skipped_until_it_recovers(replicated, monkeypatch):
+    database, client = replicated(DB_REPLICA_MAX_LAG="5")
+    write(client, order_id=2)
+    client.cookies.clear()
+    assert orders(client) == [1]
+
+    monkeypatch.setattr(database, "replication_lag", lambda connection: 30.0)
+    assert orders(client) == [1, 2]
+    assert database.replica_stats()["replicas"][0]["lag_seconds"] == 30.0
+
+    def down(connection):
+        raise OperationalError("SELECT 1", {}, Exception("connection refused"))
+    monkeypatch.setattr(database, "replication_lag", down)
+    assert orders(client) == [1, 2]
+
+    monkeypatch.setattr(database, "replication_lag", lambda connection: 1.0)
+    assert orders(client) == [1]
+    stats = database.replica_stats()
+    assert stats["primary_fallbacks"] == 2
+    assert stats["replicas"][0]["healthy"] is True
@@ -0,0 +1,171 @@
+"""Retries, timeouts and the circuit breaker of the inter-service client (utils.py), against a stub transport."""
+import asyncio
+
+import httpx
+import pytest
+
+
+class Stub:
+    """Answers the client's calls in turn with the given status codes or transport errors, counting them."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def __call__(self, request):
+        outcome = self.outcomes[min(self.calls, len(self.outcomes) - 1)]
+        self.calls += 1
+        if isinstance(outcome, Exception):
+            raise outcome
+        return httpx.Response(outcome, json={"ok": outcome < 400})
+
+
+@pytest.fixture
+def utils(load_service):
+    return load_service("order", module="utils")
+
+
+def make_client(utils, stub, **options):
+    client = utils.ServiceClient("http://downstream", backoff=0, **options)
+    client.client = httpx.AsyncClient(base_url="http://downstream", transport=httpx.MockTransport(stub))
+    return client
+
+
+def call(client, method="GET", **kwargs):
+    return asyncio.run(client.request(method, "/resource", **kwargs))
+
+
+def test_idempotent_call_is_retried_until_it_succeeds(utils):
+    stub = Stub(503, 502, 200)
+    assert call(make_client(utils, stub, retries=2)) == {"ok": True}
+    assert stub.calls == 3
+
+
+def test_retries_give_up_with_the_last_error(utils):
+    stub = Stub(503)
+    with pytest.raises(httpx.HTTPStatusError):
+        call(make_client(utils, stub, retries=2))
+    assert stub.calls == 3
+
+
+def test_post_is_not_retried_unless_marked_idempotent(utils):
+    stub = Stub(503, 200)
+    with pytest.raises(httpx.HTTPStatusError):
+        call(make_client(utils, stub, retries=2), "POST")
+    assert stub.calls == 1
+
+    stub = Stub(503, 200)
+    assert call(make_client(utils, stub, retries=2), "POST", idempotent=True) == {"ok": True}
+    assert stub.calls == 2
+
+
+def test_timeouts_are_retried_and_counted_as_failures(utils):
+    stub = Stub(httpx.ReadTimeout("timed out"))
+    client = make_client(utils, stub, retries=1)
+    with pytest.raises(httpx.ReadTimeout):
+        call(client)
+    assert stub.calls == 2
+    assert client.breaker.failures == 2
+
+
+def test_client_errors_are_neither_retried_nor_failures(utils):
+    stub = Stub(404)
+    client = make_client(utils, stub, retries=2)
+    with pytest.raises(httpx.HTTPStatusError):
+        call(client)
+    assert stub.calls == 1
+    assert client.breaker.failures == 0
+    assert client.breaker.state == "closed"
+
+
+def test_breaker_opens_after_consecutive_failures_and_fails_fast(utils):
+    stub = Stub(503)
+    client = make_client(utils, stub, retries=0, breaker=utils.CircuitBreaker(failure_threshold=3, reset_timeout=60))
+    for _ in range(3):
+        with pytest.raises(httpx.HTTPStatusError):
+            call(client)
+    assert client.breaker.state == "open"
+
+    with pytest.raises(utils.CircuitOpenError):
+        call(client)
+    assert stub.calls == 3
+
+
+def test_half_open_breaker_lets_one_trial_through(utils, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(utils.time, "monotonic", lambda: now[0])
+    breaker = utils.CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    now[0] += 30
+    assert breaker.state == "half-open"
+    breaker.before_call()
+    with pytest.raises(utils.CircuitOpenError):
+        breaker.before_call()
+
+    # A failed trial opens the circuit again for another reset_timeout
+    breaker.record_failure()
+    assert breaker.state == "open"
+    now[0] += 30
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.failures == 0
+
+
+def test_successful_trial_closes_the_circuit(utils, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(utils.time, "monotonic", lambda: now[0])
+    stub = Stub(503, 200)
+    client = make_client(utils, stub, retries=0, breaker=utils.CircuitBreaker(failure_threshold=1, reset_timeout=5))
+    with pytest.raises(httpx.HTTPStatusError):
+        call(client)
+    with pytest.raises(utils.CircuitOpenError):
+        call(client)
+
+    now[0] += 5
+    assert call(client) == {"ok": True}
+    assert client.breaker.state == "closed"
+    assert stub.calls == 2
+
+
+def test_cancelled_trial_lets_the_next_call_through(utils, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(utils.time, "monotonic", lambda: now[0])
+    started = asyncio.Event()
+
+    async def hang(request):
+        started.set()
+        await asyncio.Event().wait()
+
+    breaker = utils.CircuitBreaker(failure_threshold=1, reset_timeout=5)
+    client = make_client(utils, Stub(503), retries=0, breaker=breaker)
+    with pytest.raises(httpx.HTTPStatusError):
+        call(client)
+    now[0] += 5
+
+    async def cancel_trial():
+        client.client = httpx.AsyncClient(base_url="http://downstream", transport=httpx.MockTransport(hang))
+        trial = asyncio.create_task(client.request("GET", "/resource"))
+        await started.wait()
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+
+    asyncio.run(cancel_trial())
+    # The cancelled trial neither closed nor re-opened the circuit, and did not leave it stuck half-open
+    assert client.breaker.state == "half-open"
+    stub = Stub(200)
+    client.client = httpx.AsyncClient(base_url="http://downstream", transport=httpx.MockTransport(stub))
+    assert call(client) == {"ok": True}
+    assert client.breaker.state == "closed"
+
+
+def test_call_service_reports_failures_as_runtime_errors(utils, monkeypatch):
+    stub = Stub(500)
+    monkeypatch.setattr(utils, "_clients", {"http://downstream": make_client(utils, stub, retries=0)})
+    with pytest.raises(RuntimeError, match="Service call failed"):
+        asyncio.run(utils.call_service("http://downstream/resource"))
+    with pytest.raises(ValueError):
+        asyncio.run(utils.call_service("http://downstream/resource", method="PATCH"))
@@ -0,0 +1,47 @@
+from fastapi import HTTPException
+from sqlmodel import Session
+from typing import Optional
+from models import Users, UsersUpdate
+from pagination import Page, paginate
+
+def list_users(session: Session, is_merchant: Optional[bool], cursor: Optional[str], limit: int) -> Page:
+    """Retrieves a page of users from the database, optionally filtered by is_merchant."""
+    # Use the session to query the database
+    query = session.query(Users)
+    if is_merchant is not None:
+        query = query.filter(Users.is_merchant == is_merchant)
+    return paginate(query, [Users.id], limit, cursor)
+
+def create_user(session: Session, users: Users) -> Users:
+    """create new user into the database."""
+    # Use the session to query the database
+    session.add(users)
+    session.commit()
+    session.refresh(users)
+    return users
+
+def update_user(session: Session, user_id: int, data_update: UsersUpdate) -> dict:
+    """update user in the database."""
+    # Use the session to query the database
+    user = session.get(Users, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    user_data = data_update.model_dump(exclude_unset=True)
+    user.sqlmodel_update(user_data)
+    session.add(user)
+    session.commit()
+    session.refresh(user)
+
+    return {"message": "update user data success"}
+
+def delete_user(session: Session, user_id: int) -> dict:
+    """delete user from the database."""
+    # Use the session to query the database
+    user = session.get(Users, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    session.delete(user)
+    session.commit()
+
+    return {"message": "delete success"}
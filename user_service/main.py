@@ -1,17 +1,18 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException
-from sqlmodel import SQLModel, create_engine, Session
+from fastapi import FastAPI, APIRouter, Depends, Query
 from contextlib import asynccontextmanager
-from typing import List
+from typing import Optional
 from models import Users, UsersUpdate
-import os
-
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./database.db")
-
-engine = create_engine(DATABASE_URL, echo=True, connect_args={"check_same_thread": False})
-
-def create_db_and_tables():
-    """Creates the database tables based on your SQLModel definitions."""
-    SQLModel.metadata.create_all(engine)
+from pagination import Page, DEFAULT_LIMIT, MAX_LIMIT
+from database import (get_session, get_read_session, route_reads, run_db, run_migrations, pool_stats,
+                      replica_stats, DBSession)
+from migrations import MIGRATIONS
+from instrumentation import instrument
+from admission import admission_control, admission_stats
+import crud
+
+async def create_db_and_tables():
+    """Brings the database schema up to date by applying any pending migrations."""
+    await run_migrations(MIGRATIONS)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -19,64 +20,53 @@ async def lifespan(app: FastAPI):
     Function that runs on application startup and shutdown.
     It's the perfect place to create the database tables.
     """
-    create_db_and_tables()
+    await create_db_and_tables()
     yield
 
 app = FastAPI(title="Users Service", lifespan=lifespan)
+admission_control(app, browse=["GET /api/v1/users"])
+instrument(app)
+route_reads(app)
 
-def get_session():
-    """
-    Dependency function to get a database session.
-    It creates a session and ensures it's closed after the request.
-    """
-    with Session(engine) as session:
-        yield session
+@app.get("/metrics/pool")
+async def get_pool_stats():
+    """Returns connection pool checkout and wait metrics, used to size DB_POOL_SIZE per service."""
+    return pool_stats()
+
+@app.get("/metrics/replicas")
+async def get_replica_stats():
+    """Returns the read replicas' health and lag, and how many reads were pinned to or fell back to the primary."""
+    return replica_stats()
+
+@app.get("/metrics/admission")
+async def get_admission_stats():
+    """Returns the requests admitted, queued, shed and rate limited by priority, and the slots in use."""
+    return admission_stats()
 
 router = APIRouter()
 
-@router.get("/users", response_model=List[Users])
-def get_users(session: Session = Depends(get_session)):
-    """Retrieves all users from the database."""
-    # Use the session to query the database
-    users = session.query(Users).all()
-    return users
+@router.get("/users", response_model=Page[Users])
+async def get_users(is_merchant: Optional[bool] = None,
+                    cursor: Optional[str] = None,
+                    limit: int = Query(default=DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+                    session: DBSession = Depends(get_read_session)):
+    """Retrieves a page of users from the database, optionally filtered by is_merchant."""
+    return await run_db(session, crud.list_users, is_merchant, cursor, limit)
 
 @router.post("/users", response_model=Users)
-def create_users(users: Users, session: Session = Depends(get_session)):
+async def create_users(users: Users, session: DBSession = Depends(get_session)):
     """create new user into the database."""
-    # Use the session to query the database
-    session.add(users)
-    session.commit()
-    session.refresh(users)
-    return users
+    return await run_db(session, crud.create_user, users)
 
 @router.put("/users", response_model=Users)
-def update_users(user_id: int, data_update: UsersUpdate, session: Session = Depends(get_session)):
+async def update_users(user_id: int, data_update: UsersUpdate, session: DBSession = Depends(get_session)):
     """update user in the database."""
-    # Use the session to query the database
-    user = session.get(Users, user_id)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    user_data = data_update.model_dump(exclude_unset=True)
-    user.sqlmodel_update(user_data)
-    session.add(user)
-    session.commit()
-    session.refresh(user)
-
-    return {"message": "update user data success"}
+    return await run_db(session, crud.update_user, user_id, data_update)
 
 
 @router.delete("/users}", response_model=Users)
-def delete_users(user_id: int, session: Session = Depends(get_session)):
+async def delete_users(user_id: int, session: DBSession = Depends(get_session)):
     """delete user from the database."""
-    # Use the session to query the database
-    user = session.get(Users, user_id)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    session.delete(user)
-    session.commit()
-
-    return {"message": "delete success"}
+    return await run_db(session, crud.delete_user, user_id)
 
-app.include_router(router, tags=["users"], prefix="/api/v1")
\ No newline at end of file
+app.include_router(router, tags=["users"], prefix="/api/v1")
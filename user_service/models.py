@@ -1,5 +1,5 @@
 from typing import Optional, List
-from sqlmodel import Field, SQLModel, Relationship
+from sqlmodel import Field, SQLModel, Relationship, Index
 
 class Users(SQLModel, table=True):
     """
@@ -23,12 +23,15 @@ class Address(SQLModel, table=True):
     """
     Represents an address in the database.
     This model is also used for API requests and responses.
+    Addresses are looked up by user, and a user's default address by (user_id, default).
     """
+    __table_args__ = (Index("ix_address_user_id_default", "user_id", "default"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: int = Field(foreign_key="users.id", index=True)
-    street: str = Field(index=True)
-    city: str = Field(index=True)
-    state: str = Field(index=True)
-    zip_code: str = Field(index=True)
-    country: str = Field(index=True)
-    default: bool = Field(default=False, index=True)
\ No newline at end of file
+    user_id: int = Field(foreign_key="users.id")
+    street: str
+    city: str
+    state: str
+    zip_code: str
+    country: str
+    default: bool = Field(default=False)
\ No newline at end of file